@@ -0,0 +1,554 @@
+# -*- coding: utf-8 -*-
+import argparse
+import contextlib
+import functools
+import http.client
+import json
+import logging
+import math
+import random
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+import redis
+
+from server import config
+from server.models import Users, Products, DataVersions, SEED_USER_IDS
+
+""" Load tests the REST APIs of the product server, and of the recommender.
+
+Seeds an empty redis database with a synthetic catalog, users, their ratings
+and their curated recommendations. Then keeps `--concurrency` clients busy for
+`--duration` seconds, each sending, one after the other, requests drawn from
+a mix of:
+
+* browse: a page of the catalog, with the ratings of the user
+  (`ProductsResource`).
+* rate: a few new ratings of the user (`RatingsResource`).
+* recommend: the recommendations of the user (`RecommendationsResource`).
+
+and, given the `--recommender-url` of a recommender server with a trained
+engine, of:
+
+* on_demand: the recommendations of the user, scored on demand by the
+  recommender (its `RecommendationsResource`). The users are the same ids as
+  on the product server, the ones unknown to the engine get an empty list.
+* engine: the details of the current engine (`EngineResource`).
+
+The recommender endpoints which start jobs, the trainings and schedules, are
+left out. The first `--warmup` seconds are not measured. Prints as json, per
+endpoint and overall, the requests, the error rate, the requests/sec (and per
+server core) and the latency percentiles, in milliseconds. The seeding is the
+same from run to run, so the reports of two serving modes, or of two changes,
+can be compared side by side. The database is flushed afterwards, so it has
+to be empty to start with, but for the demo users the server registers. They
+are registered again after the flush.
+
+Start the product server against an empty redis database in one mode, eg.
+
+    REDIS_DB=15 SERVING_MODE=asgi python start_server.py
+
+then point this script at it, from the product server root, eg.
+
+    python -m benchmarks.load_test --url http://localhost:8000 --db 15
+
+and at a recommender server too, eg.
+
+    python -m benchmarks.load_test --url http://localhost:8000 --db 15 \
+        --recommender-url http://localhost:5000 \
+        --mix browse=6,rate=1,recommend=3,on_demand=3,engine=0.1
+
+Without `--url`, the server is run in this process instead, in the
+`--serving-mode` given, over an in-memory stand-in for redis (fakeredis,
+which is not a requirement of the server). The clients and the server then
+share a process, so the numbers are only good for comparisons on the same
+machine, or for a quick check that everything serves under load.
+"""
+
+BROWSE = 'browse'
+RATE = 'rate'
+RECOMMEND = 'recommend'
+ON_DEMAND = 'on_demand'
+ENGINE = 'engine'
+
+""" The requests a client sends, and how often, by default. The recommender
+ones are only sent to a recommender server, when given. """
+PRODUCT_ENDPOINTS = (BROWSE, RATE, RECOMMEND)
+RECOMMENDER_ENDPOINTS = (ON_DEMAND, ENGINE)
+ENDPOINTS = PRODUCT_ENDPOINTS + RECOMMENDER_ENDPOINTS
+DEFAULT_MIX = {BROWSE: 6, RATE: 1, RECOMMEND: 3}
+
+""" The latency percentiles reported. """
+PERCENTILES = (50, 90, 95, 99)
+
+""" The products on a page of the catalog, as in the client. """
+PAGE_SIZE = 50
+
+
+def parse_mix(text: str) -> dict:
+    """ Parses a mix of requests, eg. 'browse=6,rate=1,recommend=3'.
+
+    Returns:
+        a dict of endpoint to its weight. The endpoints left out are not
+        requested.
+
+    """
+    mix = {}
+
+    for part in text.split(','):
+        endpoint, _, weight = part.partition('=')
+        endpoint = endpoint.strip()
+
+        if endpoint not in ENDPOINTS:
+            raise ValueError('unknown endpoint: {}. Should be one of {}'
+                             .format(endpoint, ENDPOINTS))
+
+        mix[endpoint] = float(weight)
+
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError('the mix should request some endpoint.')
+
+    return mix
+
+
+def seed(redis_conn, users: int, products: int, ratings: int,
+         recommendations: int, random_seed: int = 0) -> list:
+    """ Loads a synthetic data set into an empty redis database.
+
+    The models are pointed at `redis_conn`, and the users are registered
+    with `ratings` ratings and `recommendations` curated recommendations
+    each. The default recommendations are set too.
+
+    Returns:
+        the ids of the users.
+
+    Raises:
+        RuntimeError: if the database holds anything but the demo users,
+        which the server registers when it starts.
+
+    """
+    if not _empty(redis_conn):
+        raise RuntimeError('the redis database is not empty.')
+
+    Users.redis = Products.redis = DataVersions.redis = redis_conn
+
+    generator = random.Random(random_seed)
+
+    for id in range(1, products + 1):
+        name = 'Some Movie Title {} ({})'.format(id, 1900 + id % 120)
+
+        Products.upsert(id=id, name=name, desc='Action|Adventure|Comedy')
+
+    user_ids = list(range(1, users + 1))
+    Users.register(user_ids)
+
+    pipeline = redis_conn.pipeline(transaction=False)
+
+    for user_id in user_ids:
+        for product_id in generator.sample(range(1, products + 1), ratings):
+            pipeline.hset(Users.ratings_key(user_id), product_id,
+                          generator.randint(1, 5))
+
+        pipeline.set(Users.ratings_version_key(user_id), time.time())
+        pipeline.set(Users.recommendations_key(user_id), json.dumps(
+            generator.sample(range(1, products + 1), recommendations)))
+
+    pipeline.set(Users.recommendations_key(-1), json.dumps(
+        list(range(1, recommendations + 1))))
+
+    pipeline.execute()
+
+    return user_ids
+
+
+def _empty(redis_conn) -> bool:
+    """ whether a redis database holds nothing but the demo users. """
+    registry_key = Users.registry_key().encode()
+
+    if redis_conn.dbsize() > 1 or set(redis_conn.keys()) - {registry_key}:
+        return False
+
+    return {int(id) for id in redis_conn.smembers(registry_key)} <= \
+        set(SEED_USER_IDS)
+
+
+def _request(endpoint: str, user_id: int, products: int,
+             generator: random.Random) -> tuple:
+    """ the method, path and body of a request to an endpoint. """
+    if endpoint == BROWSE:
+        offset = generator.randrange(1, max(products - PAGE_SIZE, 1) + 1)
+
+        return 'GET', '/api/v1/products?offset={}&limit={}&user_id={}'.format(
+            offset, PAGE_SIZE, user_id), None
+
+    if endpoint == RATE:
+        body = {'ratings': [{
+            'product_id': product_id,
+            'rating': generator.randint(1, 5)
+        } for product_id in generator.sample(range(1, products + 1),
+                                             min(3, products))]}
+
+        return 'PUT', '/api/v1/users/{}/ratings'.format(user_id), \
+            json.dumps(body)
+
+    if endpoint == ON_DEMAND:
+        return 'POST', '/recommendations', json.dumps({'user_ids': [user_id]})
+
+    if endpoint == ENGINE:
+        return 'GET', '/engines/current', None
+
+    return 'GET', '/api/v1/users/{}/recommendations'.format(user_id), None
+
+
+def _connect(url: str) -> http.client.HTTPConnection:
+    parsed = urlparse(url)
+
+    return http.client.HTTPConnection(parsed.hostname, parsed.port)
+
+
+def _client(urls: dict, user_ids: list, products: int, mix: dict,
+            warmup_end: float, deadline: float, random_seed: int,
+            results: list, lock: threading.Lock) -> None:
+    # a connection per server, by endpoint.
+    connections = {url: _connect(url) for url in set(urls.values())}
+    headers = {'Content-Type': 'application/json'}
+
+    generator = random.Random(random_seed)
+    endpoints = [endpoint for endpoint in mix if mix[endpoint] > 0]
+    weights = [mix[endpoint] for endpoint in endpoints]
+
+    # per endpoint, the latencies of the successful requests, and the
+    # responses by status ('error' for the failed connections).
+    latencies = {endpoint: [] for endpoint in endpoints}
+    statuses = {endpoint: {} for endpoint in endpoints}
+
+    while True:
+        start = time.time()
+
+        if start >= deadline:
+            break
+
+        endpoint = generator.choices(endpoints, weights)[0]
+        method, path, body = _request(endpoint, generator.choice(user_ids),
+                                      products, generator)
+        url = urls[endpoint]
+
+        try:
+            connections[url].request(method, path, body=body,
+                                     headers=headers)
+            response = connections[url].getresponse()
+            response.read()
+            status = str(response.status)
+        except (http.client.HTTPException, OSError):
+            status = 'error'
+            connections[url].close()
+            connections[url] = _connect(url)
+
+        if start < warmup_end:
+            continue
+
+        if status.startswith(('2', '3')):
+            latencies[endpoint].append(time.time() - start)
+
+        statuses[endpoint][status] = statuses[endpoint].get(status, 0) + 1
+
+    for connection in connections.values():
+        connection.close()
+
+    with lock:
+        results.append((latencies, statuses))
+
+
+def percentile(sorted_values: list, percent: float) -> float:
+    """ the nearest-rank percentile of sorted values, 0 if there are none. """
+    if not sorted_values:
+        return 0.0
+
+    rank = math.ceil(percent / 100 * len(sorted_values))
+
+    return sorted_values[max(rank, 1) - 1]
+
+
+def summarize(latencies: list, statuses: dict, elapsed: float,
+              server_cores: int) -> dict:
+    """ Describes the requests to an endpoint.
+
+    Args:
+        latencies: the latencies of the successful requests, in seconds.
+
+        statuses: a dict of response status to the number of requests.
+
+        elapsed: the seconds measured.
+
+    """
+    requests = sum(statuses.values())
+    latencies = sorted(latencies)
+    errors = requests - len(latencies)
+
+    summary = {
+        'requests': requests,
+        'errors': errors,
+        'error_rate': errors / requests if requests else 0.0,
+        'statuses': statuses,
+        'requests_per_sec': len(latencies) / elapsed,
+        'requests_per_sec_per_core': len(latencies) / elapsed / server_cores,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies) * 1e3 if latencies else
+            0.0,
+            'max': latencies[-1] * 1e3 if latencies else 0.0,
+        },
+    }
+
+    for percent in PERCENTILES:
+        summary['latency_ms']['p{}'.format(percent)] = \
+            percentile(latencies, percent) * 1e3
+
+    return summary
+
+
+def run(url: str, user_ids: list, products: int, mix: dict = None,
+        concurrency: int = 32, duration: float = 30, warmup: float = 5,
+        server_cores: int = 1, random_seed: int = 0,
+        recommender_url: str = None) -> dict:
+    """ Loads a server with concurrent clients, see the module docstring.
+
+    Args:
+        user_ids: the users to send requests for, picked at random.
+
+        products: the number of products in the catalog, ids from 1.
+
+        mix: a dict of endpoint to its weight, `DEFAULT_MIX` by default.
+
+        server_cores: the number of cores the server is using.
+
+        recommender_url: the recommender server of the
+        `RECOMMENDER_ENDPOINTS`.
+
+    Returns:
+        the report, with the summaries of the `endpoints` and the `total`,
+        see `summarize`.
+
+    Raises:
+        ValueError: if the mix has recommender endpoints, and no
+        `recommender_url` is given.
+
+    """
+    mix = mix or DEFAULT_MIX
+
+    if not recommender_url and any(mix.get(endpoint) for endpoint in
+                                   RECOMMENDER_ENDPOINTS):
+        raise ValueError('the recommender endpoints need a recommender url.')
+
+    urls = {endpoint: recommender_url if endpoint in RECOMMENDER_ENDPOINTS
+            else url for endpoint in mix if mix[endpoint] > 0}
+
+    results = []
+    lock = threading.Lock()
+
+    start = time.time()
+    warmup_end = start + warmup
+    deadline = warmup_end + duration
+
+    threads = [threading.Thread(
+        target=_client, args=(urls, user_ids, products, mix, warmup_end,
+                              deadline, random_seed + client, results, lock))
+        for client in range(concurrency)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.time() - max(start, warmup_end)
+
+    endpoints = {}
+    all_latencies, all_statuses = [], {}
+
+    for endpoint in mix:
+        latencies, statuses = [], {}
+
+        for client_latencies, client_statuses in results:
+            latencies.extend(client_latencies.get(endpoint, ()))
+
+            for status, count in client_statuses.get(endpoint, {}).items():
+                statuses[status] = statuses.get(status, 0) + count
+
+        if not statuses:
+            continue
+
+        endpoints[endpoint] = summarize(latencies, statuses, elapsed,
+                                        server_cores)
+
+        all_latencies.extend(latencies)
+
+        for status, count in statuses.items():
+            all_statuses[status] = all_statuses.get(status, 0) + count
+
+    return {
+        'url': url,
+        'recommender_url': recommender_url,
+        'concurrency': concurrency,
+        'duration': duration,
+        'mix': mix,
+        'endpoints': endpoints,
+        'total': summarize(all_latencies, all_statuses, elapsed,
+                           server_cores),
+    }
+
+
+def _free_port() -> int:
+    with contextlib.closing(socket.socket()) as sock:
+        sock.bind(('127.0.0.1', 0))
+
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def local_server(serving_mode: str = 'flask'):
+    """ Serves the product server in this process, over an in-memory stand-in
+    for redis.
+
+    Yields:
+        a tuple of the url of the server, and the stand-in redis connection
+        to seed.
+
+    """
+    import fakeredis
+
+    from server import app, cache
+    from server.async_models import (AsyncUsers, AsyncProducts,
+                                     AsyncDataVersions)
+
+    fake_server = fakeredis.FakeServer()
+    redis_conn = fakeredis.FakeStrictRedis(server=fake_server)
+
+    models = (Users, Products, DataVersions, AsyncUsers, AsyncProducts,
+              AsyncDataVersions)
+    connections = [model.redis for model in models]
+
+    Users.redis = Products.redis = DataVersions.redis = redis_conn
+    AsyncUsers.redis = AsyncProducts.redis = AsyncDataVersions.redis = \
+        fakeredis.FakeAsyncRedis(server=fake_server)
+
+    cache.responses.clear()
+    cache.versions.clear()
+
+    # the request logs would slow down the server, and the clients with it.
+    logging.disable(logging.INFO)
+
+    port = _free_port()
+
+    if serving_mode == 'asgi':
+        import uvicorn
+
+        server = uvicorn.Server(uvicorn.Config('server.asgi:app',
+                                               port=port, log_level='warning'))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+
+        while not server.started:
+            time.sleep(0.01)
+
+        stop = functools.partial(setattr, server, 'should_exit', True)
+    else:
+        from werkzeug.serving import make_server
+
+        server = make_server('127.0.0.1', port, app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        stop = server.shutdown
+
+    try:
+        yield 'http://127.0.0.1:{}'.format(port), redis_conn
+    finally:
+        stop()
+        thread.join()
+
+        logging.disable(logging.NOTSET)
+
+        for model, connection in zip(models, connections):
+            model.redis = connection
+
+
+@contextlib.contextmanager
+def remote_server(url: str, db: int):
+    """ Points at a running product server.
+
+    Yields:
+        a tuple of the url of the server, and the connection to its redis
+        database to seed.
+
+    """
+    yield url, redis.StrictRedis(host=config.REDIS_HOST,
+                                 port=config.REDIS_PORT, db=db)
+
+
+def main(args) -> dict:
+    mix = parse_mix(args.mix)
+
+    if args.url:
+        server = remote_server(args.url, args.db)
+    else:
+        server = local_server(args.serving_mode)
+
+    with server as (url, redis_conn):
+        demo_user_ids = redis_conn.smembers(Users.registry_key())
+
+        user_ids = seed(redis_conn, args.users, args.products, args.ratings,
+                        args.recommendations)
+
+        try:
+            return run(url, user_ids, args.products, mix, args.concurrency,
+                       args.duration, args.warmup, args.server_cores,
+                       recommender_url=args.recommender_url)
+        finally:
+            redis_conn.flushdb()
+
+            if demo_user_ids:
+                redis_conn.sadd(Users.registry_key(), *demo_user_ids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Load tests the REST APIs of the product server, and of '
+                    'the recommender.')
+    parser.add_argument('--url',
+                        help='a running server. Without it, one is run in '
+                             'this process, over an in-memory redis.')
+    parser.add_argument('--recommender-url',
+                        help='a running recommender server, for the '
+                             'on_demand and engine endpoints of the mix.')
+    parser.add_argument('--serving-mode', choices=('flask', 'asgi'),
+                        default='flask',
+                        help='the mode of the server run in this process.')
+    parser.add_argument('--db', type=int, default=15,
+                        help='the empty redis database the server uses, '
+                             'see its REDIS_DB setting.')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=3952)
+    parser.add_argument('--ratings', type=int, default=20,
+                        help='the ratings per user')
+    parser.add_argument('--recommendations', type=int, default=10,
+                        help='the recommendations per user')
+    parser.add_argument('--mix',
+                        default='browse=6,rate=1,recommend=3',
+                        help='the weight of each endpoint in the requests.')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--server-cores', type=int, default=1,
+                        help='the number of cores the server is using.')
+    parser.add_argument('--output',
+                        help='a file to write the report to, as well.')
+    args = parser.parse_args()
+
+    report = json.dumps(main(args), indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report)
+
+    print(report)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import timeit
+
+import redis
+
+from server import config
+from server.models import Products, KEYS_LAYOUT, BUCKETS_LAYOUT
+
+""" Compares the redis memory used by the layouts of the product catalog.
+
+Loads a synthetic catalog in each layout into an empty scratch redis database,
+and prints as json, per layout, the growth of redis' `used_memory`, the sum of
+`MEMORY USAGE` over the keys, the number of keys, the encoding of the keys and
+the time to fetch a page of the catalog. The scratch database is flushed
+between and after the runs, so it has to be empty to start with.
+
+Run from the product server root, eg.
+
+    python -m benchmarks.products_layout --products 100000 --db 15
+"""
+
+
+def _load(products: int) -> None:
+    for id in range(1, products + 1):
+        Products.upsert(id=id,
+                        name='Some Movie Title {} ({})'.format(id,
+                                                               1900 + id % 120),
+                        desc='Action|Adventure|Comedy')
+
+
+def _measure(redis_conn, products: int, page: int) -> dict:
+    used_before = redis_conn.info('memory')['used_memory']
+
+    _load(products)
+
+    used_after = redis_conn.info('memory')['used_memory']
+
+    keys = list(redis_conn.scan_iter(count=1000))
+
+    pipeline = redis_conn.pipeline(transaction=False)
+    for key in keys:
+        pipeline.memory_usage(key)
+    usage = pipeline.execute()
+
+    encodings = {redis_conn.object('encoding', key) for key in keys}
+
+    timer = timeit.Timer(
+        lambda: Products.get_many(list(range(1, page + 1))))
+    repeats, seconds = timer.autorange()
+
+    return {
+        'used_memory_bytes': used_after - used_before,
+        'memory_usage_bytes': sum(usage),
+        'bytes_per_product': sum(usage) / products,
+        'keys': len(keys),
+        'encodings': sorted(encoding.decode() for encoding in encodings),
+        'page_fetch_ms': seconds / repeats * 1e3,
+    }
+
+
+def run(redis_conn, products: int, bucket_size: int, page: int) -> dict:
+    if redis_conn.dbsize():
+        raise RuntimeError('the scratch database is not empty.')
+
+    Products.redis = redis_conn
+    Products.bucket_size = bucket_size
+
+    report = {}
+
+    try:
+        for layout in (KEYS_LAYOUT, BUCKETS_LAYOUT):
+            Products.layout = layout
+
+            report[layout] = _measure(redis_conn, products, page)
+
+            redis_conn.flushdb()
+    finally:
+        redis_conn.flushdb()
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compares the memory used by the catalog layouts.')
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--bucket-size', type=int,
+                        default=config.PRODUCTS_BUCKET_SIZE)
+    parser.add_argument('--page', type=int, default=50,
+                        help='the products fetched per page')
+    parser.add_argument('--db', type=int, default=15,
+                        help='an empty redis database to use')
+    args = parser.parse_args()
+
+    redis_conn = redis.StrictRedis(host=config.REDIS_HOST,
+                                   port=config.REDIS_PORT, db=args.db)
+
+    print(json.dumps(run(redis_conn, args.products, args.bucket_size,
+                         args.page), indent=2))
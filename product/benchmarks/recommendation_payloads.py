@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import random
+import timeit
+
+import redis
+
+from server import config
+from server.models import Users, Products, DataVersions
+from server.resources import RecommendationsResource
+
+""" Compares serving the recommendations from a rendered payload with joining
+the recommendation ids with the catalog at serve time.
+
+Loads a synthetic catalog and the curated recommendations of `--users` users
+into an empty scratch redis database, along with the payloads the recommender
+renders for them (see its `Transporter.send_recommendations_to_db`). Then
+times the recommendations of every user being built, first from the payloads
+and then, with the payloads dropped, by the join. Prints the mean latency of
+each per user as json, along with the redis round trips per user. The scratch
+database is flushed afterwards, so it has to be empty to start with.
+
+Run from the product server root, eg.
+
+    python -m benchmarks.recommendation_payloads --users 10000 --db 15
+"""
+
+
+def _render(product_id: int) -> dict:
+    return {
+        'product_id': product_id,
+        'meta': {
+            'name': 'Some Movie Title {}'.format(product_id),
+            'desc': 'Action|Adventure|Comedy'
+        }
+    }
+
+
+def _load(users: int, products: int, count: int) -> list:
+    for id in range(1, products + 1):
+        meta = _render(id)['meta']
+        Products.upsert(id=id, name=meta['name'], desc=meta['desc'])
+
+    user_ids = list(range(1, users + 1))
+    Users.register(user_ids)
+
+    pipeline = Users.redis.pipeline(transaction=False)
+
+    for user_id in user_ids:
+        recommendations = random.sample(range(1, products + 1), count)
+
+        pipeline.set(Users.recommendations_key(user_id),
+                     json.dumps(recommendations))
+        pipeline.set(Users.recommendations_payload_key(user_id), json.dumps({
+            'products_version': 0,
+            'recommendations': [_render(id) for id in recommendations]
+        }))
+
+    pipeline.execute()
+
+    return [Users(user_id) for user_id in user_ids]
+
+
+def _latency_us(users: list) -> float:
+    resource = RecommendationsResource()
+
+    timer = timeit.Timer(
+        lambda: [resource._get_recommendations(user, 0) for user in users])
+
+    return min(timer.repeat(repeat=3, number=1)) / len(users) * 1e6
+
+
+def run(redis_conn, users: int, products: int, count: int) -> dict:
+    if redis_conn.dbsize():
+        raise RuntimeError('the scratch database is not empty.')
+
+    Users.redis = Products.redis = DataVersions.redis = redis_conn
+
+    try:
+        loaded_users = _load(users, products, count)
+
+        payload_us = _latency_us(loaded_users)
+
+        redis_conn.delete(*[Users.recommendations_payload_key(user.id) for
+                            user in loaded_users])
+
+        join_us = _latency_us(loaded_users)
+    finally:
+        redis_conn.flushdb()
+
+    return {
+        'users': users,
+        'recommendations_per_user': count,
+        'payload': {'latency_us': payload_us, 'round_trips': 1},
+        # the payload miss, the curated ids, and a product each.
+        'join': {'latency_us': join_us, 'round_trips': 2 + count},
+        'speedup': join_us / payload_us,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compares serving rendered payloads with the join.')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=3952)
+    parser.add_argument('--count', type=int, default=10,
+                        help='the recommendations per user')
+    parser.add_argument('--db', type=int, default=15,
+                        help='an empty redis database to use')
+    args = parser.parse_args()
+
+    redis_conn = redis.StrictRedis(host=config.REDIS_HOST,
+                                   port=config.REDIS_PORT, db=args.db)
+
+    print(json.dumps(run(redis_conn, args.users, args.products, args.count),
+                     indent=2))
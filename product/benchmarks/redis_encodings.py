@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import random
+import timeit
+
+from server.serialization import JSON, RecommendationsCodec, ProductCodec
+
+""" Compares the encodings of the values stored in redis.
+
+For each version of the recommendations and product formats, encodes a
+synthetic data set and prints as json the average bytes per user (or product)
+and the average time to decode one value. With `--redis`, the values are also
+written to redis under a scratch prefix, and the memory redis actually uses
+per key (`MEMORY USAGE`, which includes the per-key overhead) is reported as
+well. The scratch keys are deleted afterwards.
+
+Run from the product server root, eg.
+
+    python -m benchmarks.redis_encodings --users 10000 --redis
+"""
+
+SCRATCH_PREFIX = 'encodings_benchmark'
+
+
+def _recommendations(users: int, count: int, products: int) -> list:
+    return [random.sample(range(1, products + 1), count) for _ in
+            range(users)]
+
+
+def _products(products: int) -> list:
+    return [{'name': 'Some Movie Title {} ({})'.format(id, 1900 + id % 120),
+             'desc': 'Action|Adventure|Comedy'} for id in
+            range(1, products + 1)]
+
+
+def _measure(codec, values: list, redis_conn=None) -> dict:
+    encoded = [codec.encode(value) for value in values]
+
+    timer = timeit.Timer(lambda: [codec.decode(value) for value in encoded])
+    repeats, seconds = timer.autorange()
+
+    report = {
+        'bytes_per_value': sum(map(len, encoded)) / len(encoded),
+        'decode_us': seconds / repeats / len(encoded) * 1e6,
+    }
+
+    if redis_conn is not None:
+        keys = ['{}_{}'.format(SCRATCH_PREFIX, i) for i in
+                range(len(encoded))]
+
+        pipeline = redis_conn.pipeline(transaction=False)
+        for key, value in zip(keys, encoded):
+            pipeline.set(key, value)
+        pipeline.execute()
+
+        for key in keys:
+            pipeline.memory_usage(key)
+        usage = pipeline.execute()
+
+        redis_conn.delete(*keys)
+
+        report['redis_bytes_per_key'] = sum(usage) / len(usage)
+
+    return report
+
+
+def run(users: int, count: int, products: int, redis_conn=None) -> dict:
+    recommendations = _recommendations(users, count, products)
+    catalog = _products(products)
+
+    return {
+        'recommendations': {
+            version: _measure(RecommendationsCodec(version), recommendations,
+                              redis_conn)
+            for version in [JSON] + sorted(RecommendationsCodec.encoders)
+        },
+        'products': {
+            version: _measure(ProductCodec(version), catalog, redis_conn)
+            for version in [JSON] + sorted(ProductCodec.encoders)
+        },
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compares the encodings of the values in redis.')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--count', type=int, default=20,
+                        help='recommendations per user')
+    parser.add_argument('--products', type=int, default=4000)
+    parser.add_argument('--redis', action='store_true',
+                        help='also measure the memory used in redis')
+    args = parser.parse_args()
+
+    redis_conn = None
+    if args.redis:
+        from server.extensions import redis_conn
+
+    print(json.dumps(run(args.users, args.count, args.products, redis_conn),
+                     indent=2))
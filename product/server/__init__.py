@@ -15,4 +15,6 @@ api = Api(app)
 
 log.configure_logging()
 
-from server import views
+from server import profiling, views
+
+profiling.install(app)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+from urllib.parse import urlencode
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from server import cache
+from server.async_models import AsyncUsers, AsyncProducts, AsyncDataVersions
+from server.exceptions import HTTPBadRequest
+from server.resources import RecommendationsResource, ProductsResource
+
+logger = logging.getLogger(__name__)
+
+""" The ASGI (asyncio) serving mode of the product server.
+
+Serves the same routes, with the same request and response formats, as the
+flask resources in `server.resources`, and reuses their rendering helpers.
+The difference is in the I/O: redis is accessed through an asyncio client
+with a bounded connection pool, and the lookups that do not depend on each
+other are issued concurrently instead of one after the other.
+
+Run with an ASGI server, eg. `uvicorn server.asgi:app`, or set `SERVING_MODE`
+to 'asgi' and use `start_server.py`.
+"""
+
+
+async def _validate_user(user_id: int) -> AsyncUsers:
+    """ same validation as the flask resources. """
+    try:
+        return await AsyncUsers.get(user_id)
+    except KeyError:
+        message = 'invalid user id:{}'.format(user_id)
+        logger.error(message)
+        raise HTTPBadRequest(message, payload={'message': message})
+
+
+async def _data_versions() -> dict:
+    """ the data versions, through the short-lived versions cache. """
+    versions = cache.versions.get('versions')
+
+    if versions is None:
+        versions = await AsyncDataVersions.get_all()
+        cache.versions.set('versions', versions)
+
+    return versions
+
+
+async def ratings(request: Request) -> JSONResponse:
+    """ the asyncio version of `RatingsResource.get` and
+    `RatingsResource.put`.
+
+    """
+    user = await _validate_user(request.path_params['user_id'])
+
+    if request.method == 'GET':
+        return JSONResponse({
+            'ratings': await user.get_ratings()
+        })
+
+    try:
+        ratings_data = (await request.json())['ratings']
+    except (ValueError, KeyError, TypeError):
+        message = "invalid ratings data."
+        logger.error(message)
+        raise HTTPBadRequest(message, payload={'message': message})
+
+    await user.set_ratings(ratings_data)
+
+    return JSONResponse({
+        'message': 'success'
+    })
+
+
+async def recommendations(request: Request) -> JSONResponse:
+    """ the asyncio version of `RecommendationsResource.get`.
+
+    The recommendations rendered by the recommender are served if there are
+    any. Otherwise, the curated recommendations and the default ones are
+    fetched together, followed by the metadata of the final recommendations
+    in a single round trip. The user's ratings are only fetched to filter the
+    default ones.
+
+    """
+    user = await _validate_user(request.path_params['user_id'])
+
+    versions, ratings_version = await asyncio.gather(
+        _data_versions(), user.get_ratings_version())
+
+    key, headers = RecommendationsResource.cache_validators(
+        versions, user.id, ratings_version)
+
+    if cache.is_not_modified(request.headers, headers):
+        return Response(status_code=304, headers=headers)
+
+    body = cache.responses.get(key)
+
+    if body is None:
+        body = await _recommendations_body(user,
+                                           versions['products']['version'])
+        cache.responses.set(key, body)
+
+    return JSONResponse(body, headers=headers)
+
+
+async def _recommendations_body(user: AsyncUsers,
+                                products_version: int) -> dict:
+    """ the body of a recommendations response, see
+    `RecommendationsResource._get_recommendations`.
+
+    """
+    rendered = RecommendationsResource._rendered_recommendations(
+        await user.get_recommendations_payload(), products_version)
+
+    if rendered is not None:
+        return {
+            'recommendations': rendered
+        }
+
+    curated, default = await asyncio.gather(
+        user.get_recommendations(),
+        AsyncUsers.get_default_recommendations())
+
+    filtered = curated
+
+    if not curated:
+        logger.debug('No curated recommendations. Picking default ones.')
+        filtered = RecommendationsResource._exclude_used(
+            default, await user.get_products_used())
+
+    products = await AsyncProducts.get_many(filtered)
+
+    return {
+        'recommendations': [
+            RecommendationsResource._render_details(product)
+            for product in products]
+    }
+
+
+async def products(request: Request) -> JSONResponse:
+    """ the asyncio version of `ProductsResource.get`.
+
+    The page of the catalog and the user's ratings are fetched together.
+
+    """
+    offset = int(request.query_params.get('offset', 1))
+
+    limit = int(request.query_params.get('limit', 50))
+
+    user_id = request.query_params.get('user_id')
+
+    try:
+        user = await _validate_user(int(user_id))
+    except (TypeError, ValueError):
+        message = 'invalid user id:{}'.format(user_id)
+        logger.error(message)
+        raise HTTPBadRequest(message, payload={'message': message})
+
+    versions, ratings_version = await asyncio.gather(
+        _data_versions(), user.get_ratings_version())
+
+    key, headers = ProductsResource.cache_validators(
+        versions, user.id, ratings_version, offset, limit)
+
+    if cache.is_not_modified(request.headers, headers):
+        return Response(status_code=304, headers=headers)
+
+    body = cache.responses.get(key)
+
+    if body is None:
+        catalog, user_ratings = await asyncio.gather(
+            AsyncProducts.get_many(list(range(offset, offset + limit))),
+            user.get_ratings())
+
+        products_data = [ProductsResource._render_product(product) for
+                         product in catalog
+                         if ProductsResource._is_valid(product)]
+
+        next_query = urlencode({'offset': offset + limit, 'limit': limit,
+                                'user_id': user_id})
+
+        body = {
+            'products': ProductsResource._transform_products(products_data,
+                                                             user_ratings),
+            'next': '{}?{}'.format(request.url.path, next_query)
+        }
+        cache.responses.set(key, body)
+
+    return JSONResponse(body, headers=headers)
+
+
+async def handle_bad_request(request: Request,
+                             error: HTTPBadRequest) -> JSONResponse:
+    return JSONResponse(error.to_dict(), status_code=error.status_code)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/v1/users/{user_id:int}/ratings', ratings,
+              methods=['GET', 'PUT']),
+        Route('/api/v1/users/{user_id:int}/recommendations', recommendations,
+              methods=['GET']),
+        Route('/api/v1/products', products, methods=['GET']),
+    ],
+    middleware=[
+        # enable CORS for this app, as for the flask one.
+        Middleware(CORSMiddleware, allow_origins=['*'],
+                   allow_methods=['*'], allow_headers=['*']),
+    ],
+    exception_handlers={
+        HTTPBadRequest: handle_bad_request,
+    })
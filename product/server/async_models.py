@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+from server import config
+from server.extensions import async_redis_conn
+from server.models import Users, Products, DataVersions, BUCKETS_LAYOUT
+
+""" asyncio counterparts of the models in `server.models`, for the ASGI
+serving mode.
+
+They read and write the very same redis keys, with the same encodings, so
+both serving modes can run side by side against one redis. Only the queries
+used by the REST resources are supported.
+"""
+
+
+class AsyncUsers(object):
+    """ An asyncio version of `Users`. See `Users` for the details. """
+
+    redis = async_redis_conn
+
+    def __init__(self, id: int):
+        self.id = id
+
+    @classmethod
+    async def get(cls, id: int):
+        if await cls.redis.sismember(Users.registry_key(), id):
+            return cls(id)
+        else:
+            raise KeyError("user with id: {} does not exist.".format(id))
+
+    async def get_ratings(self) -> list:
+        ratings_hash = await self.redis.hgetall(Users.ratings_key(self.id))
+
+        return Users.deserialize_ratings(ratings_hash)
+
+    async def set_ratings(self, ratings: list) -> None:
+        if not ratings:
+            return
+
+        key = Users.ratings_key(self.id)
+
+        mapping = {rating['product_id']: rating['rating'] for rating in
+                   ratings}
+
+        # one transaction, as in `Users.set_ratings`.
+        pipeline = self.redis.pipeline(transaction=True)
+
+        pipeline.hset(key, mapping=mapping)
+
+        pipeline.set(Users.ratings_version_key(self.id), time.time())
+
+        for rating in ratings:
+            pipeline.xadd(Users.rating_events_key(),
+                          Users.rating_event(self.id, rating),
+                          maxlen=config.RATING_EVENTS_MAXLEN,
+                          approximate=True)
+
+        await pipeline.execute()
+
+    async def get_ratings_version(self) -> float:
+        value = await self.redis.get(Users.ratings_version_key(self.id))
+
+        return Users.deserialize_version(value)
+
+    async def get_products_used(self) -> list:
+        ratings = await self.get_ratings()
+
+        return [item['product_id'] for item in ratings]
+
+    async def get_recommendations(self) -> list:
+        value = await self.redis.get(Users.recommendations_key(self.id))
+
+        return Users.deserialize_recommendations(value)
+
+    @classmethod
+    async def get_default_recommendations(cls) -> list:
+        value = await cls.redis.get(Users.recommendations_key(-1))
+
+        return Users.deserialize_recommendations(value)
+
+    async def get_recommendations_payload(self) -> dict:
+        value = await self.redis.get(
+            Users.recommendations_payload_key(self.id))
+
+        return Users.deserialize_payload(value)
+
+
+class AsyncProducts(object):
+    """ An asyncio version of `Products`. Returns plain `Products` instances.
+    See `Products` for the details.
+
+    """
+
+    redis = async_redis_conn
+
+    @classmethod
+    async def get(cls, id: int) -> Products:
+        if Products.layout == BUCKETS_LAYOUT:
+            meta = await cls.redis.hget(
+                Products.bucket_key(Products.bucket_of(id)), id)
+        else:
+            meta = await cls.redis.get(Products.key(id))
+
+        return Products.deserialize(id, meta)
+
+    @classmethod
+    async def get_many(cls, ids: list) -> list:
+        """ fetches many products in a single round trip, preserving the
+        order of the ids. Missing products are None.
+
+        """
+        if not ids:
+            return []
+
+        if Products.layout == BUCKETS_LAYOUT:
+            buckets = Products.group_by_bucket(ids)
+
+            bucket_metas = await asyncio.gather(*(
+                cls.redis.hmget(key, bucket_ids) for key, bucket_ids in
+                buckets.items()))
+
+            metas = Products.merge_buckets(ids, buckets, bucket_metas)
+        else:
+            metas = await cls.redis.mget([Products.key(id) for id in ids])
+
+        return [Products.deserialize(id, meta) for id, meta in zip(ids, metas)]
+
+
+class AsyncDataVersions(object):
+    """ An asyncio version of `DataVersions`. See `DataVersions` for the
+    details.
+
+    """
+
+    redis = async_redis_conn
+
+    @classmethod
+    async def get_all(cls) -> dict:
+        versions_hash = await cls.redis.hgetall(DataVersions.key())
+
+        return DataVersions.deserialize(versions_hash)
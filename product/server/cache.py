@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
+from server import config
+
+""" Caching of rendered responses, validated by data versions.
+
+The recommendations and the catalog only change when the recommender
+rewrites them, and it bumps a version stamp each time it does (see
+`DataVersions`). A response is keyed by the versions of all the data that
+went into it, so a cached response is served for as long as none of them
+change, and an `ETag`/`Last-Modified` pair derived from the same key lets
+clients revalidate with a `304 Not Modified`.
+"""
+
+
+class TTLCache(object):
+    """ A thread-safe, in-process LRU cache whose entries also expire after a
+    fixed time.
+
+    Attributes:
+        maxsize: the maximum number of entries. The least recently used entry
+        is evicted to make room for a new one.
+
+        ttl: the number of seconds an entry stays valid.
+
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return default
+
+            expires_at, value = entry
+
+            if expires_at < time.time():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+""" The rendered responses, keyed by the versions of the data in them. """
+responses = TTLCache(maxsize=config.RESPONSE_CACHE_SIZE,
+                     ttl=config.RESPONSE_CACHE_TTL)
+
+""" The data versions themselves. Kept for a short while, so that hot read
+traffic does not hit redis for them on every request. """
+versions = TTLCache(maxsize=1, ttl=config.VERSIONS_CACHE_TTL)
+
+
+def validators(key: tuple, last_modified: float) -> dict:
+    """ builds the cache validation headers for a response.
+
+    Args:
+        key: the cache key of the response, made of data versions.
+
+        last_modified: the time the newest data in the response was updated.
+
+    Returns:
+        a dict of response headers.
+
+    """
+    etag = hashlib.md5(repr(key).encode()).hexdigest()
+
+    return {
+        'ETag': '"{}"'.format(etag),
+        'Last-Modified': formatdate(last_modified, usegmt=True),
+        # clients may store the response, but have to revalidate it.
+        'Cache-Control': 'no-cache',
+    }
+
+
+def is_not_modified(request_headers, response_headers: dict) -> bool:
+    """ checks the conditional request headers against the validators of the
+    response, as per RFC 7232. `If-None-Match` takes precedence over
+    `If-Modified-Since`.
+
+    Args:
+        request_headers: a case-insensitive mapping of the request headers.
+
+        response_headers: the validators, from `validators`.
+
+    """
+    if_none_match = request_headers.get('If-None-Match')
+
+    if if_none_match:
+        etags = [etag.strip() for etag in if_none_match.split(',')]
+        # weak comparison, as allowed for GET requests.
+        etags = [etag[2:] if etag.startswith('W/') else etag for etag in etags]
+
+        return '*' in etags or response_headers['ETag'] in etags
+
+    if_modified_since = request_headers.get('If-Modified-Since')
+
+    if if_modified_since:
+        since = parsedate_tz(if_modified_since)
+        modified = parsedate_tz(response_headers['Last-Modified'])
+
+        return since is not None and mktime_tz(modified) <= mktime_tz(since)
+
+    return False
@@ -1,8 +1,17 @@
 # -*- coding: utf-8 -*-
 import redis
+import redis.asyncio
 
 from server import config
 
 """ Various global objects that can be loaded on demand"""
 
-redis_conn = redis.StrictRedis(host=config.REDIS_HOST, port=config.REDIS_PORT)
+redis_conn = redis.StrictRedis(host=config.REDIS_HOST, port=config.REDIS_PORT,
+                               db=config.REDIS_DB)
+
+# used by the ASGI serving mode. The blocking pool caps the number of
+# connections, and makes requests wait for a free one instead of failing.
+async_redis_conn = redis.asyncio.StrictRedis(
+    connection_pool=redis.asyncio.BlockingConnectionPool(
+        host=config.REDIS_HOST, port=config.REDIS_PORT, db=config.REDIS_DB,
+        max_connections=config.ASYNC_REDIS_POOL_SIZE))
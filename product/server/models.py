@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 import json
+import time
 from collections import Generator
 
 from server import config
 from server.extensions import redis_conn
+from server.serialization import JSON, RecommendationsCodec, ProductCodec
 
 
 """ A simple, quickly-prototyped ORM layer on top of Redis. 
@@ -15,45 +17,99 @@ The implementation details are hackish, and best left alone.
 """ The type of product to initialize at start. """
 DATA_PARTITION = 'movielens'
 
-""" The only user ids the system supports currently. """
-ALLOWED_USER_IDS = [-1, 10001, 10002]
+""" The demo users, registered when the server starts. """
+SEED_USER_IDS = [-1, 10001, 10002]
 
 
 class Users(object):
     """ A model that represents the user.
 
+    The registry of users is a redis set, so membership checks are O(1).
+    Users who submit ratings are also added to a set of users active since
+    the last sync, which the recommender's transporter drains. Each rating is
+    also published as an event to a redis stream, which the transporter
+    consumes to ingest the ratings as they come.
+
     Supports the following queries:
     * get a user from id
+    * register new users
     * get all users in the system
     * get the ratings given by a user
     * persist the given ratings for a user
     * get all the products used by a user
-    * get the recommendations for a user
+    * get the recommendations for a user, as ids or as rendered by the
+      recommender
 
     """
 
     redis = redis_conn
 
+    # only ever decodes. The recommendations are written by the recommender,
+    # in any version of the format.
+    recommendations_codec = RecommendationsCodec(JSON)
+
     def __init__(self, id: int):
         self.id = id
 
     @classmethod
     def get(cls, id: int):
-        if id in ALLOWED_USER_IDS:
+        if cls.redis.sismember(cls.registry_key(), id):
             return cls(id)
         else:
             raise KeyError("user with id: {} does not exist.".format(id))
 
+    @classmethod
+    def register(cls, ids: list) -> None:
+        if ids:
+            cls.redis.sadd(cls.registry_key(), *ids)
+
     @classmethod
     def get_all(cls) -> Generator:
-        return (cls.get(user_id) for user_id in
-                config.ALLOWED_USER_IDS)
+        # the user base can be large, stream it.
+        return (cls(int(user_id)) for user_id in
+                cls.redis.sscan_iter(cls.registry_key(),
+                                     count=config.USERS_SCAN_COUNT))
+
+    @staticmethod
+    def registry_key() -> str:
+        return '{}_users'.format(DATA_PARTITION)
+
+    @staticmethod
+    def ratings_key(id: int) -> str:
+        return '{}_ratings_{}'.format(DATA_PARTITION, id)
+
+    @staticmethod
+    def recommendations_key(id: int) -> str:
+        return '{}_recommendations_{}'.format(DATA_PARTITION, id)
+
+    @staticmethod
+    def ratings_version_key(id: int) -> str:
+        return '{}_ratings_version_{}'.format(DATA_PARTITION, id)
+
+    @staticmethod
+    def recommendations_payload_key(id: int) -> str:
+        return '{}_recommendations_payload_{}'.format(DATA_PARTITION, id)
+
+    @staticmethod
+    def rating_events_key() -> str:
+        return '{}_rating_events'.format(DATA_PARTITION)
+
+    @staticmethod
+    def rating_event(id: int, rating: dict) -> dict:
+        """ the fields of the stream entry of a rating. """
+        return {
+            'user_id': id,
+            'product_id': rating['product_id'],
+            'rating': rating['rating'],
+        }
 
     def get_ratings(self) -> list:
-        key = '{}_ratings_{}'.format(DATA_PARTITION, self.id)
+        ratings_hash = self.redis.hgetall(self.ratings_key(self.id))
 
-        ratings_hash = self.redis.hgetall(key)
+        return self.deserialize_ratings(ratings_hash)
 
+    @staticmethod
+    def deserialize_ratings(ratings_hash: dict) -> list:
         ratings = []
 
         for key, value in ratings_hash.items():
@@ -65,10 +121,36 @@ class Users(object):
         return ratings
 
     def set_ratings(self, ratings: list) -> None:
-        key = '{}_ratings_{}'.format(DATA_PARTITION, self.id)
+        """ stores the ratings, and publishes their events to the
+        recommender. All in one transaction, so the recommender gets exactly
+        the ratings stored.
+
+        """
+        key = self.ratings_key(self.id)
+
+        pipeline = self.redis.pipeline(transaction=True)
+
+        for rating in ratings:
+            pipeline.hset(key, rating['product_id'], rating['rating'])
+
+        pipeline.set(self.ratings_version_key(self.id), time.time())
 
         for rating in ratings:
-            self.redis.hset(key, rating['product_id'], rating['rating'])
+            pipeline.xadd(self.rating_events_key(),
+                          self.rating_event(self.id, rating),
+                          maxlen=config.RATING_EVENTS_MAXLEN,
+                          approximate=True)
+
+        pipeline.execute()
+
+    def get_ratings_version(self) -> float:
+        """ the time the user's ratings last changed, 0 if never. """
+        return self.deserialize_version(
+            self.redis.get(self.ratings_version_key(self.id)))
+
+    @staticmethod
+    def deserialize_version(value) -> float:
+        return float(value) if value else 0.0
 
     def get_products_used(self) -> list:
         ratings = self.get_ratings()
@@ -76,16 +158,34 @@ class Users(object):
         return [item['product_id'] for item in ratings]
 
     def get_recommendations(self) -> list:
-        key = '{}_recommendations_{}'.format(DATA_PARTITION, self.id)
+        key = self.recommendations_key(self.id)
 
         return self._get_recommendations_for_key(key)
 
     @classmethod
     def get_default_recommendations(cls):
-        key = '{}_recommendations_-1'.format(DATA_PARTITION)
+        key = cls.recommendations_key(-1)
 
         return cls._get_recommendations_for_key(key)
 
+    def get_recommendations_payload(self) -> dict:
+        """ the recommendations of the user as rendered by the recommender,
+        None if it did not render them. See `deserialize_payload`.
+
+        """
+        return self.deserialize_payload(
+            self.redis.get(self.recommendations_payload_key(self.id)))
+
+    @staticmethod
+    def deserialize_payload(value) -> dict:
+        """ decodes a rendered payload, a dict with the rendered
+        `recommendations` and the `products_version` of the catalog they
+        were rendered with.
+
+        """
+        if value:
+            return json.loads(value)
+
     def has_rated(self):
         return self.get_ratings() != []
 
@@ -93,19 +193,35 @@ class Users(object):
     def _get_recommendations_for_key(cls, key):
         value = cls.redis.get(key)
 
+        return cls.deserialize_recommendations(value)
+
+    @classmethod
+    def deserialize_recommendations(cls, value) -> list:
         if value:
-            recommendations = json.loads(value)
+            recommendations = cls.recommendations_codec.decode(value)
         else:
             recommendations = []
 
         return recommendations
 
 
+""" The layouts of the product catalog in redis, see `Products`. """
+KEYS_LAYOUT = 'keys'
+BUCKETS_LAYOUT = 'buckets'
+
+
 class Products(object):
     """ A model that represents the Product.
 
+    The catalog is stored in one of two layouts, picked in the settings,
+    which has to match the recommender's:
+    * 'keys': a string key per product.
+    * 'buckets': the products are grouped by id into hashes of `bucket_size`
+      products each, and the buckets in use are tracked in a set. See the
+      recommender's `Products` for the details.
+
     Supports the following queries:
-    * get a product from id
+    * get a product from id, or many products at once
     * get all products in the system
     * add a new product to the system. If the product already exists, update it.
 
@@ -113,19 +229,91 @@ class Products(object):
 
     redis = redis_conn
 
+    codec = ProductCodec(config.PRODUCTS_ENCODING)
+
+    layout = config.PRODUCTS_LAYOUT
+
+    bucket_size = config.PRODUCTS_BUCKET_SIZE
+
     def __init__(self, id: int, name: str, desc: str):
         self.id = id
         self.name = name
         self.desc = desc
 
+    @staticmethod
+    def key(id: int) -> str:
+        return '{}_products_{}'.format(DATA_PARTITION, id)
+
+    @staticmethod
+    def bucket_key(bucket: int) -> str:
+        return '{}_product_buckets_{}'.format(DATA_PARTITION, bucket)
+
+    @staticmethod
+    def buckets_key() -> str:
+        return '{}_product_buckets'.format(DATA_PARTITION)
+
+    @classmethod
+    def bucket_of(cls, id: int) -> int:
+        return int(id) // cls.bucket_size
+
+    @classmethod
+    def group_by_bucket(cls, ids: list) -> dict:
+        """ groups product ids by the key of their bucket. """
+        buckets = {}
+
+        for id in ids:
+            buckets.setdefault(cls.bucket_key(cls.bucket_of(id)), []).append(id)
+
+        return buckets
+
     @classmethod
     def get(cls, id: int):
-        key = '{}_products_{}'.format(DATA_PARTITION, id)
+        if cls.layout == BUCKETS_LAYOUT:
+            meta = cls.redis.hget(cls.bucket_key(cls.bucket_of(id)), id)
+        else:
+            meta = cls.redis.get(cls.key(id))
 
-        meta = cls.redis.get(key)
+        return cls.deserialize(id, meta)
 
+    @classmethod
+    def get_many(cls, ids: list) -> list:
+        """ fetches many products in a single round trip, preserving the
+        order of the ids. Missing products are None.
+
+        """
+        if not ids:
+            return []
+
+        if cls.layout == BUCKETS_LAYOUT:
+            buckets = cls.group_by_bucket(ids)
+
+            pipeline = cls.redis.pipeline(transaction=False)
+            for key, bucket_ids in buckets.items():
+                pipeline.hmget(key, bucket_ids)
+
+            metas = cls.merge_buckets(ids, buckets, pipeline.execute())
+        else:
+            metas = cls.redis.mget([cls.key(id) for id in ids])
+
+        return [cls.deserialize(id, meta) for id, meta in zip(ids, metas)]
+
+    @staticmethod
+    def merge_buckets(ids: list, buckets: dict, bucket_metas: list) -> list:
+        """ puts the metadata fetched per bucket back in the order of the
+        ids.
+
+        """
+        metas = {}
+
+        for bucket_ids, values in zip(buckets.values(), bucket_metas):
+            metas.update(zip(bucket_ids, values))
+
+        return [metas[id] for id in ids]
+
+    @classmethod
+    def deserialize(cls, id: int, meta):
         if meta:
-            meta = json.loads(meta)
+            meta = cls.codec.decode(meta)
 
             return cls(id=id, name=meta['name'], desc=meta['desc'])
 
@@ -133,16 +321,77 @@ class Products(object):
     def get_all(cls) -> list:
         # products catalog can be large
         # TODO test for possible use cases and if fine, use a generator instead
-        return [cls.get(key) for key in
-                cls.redis.keys('{}_products_*'.format(DATA_PARTITION))]
+        if cls.layout == BUCKETS_LAYOUT:
+            products = []
+
+            for bucket in cls.redis.sscan_iter(cls.buckets_key()):
+                bucket_hash = cls.redis.hgetall(cls.bucket_key(int(bucket)))
+
+                products.extend(cls.deserialize(int(id), meta) for id, meta in
+                                bucket_hash.items())
+
+            return products
+
+        prefix = cls.key('').encode()
+
+        return [cls.get(int(key[len(prefix):])) for key in
+                cls.redis.scan_iter(match=prefix + b'*')]
 
     @classmethod
     def upsert(cls, id, name, desc) -> None:
-        key = '{}_products_{}'.format(DATA_PARTITION, id)
-
-        value = json.dumps({
+        value = cls.codec.encode({
             'name': name,
             'desc': desc
         })
 
-        cls.redis.set(key, value)
+        if cls.layout == BUCKETS_LAYOUT:
+            bucket = cls.bucket_of(id)
+
+            pipeline = cls.redis.pipeline(transaction=False)
+            pipeline.hset(cls.bucket_key(bucket), id, value)
+            pipeline.sadd(cls.buckets_key(), bucket)
+            pipeline.execute()
+        else:
+            cls.redis.set(cls.key(id), value)
+
+
+class DataVersions(object):
+    """ A model for the version stamps of the data sets in the serving db.
+
+    The recommender bumps the version of a data set each time it rewrites it.
+
+    Supports the following queries:
+    * get the versions of all data sets
+
+    """
+
+    redis = redis_conn
+
+    """ The data sets with a version. """
+    DATA_SETS = ('recommendations', 'products')
+
+    @staticmethod
+    def key() -> str:
+        return '{}_versions'.format(DATA_PARTITION)
+
+    @classmethod
+    def get_all(cls) -> dict:
+        return cls.deserialize(cls.redis.hgetall(cls.key()))
+
+    @classmethod
+    def deserialize(cls, versions_hash: dict) -> dict:
+        """ turns the raw hash into a dict of data set to a dict with its
+        `version` and the time it was `updated_at`. Data sets never written
+        are at version 0.
+
+        """
+        versions_hash = {key.decode() if isinstance(key, bytes) else key: value
+                         for key, value in versions_hash.items()}
+
+        return {
+            data_set: {
+                'version': int(versions_hash.get(data_set, 0)),
+                'updated_at': float(versions_hash.get(
+                    '{}_updated_at'.format(data_set), 0)),
+            } for data_set in cls.DATA_SETS
+        }
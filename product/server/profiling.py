@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+import cProfile
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import Flask, g, request
+
+from server import config
+
+logger = logging.getLogger(__name__)
+
+""" Opt-in profiling of requests.
+
+A unit of work (here a request) runs under either a deterministic profiler
+(`cProfile`), which records every call, or a sampling one, which records the
+stack of the working thread every few milliseconds at a much lower overhead.
+The profile is saved to the profiles directory, named after the unit of work,
+as a collapsed-stack file (one `frame;frame;frame count` line per stack, the
+input of flamegraph tools) and, for deterministic profiles, a pstats file.
+"""
+
+DETERMINISTIC = 'deterministic'
+SAMPLING = 'sampling'
+
+""" The profiling modes. """
+MODES = (DETERMINISTIC, SAMPLING)
+
+""" The request header to profile a single request with, set to a mode. """
+PROFILE_HEADER = 'X-Profile'
+
+""" The response header with the name of the saved profile. """
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+# the deepest stack followed when collapsing a deterministic profile.
+_MAX_DEPTH = 64
+
+
+class Profile(object):
+    """ Profiles a unit of work, from `start` to `stop`, in the calling
+    thread. Can also be used as a context manager.
+
+    Attributes:
+        name: the name of the unit of work, eg. a request id. Anything but
+        letters, digits, dots, dashes and underscores is replaced.
+
+        mode: one of `MODES`.
+
+        directory: the directory the profile is saved to.
+
+        interval: the seconds between two samples, in the sampling mode.
+
+    """
+
+    def __init__(self, name: str, mode: str = DETERMINISTIC,
+                 directory: str = config.PROFILES_DIR,
+                 interval: float = config.PROFILING_INTERVAL):
+        if mode not in MODES:
+            raise ValueError('unknown profiling mode: {}. Should be one of {}'
+                             .format(mode, MODES))
+
+        self.name = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+        self.mode = mode
+        self.directory = directory
+        self.interval = interval
+
+        self._profiler = None
+        self._sampler = None
+
+    def start(self) -> None:
+        if self.mode == DETERMINISTIC:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._sampler = _Sampler(threading.get_ident(), self.interval)
+            self._sampler.start()
+
+    def stop(self) -> str:
+        """ Stops profiling, and saves the profile. Does nothing if already
+        stopped.
+
+        Returns:
+            the base name of the saved profile files, None if already stopped.
+
+        """
+        if self._profiler is None and self._sampler is None:
+            return None
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        base_name = '{}-{}'.format(time.strftime('%Y%m%dT%H%M%S'), self.name)
+        path = '{}/{}'.format(self.directory, base_name)
+
+        if self._profiler is not None:
+            self._profiler.disable()
+
+            stats = pstats.Stats(self._profiler)
+            stats.dump_stats('{}.pstats'.format(path))
+
+            stacks = collapse_stats(stats)
+            self._profiler = None
+        else:
+            stacks = self._sampler.stop()
+            self._sampler = None
+
+        with open('{}.collapsed'.format(path), 'w') as collapsed_file:
+            for stack, value in sorted(stacks.items()):
+                collapsed_file.write('{} {}\n'.format(stack, value))
+
+        prune_profiles(self.directory)
+
+        logger.info('saved {} profile {}'.format(self.mode, base_name))
+
+        return base_name
+
+    def __enter__(self) -> 'Profile':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+@contextmanager
+def profiled(name: str, mode: str = None):
+    """ Profiles the enclosed block with the given mode, or not at all if the
+    mode is None.
+
+    """
+    if not mode:
+        yield None
+        return
+
+    with Profile(name, mode) as profile:
+        yield profile
+
+
+class _Sampler(threading.Thread):
+    """ samples the stack of a thread at regular intervals, and counts the
+    samples of each stack.
+
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name='profile-sampler', daemon=True)
+
+        self.thread_id = thread_id
+        self.interval = interval
+
+        self.counts = Counter()
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(_label(code.co_filename, code.co_firstlineno,
+                                    code.co_name))
+                frame = frame.f_back
+
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self.join()
+
+        return self.counts
+
+
+def _label(filename: str, line: int, function: str) -> str:
+    """ a frame of a collapsed stack, without the separators. """
+    if filename == '~':
+        label = function
+    else:
+        label = '{} ({}:{})'.format(function, os.path.basename(filename),
+                                    line)
+
+    return label.replace(';', ',').replace(' ', '_')
+
+
+def collapse_stats(stats: pstats.Stats) -> Counter:
+    """ Turns a deterministic profile into collapsed stacks.
+
+    cProfile only records the caller of each call, not whole stacks, so the
+    own time of a function is split among the paths reaching it in
+    proportion to the time spent on each incoming call, like flameprof does.
+
+    Returns:
+        a counter of collapsed stack to microseconds of own time.
+
+    """
+    children = {}
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, caller_time) in callers.items():
+            children.setdefault(caller, []).append((function, caller_time))
+
+    stacks = Counter()
+
+    pending = [((function,), 1.0) for function, entry in stats.stats.items()
+               if not entry[4]]
+
+    while pending:
+        path, share = pending.pop()
+        function = path[-1]
+        own_time = stats.stats[function][2]
+
+        stack = ';'.join(_label(*frame) for frame in path)
+
+        microseconds = int(own_time * share * 1e6)
+        if microseconds:
+            stacks[stack] += microseconds
+
+        if len(path) >= _MAX_DEPTH:
+            continue
+
+        for child, call_time in children.get(function, ()):
+            child_total = stats.stats[child][3]
+
+            # recursion is cut, and so are the negligible paths.
+            if child in path or child_total <= 0 or \
+                    call_time * share < 1e-6:
+                continue
+
+            pending.append((path + (child,),
+                            share * call_time / child_total))
+
+    return stacks
+
+
+def recent_profiles(directory: str = config.PROFILES_DIR,
+                    count: int = None) -> list:
+    """ Lists the saved profiles, newest first.
+
+    Returns:
+        a list of dicts with the `name`, `size` and `created_at` time of each
+        profile file.
+
+    """
+    if not os.path.exists(directory):
+        return []
+
+    files = []
+    for name in os.listdir(directory):
+        info = os.stat('{}/{}'.format(directory, name))
+        files.append({'name': name, 'size': info.st_size,
+                      'created_at': info.st_mtime})
+
+    files.sort(key=lambda file: (file['created_at'], file['name']),
+               reverse=True)
+
+    return files[:count]
+
+
+def prune_profiles(directory: str = config.PROFILES_DIR,
+                   keep: int = config.PROFILES_KEPT) -> None:
+    """ removes all but the newest `keep` profile files. """
+    for file in recent_profiles(directory)[keep:]:
+        os.remove('{}/{}'.format(directory, file['name']))
+
+
+def enabled() -> bool:
+    """ whether the requests can be profiled at all, and so whether the
+    saved profiles are served.
+
+    """
+    return bool(config.PROFILE_REQUESTS or config.PROFILING_HEADER_ENABLED)
+
+
+def install(app: Flask) -> None:
+    """ Profiles the requests to a flask app.
+
+    Every request is profiled with the `PROFILE_REQUESTS` mode, if set, and
+    single requests with the mode in their `X-Profile` header, if
+    `PROFILING_HEADER_ENABLED`. The name of the saved profile is sent back in
+    the `X-Profile-Id` header.
+
+    """
+    @app.before_request
+    def start_profile():
+        mode = config.PROFILE_REQUESTS
+
+        if config.PROFILING_HEADER_ENABLED:
+            mode = request.headers.get(PROFILE_HEADER, mode)
+
+        if not mode:
+            return
+
+        if mode not in MODES:
+            logger.warning('ignoring unknown profiling mode: {}'.format(mode))
+            return
+
+        name = 'request-{}'.format(
+            request.headers.get('X-Request-Id', uuid.uuid4().hex))
+
+        g.profile = Profile(name, mode, directory=config.PROFILES_DIR)
+        g.profile.start()
+
+    @app.after_request
+    def stop_profile(response):
+        profile = g.pop('profile', None)
+
+        if profile is not None:
+            response.headers[PROFILE_ID_HEADER] = profile.stop()
+
+        return response
+
+    @app.teardown_request
+    def stop_failed_profile(exception):
+        profile = g.pop('profile', None)
+
+        if profile is not None:
+            profile.stop()
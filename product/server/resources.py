@@ -2,13 +2,13 @@
 
 import logging
 
-from flask import request
+from flask import request, send_from_directory
 from flask_restful import Resource
-from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import BadRequest, NotFound
 
-from server import api
+from server import api, cache, config, profiling
 from server.exceptions import HTTPBadRequest
-from server.models import Users, Products
+from server.models import Users, Products, DataVersions
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +30,20 @@ def _is_valid_user(user_id: int) -> bool:
         return False
 
 
+def _data_versions() -> dict:
+    """ module-level function to get the data versions, through the
+    short-lived versions cache.
+
+    """
+    versions = cache.versions.get('versions')
+
+    if versions is None:
+        versions = DataVersions.get_all()
+        cache.versions.set('versions', versions)
+
+    return versions
+
+
 class RatingsResource(Resource):
     """ Exposes the ratings associated with a user id as a resource for REST.
 
@@ -133,18 +147,55 @@ class RecommendationsResource(Resource):
 
         user = Users.get(user_id)
 
-        recommendations = self._get_recommendations(user)
+        versions = _data_versions()
 
-        return {
-            'recommendations': recommendations
-        }
+        key, headers = self.cache_validators(versions, user.id,
+                                             user.get_ratings_version())
+
+        if cache.is_not_modified(request.headers, headers):
+            return None, 304, headers
+
+        body = cache.responses.get(key)
+
+        if body is None:
+            body = {
+                'recommendations': self._get_recommendations(
+                    user, versions['products']['version'])
+            }
+            cache.responses.set(key, body)
+
+        return body, 200, headers
+
+    @staticmethod
+    def cache_validators(versions: dict, user_id: int,
+                         ratings_version: float) -> tuple:
+        """ computes the cache key and validation headers of a user's
+        recommendations. They change whenever the recommendations, the
+        product catalog or the user's ratings do.
+
+        Returns:
+            a tuple of the cache key and a dict of headers.
 
-    def _get_recommendations(self, user: Users) -> list:
+        """
+        key = ('recommendations', user_id,
+               versions['recommendations']['version'],
+               versions['products']['version'], ratings_version)
+
+        last_modified = max(versions['recommendations']['updated_at'],
+                            versions['products']['updated_at'],
+                            ratings_version)
+
+        return key, cache.validators(key, last_modified)
+
+    def _get_recommendations(self, user: Users, products_version: int) -> list:
         """ driver method to orchestrate the ratings extraction.
 
-        This method determines if curated or a default recommendations need to
-        be shown. It also filters the recommendations, and associates metadata
-        with the product ids for final consumption by the client.
+        The curated recommendations are served as rendered by the recommender
+        when it did, in a single read. Otherwise, this method determines if
+        curated or a default recommendations need to be shown. It also filters
+        the default recommendations, and associates metadata with the product
+        ids for final consumption by the client. The curated recommendations
+        leave out the used products already, from when they were generated.
 
         The logic of this method is subjective - it can be as simple or as
         complex as needed by the product business considerations. It can mix
@@ -156,13 +207,20 @@ class RecommendationsResource(Resource):
         Args:
             user: a user object
 
+            products_version: the current version of the product catalog.
+            A payload rendered with an older one is not used.
+
         Returns:
             a list of final recommendations.
 
         """
-        all_recommendations = self._get_curated_or_default(user)
+        rendered = self._rendered_recommendations(
+            user.get_recommendations_payload(), products_version)
 
-        filtered_recommendations = self._filter_recommendations(user, all_recommendations)
+        if rendered is not None:
+            return rendered
+
+        filtered_recommendations = self._get_curated_or_default(user)
 
         detailed_recommendations = []
 
@@ -171,9 +229,23 @@ class RecommendationsResource(Resource):
 
         return detailed_recommendations
 
+    @staticmethod
+    def _rendered_recommendations(payload: dict,
+                                  products_version: int) -> list:
+        """ the recommendations rendered by the recommender, None if there
+        are none, or they were rendered with an older product catalog.
+
+        """
+        if payload is None or payload['products_version'] != products_version:
+            return None
+
+        return payload['recommendations']
+
     @staticmethod
     def _get_curated_or_default(user: Users) -> list:
         """ gets the curated or default recommendations as the case may be.
+        The default ones are the same for all users, so the products used by
+        the user are filtered out of them.
 
         Args:
             user: the user object
@@ -186,7 +258,8 @@ class RecommendationsResource(Resource):
 
         if not recommendations:
             logger.debug('No curated recommendations. Picking default ones.')
-            recommendations = user.get_default_recommendations()
+            recommendations = RecommendationsResource._filter_recommendations(
+                user, user.get_default_recommendations())
 
         logger.debug({' recommendations:{}'.format(recommendations)})
 
@@ -206,6 +279,16 @@ class RecommendationsResource(Resource):
         """
         used = user.get_products_used()
 
+        return RecommendationsResource._exclude_used(all_, used)
+
+    @staticmethod
+    def _exclude_used(all_: list, used: list) -> list:
+        """ removes the used products from a list of recommendations,
+        preserving the order.
+
+        """
+        used = set(used)
+
         filtered = [item for item in all_ if item not in used]
 
         logger.debug('filtered recommendations:{}'.format(filtered))
@@ -226,6 +309,15 @@ class RecommendationsResource(Resource):
 
         product = Products.get(product_id)
 
+        return RecommendationsResource._render_details(product)
+
+    @staticmethod
+    def _render_details(product: Products) -> dict:
+        """ renders a product as it appears in the recommendations. The
+        recommender renders the payloads the same way, see its
+        `Transporter`.
+
+        """
         return {
             'product_id': product.id,
             'meta': {
@@ -271,13 +363,43 @@ class ProductsResource(Resource):
 
         user = Users.get(id=int(user_id))
 
-        products = self._get_products(user, offset, limit)
+        key, headers = self.cache_validators(_data_versions(), user.id,
+                                             user.get_ratings_version(),
+                                             offset, limit)
 
-        return {
-            'products': products,
-            'next': api.url_for(ProductsResource, offset=offset + limit,
-                                limit=limit, user_id=user_id)
-        }
+        if cache.is_not_modified(request.headers, headers):
+            return None, 304, headers
+
+        body = cache.responses.get(key)
+
+        if body is None:
+            body = {
+                'products': self._get_products(user, offset, limit),
+                'next': api.url_for(ProductsResource, offset=offset + limit,
+                                    limit=limit, user_id=user_id)
+            }
+            cache.responses.set(key, body)
+
+        return body, 200, headers
+
+    @staticmethod
+    def cache_validators(versions: dict, user_id: int, ratings_version: float,
+                         offset: int, limit: int) -> tuple:
+        """ computes the cache key and validation headers of a page of the
+        catalog, as seen by a user. They change whenever the product catalog
+        or the user's ratings do.
+
+        Returns:
+            a tuple of the cache key and a dict of headers.
+
+        """
+        key = ('products', user_id, offset, limit,
+               versions['products']['version'], ratings_version)
+
+        last_modified = max(versions['products']['updated_at'],
+                            ratings_version)
+
+        return key, cache.validators(key, last_modified)
 
     def _get_products(self, user: Users, offset: int, limit: int) -> list:
         """ driver method orchestrating and handling all transformations to
@@ -317,25 +439,25 @@ class ProductsResource(Resource):
             yet.
 
         """
-        products = []
-
-        for product_id in range(offset, offset + limit):
+        catalog = Products.get_many(list(range(offset, offset + limit)))
 
-            product = Products.get(product_id)
+        return [self._render_product(product) for product in catalog if
+                self._is_valid(product)]
 
-            if self._is_valid(product):
-                product_data = {
-                    'product_id': product.id,
-                    'meta': {
-                        'product_name': product.name,
-                        'product_desc': product.desc
-                    },
-                    'rating': -1
-                }
-
-                products.append(product_data)
+    @staticmethod
+    def _render_product(product: Products) -> dict:
+        """ renders a product as it appears in the catalog, with a default
+        rating of -1.
 
-        return products
+        """
+        return {
+            'product_id': product.id,
+            'meta': {
+                'product_name': product.name,
+                'product_desc': product.desc
+            },
+            'rating': -1
+        }
 
     @staticmethod
     def _is_valid(product):
@@ -359,17 +481,66 @@ class ProductsResource(Resource):
         Returns:
             a list of patched products, with user ratings superimposed.
         """
+        ratings_by_product = {user_rating['product_id']: user_rating['rating']
+                              for user_rating in user_ratings}
+
         transformed_products = []
 
-        # TODO inefficient, think of a better way!
         for product_data in products:
 
-            for user_rating in user_ratings:
-
-                if user_rating['product_id'] == product_data['product_id']:
-                    product_data['rating'] = user_rating['rating']
-                    break
+            if product_data['product_id'] in ratings_by_product:
+                product_data['rating'] = \
+                    ratings_by_product[product_data['product_id']]
 
             transformed_products.append(product_data)
 
         return transformed_products
+
+
+def _ensure_profiling_enabled() -> None:
+    """ the saved profiles are not found while profiling is off, see
+    `server.profiling.enabled`.
+
+    """
+    if not profiling.enabled():
+        raise NotFound()
+
+
+class ProfilesResource(Resource):
+    """ Exposes the saved profiles as a resource for REST, while profiling
+    is on. See `server.profiling`.
+
+    """
+    def get(self):
+        """ lists the most recent profile files, newest first.
+
+        Request args:
+            count: the number of files to list, 50 by default.
+
+        """
+        _ensure_profiling_enabled()
+
+        try:
+            count = int(request.args.get('count', 50))
+        except ValueError:
+            message = 'invalid count:{}'.format(request.args.get('count'))
+            logger.error(message)
+            raise HTTPBadRequest(message, payload={'message': message})
+
+        return {
+            'profiles': profiling.recent_profiles(config.PROFILES_DIR,
+                                                  count=count)
+        }
+
+
+class ProfileResource(Resource):
+    """ Exposes a saved profile file as a resource for REST. """
+    def get(self, name: str):
+        """ downloads a profile file, by the name listed by
+        `ProfilesResource`.
+
+        """
+        _ensure_profiling_enabled()
+
+        return send_from_directory(config.PROFILES_DIR, name,
+                                   as_attachment=True)
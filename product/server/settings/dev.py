@@ -6,8 +6,45 @@ PROJECT_ROOT = os.getcwd()
 
 REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
+# the database of the server. Another one than the recommender's can be given
+# to run a scratch server, eg. for `benchmarks.load_test`.
+REDIS_DB = int(os.environ.get('REDIS_DB', 0))
+
+# serving. 'flask' for the WSGI app, 'asgi' for the asyncio one.
+SERVING_MODE = os.environ.get('SERVING_MODE', 'flask')
+SERVER_PORT = 8000
+ASGI_WORKERS = 1
+ASYNC_REDIS_POOL_SIZE = 32
+
+# caching
+RESPONSE_CACHE_SIZE = 10000
+RESPONSE_CACHE_TTL = 300
+VERSIONS_CACHE_TTL = 1
 
 # models
+USERS_SCAN_COUNT = 1000
+# the encoding version of the products written by the server, see
+# `server.serialization`. Any version is read.
+PRODUCTS_ENCODING = 1
+# the layout of the product catalog in redis, 'keys' or 'buckets'. Has to
+# match the recommender's, which also migrates between them.
+PRODUCTS_LAYOUT = 'keys'
+PRODUCTS_BUCKET_SIZE = 100
+# every rating is published to a redis stream, for the recommender to ingest.
+# The stream is trimmed to about RATING_EVENTS_MAXLEN events, which should be
+# well beyond the backlog of the consumer.
+RATING_EVENTS_MAXLEN = 1000000
+
+# profiling, see `server.profiling`. PROFILE_REQUESTS profiles every request
+# with the given mode, 'deterministic' or 'sampling'. The X-Profile header
+# profiles a single request, when PROFILING_HEADER_ENABLED, which lets any
+# client profile, so it is off by default. The saved profiles are only served
+# while some profiling is on.
+PROFILES_DIR = '{}/profiles'.format(PROJECT_ROOT)
+PROFILE_REQUESTS = None
+PROFILING_HEADER_ENABLED = False
+PROFILING_INTERVAL = 0.005
+PROFILES_KEPT = 100
 
 
 # logging
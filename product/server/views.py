@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from server import api
 from server.resources import RatingsResource, RecommendationsResource, \
-    ProductsResource
+    ProductsResource, ProfilesResource, ProfileResource
 
 api.add_resource(RatingsResource, '/api/v1/users/<int:user_id>/ratings')
 
@@ -9,3 +9,7 @@ api.add_resource(RecommendationsResource,
                  '/api/v1/users/<int:user_id>/recommendations')
 
 api.add_resource(ProductsResource, '/api/v1/products')
+
+api.add_resource(ProfilesResource, '/api/v1/profiles')
+
+api.add_resource(ProfileResource, '/api/v1/profiles/<name>')
@@ -1,5 +1,15 @@
 # -*- coding: utf-8 -*-
 
-from server import app
+from server import app, config
+from server.models import Users, SEED_USER_IDS
 
-app.run(debug=True, port=8000)
\ No newline at end of file
+# make sure the demo users are registered.
+Users.register(SEED_USER_IDS)
+
+if config.SERVING_MODE == 'asgi':
+    import uvicorn
+
+    uvicorn.run('server.asgi:app', port=config.SERVER_PORT,
+                workers=config.ASGI_WORKERS)
+else:
+    app.run(debug=True, port=config.SERVER_PORT)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+from starlette.testclient import TestClient
+
+from server import asgi, cache
+from server.async_models import AsyncUsers, AsyncProducts, AsyncDataVersions
+from server.models import DATA_PARTITION, BUCKETS_LAYOUT, Products
+
+
+class FakeAsyncRedis(object):
+    """ the handful of async redis commands used by the async models. """
+
+    def __init__(self, data: dict):
+        self.data = data
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    async def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    async def hmget(self, key, fields):
+        return [self.data.get(key, {}).get(field) for field in fields]
+
+    async def hgetall(self, key):
+        return self.data.get(key, {})
+
+    async def set(self, key, value):
+        self.data[key] = value
+
+    async def hset(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+
+    async def sismember(self, key, member):
+        return member in self.data.get(key, set())
+
+    async def xadd(self, key, fields, maxlen=None, approximate=True):
+        self.data.setdefault(key, []).append(fields)
+
+    def pipeline(self, transaction=True):
+        return FakeAsyncPipeline(self)
+
+
+class FakeAsyncPipeline(object):
+    """ queues the commands of a `FakeAsyncRedis`, and runs them all on
+    `execute`.
+
+    """
+
+    def __init__(self, redis: FakeAsyncRedis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.redis, name), args, kwargs))
+            return self
+
+        return queue
+
+    async def execute(self):
+        return [await command(*args, **kwargs) for command, args, kwargs in
+                self.commands]
+
+
+class TestAsgi(object):
+
+    @pytest.fixture
+    def redis(self, monkeypatch):
+        redis = FakeAsyncRedis({
+            '{}_users'.format(DATA_PARTITION): {10001, 10002, 10003},
+            '{}_recommendations_10001'.format(DATA_PARTITION): b'[2]',
+            '{}_recommendations_-1'.format(DATA_PARTITION): b'[1, 2]',
+            '{}_ratings_10001'.format(DATA_PARTITION): {b'1': b'5'},
+            '{}_ratings_10003'.format(DATA_PARTITION): {b'2': b'3'},
+            '{}_products_1'.format(DATA_PARTITION):
+                b'{"name": "one", "desc": "first"}',
+            '{}_products_2'.format(DATA_PARTITION):
+                b'{"name": "two", "desc": "second"}',
+        })
+
+        monkeypatch.setattr(AsyncUsers, 'redis', redis)
+        monkeypatch.setattr(AsyncProducts, 'redis', redis)
+        monkeypatch.setattr(AsyncDataVersions, 'redis', redis)
+
+        cache.responses.clear()
+        cache.versions.clear()
+
+        return redis
+
+    @pytest.fixture
+    def client(self, redis):
+        return TestClient(asgi.app)
+
+    def test_curated_recommendations(self, client):
+        response = client.get('/api/v1/users/10001/recommendations')
+
+        assert response.status_code == 200
+        assert response.json() == {'recommendations': [
+            {'product_id': 2, 'meta': {'name': 'two', 'desc': 'second'}}
+        ]}
+
+    @pytest.mark.parametrize('products_version, name', [
+        (0, 'rendered'),
+        # rendered with an older catalog.
+        (1, 'two'),
+    ])
+    def test_rendered_recommendations(self, client, redis, products_version,
+                                      name):
+        redis.data['{}_recommendations_payload_10001'.format(
+            DATA_PARTITION)] = json.dumps({
+                'products_version': products_version,
+                'recommendations': [{'product_id': 2, 'meta': {
+                    'name': 'rendered', 'desc': 'second'}}]}).encode()
+
+        response = client.get('/api/v1/users/10001/recommendations')
+
+        assert response.json()['recommendations'][0]['meta']['name'] == name
+
+    def test_default_recommendations_exclude_rated(self, client):
+        response = client.get('/api/v1/users/10003/recommendations')
+
+        assert response.status_code == 200
+        assert response.json() == {'recommendations': [
+            {'product_id': 1, 'meta': {'name': 'one', 'desc': 'first'}}
+        ]}
+
+    def test_invalid_user(self, client):
+        response = client.get('/api/v1/users/42/recommendations')
+
+        assert response.status_code == 400
+
+    def test_products_superimpose_ratings(self, client):
+        response = client.get('/api/v1/products?offset=1&limit=3'
+                              '&user_id=10001')
+
+        products = response.json()['products']
+
+        assert [product['product_id'] for product in products] == [1, 2]
+        assert [product['rating'] for product in products] == [5, -1]
+
+    def test_put_ratings(self, client, redis):
+        response = client.put('/api/v1/users/10002/ratings',
+                              json={'ratings': [{'product_id': 2,
+                                                 'rating': 4}]})
+
+        assert response.status_code == 200
+        assert redis.data['{}_ratings_10002'.format(DATA_PARTITION)] == {2: 4}
+        assert '{}_active_users'.format(DATA_PARTITION) not in redis.data
+        assert redis.data['{}_rating_events'.format(DATA_PARTITION)] == [
+            {'user_id': 10002, 'product_id': 2, 'rating': 4}]
+
+    def test_not_modified(self, client):
+        response = client.get('/api/v1/users/10001/recommendations')
+
+        response = client.get(
+            '/api/v1/users/10001/recommendations',
+            headers={'If-None-Match': response.headers['ETag']})
+
+        assert response.status_code == 304
+
+    def test_new_ratings_change_the_etag(self, client):
+        etag = client.get('/api/v1/users/10003/recommendations') \
+            .headers['ETag']
+
+        client.put('/api/v1/users/10003/ratings',
+                   json={'ratings': [{'product_id': 1, 'rating': 4}]})
+
+        response = client.get('/api/v1/users/10003/recommendations',
+                              headers={'If-None-Match': etag})
+
+        assert response.status_code == 200
+        assert response.json() == {'recommendations': []}
+
+    def test_products_in_buckets(self, client, redis, monkeypatch):
+        monkeypatch.setattr(Products, 'layout', BUCKETS_LAYOUT)
+        monkeypatch.setattr(Products, 'bucket_size', 2)
+
+        redis.data.update({
+            Products.bucket_key(0): {1: b'{"name": "one", "desc": "first"}'},
+            Products.bucket_key(1): {2: b'{"name": "two", "desc": "second"}',
+                                     3: b'{"name": "three", "desc": "third"}'},
+        })
+
+        response = client.get('/api/v1/products?offset=1&limit=3'
+                              '&user_id=10001')
+
+        products = response.json()['products']
+
+        assert [product['product_id'] for product in products] == [1, 2, 3]
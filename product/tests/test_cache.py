@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import time
+
+from server.cache import TTLCache, validators, is_not_modified
+
+
+class TestTTLCache(object):
+
+    def test_get_and_set(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+
+        cache.set('a', 1)
+
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.get('c') == 3
+
+    def test_expires(self):
+        cache = TTLCache(maxsize=2, ttl=0.01)
+
+        cache.set('a', 1)
+        time.sleep(0.02)
+
+        assert cache.get('a') is None
+
+
+class TestValidators(object):
+
+    def test_etag_depends_on_key(self):
+        assert validators(('a', 1), 0)['ETag'] != \
+            validators(('a', 2), 0)['ETag']
+
+    def test_if_none_match(self):
+        headers = validators(('a', 1), 0)
+
+        assert is_not_modified({'If-None-Match': headers['ETag']}, headers)
+        assert is_not_modified({'If-None-Match': '"x", W/' + headers['ETag']},
+                               headers)
+        assert not is_not_modified({'If-None-Match': '"x"'}, headers)
+
+    def test_if_modified_since(self):
+        headers = validators(('a', 1), 1000000)
+
+        assert is_not_modified(
+            {'If-Modified-Since': headers['Last-Modified']}, headers)
+        assert not is_not_modified(
+            {'If-Modified-Since': validators(('a', 1), 0)['Last-Modified']},
+            headers)
+
+    def test_unconditional_request(self):
+        assert not is_not_modified({}, validators(('a', 1), 0))
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from benchmarks import load_test
+
+
+class TestLoadTest(object):
+
+    def test_parse_mix(self):
+        assert load_test.parse_mix('browse=2, recommend=1') == {
+            'browse': 2.0, 'recommend': 1.0}
+
+        with pytest.raises(ValueError):
+            load_test.parse_mix('checkout=1')
+
+        with pytest.raises(ValueError):
+            load_test.parse_mix('browse=0')
+
+    def test_summarize(self):
+        latencies = [i / 1000 for i in range(100, 0, -1)]
+
+        summary = load_test.summarize(latencies, {'200': 100, '400': 4,
+                                                  'error': 1},
+                                      elapsed=2.0, server_cores=2)
+
+        assert summary['requests'] == 105
+        assert summary['errors'] == 5
+        assert summary['error_rate'] == pytest.approx(5 / 105)
+        assert summary['requests_per_sec'] == 50.0
+        assert summary['requests_per_sec_per_core'] == 25.0
+        assert summary['latency_ms']['p50'] == pytest.approx(50.0)
+        assert summary['latency_ms']['p99'] == pytest.approx(99.0)
+        assert summary['latency_ms']['max'] == pytest.approx(100.0)
+
+    def test_percentile_of_nothing(self):
+        assert load_test.percentile([], 99) == 0.0
+
+    @pytest.mark.parametrize('serving_mode', ['flask', 'asgi'])
+    def test_loads_a_local_server(self, serving_mode):
+        pytest.importorskip('fakeredis')
+
+        with load_test.local_server(serving_mode) as (url, redis_conn):
+            user_ids = load_test.seed(redis_conn, users=20, products=60,
+                                      ratings=5, recommendations=3)
+
+            report = load_test.run(url, user_ids, products=60,
+                                   concurrency=2, duration=0.5, warmup=0)
+
+        assert set(report['endpoints']) == set(load_test.PRODUCT_ENDPOINTS)
+
+        for summary in report['endpoints'].values():
+            assert summary['requests'] > 0
+            assert summary['errors'] == 0
+
+    def test_seeds_beside_the_demo_users(self):
+        fakeredis = pytest.importorskip('fakeredis')
+
+        from server.models import Users, Products, DataVersions, \
+            SEED_USER_IDS
+
+        redis_conn = fakeredis.FakeStrictRedis()
+        models = (Users, Products, DataVersions)
+        connections = [model.redis for model in models]
+
+        try:
+            # as a server registers them when it starts.
+            redis_conn.sadd(Users.registry_key(), *SEED_USER_IDS)
+
+            assert load_test.seed(redis_conn, users=3, products=5, ratings=2,
+                                  recommendations=2) == [1, 2, 3]
+
+            with pytest.raises(RuntimeError):
+                load_test.seed(redis_conn, users=3, products=5, ratings=2,
+                               recommendations=2)
+        finally:
+            for model, connection in zip(models, connections):
+                model.redis = connection
+
+    def test_recommender_endpoints_need_a_recommender(self):
+        with pytest.raises(ValueError):
+            load_test.run('http://127.0.0.1:1', [1], products=1,
+                          mix={'browse': 1, 'on_demand': 1})
+
+    def test_loads_a_recommender(self):
+        requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                requests.append((self.command, self.path,
+                                 self.rfile.read(length)))
+
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            do_GET = do_POST = _respond
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        with server:
+            url = 'http://127.0.0.1:{}'.format(server.server_port)
+
+            report = load_test.run('http://127.0.0.1:1', [7], products=1,
+                                   mix={'on_demand': 1, 'engine': 1},
+                                   concurrency=2, duration=0.2, warmup=0,
+                                   recommender_url=url)
+
+            server.shutdown()
+
+        assert set(report['endpoints']) == \
+            set(load_test.RECOMMENDER_ENDPOINTS)
+        assert report['total']['errors'] == 0
+        assert set(requests) == {
+            ('POST', '/recommendations', b'{"user_ids": [7]}'),
+            ('GET', '/engines/current', b'')}
@@ -3,7 +3,7 @@ import pytest
 from mock import MagicMock
 
 from server.models import DATA_PARTITION
-from server.models import Products
+from server.models import Products, Users, BUCKETS_LAYOUT
 
 
 class TestProducts(object):
@@ -32,3 +32,70 @@ class TestProducts(object):
         products_model.upsert(id=123, name='testname', desc='testdesc')
 
         products_model.redis.set.assert_called_once()
+
+    def test_get_many_from_buckets(self, products_model, monkeypatch):
+        monkeypatch.setattr(products_model, 'layout', BUCKETS_LAYOUT)
+        monkeypatch.setattr(products_model, 'bucket_size', 100)
+
+        pipeline = products_model.redis.pipeline.return_value
+        pipeline.execute.return_value = [
+            [b'{"name": "five", "desc": "a"}', None],
+            [b'{"name": "two fifty", "desc": "b"}']]
+
+        products = products_model.get_many([5, 250, 7])
+
+        pipeline.hmget.assert_any_call(
+            '{}_product_buckets_0'.format(DATA_PARTITION), [5, 7])
+        pipeline.hmget.assert_any_call(
+            '{}_product_buckets_2'.format(DATA_PARTITION), [250])
+        assert [product and product.name for product in products] == \
+            ['five', 'two fifty', None]
+
+
+class TestUsers(object):
+    """ Test the users resource. """
+
+    @pytest.fixture
+    def users_model(self):
+        model = Users
+
+        model.redis = MagicMock()
+
+        return model
+
+    def test_get_checks_registry(self, users_model):
+        users_model.redis.sismember.return_value = True
+
+        user = users_model.get(id=10001)
+
+        assert user.id == 10001
+        users_model.redis.sismember.assert_called_once_with(
+            '{}_users'.format(DATA_PARTITION), 10001)
+
+    def test_get_unregistered(self, users_model):
+        users_model.redis.sismember.return_value = False
+
+        with pytest.raises(KeyError):
+            users_model.get(id=42)
+
+    def test_set_ratings_in_one_transaction(self, users_model):
+        users_model(10001).set_ratings([{'product_id': 1, 'rating': 5}])
+
+        users_model.redis.pipeline.assert_called_once_with(transaction=True)
+        pipeline = users_model.redis.pipeline.return_value
+        pipeline.hset.assert_called_once_with(
+            '{}_ratings_10001'.format(DATA_PARTITION), 1, 5)
+        pipeline.execute.assert_called_once_with()
+
+    def test_set_ratings_publishes_events(self, users_model):
+        users_model(10001).set_ratings([{'product_id': 1, 'rating': 5},
+                                        {'product_id': 2, 'rating': 3}])
+
+        pipeline = users_model.redis.pipeline.return_value
+        events = [call[0] for call in pipeline.xadd.call_args_list]
+        assert events == [
+            ('{}_rating_events'.format(DATA_PARTITION),
+             {'user_id': 10001, 'product_id': 1, 'rating': 5}),
+            ('{}_rating_events'.format(DATA_PARTITION),
+             {'user_id': 10001, 'product_id': 2, 'rating': 3}),
+        ]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import os
+import pstats
+import time
+
+import pytest
+
+from server import app, config, profiling
+
+
+def _work():
+    return sum(i * i for i in range(200000))
+
+
+class TestProfiling(object):
+
+    @pytest.fixture
+    def directory(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(config, 'PROFILES_DIR', str(tmpdir))
+
+        return str(tmpdir)
+
+    def test_deterministic(self, directory):
+        with profiling.Profile('task/1', directory=directory) as profile:
+            _work()
+
+        # already stopped and saved.
+        assert profile.stop() is None
+
+        names = sorted(os.listdir(directory))
+        assert [os.path.splitext(name)[1] for name in names] == \
+            ['.collapsed', '.pstats']
+        assert names[0].endswith('task_1.collapsed')
+
+        stats = pstats.Stats('{}/{}'.format(directory, names[1]))
+        assert any(function == '_work' for _, _, function in stats.stats)
+
+        with open('{}/{}'.format(directory, names[0])) as collapsed_file:
+            stacks = collapsed_file.read()
+        assert '_work' in stacks
+
+    def test_sampling(self, directory):
+        profile = profiling.Profile('sampled', mode=profiling.SAMPLING,
+                                    directory=directory, interval=0.001)
+        profile.start()
+        deadline = time.time() + 0.1
+        while time.time() < deadline:
+            _work()
+        base_name = profile.stop()
+
+        assert os.listdir(directory) == ['{}.collapsed'.format(base_name)]
+
+        with open('{}/{}.collapsed'.format(directory, base_name)) as file:
+            lines = file.read().splitlines()
+
+        assert lines
+        assert any('_work' in line for line in lines)
+        assert all(int(line.rsplit(' ', 1)[1]) > 0 for line in lines)
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            profiling.Profile('name', mode='tracing')
+
+    def test_profiled_without_mode(self, directory):
+        with profiling.profiled('name', None) as profile:
+            _work()
+
+        assert profile is None
+        assert os.listdir(directory) == []
+
+    def test_prune(self, directory):
+        for number in range(3):
+            path = '{}/{}.collapsed'.format(directory, number)
+            open(path, 'w').close()
+            os.utime(path, (number, number))
+
+        profiling.prune_profiles(directory, keep=2)
+
+        assert sorted(os.listdir(directory)) == ['1.collapsed',
+                                                 '2.collapsed']
+
+    def test_request_header(self, directory, monkeypatch):
+        monkeypatch.setattr(config, 'PROFILING_HEADER_ENABLED', True)
+
+        client = app.test_client()
+
+        response = client.get('/api/v1/profiles',
+                              headers={profiling.PROFILE_HEADER:
+                                       profiling.DETERMINISTIC,
+                                       'X-Request-Id': 'abc'})
+
+        base_name = response.headers[profiling.PROFILE_ID_HEADER]
+        assert base_name.endswith('request-abc')
+
+        names = [profile['name'] for profile in client.get(
+            '/api/v1/profiles').get_json()['profiles']]
+        assert '{}.pstats'.format(base_name) in names
+
+        response = client.get('/api/v1/profiles/{}.collapsed'.format(
+            base_name))
+        assert response.status_code == 200
+        assert response.data
+
+    def test_requests_are_not_profiled_by_default(self, directory):
+        # nor can a client ask for it, or get the saved profiles.
+        response = app.test_client().get('/api/v1/profiles', headers={
+            profiling.PROFILE_HEADER: profiling.DETERMINISTIC})
+
+        assert response.status_code == 404
+        assert profiling.PROFILE_ID_HEADER not in response.headers
+        assert os.listdir(directory) == []
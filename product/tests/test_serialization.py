@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from server.serialization import JSON, RecommendationsCodec, ProductCodec
+
+
+class TestRecommendationsCodec(object):
+
+    def test_packed_ids(self):
+        codec = RecommendationsCodec(1)
+
+        value = codec.encode([3, 1, 2147483647])
+
+        assert len(value) == 1 + 3 * 4
+        assert codec.decode(value) == [3, 1, 2147483647]
+
+    def test_empty(self):
+        codec = RecommendationsCodec(1)
+
+        assert codec.decode(codec.encode([])) == []
+
+    def test_decodes_legacy_json(self):
+        codec = RecommendationsCodec(1)
+
+        assert codec.decode(b'[1, 2]') == [1, 2]
+        assert codec.decode('[1, 2]') == [1, 2]
+
+    def test_encodes_legacy_json(self):
+        codec = RecommendationsCodec(JSON)
+
+        assert codec.encode([1, 2]) == b'[1, 2]'
+
+    def test_unknown_version(self):
+        with pytest.raises(ValueError):
+            RecommendationsCodec(42)
+
+        with pytest.raises(ValueError):
+            RecommendationsCodec(1).decode(b'\x2a\x00\x00\x00\x00')
+
+
+class TestProductCodec(object):
+
+    def test_record(self):
+        codec = ProductCodec(1)
+        meta = {'name': 'Amélie (2001)', 'desc': 'Comedy|Romance'}
+
+        value = codec.encode(meta)
+
+        assert len(value) < len(ProductCodec(JSON).encode(meta))
+        assert codec.decode(value) == meta
+
+    def test_decodes_legacy_json(self):
+        codec = ProductCodec(1)
+
+        assert codec.decode(b'{"name": "one", "desc": "first"}') == \
+            {'name': 'one', 'desc': 'first'}
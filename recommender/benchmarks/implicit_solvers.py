@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import timeit
+
+import numpy as np
+from scipy import sparse
+
+from core import implicit_als
+
+""" Compares the implicit ALS solvers.
+
+Factorizes a synthetic implicit feedback matrix with the exact per user solves
+and with conjugate gradient, and prints as json, per solver, the seconds per
+sweep over the users and the items and the final loss.
+
+Run from the recommender root, eg.
+
+    python -m benchmarks.implicit_solvers --users 20000 --items 5000 --rank 64
+"""
+
+
+def _confidences(users: int, items: int, density: float) -> sparse.csr_matrix:
+    random = np.random.RandomState(0)
+
+    ratings = sparse.random(users, items, density=density, format='csr',
+                            random_state=random,
+                            data_rvs=lambda size: random.randint(1, 10, size))
+
+    ratings.data = implicit_als.confidence(ratings.data)
+
+    return ratings
+
+
+def _measure(confidences: sparse.csr_matrix, rank: int, sweeps: int,
+             **solver_opts) -> dict:
+    factors = []
+
+    def fit():
+        factors[:] = implicit_als.fit(confidences, rank=rank, reg_param=0.1,
+                                      max_iter=sweeps, **solver_opts)
+
+    seconds = min(timeit.Timer(fit).repeat(repeat=3, number=1))
+
+    return {
+        'seconds_per_sweep': seconds / sweeps,
+        'loss': implicit_als.loss(confidences, *factors, reg_param=0.1),
+    }
+
+
+def run(users: int, items: int, density: float, rank: int, sweeps: int,
+        cg_steps: int) -> dict:
+    confidences = _confidences(users, items, density)
+
+    return {
+        'exact': _measure(confidences, rank, sweeps, solver='exact'),
+        'cg': _measure(confidences, rank, sweeps, solver='cg',
+                       cg_steps=cg_steps),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compares the implicit ALS solvers.')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--density', type=float, default=0.005)
+    parser.add_argument('--rank', type=int, default=64)
+    parser.add_argument('--sweeps', type=int, default=3)
+    parser.add_argument('--cg-steps', type=int, default=3)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.users, args.items, args.density, args.rank,
+                         args.sweeps, args.cg_steps), indent=2))
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from core import config, implicit_als, out_of_core
+from core.warehouse import FileWarehouse
+
+""" Reports the peak RSS of implicit ALS training against the dataset size.
+
+For each of `--ratings`, writes that many synthetic ratings to a scratch
+warehouse partition, then trains on them in a fresh process, once in memory
+(`implicit_als.fit` over the whole confidence matrix) and once out of core
+(`out_of_core.build` and `out_of_core.fit` over memory-mapped shards). Prints
+as json, per size and mode, the peak RSS of the training process and the
+seconds it took. The scratch partition is deleted afterwards.
+
+Run from the recommender root, eg.
+
+    python -m benchmarks.out_of_core --ratings 1000000 10000000 --rank 32
+"""
+
+PARTITION = 'out_of_core_benchmark'
+
+IN_MEMORY = 'in_memory'
+OUT_OF_CORE = 'out_of_core'
+
+
+def _rows(ratings: int, users: int, items: int):
+    random = np.random.RandomState(0)
+
+    for start in range(0, ratings, 100000):
+        size = min(100000, ratings - start)
+
+        for user, item, rating in zip(random.randint(1, users + 1, size),
+                                      random.randint(1, items + 1, size),
+                                      random.randint(1, 10, size)):
+            yield {config.USER_COL: int(user), config.PRODUCT_COL: int(item),
+                   config.RATINGS_COL: int(rating)}
+
+
+def train(mode: str, rank: int, sweeps: int) -> dict:
+    """ trains on the scratch partition, in this process. """
+    warehouse = FileWarehouse(partition=PARTITION)
+    files = warehouse.ratings_files()
+
+    start = time.perf_counter()
+
+    if mode == IN_MEMORY:
+        _, _, confidences = implicit_als.ratings_matrix(
+            warehouse.read_rows(files))
+        confidences.data = implicit_als.confidence(confidences.data)
+
+        implicit_als.fit(confidences, rank=rank, reg_param=0.1,
+                         max_iter=sweeps)
+    else:
+        directory = '{}/{}'.format(config.OUT_OF_CORE_DIR, PARTITION)
+
+        _, _, by_user, by_item = out_of_core.build(files, directory)
+
+        out_of_core.fit(by_user, by_item, rank=rank, reg_param=0.1,
+                        max_iter=sweeps, transform=implicit_als.confidence)
+
+    return {
+        'peak_rss_bytes': out_of_core.peak_rss(),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def _train_in_subprocess(mode: str, rank: int, sweeps: int) -> dict:
+    # a fresh process per run, since the peak RSS never goes down.
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.out_of_core', '--train', mode,
+         '--rank', str(rank), '--sweeps', str(sweeps)])
+
+    return json.loads(output.decode())
+
+
+def run(sizes: list, users: int, items: int, rank: int, sweeps: int) -> list:
+    warehouse = FileWarehouse(partition=PARTITION)
+
+    results = []
+
+    try:
+        for ratings in sizes:
+            warehouse.cleanup()
+            warehouse.update_ratings(_rows(ratings, users, items))
+
+            results.append({
+                'ratings': ratings,
+                IN_MEMORY: _train_in_subprocess(IN_MEMORY, rank, sweeps),
+                OUT_OF_CORE: _train_in_subprocess(OUT_OF_CORE, rank, sweeps),
+            })
+    finally:
+        warehouse.delete()
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Reports the peak RSS of ALS training per dataset size.')
+    parser.add_argument('--ratings', type=int, nargs='+',
+                        default=[100000, 1000000])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--rank', type=int, default=32)
+    parser.add_argument('--sweeps', type=int, default=2)
+    parser.add_argument('--train', choices=[IN_MEMORY, OUT_OF_CORE],
+                        help='train on the scratch partition in this process '
+                             'and exit, as the benchmark does')
+    args = parser.parse_args()
+
+    if args.train:
+        print(json.dumps(train(args.train, args.rank, args.sweeps)))
+    else:
+        print(json.dumps(run(args.ratings, args.users, args.items, args.rank,
+                             args.sweeps), indent=2))
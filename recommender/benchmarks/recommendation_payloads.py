@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import random
+import time
+
+import redis
+
+from core import config
+from core.models import Users, Products, DataVersions
+from core.transporter import Transporter
+from core.warehouse import FileWarehouse
+
+""" Measures the cost of rendering the recommendation payloads.
+
+Writes the recommendations of `--users` users to a scratch warehouse
+partition, and a synthetic catalog to an empty scratch redis database. Then
+sends the recommendations to the serving db with and without the rendered
+payloads (see `Transporter.send_recommendations_to_db`), and prints the
+users/sec of each as json. The scratch partition and database are cleared
+afterwards, so the database has to be empty to start with.
+
+Run from the recommender root, eg.
+
+    python -m benchmarks.recommendation_payloads --users 100000 --db 15
+"""
+
+PARTITION = 'payloads_benchmark'
+
+
+def _load(warehouse: FileWarehouse, users: int, products: int,
+          count: int) -> None:
+    for id in range(1, products + 1):
+        Products.upsert(id=id, name='Some Movie Title {}'.format(id),
+                        desc='Action|Adventure|Comedy',
+                        data_partition=PARTITION)
+
+    files = [open(file, 'w') for file in
+             warehouse.shard_files(warehouse.recommendations_file)]
+
+    try:
+        for user_id in range(1, users + 1):
+            warehouse.write_row(files[warehouse.shard_of(user_id)], {
+                config.USER_COL: user_id,
+                'recommendations': random.sample(range(1, products + 1),
+                                                 count)
+            })
+    finally:
+        for file in files:
+            file.close()
+
+
+def _users_per_second(transporter: Transporter, users: int, workers: int,
+                      payloads: bool) -> float:
+    start = time.perf_counter()
+
+    transporter.send_recommendations_to_db(workers=workers,
+                                           payloads=payloads)
+
+    return users / (time.perf_counter() - start)
+
+
+def run(redis_conn, users: int, products: int, count: int,
+        workers: int) -> dict:
+    if redis_conn.dbsize():
+        raise RuntimeError('the scratch database is not empty.')
+
+    Users.redis = Products.redis = DataVersions.redis = redis_conn
+
+    warehouse = FileWarehouse(partition=PARTITION)
+    warehouse.cleanup()
+
+    try:
+        _load(warehouse, users, products, count)
+
+        transporter = Transporter(warehouse=warehouse, user_model=Users)
+
+        ids_only = _users_per_second(transporter, users, workers, False)
+        rendered = _users_per_second(transporter, users, workers, True)
+    finally:
+        warehouse.delete()
+        redis_conn.flushdb()
+
+    return {
+        'users': users,
+        'recommendations_per_user': count,
+        'ids_users_per_sec': ids_only,
+        'payloads_users_per_sec': rendered,
+        'slowdown': ids_only / rendered,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measures the cost of rendering the payloads.')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--products', type=int, default=3952)
+    parser.add_argument('--count', type=int, default=10,
+                        help='the recommendations per user')
+    parser.add_argument('--workers', type=int,
+                        default=config.TRANSPORTER_WORKERS)
+    parser.add_argument('--db', type=int, default=15,
+                        help='an empty redis database to use')
+    args = parser.parse_args()
+
+    redis_conn = redis.StrictRedis(host=config.REDIS_HOST,
+                                   port=config.REDIS_PORT, db=args.db)
+
+    print(json.dumps(run(redis_conn, args.users, args.products, args.count,
+                         args.workers), indent=2))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import timeit
+
+from core import config
+from core.datasources.movielens_source import MovieLensSource
+from core.exceptions import ParserError
+
+""" Compares the parse throughput of the movielens ratings parsers.
+
+Parses a synthetic movielens ratings file with the hand-written parser that
+`MovieLensSource` used before it became a `DelimitedSource`, with the compiled
+row parser, and with the batch parser, and prints the lines/sec of each as
+json.
+
+Run from the recommender root, eg.
+
+    python -m benchmarks.source_parsers --lines 1000000
+"""
+
+
+def hand_written_ratings_parser(line: str) -> dict:
+    """ the previous `MovieLensSource.ratings_parser`, as the baseline. """
+    try:
+        assert line
+    except AssertionError as e:
+        raise ParserError("Invalid line.") from e
+
+    fields = line.strip().split("::")
+
+    try:
+        # there are 4 fields in the movielens ratings line
+        assert len(fields) == 4
+    except AssertionError as e:
+        raise ParserError("Unable to find 4 fields in the line.") from e
+
+    timestamp_hash = int(fields[3]) % 10
+
+    if timestamp_hash < 6:
+        data_type = "training"
+    elif 6 <= timestamp_hash < 8:
+        data_type = "validation"
+    else:
+        data_type = "test"
+
+    return {
+        'metadata': {
+            'type': data_type
+        },
+        'payload': {
+            config.USER_COL: int(fields[0]),
+            config.PRODUCT_COL: int(fields[1]),
+            config.RATINGS_COL: float(fields[2])
+        }
+    }
+
+
+def _lines(count: int) -> list:
+    return ['{}::{}::{}::{}\n'.format(line % 6040 + 1, line % 3952 + 1,
+                                      line % 5 + 1, 956703932 + line)
+            for line in range(count)]
+
+
+def _lines_per_second(parse, lines: list, per_line: bool) -> float:
+    if per_line:
+        timer = timeit.Timer(lambda: [parse(line) for line in lines])
+    else:
+        timer = timeit.Timer(lambda: parse(lines))
+
+    return len(lines) / min(timer.repeat(repeat=3, number=1))
+
+
+def run(count: int) -> dict:
+    source = MovieLensSource('benchmark', ratings_file='', products_file='')
+
+    lines = _lines(count)
+
+    return {
+        'hand_written': _lines_per_second(hand_written_ratings_parser, lines,
+                                          per_line=True),
+        'compiled': _lines_per_second(source.ratings_parser, lines,
+                                      per_line=True),
+        'batch': _lines_per_second(source.ratings_batch_parser, lines,
+                                   per_line=False),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compares the parse throughput of the ratings parsers.')
+    parser.add_argument('--lines', type=int, default=1000000)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.lines), indent=2))
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+from core import config
+
+logger = logging.getLogger(__name__)
+
+""" Coalescing of concurrent calls into batched ones.
+
+Scoring one user is a tiny matrix product, dominated by the overhead around
+it. When many requests come in at about the same time, it is much cheaper to
+score all of their users with one matrix product. A `MicroBatcher` holds each
+call back for a short window, and hands all the calls made within it to a
+batch function at once.
+"""
+
+
+class MicroBatcher(object):
+    """ Turns single calls into batched calls of a function.
+
+    The calls are queued, and a background thread takes them off the queue a
+    batch at a time. A batch closes `window` seconds after its first call, or
+    as soon as it has `max_size` calls, whichever comes first. The thread is
+    started on the first call, so a batcher can be created before forking.
+
+    Attributes:
+        function: the batch function. Takes a list of items, and returns a
+        list of results, one per item and in the same order.
+
+        window: the longest a call waits for others to join its batch, in
+        seconds.
+
+        max_size: the most items passed to the function at once.
+
+    """
+
+    def __init__(self, function: Callable,
+                 window: float = config.ONLINE_BATCH_WINDOW,
+                 max_size: int = config.ONLINE_BATCH_SIZE):
+        self.function = function
+        self.window = window
+        self.max_size = max_size
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, item) -> Future:
+        """ Queues an item for the next batch.
+
+        Returns:
+            a future of the item's result. If the batch function raises, so
+            does the future of each item in the batch.
+
+        """
+        self._start()
+
+        future = Future()
+        self._queue.put((item, future))
+
+        return future
+
+    def __call__(self, item, timeout: float = None):
+        """ Queues an item, and waits for its result. """
+        return self.submit(item).result(timeout)
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name='micro-batcher',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._execute(self._next_batch())
+
+    def _next_batch(self) -> list:
+        """ blocks for the first call, then collects the calls which follow
+        it within the window.
+
+        """
+        batch = [self._queue.get()]
+
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_size:
+            remaining = deadline - time.monotonic()
+
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _execute(self, batch: list) -> None:
+        items = [item for item, _ in batch]
+
+        logger.debug('executing a batch of {} calls'.format(len(items)))
+
+        try:
+            results = self.function(items)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
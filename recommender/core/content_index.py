@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+import logging
+import math
+import os
+import re
+import zlib
+from typing import Iterable
+
+import numpy as np
+from scipy import sparse
+
+from core import config, item_knn
+from core.scoring import positions
+from core.warehouse import FileWarehouse
+
+logger = logging.getLogger(__name__)
+
+""" A content-based index of the products, for the cold start.
+
+A product nobody rated yet is invisible to the collaborative engines, and a
+user with only a couple of ratings gets little out of them. Here the products
+are described by their metadata instead: a one-hot of their genres (the
+pipe-separated `desc` of the movielens products) and the tokens of their name,
+hashed into `CONTENT_HASH_BUCKETS` features. The most similar products of each
+product, by the cosine of their features, are computed once when the catalog
+is loaded (see `core.item_knn.similarities`) and stored in the warehouse.
+
+The products similar to the ones a user rated are then a sum over a handful of
+sparse rows, whatever the size of the catalog, and are blended with the
+collaborative recommendations of the users with few ratings. See `blend`. The
+users with no ratings get the default recommendations instead, and everyone
+else a few of the new products, which the collaborative engines do not know
+yet, so those reach all the users. See `ContentIndex.complement`.
+"""
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def _tokens(name: str) -> set:
+    """ the distinct lowercase words and numbers of a product name. """
+    return set(_TOKEN.findall(name.lower()))
+
+
+def _bucket(token: str, buckets: int) -> int:
+    """ a hash of a token, stable across processes unlike `hash`. """
+    return zlib.crc32(token.encode('utf-8')) % buckets
+
+
+def features(rows: Iterable[dict], buckets: int = config.CONTENT_HASH_BUCKETS,
+             title_weight: float = config.CONTENT_TITLE_WEIGHT) -> tuple:
+    """ Describes products by their metadata.
+
+    Args:
+        rows: the warehouse products rows, with their `name` and `desc`.
+
+        buckets: the number of features the name tokens are hashed into.
+
+        title_weight: the weight of a name token, against 1 for a genre.
+
+    Returns:
+        a tuple of the product ids, the genres, and a csr matrix with a row
+        per product id, a column per genre and then one per hash bucket.
+
+    """
+    product_ids, genres, tokens = [], [], []
+
+    for row in rows:
+        product_ids.append(row[config.PRODUCT_COL])
+        genres.append({genre.strip() for genre in
+                       (row.get('desc') or '').split('|') if genre.strip()})
+        tokens.append(_tokens(row.get('name') or ''))
+
+    vocabulary = sorted(set().union(*genres))
+    columns = {genre: column for column, genre in enumerate(vocabulary)}
+
+    rows, cols, values = [], [], []
+
+    for row, (product_genres, product_tokens) in enumerate(zip(genres,
+                                                               tokens)):
+        for genre in product_genres:
+            rows.append(row)
+            cols.append(columns[genre])
+            values.append(1.0)
+
+        for token in product_tokens:
+            rows.append(row)
+            cols.append(len(vocabulary) + _bucket(token, buckets))
+            values.append(title_weight)
+
+    matrix = sparse.csr_matrix(
+        (values, (rows, cols)),
+        shape=(len(product_ids), len(vocabulary) + buckets))
+    # tokens sharing a bucket add up.
+    matrix.sum_duplicates()
+
+    return np.array(product_ids, dtype=np.int64), vocabulary, matrix
+
+
+class ContentIndex(object):
+    """ The most similar products of each product, by their metadata.
+
+    Attributes:
+        product_ids: a 1-d array of the indexed product ids.
+
+        neighbors: a csr matrix with a row per product id, holding the
+        similarities of its most similar products (one column per product
+        id).
+
+    """
+
+    def __init__(self, product_ids, neighbors):
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.neighbors = sparse.csr_matrix(neighbors, dtype=np.float32)
+
+    @classmethod
+    def build(cls, rows: Iterable[dict],
+              neighbors: int = config.CONTENT_NEIGHBORS) -> 'ContentIndex':
+        """ Indexes products from their warehouse rows.
+
+        Args:
+            neighbors: the number of most similar products kept per product.
+
+        """
+        product_ids, genres, matrix = features(rows)
+
+        # the products are the "items" whose columns are compared.
+        similarities = item_knn.similarities(matrix.T.tocsr(),
+                                             neighbors=neighbors,
+                                             similarity='cosine')
+
+        logger.info('indexed {} products by {} genres and their names'
+                    .format(len(product_ids), len(genres)))
+
+        return cls(product_ids, similarities.T)
+
+    @classmethod
+    def load(cls, warehouse: FileWarehouse) -> 'ContentIndex':
+        """ Loads the index stored in the warehouse, None if there is none.
+        """
+        if not os.path.exists(warehouse.content_index_file):
+            return None
+
+        with np.load(warehouse.content_index_file) as arrays:
+            product_ids = arrays['product_ids']
+
+            return cls(product_ids, sparse.csr_matrix(
+                (arrays['data'], arrays['indices'], arrays['indptr']),
+                shape=(len(product_ids), len(product_ids))))
+
+    def save(self, warehouse: FileWarehouse) -> None:
+        # np.savez appends the .npz suffix to other names.
+        temporary_file = '{}.tmp.npz'.format(
+            warehouse.content_index_file[:-len('.npz')])
+
+        np.savez(temporary_file, product_ids=self.product_ids,
+                 data=self.neighbors.data, indices=self.neighbors.indices,
+                 indptr=self.neighbors.indptr)
+
+        os.replace(temporary_file, warehouse.content_index_file)
+
+    def similar(self, product_ids: list, count: int,
+                exclude: Iterable = (), among: np.ndarray = None) -> list:
+        """ Finds the products most similar to the given ones.
+
+        Only the rows of the given products are read, so the cost does not
+        depend on the size of the catalog.
+
+        Args:
+            product_ids: the products to find similar ones to, eg. the ones a
+            user rated. Unknown ids are ignored.
+
+            count: the number of products to find.
+
+            exclude: product ids which should not be returned. The given
+            products never are.
+
+            among: a boolean mask of the indexed products to choose from, eg.
+            from `new_products`. All of them if None.
+
+        Returns:
+            a list of at most `count` product ids, sorted by decreasing sum
+            of their similarities to the given products.
+
+        """
+        rows = positions(self.product_ids, product_ids)
+        rows = rows[rows >= 0]
+
+        if not len(rows):
+            return []
+
+        similar = self.neighbors[rows]
+
+        cols, inverse = np.unique(similar.indices, return_inverse=True)
+        scores = np.bincount(inverse, weights=similar.data)
+
+        excluded = np.isin(cols, rows) | np.isin(
+            self.product_ids[cols], np.fromiter(exclude, dtype=np.int64))
+
+        if among is not None:
+            excluded |= ~among[cols]
+
+        cols = cols[~excluded]
+        scores = scores[~excluded]
+
+        # the stable sort keeps the ties in the order of the index.
+        top = np.argsort(-scores, kind='stable')[:count]
+
+        return self.product_ids[cols[top]].tolist()
+
+    def new_products(self, known_ids) -> np.ndarray:
+        """ a boolean mask of the indexed products not among the known ones,
+        eg. the items of a collaborative model.
+
+        """
+        return ~np.isin(self.product_ids,
+                        np.asarray(known_ids, dtype=np.int64))
+
+    def add_new_products(self, recommendations: list, known_ids, count: int,
+                         share: float = config.CONTENT_NEW_SHARE) -> list:
+        """ Blends `share` of new products, similar to the recommended ones,
+        into a list of recommendations, eg. the default ones.
+
+        Args:
+            known_ids: the items of the collaborative model, see
+            `new_products`.
+
+        """
+        return blend(recommendations, self.similar(
+            recommendations, count, among=self.new_products(known_ids)),
+            count, share)
+
+    def complement(self, user_ids: list, recommendations: list, seen: list,
+                   count: int, known_ids=None, defaults: list = (),
+                   new_share: float = config.CONTENT_NEW_SHARE) -> list:
+        """ Blends the collaborative recommendations of users with few
+        ratings with the products similar to the ones they rated, see
+        `content_share` and `blend`. The users with no ratings get the
+        `defaults`, and the other ones `new_share` of new products similar to
+        the ones they rated, if more than their content share.
+
+        Args:
+            user_ids: a list of distinct user ids.
+
+            recommendations: the collaborative recommendations, one list per
+            user id.
+
+            seen: a list of (user id, product id) pairs, the ratings of the
+            users. They are never recommended.
+
+            count: the number of recommendations per user.
+
+            known_ids: the items of the collaborative model, see
+            `new_products`. None for no new products.
+
+            defaults: the default recommendations.
+
+            new_share: the share of the new products.
+
+        Returns:
+            a list with the recommendations of each user id.
+
+        """
+        rated = {user_id: [] for user_id in user_ids}
+
+        for user_id, product_id in seen:
+            if user_id in rated:
+                rated[user_id].append(product_id)
+
+        new = None if known_ids is None else self.new_products(known_ids)
+
+        blended = []
+
+        for user_id, user_recommendations in zip(user_ids, recommendations):
+            user_rated = rated[user_id]
+            share = content_share(len(set(user_rated)))
+
+            if not user_rated:
+                content = defaults
+            elif new is not None and share < new_share:
+                share = new_share
+                content = self.similar(user_rated, count, exclude=user_rated,
+                                       among=new)
+            elif share:
+                content = self.similar(user_rated, count, exclude=user_rated)
+            else:
+                content = []
+
+            if content:
+                user_recommendations = blend(user_recommendations, content,
+                                             count, share)
+
+            blended.append(user_recommendations)
+
+        return blended
+
+
+def content_share(ratings: int,
+                  cold_start_ratings: int = config.CONTENT_COLD_START_RATINGS
+                  ) -> float:
+    """ The share of the recommendations of a user to take from the content
+    index: all of them for a user with no ratings, less and less for each
+    rating, and none from `cold_start_ratings` on.
+
+    """
+    if ratings >= cold_start_ratings:
+        return 0.0
+
+    return 1.0 - ratings / cold_start_ratings
+
+
+def blend(collaborative: list, content: list, count: int,
+          share: float) -> list:
+    """ Merges two ranked lists of recommendations.
+
+    The slots are interleaved, so that `share` of the slots of every prefix,
+    rounded to the nearest, come from `content`. A product in both lists
+    takes one slot, and when a list runs out the other one fills the rest.
+
+    Returns:
+        a list of at most `count` product ids.
+
+    """
+    blended = []
+    taken = set()
+
+    sources = {True: iter(content), False: iter(collaborative)}
+
+    while len(blended) < count:
+        from_content = math.floor((len(blended) + 1) * share + 0.5) > \
+            math.floor(len(blended) * share + 0.5)
+
+        product_id = _next(sources[from_content], taken)
+
+        if product_id is None:
+            product_id = _next(sources[not from_content], taken)
+
+        if product_id is None:
+            break
+
+        blended.append(product_id)
+        taken.add(product_id)
+
+    return blended
+
+
+def _next(products: Iterable, taken: set):
+    """ the next product of an iterator not taken yet, None if none. """
+    return next((product_id for product_id in products if
+                 product_id not in taken), None)
@@ -1,12 +1,19 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import math
+import mmap
+import multiprocessing
+import os
+import shutil
 from abc import abstractmethod, ABC
+from typing import Callable, Iterable, Iterator
 
 from core import config
+from core.content_index import ContentIndex
 from core.datasources.base_source import BaseSource
 from core.exceptions import ParserError
-from core.models import Products
+from core.models import Products, DataVersions
 from core.warehouse import FileWarehouse
 
 logger = logging.getLogger(__name__)
@@ -83,12 +90,15 @@ class DataLoader(BaseDataLoader):
     # better set a class-level instance instead of using the global.
     # This facilitates unit testing by IoC.
     products_model = Products
+    versions_model = DataVersions
 
     def __init__(self, source: BaseSource, warehouse: FileWarehouse) -> None:
         self.source = source
         self.warehouse = warehouse
 
-    def create_ratings_data_in_warehouse(self, continue_on_error: bool = False) -> None:
+    def create_ratings_data_in_warehouse(
+            self, continue_on_error: bool = False,
+            workers: int = config.LOADER_WORKERS) -> None:
         """ Populates the various ratings files (ratings, training, test,
         validation) in the warehouse.
 
@@ -96,61 +106,184 @@ class DataLoader(BaseDataLoader):
             continue_on_error: should an error in loading one row abort the
             entire process, or let it continue?
 
+            workers: the number of processes parsing the source file. See
+            `_load_in_parallel`.
+
         """
-        files = self._get_warehouse_rating_file_handles()
+        # the bulk loaded ratings start a new generation of the ratings.
+        self.warehouse.reset_ratings()
 
-        with open(self.source.ratings_file,
-                  encoding=self.source.encoding) as source_ratings_file:
+        files = self.warehouse.shard_files(self.warehouse.ratings_file) + [
+            self.warehouse.training_file, self.warehouse.test_file,
+            self.warehouse.validation_file]
 
-            for line in source_ratings_file:
+        self._load(self.source.ratings_file, self._ratings_rows, files,
+                   continue_on_error, workers)
 
-                try:
-                    data = self.source.ratings_parser(line)
-                    logger.debug('output from ratings parser :{}'.format(data))
-                except ParserError as e:
-                    logger.error(
-                        "parsing error in line: {} of source file. "
-                        "Error reported: {}".format(line, e))
-                    if continue_on_error:
-                        continue
-                    else:
-                        raise
-
-                # write the line to the ratings file, and one of
-                # the training, test or validation files.
-                # the logic for choosing which of the latter 3 files
-                # should ideally be with the data loader.
-                # For convenience, here type comes from
-                # the source parser and the loader uses it directly.
-                files_to_write = (files['ratings'],
-                                  files[data['metadata']['type']])
-
-                for file in files_to_write:
-                    self.warehouse.write_row(file, data['payload'])
-
-        for file in files.keys():
-            files[file].close()
-
-    def create_product_catalog_in_warehouse(self) -> None:
-        """ Populates the products file in the warehouse. """
-        with open(self.warehouse.products_file, 'w') as products_file:
-
-            with open(self.source.products_file,
-                      encoding=self.source.encoding) as source_products_file:
-
-                for line in source_products_file:
-
-                    try:
-                        data = self.source.product_parser(line)
-                        logger.debug(
-                            'output from products parser :{}'.format(data))
-                    except ParserError as e:
-                        logger.error(
-                            "parsing error in line: {} of source file. "
-                            "Error reported: {}".format(line, e))
-                        raise
-
-                    self.warehouse.write_row(products_file, data)
+    def _ratings_rows(self, lines: Iterable,
+                      continue_on_error: bool) -> Iterator[tuple]:
+        """ parses lines of the source ratings file.
+
+        Returns:
+            a generator of (warehouse file, row) tuples.
+
+        """
+        ratings_files = self.warehouse.shard_files(self.warehouse.ratings_file)
+
+        for line in lines:
+
+            try:
+                data = self.source.ratings_parser(line)
+                logger.debug('output from ratings parser :{}'.format(data))
+            except ParserError as e:
+                logger.error(
+                    "parsing error in line: {} of source file. "
+                    "Error reported: {}".format(line, e))
+                if continue_on_error:
+                    continue
+                else:
+                    raise
+
+            # write the line to the ratings file, and one of
+            # the training, test or validation files.
+            # the logic for choosing which of the latter 3 files
+            # should ideally be with the data loader.
+            # For convenience, here type comes from
+            # the source parser and the loader uses it directly.
+            # The ratings file can be sharded, in which case the user id
+            # decides the shard.
+            shard = self.warehouse.shard_of(
+                data['payload'][self.source.user_col])
+
+            yield ratings_files[shard], data['payload']
+
+            yield getattr(self.warehouse,
+                          '{}_file'.format(data['metadata']['type'])), \
+                data['payload']
+
+    def create_product_catalog_in_warehouse(
+            self, workers: int = config.LOADER_WORKERS) -> None:
+        """ Populates the products file in the warehouse, and indexes the
+        products by their metadata, see `core.content_index`.
+
+        Args:
+            workers: the number of processes parsing the source file. See
+            `_load_in_parallel`.
+
+        """
+        self._load(self.source.products_file, self._products_rows,
+                   [self.warehouse.products_file], False, workers)
+
+        ContentIndex.build(self.warehouse.read_rows(
+            [self.warehouse.products_file])).save(self.warehouse)
+
+    def _products_rows(self, lines: Iterable,
+                       continue_on_error: bool) -> Iterator[tuple]:
+        """ parses lines of the source products file. Errors are never
+        skipped.
+
+        Returns:
+            a generator of (warehouse file, row) tuples.
+
+        """
+        for line in lines:
+
+            try:
+                data = self.source.product_parser(line)
+                logger.debug(
+                    'output from products parser :{}'.format(data))
+            except ParserError as e:
+                logger.error(
+                    "parsing error in line: {} of source file. "
+                    "Error reported: {}".format(line, e))
+                raise
+
+            yield self.warehouse.products_file, data
+
+    def _load(self, source_file: str, rows: Callable, files: list,
+              continue_on_error: bool, workers: int) -> None:
+        """ parses a source file into the given warehouse files, which are
+        rewritten from scratch.
+
+        Args:
+            source_file: the path of the source file.
+
+            rows: turns lines of the source file into (warehouse file, row)
+            tuples, eg. `_ratings_rows`.
+
+            files: all the warehouse files `rows` can write to.
+
+            continue_on_error: passed on to `rows`.
+
+            workers: the number of processes to parse with. One parses in
+            this process.
+
+        """
+        # daemonic processes (like celery's prefork workers) cannot have
+        # children.
+        if workers > 1 and not multiprocessing.current_process().daemon:
+            self._load_in_parallel(source_file, rows, files,
+                                   continue_on_error, workers)
+            return
+
+        handles = {file: open(file, 'w') for file in files}
+
+        try:
+            with open(source_file,
+                      encoding=self.source.encoding) as source_lines:
+
+                for file, row in rows(source_lines, continue_on_error):
+                    self.warehouse.write_row(handles[file], row)
+        finally:
+            for handle in handles.values():
+                handle.close()
+
+    def _load_in_parallel(self, source_file: str, rows: Callable, files: list,
+                          continue_on_error: bool, workers: int) -> None:
+        """ the parallel version of `_load`.
+
+        The source file is split into newline-aligned byte ranges of about
+        `LOADER_CHUNK_BYTES`, and at least one per worker. Each range is
+        parsed in a pool of `workers` processes, which read it through
+        `mmap` and write its rows to part files of their own, one per
+        warehouse file. The part files are then concatenated in the order of
+        their ranges, so the warehouse files come out exactly as with a
+        single process.
+
+        """
+        chunks = max(workers, math.ceil(os.path.getsize(source_file) /
+                                        config.LOADER_CHUNK_BYTES))
+
+        ranges = split_ranges(source_file, chunks)
+
+        tasks = [(self, rows, source_file, number, start, end,
+                  continue_on_error) for number, (start, end) in
+                 enumerate(ranges)]
+
+        logger.info('loading {} in {} chunks with {} workers'.format(
+            source_file, len(tasks), workers))
+
+        try:
+            with multiprocessing.Pool(processes=workers) as pool:
+                # consume the results, to raise the errors of the workers.
+                for _ in pool.imap_unordered(_load_range, tasks):
+                    pass
+
+            for file in files:
+                with open(file, 'wb') as handle:
+                    for number in range(len(tasks)):
+                        part_file = _part_file(file, number)
+
+                        if os.path.exists(part_file):
+                            with open(part_file, 'rb') as part:
+                                shutil.copyfileobj(part, handle)
+        finally:
+            for file in files:
+                for number in range(len(tasks)):
+                    part_file = _part_file(file, number)
+
+                    if os.path.exists(part_file):
+                        os.remove(part_file)
 
     def create_ratings_data_in_serving_layer(self, continue_on_error=False) -> None:
         """ Populate the ratings data to the serving db.
@@ -183,13 +316,80 @@ class DataLoader(BaseDataLoader):
                                 name=data['name'],
                                 desc=data['desc'])
 
-    def _get_warehouse_rating_file_handles(self) -> dict:
-        """ return file handles to all the ratings files in the warehouse """
-        file_handles = {
-            'ratings': open(self.warehouse.ratings_file, 'w'),
-            'training': open(self.warehouse.training_file, 'w'),
-            'test': open(self.warehouse.test_file, 'w'),
-            'validation': open(self.warehouse.validation_file, 'w'),
-        }
+        # let the serving layer know that its cached catalog is stale.
+        self.versions_model.bump('products', data_partition=self.source.name)
+
+
+def split_ranges(path: str, chunks: int) -> list:
+    """ Splits a file into at most `chunks` byte ranges of about the same
+    size. Each range starts at the beginning of a line, and ends right after
+    a newline or at the end of the file.
+
+    Returns:
+        a list of (start, end) byte offsets, empty for an empty file.
+
+    """
+    size = os.path.getsize(path)
+
+    if not size:
+        return []
+
+    starts = [0]
+
+    with open(path, 'rb') as handle, \
+            mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+
+        for chunk in range(1, chunks):
+            newline = data.find(b'\n', max(size * chunk // chunks, starts[-1]))
+
+            if newline == -1 or newline + 1 == size:
+                break
+
+            starts.append(newline + 1)
+
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def _read_lines(path: str, start: int, end: int, encoding: str) -> Iterator:
+    """ reads the lines of a byte range of a file, through `mmap`. """
+    with open(path, 'rb') as handle, \
+            mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+
+        position = start
+
+        while position < end:
+            newline = data.find(b'\n', position, end)
+
+            line_end = end if newline == -1 else newline + 1
+
+            yield data[position:line_end].decode(encoding)
+
+            position = line_end
+
+
+def _part_file(file: str, number: int) -> str:
+    return '{}.part-{:05d}'.format(file, number)
+
+
+def _load_range(args: tuple) -> None:
+    """ parses a byte range of a source file, in a worker process.
+
+    The rows are written to part files, named after the warehouse file they
+    belong to and the number of the range. See `DataLoader._load_in_parallel`.
+
+    """
+    loader, rows, source_file, number, start, end, continue_on_error = args
+
+    handles = {}
+
+    try:
+        lines = _read_lines(source_file, start, end, loader.source.encoding)
+
+        for file, row in rows(lines, continue_on_error):
+            if file not in handles:
+                handles[file] = open(_part_file(file, number), 'w')
 
-        return file_handles
+            loader.warehouse.write_row(handles[file], row)
+    finally:
+        for handle in handles.values():
+            handle.close()
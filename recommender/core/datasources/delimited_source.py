@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+import numpy as np
+
+from core.datasources.base_source import BaseSource
+from core.exceptions import ParserError
+
+logger = logging.getLogger(__name__)
+
+""" The types a ratings line can be split into, see `DelimitedSource`. """
+SPLIT_TYPES = ('training', 'validation', 'test')
+
+# the numpy types of the column types supported by the batch parser.
+_NUMPY_TYPES = {int: np.int64, float: np.float64, str: object}
+
+_PARSER_TEMPLATE = '''
+def parse(line):
+    try:
+        fields = line.strip().split(delimiter)
+    except AttributeError as e:
+        raise ParserError("Invalid line.") from e
+
+    if len(fields) != {count}:
+        raise ParserError("Unable to find {count} fields in the line.")
+
+    try:
+        return {result}
+    except ValueError as e:
+        raise ParserError("Invalid value in the line: " + str(e)) from e
+'''
+
+
+class DelimitedSource(BaseSource):
+    """ A data source for delimited text files, configured with a spec of
+    its columns instead of hand-written parsers.
+
+    The row parsers are compiled once, from the spec, into plain functions
+    which do no more work per line than a hand-written parser would. Batch
+    parsers turn many lines at once into typed numpy arrays.
+
+    Implements the `BaseSource` contract. For more details see `BaseSource`.
+
+    Attributes:
+        same as `BaseSource`, and
+
+        delimiter: the string between the fields of a line.
+
+        ratings_columns: a list of (name, type) tuples, one per field of a
+        ratings line, in order. The type is `int`, `float` or `str`. The
+        columns named after `user_col`, `product_col` and `ratings_col` make
+        up the payload of a rating, the others are only parsed.
+
+        products_columns: a list of (name, type) tuples, one per field of a
+        products line, in order. All the columns make up a product.
+
+        split_column: the name of an int ratings column which decides the
+        type of a rating. See `split_weights`.
+
+        split_weights: the relative sizes of the training, validation and test
+        data sets. A rating with a split column value of `v` falls into
+        bucket `v % sum(split_weights)`, and the buckets are handed out to
+        the types in order.
+
+    """
+
+    def __init__(self, name: str, ratings_file: str, products_file: str,
+                 encoding: str, delimiter: str, ratings_columns: list,
+                 products_columns: list, split_column: str,
+                 split_weights: tuple = (6, 2, 2)):
+        super().__init__(name, ratings_file, products_file, encoding)
+
+        self.delimiter = delimiter
+
+        self.ratings_columns = list(ratings_columns)
+
+        self.products_columns = list(products_columns)
+
+        self.split_column = split_column
+
+        self.split_weights = tuple(split_weights)
+
+        self._compile()
+
+    def _compile(self) -> None:
+        """ compiles the row parsers from the spec. """
+        names = [name for name, _ in self.ratings_columns]
+
+        if self.split_column not in names:
+            raise ValueError('unknown split column: {}'.format(
+                self.split_column))
+
+        self._split_types = tuple(
+            data_type for data_type, weight in
+            zip(SPLIT_TYPES, self.split_weights) for _ in range(weight))
+
+        payload = [column for column, _ in enumerate(self.ratings_columns) if
+                   names[column] in (self.user_col, self.product_col,
+                                     self.ratings_col)]
+
+        split = names.index(self.split_column)
+
+        result = "{{'metadata': {{'type': split_types[{} % {}]}}, " \
+                 "'payload': {}}}".format(
+                     self._field(split, self.ratings_columns[split][1]),
+                     len(self._split_types),
+                     self._fields(self.ratings_columns, payload))
+
+        self._parse_rating = self._compile_parser(len(names), result)
+
+        self._parse_product = self._compile_parser(
+            len(self.products_columns),
+            self._fields(self.products_columns,
+                         range(len(self.products_columns))))
+
+    @staticmethod
+    def _field(column: int, column_type: type) -> str:
+        """ the expression converting a field to its column's type. """
+        if column_type is str:
+            return 'fields[{}]'.format(column)
+
+        return '{}(fields[{}])'.format(column_type.__name__, column)
+
+    @classmethod
+    def _fields(cls, columns: list, picked) -> str:
+        """ the expression of a dict of the picked columns. """
+        return '{{{}}}'.format(', '.join(
+            '{!r}: {}'.format(columns[column][0],
+                              cls._field(column, columns[column][1]))
+            for column in picked))
+
+    def _compile_parser(self, count: int, result: str):
+        namespace = {
+            'delimiter': self.delimiter,
+            'split_types': self._split_types,
+            'ParserError': ParserError,
+        }
+
+        code = _PARSER_TEMPLATE.format(count=count, result=result)
+
+        logger.debug('compiled parser for source {}:{}'.format(self.name,
+                                                                code))
+
+        exec(code, namespace)
+
+        return namespace['parse']
+
+    def __getstate__(self) -> dict:
+        # the compiled parsers cannot be pickled, and are compiled again.
+        state = self.__dict__.copy()
+
+        del state['_parse_rating']
+        del state['_parse_product']
+
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+
+        self._compile()
+
+    def ratings_parser(self, line: str) -> dict:
+        """ Implements the ratings parser as defined in the base source.
+
+        Args:
+            same as `BaseSource.ratings_parser`
+
+        Returns:
+            same as `BaseSource.ratings_parser`
+
+        """
+        return self._parse_rating(line)
+
+    def product_parser(self, line: str) -> dict:
+        """ Implements the product parser as defined in the base source.
+
+        Args:
+            same as `BaseSource.product_parser`
+
+        Returns:
+            same as `BaseSource.product_parser`
+
+        """
+        return self._parse_product(line)
+
+    def ratings_batch_parser(self, lines: list) -> dict:
+        """ Parses many lines of the ratings file at once. Raises a
+        `ParserError` if any of them is invalid.
+
+        Args:
+            lines: a list of lines from the ratings file.
+
+        Returns:
+            A dict like the one returned by `ratings_parser`, but with an
+            array of values, one per line, in place of every value. Unlike
+            `ratings_parser`, all the columns are returned in the payload.
+
+        """
+        columns = self._parse_batch(lines, self.ratings_columns)
+
+        split = columns[self.split_column].astype(np.int64)
+
+        return {
+            'metadata': {
+                'type': np.array(self._split_types)[
+                    split % len(self._split_types)]
+            },
+            'payload': columns
+        }
+
+    def product_batch_parser(self, lines: list) -> dict:
+        """ Parses many lines of the products file at once. Raises a
+        `ParserError` if any of them is invalid.
+
+        Returns:
+            a dict of column name to an array of values, one per line.
+
+        """
+        return self._parse_batch(lines, self.products_columns)
+
+    def _parse_batch(self, lines: list, columns: list) -> dict:
+        """ parses lines into a dict of column name to array.
+
+        Lines of numbers only are parsed by numpy in one go. Integers are
+        exact up to 2**53.
+
+        """
+        lines = list(lines)
+        count = len(columns)
+
+        for line in lines:
+            if not line or line.count(self.delimiter) != count - 1:
+                raise ParserError("Unable to find {} fields in the line: {}"
+                                  .format(count, line))
+
+        if all(column_type is not str for _, column_type in columns):
+            text = '\n'.join(lines).replace(self.delimiter, ' ')
+
+            try:
+                values = np.fromstring(text, sep=' ')
+            except ValueError as e:
+                raise ParserError("Invalid value in the batch.") from e
+
+            # older numpy versions stop at the first invalid value instead.
+            if values.size != count * len(lines):
+                raise ParserError("Invalid value in the batch.")
+
+            values = values.reshape(-1, count)
+        else:
+            values = np.array([line.strip().split(self.delimiter) for line in
+                               lines], dtype=object).reshape(-1, count)
+
+        try:
+            return {name: values[:, column].astype(_NUMPY_TYPES[column_type])
+                    for column, (name, column_type) in enumerate(columns)}
+        except ValueError as e:
+            raise ParserError("Invalid value in the batch.") from e
@@ -1,18 +1,25 @@
 # -*- coding: utf-8 -*-
+import functools
 import itertools
 import json
 import logging
-import math
 import os
 from abc import ABC, abstractmethod
 
+import numpy as np
 from py4j.protocol import Py4JJavaError
-from pyspark.ml.evaluation import RegressionEvaluator
 from pyspark.ml.recommendation import ALS, ALSModel
-from pyspark.sql import SparkSession, DataFrame
+from pyspark.sql import SparkSession
 from pyspark.sql.utils import AnalysisException
 
-from core import config, utils
+from core import (config, evaluation, implicit_als, item_knn, out_of_core,
+                  utils)
+from core.content_index import ContentIndex
+from core.model_store import ModelStore
+from core.popularity import Popularity
+from core.progress import Progress
+from core.rated import RatedProducts
+from core.scoring import FactorModel, generate_for_shards
 from core.warehouse import FileWarehouse
 
 logger = logging.getLogger(__name__)
@@ -34,8 +41,17 @@ class RecommendationEngine(ABC):
 
         model_params: The parameters that describe the model.
 
+        progress: where the training and the generation report their
+        progress, see `core.progress`. Only tracked by default, a task
+        replaces it to publish it.
+
+        default_metric: the metric a training selects the best model by,
+        when none is given.
+
     """
 
+    default_metric = 'rmse'
+
     def __init__(self, warehouse: FileWarehouse, recommendation_count: int,
                  model, model_params: dict):
         self.warehouse = warehouse
@@ -46,6 +62,8 @@ class RecommendationEngine(ABC):
 
         self.model_params = {} if model_params is None else model_params
 
+        self.progress = Progress()
+
     @abstractmethod
     def train_new_model(self, **model_opts) -> dict:
         """ Trains a new model.
@@ -62,6 +80,19 @@ class RecommendationEngine(ABC):
         """
         pass
 
+    @classmethod
+    @abstractmethod
+    def model_opts(cls) -> tuple:
+        """ The keyword arguments of `train_new_model` with options to choose
+        from, which a client can pass.
+
+        Returns:
+            a tuple of the names of the required ones, and of the optional
+            ones.
+
+        """
+        pass
+
     @abstractmethod
     def export(self, path: str) -> None:
         """ Serializes and exports the engine to disk.
@@ -100,6 +131,7 @@ class RecommendationEngine(ABC):
 
         This method requires a pre-trained model to be present.
         The method calls the warehouse APIs internally to locate the data sets.
+        The products the user already rated are never recommended.
 
         Args:
              user_id: the id of the user for whom recommendations are to be
@@ -108,41 +140,26 @@ class RecommendationEngine(ABC):
         pass
 
 
-class ALSRecommendationEngine(RecommendationEngine):
-    """ A recommendation engine that uses the ALS (Alternating Least Squares)
-    model provided by Apache Spark. For more details see
-    https://spark.apache.org/docs/2.1.1/ml-collaborative-filtering.html .
+class FactorEngine(RecommendationEngine):
+    """ The common ground of the engines whose models are matrix
+    factorizations, or score the users like one (see
+    `core.item_knn.SimilarityModel`).
 
-    Implements the `RecommendationEngine` contract. For more details see
-    `RecommendationEngine`.
+    The trained model is snapshotted into a `FactorModel` to generate the
+    recommendations, in batches and without any spark jobs. Subclasses
+    implement the training, and the (de)serialization of their models.
 
     Attributes:
         same as `RecommendationEngine`.
 
     """
 
-    def __init__(self, warehouse: FileWarehouse, recommendation_count: int = 5,
-                 model_params: dict = None, model: ALSModel = None):
-        """ Instantiates the engine and loads a spark session.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
 
-        Args:
-            same as `RecommendationEngine`.
-
-        """
-        super().__init__(warehouse=warehouse,
-                         recommendation_count=recommendation_count,
-                         model=model,
-                         model_params=model_params)
-
-        self._load_spark_session()
-
-    @classmethod
-    def _load_spark_session(cls):
-        """ Loads a spark session bound at the class level. """
-        cls.spark = SparkSession.builder \
-            .appName("ALS Recommendation Engine") \
-            .master("local") \
-            .getOrCreate()
+        # the products rated by the users of each shard, read on the first
+        # `generate_recommendations_for_user` of one of them.
+        self._rated = {}
 
     def ready(self) -> bool:
         """ A simple method to check if the engine is ready. An engine is
@@ -158,114 +175,481 @@ class ALSRecommendationEngine(RecommendationEngine):
 
         return ready
 
-    def export(self, path: str) -> None:
+    @abstractmethod
+    def _factors(self) -> FactorModel:
+        """ snapshots the trained model, with all its users and items. """
+        pass
+
+    def factor_model(self) -> FactorModel:
+        """ Snapshots the trained model into an in-memory `FactorModel`, to
+        score users in batches.
+
+        Returns:
+            a `FactorModel` whose candidate items are the products in the
+            catalog, as in `generate_recommendations_for_user`.
+
+        """
+        assert self.ready()
+
+        catalog = (row[config.PRODUCT_COL] for row in
+                   self.warehouse.read_rows([self.warehouse.products_file]))
+
+        return self._factors().restrict_items(catalog)
+
+    def generate_recommendations(
+            self, workers: int = config.GENERATION_WORKERS) -> None:
+        """ Churns out the recommendations for all users in a batch fashion.
+
+        The model is snapshotted into in-memory factor matrices once, and
+        every shard of the warehouse users is then scored against it in
+        batches, with up to `workers` shards processed concurrently. See
+        `core.scoring.generate_for_shards`. The recommendations for a user are
+        the same as the ones from `generate_recommendations_for_user`,
+        including the products similar to the ones they rated if they rated
+        few, see `core.content_index`.
+
+        Args:
+            workers: the maximum number of worker processes to use.
+
+        """
+        assert self.ready()
+
+        logger.debug('starting the batch recommendation job...')
+
+        self.progress.start('snapshot')
+        model = self.factor_model()
+        content_index = ContentIndex.load(self.warehouse)
+
+        # the users with no ratings get the default recommendations.
+        self.progress.start('defaults')
+        default_recommendations = self.generate_default_recommendations(
+            model=model, content_index=content_index)
+
+        self.progress.start('scoring', total=self.warehouse.shards)
+        users_count = generate_for_shards(
+            warehouse=self.warehouse, model=model,
+            count=self.recommendation_count, workers=workers,
+            progress=lambda users: self.progress.advance(users=users),
+            content_index=content_index, defaults=default_recommendations)
+
+        if not users_count:
+            logger.warning('the users file is empty. '
+                           'Perhaps no users have rated anything yet.')
+
+        # store the default recommendations. The shards are rewritten by the
+        # step above, so this has to come after it.
+        self.warehouse.update_recommendations(config.DEFAULT_USERID,
+                                              default_recommendations)
+
+        self.progress.finish()
+
+        logger.info('recommendations generated for {} users.'
+                    .format(users_count))
+
+    def generate_recommendations_for_user(self, user_id: int) -> list:
+        """ Implements generating recommendations for a given user as defined
+        in `RecommendationEngine`.
+
+        Args:
+            same as in `RecommendationEngine.generate_recommendations_for_user`.
+
+        Returns:
+            same as in `RecommendationEngine.generate_recommendations_for_user`.
+
+        """
+        assert self.ready()
+
+        seen = [(user_id, product_id) for product_id in
+                self._products_rated_by(user_id)]
+
+        model = self.factor_model()
+
+        recommendations = model.recommend(
+            [user_id], self.recommendation_count, seen=seen)
+
+        # the users with few ratings get products similar to them too, see
+        # `generate_recommendations`.
+        content_index = ContentIndex.load(self.warehouse)
+
+        if content_index is not None:
+            recommendations = content_index.complement(
+                [user_id], recommendations, seen, self.recommendation_count,
+                known_ids=model.item_ids,
+                defaults=self.default_recommendations(model, content_index))
+
+        recommendations = recommendations[0]
+
+        logger.info(
+            'curated recommendations generated for user id {}: {}'
+            .format(user_id, recommendations))
+
+        return recommendations
+
+    def _products_rated_by(self, user_id: int) -> list:
+        """ the products a user rated. Only the user's shard of the ratings
+        has them. It is read once, then only the ratings added since.
+
+        """
+        shard = self.warehouse.shard_of(user_id)
+
+        if shard not in self._rated:
+            self._rated[shard] = RatedProducts(self.warehouse, shard=shard)
+
+        self._rated[shard].update()
+
+        return self._rated[shard].products(user_id)
+
+    def generate_default_recommendations(
+            self, model: FactorModel = None,
+            content_index: ContentIndex = None) -> list:
+        """ Implements a method to generate the default recommendations as
+        defined in `RecommendationEngine`.
+
+        Args:
+            same as in `RecommendationEngine.generate_default_recommendations`,
+            and the ones of `default_recommendations`.
+
+        Returns:
+            same as in `RecommendationEngine.generate_default_recommendations`.
+
+        """
+        logger.info('generating the default recommendations...')
+
+        # recommend the overall top rated products. The totals are kept up to
+        # date incrementally, reading only the ratings added since last time.
+        popularity = Popularity.load(self.warehouse)
+        popularity.update()
+        popularity.save()
+
+        recommendations = self.default_recommendations(model, content_index)
+
+        logger.info('default recommendations generated.')
+
+        return recommendations
+
+    def default_recommendations(self, model: FactorModel = None,
+                                content_index: ContentIndex = None) -> list:
+        """ The most popular products, as last counted by
+        `generate_default_recommendations`. If there is a content index, new
+        products similar to them are blended in, see
+        `ContentIndex.add_new_products`.
+
+        Args:
+            model: the snapshot of the model, see `factor_model`. Taken if
+            None and the engine is ready.
+
+            content_index: the content index of the warehouse, loaded if
+            None.
+
+        """
+        recommendations = Popularity.load(self.warehouse).top(
+            self.recommendation_count)
+
+        content_index = content_index or ContentIndex.load(self.warehouse)
+
+        if content_index is not None and (model is not None or self.ready()):
+            if model is None:
+                model = self.factor_model()
+
+            recommendations = content_index.add_new_products(
+                recommendations, model.item_ids, self.recommendation_count)
+
+        return recommendations
+
+    def export(self, path: str, checkpoint: bool = False) -> None:
         """ Implements the export method as defined in `RecommendationEngine`.
 
+        The engine is written to a new version under the path, which is only
+        promoted to the current one once fully written, unless a newer one
+        was promoted in the meantime. See `ModelStore`.
+
         Args:
             same as `RecommendationEngine.export`.
 
+            checkpoint: whether the version is a checkpoint of online
+            updates, see `ModelStore.promote`.
+
         """
-        utils.create_directory(path)
+        store = ModelStore(path)
+
+        version = store.new_version()
 
         if self.ready():
-            self._persist_model(path=path, model=self.model)
+            self._persist_model(path=store.path(version), model=self.model)
 
-        self._persist_params(path=path,
+        self._persist_params(path=store.path(version),
+                             engine=type(self).__name__,
                              warehouse_partition=self.warehouse.partition,
+                             warehouse_shards=self.warehouse.shards,
                              recommendation_count=self.recommendation_count,
                              model_params=self.model_params)
 
+        # a newer export promoted in the meantime wins.
+        if not store.promote(version, checkpoint=checkpoint):
+            utils.delete_directory(store.path(version))
+
+        store.prune()
+
     @classmethod
-    def import_from_path(cls, path: str) -> 'ALSRecommendationEngine':
+    def import_from_path(cls, path: str) -> 'FactorEngine':
         """ Implements the import method as defined in `RecommendationEngine`.
 
         Args:
             same as `RecommendationEngine.export`.
 
         Returns:
-            a new `ALSRecommendationEngine` instance.
+            a new engine instance, from the current version under the path.
+            See `ModelStore`.
 
         """
-        cls._load_spark_session()
+        # resolve the current version once, so a concurrent export cannot
+        # switch it halfway through.
+        path = ModelStore(path).current()
 
         model = cls._load_model(path)
 
         params = cls._load_params(path)
 
+        warehouse = FileWarehouse(
+            partition=params['warehouse_partition'],
+            shards=params.get('warehouse_shards', config.WAREHOUSE_SHARDS))
+
         engine = cls(
-            warehouse=FileWarehouse(partition=params['warehouse_partition']),
+            warehouse=warehouse,
             recommendation_count=params['recommendation_count'],
             model_params=params['model_params'],
             model=model)
 
         return engine
 
-    def train_new_model(self, **als_opts) -> dict:
+    @staticmethod
+    @abstractmethod
+    def _load_model(path: str):
+        """ instantiates a model object from a path, None if there is none.
+        """
+        pass
+
+    @staticmethod
+    @abstractmethod
+    def _persist_model(path: str, model) -> None:
+        """ serializes the model object to a path on disk. """
+        pass
+
+    @staticmethod
+    def _load_params(path) -> dict:
+        """ instantiates the engine params as a dict from a file path. """
+        with open('{}/{}'.format(path, 'params.json')) as params_file:
+            return json.load(params_file)
+
+    @staticmethod
+    def _persist_params(path: str, engine, warehouse_partition,
+                        warehouse_shards, recommendation_count,
+                        model_params) -> None:
+        """ serializes the model params to a file on disk.
+
+        Args:
+            the various engine params. `engine` is the name of the class,
+            see `import_engine`.
+        """
+        params = {
+            'engine': engine,
+            'warehouse_partition': warehouse_partition,
+            'warehouse_shards': warehouse_shards,
+            'recommendation_count': recommendation_count,
+            'model_params': model_params
+        }
+
+        with open('{}/{}'.format(path, 'params.json'), 'w') as params_file:
+            json.dump(params, params_file)
+
+
+class ALSRecommendationEngine(FactorEngine):
+    """ A recommendation engine that uses the ALS (Alternating Least Squares)
+    model provided by Apache Spark. For more details see
+    https://spark.apache.org/docs/2.1.1/ml-collaborative-filtering.html .
+
+    Implements the `RecommendationEngine` contract. For more details see
+    `RecommendationEngine` and `FactorEngine`.
+
+    The model is an `ALSModel`, or the `FactorModel` of the last checkpoint of
+    the online learner, see `core.online_learning`.
+
+    Attributes:
+        same as `RecommendationEngine`.
+
+    """
+
+    def __init__(self, warehouse: FileWarehouse, recommendation_count: int = 5,
+                 model_params: dict = None, model: ALSModel = None):
+        """ Instantiates the engine and loads a spark session.
+
+        Args:
+            same as `RecommendationEngine`.
+
+        """
+        super().__init__(warehouse=warehouse,
+                         recommendation_count=recommendation_count,
+                         model=model,
+                         model_params=model_params)
+
+        self._load_spark_session()
+
+    @classmethod
+    def _load_spark_session(cls):
+        """ Loads a spark session bound at the class level. Its jobs are
+        scheduled fairly, so the engines of several partitions can share it,
+        see `core.scheduler`.
+
+        """
+        cls.spark = SparkSession.builder \
+            .appName("ALS Recommendation Engine") \
+            .master("local") \
+            .config("spark.scheduler.mode", "FAIR") \
+            .getOrCreate()
+
+    @classmethod
+    def import_from_path(cls, path: str) -> 'ALSRecommendationEngine':
+        """ Implements the import method as defined in `RecommendationEngine`,
+        see `FactorEngine.import_from_path`.
+
+        """
+        cls._load_spark_session()
+
+        return super().import_from_path(path)
+
+    def _factors(self) -> FactorModel:
+        # the checkpoints of the online learner hold the factors themselves.
+        if isinstance(self.model, FactorModel):
+            return self.model
+
+        return FactorModel.from_als_model(self.model)
+
+    @classmethod
+    def model_opts(cls) -> tuple:
+        return ('rank_opts', 'reg_param_opts'), ('max_iter_opts',)
+
+    def train_new_model(self, metric: str = 'rmse', **als_opts) -> dict:
         """ Implements the train method as defined in `RecommendationEngine`.
 
+        Each candidate model is evaluated in-process against the validation
+        data set, see `core.evaluation.Evaluator`.
+
         Args:
+            metric: the metric to select the best model by. One of the keys
+            of `core.evaluation.METRICS`.
+
             als_opts: The keyword arguments `rank`, `reg_param` and `max_iter`
             which define an ALS model. Used in the spirit as mentiond in
-            `RecommendationEngine.train_new_model`.
+            `RecommendationEngine.train_new_model`. The optional `max_iter`
+            options are tried from the smallest, and the larger ones skipped
+            once the validation metric improves by less than
+            `ALS_TOLERANCE`. `ALS_MAX_ITER` if none.
 
         Returns:
-            A dict with the chosen values of `rank`, `reg_param` and `max_iter`.
+            A dict with the chosen values of `rank`, `reg_param` and
+            `max_iter`, the metric used for the selection, and all the metrics
+            of the chosen model on the test data set. The test RMSE is also
+            available directly under `rmse`.
 
         """
+        if metric not in evaluation.METRICS:
+            raise ValueError('unknown metric: {}. Should be one of {}'
+                             .format(metric, sorted(evaluation.METRICS)))
+
         logger.info('starting training of a new model...')
 
         # load data sets
+        self.progress.start('loading')
         training_data = self.spark.read.json(self.warehouse.training_file)
-        validation_data = self.spark.read.json(self.warehouse.validation_file)
-        test_data = self.spark.read.json(self.warehouse.test_file)
+        validation = evaluation.Evaluator.from_warehouse_files(
+            holdout_files=[self.warehouse.validation_file],
+            seen_files=[self.warehouse.training_file])
+        test = evaluation.Evaluator.from_warehouse_files(
+            holdout_files=[self.warehouse.test_file],
+            seen_files=[self.warehouse.training_file])
 
         # fix some (sane) defaults for the current untrained model.
-        current_model = None
-        current_model_params = {
-            'rmse': float('inf')
-        }
+        best_model = None
+        best_model_params = {}
+        best_value = evaluation.worst_value(metric)
+
+        max_iters = sorted(als_opts.get('max_iter_opts') or
+                           [config.ALS_MAX_ITER])
+
+        self.progress.start('candidates', total=len(als_opts['rank_opts']) *
+                            len(als_opts['reg_param_opts']) * len(max_iters))
 
         # cycle through all possible combinations of the options provided.
-        # choose the best combination (the one with the lowest RMSE).
-        for rank, reg_param, max_iter in itertools.product(
-                als_opts['rank_opts'],
-                als_opts['reg_param_opts'],
-                als_opts['max_iter_opts']):
-
-            logger.debug('training model for rank: {}, reg_param: {}, max_iter:'
-                         ' {}...'.format(rank, reg_param, max_iter))
-
-            current_model = ALS(rank=rank,
-                                regParam=reg_param,
-                                maxIter=max_iter,
-                                userCol=config.USER_COL,
-                                itemCol=config.PRODUCT_COL,
-                                ratingCol=config.RATINGS_COL) \
-                .fit(training_data)
-
-            current_rmse = self._compute_rmse(current_model, validation_data)
-
-            logger.debug('rmse found:{}'.format(current_rmse))
-
-            if not math.isnan(current_rmse) and \
-                    current_rmse < current_model_params['rmse']:
-                current_model_params = {
-                    'rank': rank,
-                    'reg_param': reg_param,
-                    'max_iter': max_iter,
-                    'rmse': current_rmse
-                }
-
-        # once the model is trained, compute the RMSE on test dataset.
-        # this gives us an idea of the typical RMSE to expect from this model.
-        current_model_params['rmse'] = self._compute_rmse(current_model,
-                                                          test_data)
-        logger.debug(
-            'rmse on the test data: {}'.format(current_model_params['rmse']))
+        # choose the best combination as per the metric.
+        for rank, reg_param in itertools.product(als_opts['rank_opts'],
+                                                 als_opts['reg_param_opts']):
+            previous_value = evaluation.worst_value(metric)
+
+            for position, max_iter in enumerate(max_iters):
+                logger.debug('training model for rank: {}, reg_param: {}, '
+                             'max_iter: {}...'.format(rank, reg_param,
+                                                      max_iter))
+
+                self.progress.advance(0, current={'rank': rank,
+                                                  'reg_param': reg_param,
+                                                  'max_iter': max_iter})
+
+                current_model = ALS(rank=rank,
+                                    regParam=reg_param,
+                                    maxIter=max_iter,
+                                    userCol=config.USER_COL,
+                                    itemCol=config.PRODUCT_COL,
+                                    ratingCol=config.RATINGS_COL) \
+                    .fit(training_data)
+
+                current_metrics = validation.evaluate(
+                    FactorModel.from_als_model(current_model))
+
+                logger.debug('validation metrics found:{}'.format(
+                    current_metrics))
+
+                self.progress.advance()
+
+                if evaluation.is_better(metric, current_metrics[metric],
+                                        best_value):
+                    best_value = current_metrics[metric]
+                    best_model = current_model
+                    best_model_params = {
+                        'rank': rank,
+                        'reg_param': reg_param,
+                        'max_iter': max_iter,
+                        'metric': metric,
+                    }
+
+                # more sweeps would not pay off.
+                if not evaluation.is_better(
+                        metric, current_metrics[metric], previous_value,
+                        tolerance=config.ALS_TOLERANCE):
+                    logger.debug('{} plateaued at max_iter {}'.format(
+                        metric, max_iter))
+                    self.progress.advance(len(max_iters) - position - 1)
+                    break
+
+                previous_value = current_metrics[metric]
+
+        if best_model is None:
+            raise ValueError('no candidate model could be evaluated on {}.'
+                             .format(metric))
+
+        # once the model is trained, compute the metrics on test dataset.
+        # this gives us an idea of the typical values to expect from this
+        # model.
+        self.progress.start('testing')
+        test_metrics = test.evaluate(FactorModel.from_als_model(best_model))
+        best_model_params['metrics'] = test_metrics
+        best_model_params['rmse'] = test_metrics['rmse']
+        logger.debug('metrics on the test data: {}'.format(test_metrics))
+
+        self.progress.finish()
 
         # attach this model to the engine. It is ready now.
-        self.model = current_model
-        self.model_params = current_model_params
+        self.model = best_model
+        self.model_params = best_model_params
         logger.info(
             'model trained and ready. params are: {}'.format(self.model_params))
 
@@ -280,9 +664,11 @@ class ALSRecommendationEngine(RecommendationEngine):
         logger.info('starting training of the current model...')
 
         # load the updated data
-        training_data = self.spark.read.json(self.warehouse.ratings_file)
+        self.progress.start('loading')
+        training_data = self.spark.read.json(self.warehouse.ratings_files())
 
         # train the existing model on the updated data
+        self.progress.start('training')
         self.model = ALS(rank=self.model_params['rank'],
                          regParam=self.model_params['reg_param'],
                          maxIter=self.model_params['max_iter'],
@@ -291,159 +677,672 @@ class ALSRecommendationEngine(RecommendationEngine):
                          ratingCol=config.RATINGS_COL) \
             .fit(training_data)
 
-        logger.info('model trained successfully.')
+        self.progress.finish()
 
-    def generate_recommendations(self) -> None:
-        """ Churns out the recommendations for all users in a batch fashion.
+        logger.info('model trained successfully.')
 
-        A wrapper over the `generate_recommendations_for_user` and
-        `generate_default_recommendations` methods.
+    @staticmethod
+    def _load_model(path) -> ALSModel:
+        """ instantiates a model object from a file path. The checkpoints
+        of the online learner are `FactorModel`s, see `_persist_model`.
 
         """
-        logger.debug('starting the batch recommendation job...')
+        file = '{}/{}'.format(path, 'factors.npz')
 
-        # generate and store the default recommendations
-        default_recommendations = self.generate_default_recommendations()
-        self.warehouse.update_recommendations(config.DEFAULT_USERID,
-                                              default_recommendations)
+        if os.path.exists(file):
+            return FactorModel.load(file)
 
-        # load users from the warehouse and generate recommendations for them
-        # one by one.
         try:
-            assert os.stat(self.warehouse.users_file).st_size > 0
-            users = self.spark.read.json(self.warehouse.users_file).select(
-                config.USER_COL).collect()
-            for user in users:
-                rec = self.generate_recommendations_for_user(user.user_id)
-                self.warehouse.update_recommendations(user.user_id, rec)
-        except AssertionError:
-            logger.warning('the users file is empty. '
-                           'Perhaps no users have rated anything yet.')
+            return ALSModel.load(path)
+        except (Py4JJavaError, AnalysisException):
+            logger.warning('no model found at path {}'.format(path))
 
-    def generate_recommendations_for_user(self, user_id: int) -> list:
-        """ Implements generating recommendations for a given user as defined
-        in `RecommendationEngine`.
+    @staticmethod
+    def _persist_model(path: str, model: ALSModel) -> None:
+        """ serializes the model object to a path on disk. """
+        if isinstance(model, FactorModel):
+            model.save('{}/{}'.format(path, 'factors.npz'))
+        else:
+            model.write().overwrite().save(path)
 
-        Args:
-            same as in `RecommendationEngine.generate_recommendations_for_user`.
+
+class ImplicitALSEngine(FactorEngine):
+    """ A recommendation engine for implicit feedback, like views or clicks,
+    trained with the conjugate gradient ALS of `core.implicit_als`. Needs no
+    spark.
+
+    The ratings are taken as amounts of feedback, and turned into confidences
+    with a configurable transform, see `core.implicit_als.confidence`. The
+    model is a `FactorModel`.
+
+    Implements the `RecommendationEngine` contract. For more details see
+    `RecommendationEngine` and `FactorEngine`.
+
+    Attributes:
+        same as `RecommendationEngine`. The model params also hold the
+        `confidence` transform, its `alpha` and `epsilon`, the `solver` and
+        its `cg_steps`, and the `tolerance` of the early stopping, all
+        defaulting to the config.
+
+    """
+
+    def __init__(self, warehouse: FileWarehouse, recommendation_count: int = 5,
+                 model_params: dict = None, model: FactorModel = None):
+        super().__init__(warehouse=warehouse,
+                         recommendation_count=recommendation_count,
+                         model=model,
+                         model_params=model_params)
+
+    default_metric = 'precision_at_k'
+
+    def _factors(self) -> FactorModel:
+        return self.model
+
+    @classmethod
+    def model_opts(cls) -> tuple:
+        return ('rank_opts', 'reg_param_opts'), ('max_iter_opts',)
+
+    def _training_opts(self) -> dict:
+        """ the options of the training besides the factorization ones, from
+        the model params or the config.
+
+        """
+        return {
+            'confidence': self.model_params.get('confidence',
+                                                config.IMPLICIT_CONFIDENCE),
+            'alpha': self.model_params.get('alpha', config.IMPLICIT_ALPHA),
+            'epsilon': self.model_params.get('epsilon',
+                                             config.IMPLICIT_EPSILON),
+            'solver': self.model_params.get('solver', 'cg'),
+            'cg_steps': self.model_params.get('cg_steps',
+                                              config.IMPLICIT_CG_STEPS),
+            'tolerance': self.model_params.get('tolerance',
+                                               config.ALS_TOLERANCE),
+        }
+
+    def confidence(self, ratings: np.ndarray) -> np.ndarray:
+        """ turns ratings into confidences, with the transform of the model.
+        """
+        opts = self._training_opts()
+
+        return implicit_als.confidence(ratings, transform=opts['confidence'],
+                                       alpha=opts['alpha'],
+                                       epsilon=opts['epsilon'])
+
+    def _training_data(self, files: list) -> tuple:
+        """ reads the ratings files into a confidence matrix.
 
         Returns:
-            same as in `RecommendationEngine.generate_recommendations_for_user`.
+            a tuple of the sorted user ids, the sorted item ids, and the
+            ratings in the form `_fit` takes. Here, as for
+            `core.implicit_als.ratings_matrix`, with confidences in place of
+            the ratings.
 
         """
-        assert self.ready()
+        user_ids, item_ids, matrix = implicit_als.ratings_matrix(
+            self.warehouse.read_rows(files))
 
-        logger.info('generating curated recommendations'
-                    ' for user id: {}'.format(user_id))
-
-        # load the products catalog to get all the candidate product ids
-        df = self.spark.read.json(self.warehouse.products_file)
-        df.createOrReplaceTempView("product_catalog")
-        query = "SELECT {} as {}, {} FROM product_catalog" \
-            .format(user_id, config.USER_COL, config.PRODUCT_COL)
-        candidates = self.spark.sql(query)
-        logger.debug('candidate products loaded successfully.')
-
-        # generate recommendations and filter out invalid values like NaN.
-        predictions = self.model.transform(candidates)
-        predictions = predictions.na.drop(subset=["prediction"])
-        rows = predictions.orderBy('prediction', ascending=False).take(
-            self.recommendation_count)
-        recommendations = [i.product_id for i in rows]
+        matrix.data = self.confidence(matrix.data)
 
-        logger.info(
-            'curated recommendations generated for user id {}: {}'
-            .format(user_id, recommendations))
+        return user_ids, item_ids, matrix
 
-        return recommendations
+    def _fit(self, data, rank: int, reg_param: float, max_iter: int,
+             user_factors: np.ndarray = None, item_factors: np.ndarray = None,
+             callback=None) -> tuple:
+        """ factorizes the ratings from `_training_data`, see
+        `core.implicit_als.fit`.
 
-    def generate_default_recommendations(self) -> list:
-        """ Implements a method to generate the default recommendations as
-        defined in `RecommendationEngine`.
+        Returns:
+            a tuple of the user factors and the item factors.
+
+        """
+        opts = self._training_opts()
+
+        return implicit_als.fit(
+            data, rank=rank, reg_param=reg_param, max_iter=max_iter,
+            solver=opts['solver'], cg_steps=opts['cg_steps'],
+            user_factors=user_factors, item_factors=item_factors,
+            callback=callback)
+
+    def _loss(self, data, user_factors: np.ndarray, item_factors: np.ndarray,
+              reg_param: float) -> float:
+        """ the training loss of factors of the ratings from
+        `_training_data`.
+
+        """
+        return implicit_als.loss(data, user_factors, item_factors, reg_param)
+
+    def _early_stopping(self, data, reg_param: float,
+                        validation: evaluation.Evaluator = None,
+                        metric: str = None, user_ids: np.ndarray = None,
+                        item_ids: np.ndarray = None):
+        """ the `core.implicit_als.EarlyStopping` of a fit, watching the
+        training loss and, if given, the metric on a validation data set.
+
+        """
+        validate = None
+
+        if validation is not None:
+            def validate(user_factors, item_factors):
+                return validation.evaluate(FactorModel(
+                    user_ids=user_ids, user_factors=user_factors,
+                    item_ids=item_ids, item_factors=item_factors))
+
+        return implicit_als.EarlyStopping(
+            loss=functools.partial(self._loss, data, reg_param=reg_param),
+            tolerance=self._training_opts()['tolerance'], validate=validate,
+            metric=metric)
+
+    def _evaluator(self, holdout_file: str,
+                   user_ids: np.ndarray) -> evaluation.Evaluator:
+        """ an evaluator on a held-out data set, for a model of the given
+        users.
+
+        """
+        return evaluation.Evaluator.from_warehouse_files(
+            holdout_files=[holdout_file],
+            seen_files=[self.warehouse.training_file])
+
+    def train_new_model(self, metric: str = 'precision_at_k',
+                        **als_opts) -> dict:
+        """ Implements the train method as defined in `RecommendationEngine`.
+
+        Each candidate model is evaluated in-process against the validation
+        data set, see `core.evaluation.Evaluator`.
 
         Args:
-            same as in `RecommendationEngine.generate_default_recommendations`.
+            metric: the metric to select the best model by. One of the keys
+            of `core.evaluation.METRICS`. The ratings are not predicted, so
+            the ranking metrics are the meaningful ones.
+
+            als_opts: The keyword arguments `rank_opts` and
+            `reg_param_opts`, as for `ALSRecommendationEngine`. The sweeps
+            of each candidate stop early, see
+            `core.implicit_als.EarlyStopping`, and the largest of the
+            optional `max_iter_opts` caps them, `ALS_MAX_ITER` if none.
 
         Returns:
-            same as in `RecommendationEngine.generate_default_recommendations`.
+            A dict with the chosen values of `rank` and `reg_param`, the
+            sweeps the chosen model took as `max_iter`, the training options
+            (see the class attributes), the metric used for the selection,
+            the `ratings_watermark` the training data goes up to, and all the
+            metrics of the chosen model on the test data set.
 
         """
-        logger.info('generating the default recommendations...')
+        if metric not in evaluation.METRICS:
+            raise ValueError('unknown metric: {}. Should be one of {}'
+                             .format(metric, sorted(evaluation.METRICS)))
 
-        # read the product catalog and recommend the overall top rated products.
-        df = self.spark.read.json(self.warehouse.ratings_file)
-        df.createOrReplaceTempView("user_ratings")
-        candidates = self.spark.sql(
-            "SELECT product_id, sum(ratings) AS overall_ratings "
-            "FROM user_ratings GROUP BY product_id")
-        rows = candidates.orderBy('overall_ratings', ascending=False).take(
-            self.recommendation_count)
-        recommendations = [i.product_id for i in rows]
+        logger.info('starting training of a new implicit model...')
 
-        logger.info('default recommendations generated.')
+        opts = self._training_opts()
 
-        return recommendations
+        # load data sets
+        self.progress.start('loading')
+        # the training split is of the bulk loaded ratings, segment 0 of
+        # their generation. The online updates go on from there, see
+        # `core.online_learning`.
+        watermark = [self.warehouse.ratings_manifest()['generation'], 0]
+        user_ids, item_ids, data = self._training_data(
+            [self.warehouse.training_file])
+        validation = self._evaluator(self.warehouse.validation_file, user_ids)
+        test = self._evaluator(self.warehouse.test_file, user_ids)
+
+        best_model = None
+        best_model_params = {}
+        best_value = evaluation.worst_value(metric)
+
+        max_iter = max(als_opts.get('max_iter_opts') or [config.ALS_MAX_ITER])
+
+        self.progress.start('candidates', total=len(als_opts['rank_opts']) *
+                            len(als_opts['reg_param_opts']))
+
+        for rank, reg_param in itertools.product(als_opts['rank_opts'],
+                                                 als_opts['reg_param_opts']):
+
+            logger.debug('training model for rank: {}, reg_param: {}, up to '
+                         '{} sweeps...'.format(rank, reg_param, max_iter))
+
+            self.progress.advance(0, current={'rank': rank,
+                                              'reg_param': reg_param})
+
+            stopping = self._early_stopping(
+                data, reg_param, validation=validation, metric=metric,
+                user_ids=user_ids, item_ids=item_ids)
+
+            self._fit(data, rank=rank, reg_param=reg_param,
+                      max_iter=max_iter, callback=stopping)
+
+            current_model = FactorModel(user_ids=user_ids,
+                                        user_factors=stopping.user_factors,
+                                        item_ids=item_ids,
+                                        item_factors=stopping.item_factors)
+
+            current_metrics = stopping.metrics
+
+            logger.debug('validation metrics found after {} sweeps:{}'.format(
+                stopping.sweeps, current_metrics))
+
+            self.progress.advance()
+
+            if evaluation.is_better(metric, current_metrics[metric],
+                                    best_value):
+                best_value = current_metrics[metric]
+                best_model = current_model
+                best_model_params = dict(opts, rank=rank, reg_param=reg_param,
+                                         max_iter=stopping.sweeps,
+                                         metric=metric,
+                                         ratings_watermark=watermark)
+
+        if best_model is None:
+            raise ValueError('no candidate model could be evaluated on {}.'
+                             .format(metric))
+
+        self.progress.start('testing')
+        test_metrics = test.evaluate(best_model)
+        best_model_params['metrics'] = test_metrics
+        logger.debug('metrics on the test data: {}'.format(test_metrics))
+
+        self.progress.finish()
+
+        self.model = best_model
+        self.model_params = best_model_params
+        logger.info(
+            'model trained and ready. params are: {}'.format(self.model_params))
+
+        return self.model_params
+
+    def retrain_with_updated_data(self) -> None:
+        """ Implements the retrain method as defined in `RecommendationEngine`.
+
+        The known users and items start from their current factors, so a few
+        sweeps are enough to take in the new ratings. The sweeps stop once the
+        training loss converges, and after `max_iter` at most.
+
+        """
+        assert self.ready()
+
+        logger.info('starting training of the current model...')
+
+        self.progress.start('loading')
+        watermark = self.warehouse.ratings_watermark()
+        user_ids, item_ids, data = self._training_data(
+            self.warehouse.ratings_files(until=watermark))
+
+        random = np.random.RandomState(0)
+
+        user_factors = self._warm_start(
+            self.model.user_rows(user_ids), self.model.user_factors, random)
+        item_factors = self._warm_start(
+            self.model.item_rows(item_ids), self.model.item_factors, random)
+
+        stopping = self._early_stopping(data, self.model_params['reg_param'])
+
+        self.progress.start('training')
+        self._fit(data, rank=self.model_params['rank'],
+                  reg_param=self.model_params['reg_param'],
+                  max_iter=self.model_params['max_iter'],
+                  user_factors=user_factors, item_factors=item_factors,
+                  callback=stopping)
+
+        self.model = FactorModel(user_ids=user_ids,
+                                 user_factors=stopping.user_factors,
+                                 item_ids=item_ids,
+                                 item_factors=stopping.item_factors)
+
+        # a batch model again, of the ratings up to the watermark, see
+        # `core.online_learning`.
+        self.model_params.pop('online', None)
+        self.model_params['ratings_watermark'] = watermark
+
+        self.progress.finish()
+
+        logger.info('model trained successfully in {} sweeps.'.format(
+            stopping.sweeps))
 
     @staticmethod
-    def _load_params(path) -> dict:
-        """ instantiates the engine params as a dict from a file path. """
-        with open('{}/{}'.format(path, 'params.json')) as params_file:
-            return json.load(params_file)
+    def _warm_start(rows: np.ndarray, factors: np.ndarray,
+                    random: np.random.RandomState) -> np.ndarray:
+        """ the starting factors of a retrain: the current ones of the known
+        rows (>= 0), small random values for the new ones.
+
+        """
+        start = random.normal(scale=0.01, size=(len(rows), factors.shape[1]))
+
+        known = rows >= 0
+        start[known] = factors[rows[known]]
+
+        return start
 
     @staticmethod
-    def _load_model(path) -> ALSModel:
+    def _load_model(path: str) -> FactorModel:
         """ instantiates a model object from a file path. """
-        try:
-            return ALSModel.load(path)
-        except (Py4JJavaError, AnalysisException):
+        file = '{}/{}'.format(path, 'factors.npz')
+
+        if not os.path.exists(file):
             logger.warning('no model found at path {}'.format(path))
+            return None
+
+        return FactorModel.load(file)
 
     @staticmethod
-    def _persist_model(path: str, model: ALSModel) -> None:
+    def _persist_model(path: str, model: FactorModel) -> None:
         """ serializes the model object to a path on disk. """
-        model.write().overwrite().save(path)
+        model.save('{}/{}'.format(path, 'factors.npz'))
 
-    @staticmethod
-    def _persist_params(path: str, warehouse_partition, recommendation_count,
-                        model_params) -> None:
-        """ serializes the model params to a file on disk.
 
-        Args:
-            the various engine params.
+class OutOfCoreALSEngine(ImplicitALSEngine):
+    """ An `ImplicitALSEngine` for ratings which do not fit in memory.
+
+    The ratings are converted into memory-mapped shards on disk, sorted by
+    user and by item, and each sweep of the training streams over them, see
+    `core.out_of_core`. Only the factors stay in memory. The candidate models
+    are evaluated on a sample of the users, see
+    `OUT_OF_CORE_EVALUATION_USERS`. The shards are removed after training,
+    and the peak RSS of the process is logged along with their size.
+
+    The rows are always solved with conjugate gradient, whatever the
+    `solver` param.
+
+    Attributes:
+        same as `ImplicitALSEngine`.
+
+    """
+
+    def _shards_directory(self) -> str:
+        return '{}/{}'.format(config.OUT_OF_CORE_DIR, self.warehouse.partition)
+
+    def _training_data(self, files: list) -> tuple:
+        """ converts the ratings files into shards.
+
+        Returns:
+            a tuple of the sorted user ids, the sorted item ids, and a tuple
+            of the user-sorted and the item-sorted `ShardedMatrix`.
+
         """
-        params = {
-            'warehouse_partition': warehouse_partition,
-            'recommendation_count': recommendation_count,
-            'model_params': model_params
-        }
+        user_ids, item_ids, by_user, by_item = out_of_core.build(
+            files, self._shards_directory())
 
-        with open('{}/{}'.format(path, 'params.json'), 'w') as params_file:
-            json.dump(params, params_file)
+        logger.info('ratings sharded into {} bytes, peak rss is {} bytes'
+                    .format(by_user.size() + by_item.size(),
+                            out_of_core.peak_rss()))
 
-    @staticmethod
-    def _compute_rmse(model: ALSModel, data: DataFrame) -> float:
-        """ computes the RMSE error for a given model .
+        return user_ids, item_ids, (by_user, by_item)
+
+    def _fit(self, data, rank: int, reg_param: float, max_iter: int,
+             user_factors: np.ndarray = None, item_factors: np.ndarray = None,
+             callback=None) -> tuple:
+        by_user, by_item = data
+
+        return out_of_core.fit(
+            by_user, by_item, rank=rank, reg_param=reg_param,
+            max_iter=max_iter, transform=self.confidence,
+            cg_steps=self._training_opts()['cg_steps'],
+            user_factors=user_factors, item_factors=item_factors,
+            callback=callback)
+
+    def _loss(self, data, user_factors: np.ndarray, item_factors: np.ndarray,
+              reg_param: float) -> float:
+        return out_of_core.loss(data[0], user_factors, item_factors,
+                                reg_param, transform=self.confidence)
+
+    def _evaluator(self, holdout_file: str,
+                   user_ids: np.ndarray) -> evaluation.Evaluator:
+        """ an evaluator on a held-out data set, for a sample of the users.
+        The same sample for all the data sets.
+
+        """
+        sample = user_ids
+
+        if len(user_ids) > config.OUT_OF_CORE_EVALUATION_USERS:
+            sample = np.random.RandomState(0).choice(
+                user_ids, config.OUT_OF_CORE_EVALUATION_USERS, replace=False)
+
+        return evaluation.Evaluator.from_warehouse_files(
+            holdout_files=[holdout_file],
+            seen_files=[self.warehouse.training_file],
+            users=set(sample.tolist()))
+
+    def train_new_model(self, metric: str = 'precision_at_k',
+                        **als_opts) -> dict:
+        """ same as `ImplicitALSEngine.train_new_model`, out of core. """
+        try:
+            return super().train_new_model(metric=metric, **als_opts)
+        finally:
+            self._remove_shards()
+
+    def retrain_with_updated_data(self) -> None:
+        """ same as `ImplicitALSEngine.retrain_with_updated_data`, out of
+        core.
+
+        """
+        try:
+            super().retrain_with_updated_data()
+        finally:
+            self._remove_shards()
+
+    def _remove_shards(self) -> None:
+        utils.delete_directory(self._shards_directory())
+
+        logger.info('peak rss of the training: {} bytes'.format(
+            out_of_core.peak_rss()))
+
+
+class ItemKNNEngine(FactorEngine):
+    """ A recommendation engine recommending the items most similar to the
+    ones a user rated, see `core.item_knn`. Needs no spark, and fits no
+    factors: building a model takes a couple of sparse products, so it can be
+    retrained much more often than the ALS engines, and the latest ratings of
+    a user count in the generation without any retrain.
+
+    The model is a `core.item_knn.SimilarityModel`.
+
+    Implements the `RecommendationEngine` contract. For more details see
+    `RecommendationEngine` and `FactorEngine`.
+
+    Attributes:
+        same as `RecommendationEngine`.
+
+    """
+
+    def __init__(self, warehouse: FileWarehouse, recommendation_count: int = 5,
+                 model_params: dict = None,
+                 model: item_knn.SimilarityModel = None):
+        super().__init__(warehouse=warehouse,
+                         recommendation_count=recommendation_count,
+                         model=model,
+                         model_params=model_params)
+
+    default_metric = 'precision_at_k'
+
+    def _factors(self) -> item_knn.SimilarityModel:
+        return self.model
+
+    @classmethod
+    def model_opts(cls) -> tuple:
+        return (), ('neighbors_opts', 'similarity_opts')
+
+    def train_new_model(self, metric: str = 'precision_at_k',
+                        neighbors_opts: list = None,
+                        similarity_opts: list = None) -> dict:
+        """ Implements the train method as defined in `RecommendationEngine`.
+
+        Each candidate model is evaluated in-process against the validation
+        data set, see `core.evaluation.Evaluator`. The similarities are
+        computed once per similarity, for the largest number of neighbors,
+        and cut down for the others.
 
         Args:
-            model: the model instance
+            metric: the metric to select the best model by. One of the keys
+            of `core.evaluation.METRICS`. The ratings are not predicted, so
+            the ranking metrics are the meaningful ones.
 
-            data: a spark DataFrame on which to run the model and compare the
-            predicted vs actual ratings.
+            neighbors_opts: the numbers of neighbors per item to choose from,
+            `ITEM_KNN_NEIGHBORS` if None.
+
+            similarity_opts: the similarities to choose from, see
+            `core.item_knn.SIMILARITIES`, `ITEM_KNN_SIMILARITY` if None.
 
         Returns:
-            rmse : the root-mean-squared error value
+            A dict with the chosen values of `neighbors` and `similarity`, the
+            `shrinkage`, the metric used for the selection, and all the
+            metrics of the chosen model on the test data set.
+
         """
-        predictions = model.transform(data)
-        # remove all NaN values
-        predictions = predictions.na.drop(subset=["prediction"])
+        if metric not in evaluation.METRICS:
+            raise ValueError('unknown metric: {}. Should be one of {}'
+                             .format(metric, sorted(evaluation.METRICS)))
 
-        try:
-            evaluator = RegressionEvaluator(metricName="rmse",
-                                            labelCol=config.RATINGS_COL,
-                                            predictionCol="prediction")
-            rmse = evaluator.evaluate(predictions)
-            return rmse
-        except Exception as e:
-            logger.warning(
-                'Error in computing rmse. Error description: {}'.format(e))
-            return math.nan
+        neighbors_opts = neighbors_opts or [config.ITEM_KNN_NEIGHBORS]
+        similarity_opts = similarity_opts or [config.ITEM_KNN_SIMILARITY]
+
+        logger.info('starting training of a new item-kNN model...')
+
+        shrinkage = self.model_params.get('shrinkage',
+                                          config.ITEM_KNN_SHRINKAGE)
+
+        # load data sets
+        self.progress.start('loading')
+        user_ids, item_ids, ratings = implicit_als.ratings_matrix(
+            self.warehouse.read_rows([self.warehouse.training_file]))
+        validation = evaluation.Evaluator.from_warehouse_files(
+            holdout_files=[self.warehouse.validation_file],
+            seen_files=[self.warehouse.training_file])
+        test = evaluation.Evaluator.from_warehouse_files(
+            holdout_files=[self.warehouse.test_file],
+            seen_files=[self.warehouse.training_file])
+
+        best_model = None
+        best_model_params = {}
+        best_value = evaluation.worst_value(metric)
+
+        self.progress.start('candidates', total=len(neighbors_opts) *
+                            len(similarity_opts))
+
+        for similarity in similarity_opts:
+            logger.debug('computing the {} similarities...'
+                         .format(similarity))
+
+            computed = item_knn.similarities(
+                ratings, neighbors=max(neighbors_opts), similarity=similarity,
+                shrinkage=shrinkage)
+
+            for neighbors in neighbors_opts:
+                self.progress.advance(0, current={'similarity': similarity,
+                                                  'neighbors': neighbors})
+
+                current_model = item_knn.SimilarityModel.from_ratings(
+                    user_ids, item_ids, ratings,
+                    item_knn.truncate(computed, neighbors))
+
+                current_metrics = validation.evaluate(current_model)
+
+                logger.debug('validation metrics found for {} neighbors: {}'
+                             .format(neighbors, current_metrics))
+
+                self.progress.advance()
+
+                if evaluation.is_better(metric, current_metrics[metric],
+                                        best_value):
+                    best_value = current_metrics[metric]
+                    best_model = current_model
+                    best_model_params = {'neighbors': neighbors,
+                                         'similarity': similarity,
+                                         'shrinkage': shrinkage,
+                                         'metric': metric}
+
+        if best_model is None:
+            raise ValueError('no candidate model could be evaluated on {}.'
+                             .format(metric))
+
+        self.progress.start('testing')
+        test_metrics = test.evaluate(best_model)
+        best_model_params['metrics'] = test_metrics
+        logger.debug('metrics on the test data: {}'.format(test_metrics))
+
+        self.progress.finish()
+
+        self.model = best_model
+        self.model_params = best_model_params
+        logger.info(
+            'model trained and ready. params are: {}'.format(self.model_params))
+
+        return self.model_params
+
+    def retrain_with_updated_data(self) -> None:
+        """ Implements the retrain method as defined in `RecommendationEngine`.
+
+        The similarities are computed again over all the ratings, with the
+        chosen params.
+
+        """
+        assert self.ready()
+
+        logger.info('starting training of the current model...')
+
+        self.progress.start('loading')
+        user_ids, item_ids, ratings = implicit_als.ratings_matrix(
+            self.warehouse.read_rows(self.warehouse.ratings_files()))
+
+        self.progress.start('training')
+        self.model = item_knn.SimilarityModel.from_ratings(
+            user_ids, item_ids, ratings, item_knn.similarities(
+                ratings, neighbors=self.model_params['neighbors'],
+                similarity=self.model_params['similarity'],
+                shrinkage=self.model_params['shrinkage']))
+
+        self.progress.finish()
+
+        logger.info('model trained successfully on {} ratings.'.format(
+            ratings.nnz))
+
+    @staticmethod
+    def _load_model(path: str) -> item_knn.SimilarityModel:
+        """ instantiates a model object from a file path. """
+        file = '{}/{}'.format(path, 'similarities.npz')
+
+        if not os.path.exists(file):
+            logger.warning('no model found at path {}'.format(path))
+            return None
+
+        return item_knn.SimilarityModel.load(file)
+
+    @staticmethod
+    def _persist_model(path: str, model: item_knn.SimilarityModel) -> None:
+        """ serializes the model object to a path on disk. """
+        model.save('{}/{}'.format(path, 'similarities.npz'))
+
+
+""" The engines which can be exported, by the name of their class. """
+ENGINES = {engine.__name__: engine for engine in (
+    ALSRecommendationEngine, ImplicitALSEngine, OutOfCoreALSEngine,
+    ItemKNNEngine)}
+
+
+def engine_class(path: str) -> type:
+    """ The class of the engine exported to a path, or of the new engines
+    if none was, see `config.ENGINE`.
+
+    The class is recorded in the params of the export. The exports which
+    predate that are `ALSRecommendationEngine` ones.
+
+    """
+    path = ModelStore(path).current()
+
+    if not os.path.exists('{}/{}'.format(path, 'params.json')):
+        return ENGINES[config.ENGINE]
+
+    params = FactorEngine._load_params(path)
+
+    return ENGINES[params.get('engine', ALSRecommendationEngine.__name__)]
+
+
+def import_engine(path: str) -> FactorEngine:
+    """ Imports the engine exported to a path, whatever its class, see
+    `engine_class`.
+
+    """
+    # the version is resolved once, as in `FactorEngine.import_from_path`.
+    path = ModelStore(path).current()
+
+    return engine_class(path).import_from_path(path)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import logging
+import math
+
+import numpy as np
+from scipy import sparse
+
+from core import config
+from core.scoring import FactorModel, indicator, top_k
+from core.warehouse import FileWarehouse
+
+logger = logging.getLogger(__name__)
+
+""" Offline evaluation of factorization models against held-out ratings.
+
+All users are evaluated at once: the held-out ratings are kept in a sparse
+user x item matrix, and users are scored in batches with one matrix product
+each, followed by an `argpartition` based top-K. No spark jobs are involved,
+so evaluating a candidate model takes seconds.
+"""
+
+""" The metrics supported by `Evaluator.evaluate`, and whether a lower value
+is better for each. """
+METRICS = {
+    'rmse': True,
+    'precision_at_k': False,
+    'recall_at_k': False,
+    'ndcg_at_k': False,
+    'coverage': False,
+}
+
+
+def is_better(metric: str, value: float, best: float,
+              tolerance: float = 0.0) -> bool:
+    """ compares two values of a metric, and tells if `value` is better than
+    `best`, by more than `tolerance` times `best`. NaN values are never
+    better.
+
+    """
+    if math.isnan(value):
+        return False
+
+    if math.isnan(best):
+        return True
+
+    margin = 0.0 if math.isinf(best) else tolerance * abs(best)
+
+    return value < best - margin if METRICS[metric] else \
+        value > best + margin
+
+
+def worst_value(metric: str) -> float:
+    """ returns a value which any valid value of the metric will beat. """
+    return float('inf') if METRICS[metric] else float('-inf')
+
+
+class Evaluator(object):
+    """ Computes the quality metrics of a model on a held-out data set.
+
+    Metrics:
+        rmse: root-mean-squared error of the predicted ratings, over the
+        held-out ratings of users and items known to the model.
+
+        precision_at_k, recall_at_k, ndcg_at_k: the top-K ranking metrics,
+        averaged over the users with at least one relevant held-out item. An
+        item is relevant if its held-out rating is at least
+        `relevance_threshold`.
+
+        coverage: the fraction of the model's items that show up in the top-K
+        of at least one user.
+
+    Attributes:
+        holdout: a list of (user id, item id, rating) triples to evaluate on.
+
+        seen: a list of (user id, item id) pairs which should not be
+        recommended, typically the training data. Can be empty.
+
+        k: the cut-off for the ranking metrics.
+
+        relevance_threshold: the minimum rating of a relevant item.
+
+    """
+
+    def __init__(self, holdout: list, seen: list = (),
+                 k: int = config.EVALUATION_K,
+                 relevance_threshold: float = config.RELEVANCE_THRESHOLD):
+        self.k = k
+        self.relevance_threshold = relevance_threshold
+
+        holdout = np.array(holdout, dtype=np.float64).reshape(-1, 3)
+        self._holdout_users = holdout[:, 0].astype(np.int64)
+        self._holdout_items = holdout[:, 1].astype(np.int64)
+        self._holdout_ratings = holdout[:, 2]
+
+        seen = np.array(seen, dtype=np.int64).reshape(-1, 2)
+        self._seen_users = seen[:, 0]
+        self._seen_items = seen[:, 1]
+
+    @classmethod
+    def from_warehouse_files(cls, holdout_files: list, seen_files: list = (),
+                             users: set = None, **kwargs) -> 'Evaluator':
+        """ Builds an evaluator from ratings files in the warehouse.
+
+        Args:
+            holdout_files: a list of ratings files to evaluate on.
+
+            seen_files: a list of ratings files with items to exclude from
+            the rankings.
+
+            users: only evaluate on these user ids, eg. a sample of them, so
+            that only their ratings are kept in memory. All the users if
+            None.
+
+            **kwargs: passed on to `Evaluator.__init__`.
+
+        """
+        holdout = [(row[config.USER_COL], row[config.PRODUCT_COL],
+                    row[config.RATINGS_COL]) for row in
+                   FileWarehouse.read_rows(holdout_files) if
+                   users is None or row[config.USER_COL] in users]
+
+        seen = [(row[config.USER_COL], row[config.PRODUCT_COL]) for row in
+                FileWarehouse.read_rows(seen_files) if
+                users is None or row[config.USER_COL] in users]
+
+        return cls(holdout=holdout, seen=seen, **kwargs)
+
+    def evaluate(self, model: FactorModel,
+                 batch_size: int = config.GENERATION_BATCH_SIZE) -> dict:
+        """ Computes all the metrics for a model.
+
+        Args:
+            model: the model to evaluate.
+
+            batch_size: the number of users to score with one matrix product.
+
+        Returns:
+            a dict of metric name to value. Metrics which cannot be computed
+            (eg. no held-out rating is known to the model) are NaN.
+
+        """
+        users = model.user_rows(self._holdout_users)
+        items = model.item_rows(self._holdout_items)
+        known = (users >= 0) & (items >= 0)
+
+        metrics = {'rmse': self._rmse(model, users[known], items[known],
+                                      self._holdout_ratings[known])}
+
+        shape = (len(model.user_ids), len(model.item_ids))
+
+        relevant = known & (self._holdout_ratings >= self.relevance_threshold)
+        relevant = indicator(users[relevant], items[relevant], shape)
+
+        seen_users = model.user_rows(self._seen_users)
+        seen_items = model.item_rows(self._seen_items)
+        seen_known = (seen_users >= 0) & (seen_items >= 0)
+        seen = indicator(seen_users[seen_known], seen_items[seen_known], shape)
+
+        metrics.update(self._ranking_metrics(model, relevant, seen,
+                                             batch_size))
+
+        logger.debug('evaluation metrics: {}'.format(metrics))
+
+        return metrics
+
+    @staticmethod
+    def _rmse(model: FactorModel, users: np.ndarray, items: np.ndarray,
+              ratings: np.ndarray) -> float:
+        if not len(ratings):
+            return math.nan
+
+        predictions = model.predict(users, items)
+
+        return float(np.sqrt(np.mean((predictions - ratings) ** 2)))
+
+    def _ranking_metrics(self, model: FactorModel, relevant: sparse.csr_matrix,
+                         seen: sparse.csr_matrix, batch_size: int) -> dict:
+        """ scores all users with relevant items in batches, and accumulates
+        the top-K metrics.
+
+        """
+        users = np.flatnonzero(np.diff(relevant.indptr))
+
+        if not len(users):
+            return {'precision_at_k': math.nan, 'recall_at_k': math.nan,
+                    'ndcg_at_k': math.nan, 'coverage': math.nan}
+
+        k = min(self.k, len(model.item_ids))
+
+        # the discount for each rank, and the ideal DCG for each possible
+        # number of relevant items.
+        discounts = 1.0 / np.log2(np.arange(2, k + 2))
+        ideal = np.concatenate(([0.0], np.cumsum(discounts)))
+
+        precision = recall = ndcg = 0.0
+        recommended = np.zeros(len(model.item_ids), dtype=bool)
+
+        for start in range(0, len(users), batch_size):
+            batch = users[start:start + batch_size]
+
+            scores = model.scores(batch)
+
+            top = top_k(scores, k, exclude=seen[batch])
+
+            # the items a model cannot score for a user (-inf) are not
+            # recommended to them.
+            rows = np.arange(len(batch))[:, None]
+            finite = np.isfinite(scores[rows, top])
+            recommended[top[finite]] = True
+
+            batch_relevant = relevant[batch].toarray()
+            hits = (batch_relevant[rows, top] * finite).astype(np.float64)
+            relevant_count = batch_relevant.sum(axis=1)
+
+            precision += (hits.sum(axis=1) / self.k).sum()
+            recall += (hits.sum(axis=1) / relevant_count).sum()
+            ndcg += (hits.dot(discounts) /
+                     ideal[np.minimum(relevant_count, k)]).sum()
+
+        return {
+            'precision_at_k': float(precision / len(users)),
+            'recall_at_k': float(recall / len(users)),
+            'ndcg_at_k': float(ndcg / len(users)),
+            'coverage': float(recommended.mean()),
+        }
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+import logging
+from typing import Callable, Iterable
+
+import numpy as np
+from scipy import sparse
+
+from core import config, evaluation
+
+logger = logging.getLogger(__name__)
+
+""" Alternating least squares for implicit feedback, in numpy.
+
+With implicit feedback (views, clicks, ...) every user x item pair is a data
+point: the user either showed a preference for the item or not, with a
+confidence growing with the amount of feedback. See Hu, Koren and Volinsky,
+"Collaborative Filtering for Implicit Feedback Datasets".
+
+Solving the least squares problem of each user exactly means building and
+factorizing a rank x rank matrix per user. Here the solves are replaced by a
+few steps of conjugate gradient, warm started from the previous factors, and
+run for a block of users at once: every step is a couple of sparse and dense
+matrix products over the factors of the block. The `Y^T Y` Gram matrix, shared
+by all the users, is computed once per sweep.
+"""
+
+
+def _linear(ratings: np.ndarray, alpha: float, epsilon: float) -> np.ndarray:
+    return 1.0 + alpha * ratings
+
+
+def _log(ratings: np.ndarray, alpha: float, epsilon: float) -> np.ndarray:
+    return 1.0 + alpha * np.log1p(ratings / epsilon)
+
+
+""" The supported rating to confidence transforms, by name. """
+CONFIDENCE_TRANSFORMS = {
+    'linear': _linear,
+    'log': _log,
+}
+
+""" The supported solvers of the per user (and item) least squares. """
+SOLVERS = ('cg', 'exact')
+
+
+def confidence(ratings: np.ndarray, transform: str = config.IMPLICIT_CONFIDENCE,
+               alpha: float = config.IMPLICIT_ALPHA,
+               epsilon: float = config.IMPLICIT_EPSILON) -> np.ndarray:
+    """ Turns the ratings (eg. view counts) of observed pairs into
+    confidences, all at least 1.
+
+    Args:
+        ratings: an array of non-negative ratings.
+
+        transform: the name of a transform in `CONFIDENCE_TRANSFORMS`. The
+        confidence of a rating r is `1 + alpha * r` when linear, and
+        `1 + alpha * log(1 + r / epsilon)` when log.
+
+    """
+    if transform not in CONFIDENCE_TRANSFORMS:
+        raise ValueError('unknown confidence transform: {}. Should be one of '
+                         '{}'.format(transform, sorted(CONFIDENCE_TRANSFORMS)))
+
+    return CONFIDENCE_TRANSFORMS[transform](
+        np.asarray(ratings, dtype=np.float64), alpha, epsilon)
+
+
+def ratings_matrix(rows: Iterable[dict]) -> tuple:
+    """ Builds a sparse user x item matrix from warehouse ratings rows. The
+    ratings of repeated pairs add up.
+
+    Returns:
+        a tuple of the user ids, the item ids, and a csr matrix of the
+        ratings with a row per user id and a column per item id.
+
+    """
+    triples = np.array([(row[config.USER_COL], row[config.PRODUCT_COL],
+                         row[config.RATINGS_COL]) for row in rows],
+                       dtype=np.float64).reshape(-1, 3)
+
+    user_ids, users = np.unique(triples[:, 0].astype(np.int64),
+                                return_inverse=True)
+    item_ids, items = np.unique(triples[:, 1].astype(np.int64),
+                                return_inverse=True)
+
+    matrix = sparse.csr_matrix((triples[:, 2], (users, items)),
+                               shape=(len(user_ids), len(item_ids)))
+    matrix.sum_duplicates()
+
+    return user_ids, item_ids, matrix
+
+
+def gram(other: np.ndarray, reg_param: float) -> np.ndarray:
+    """ the regularized `Y^T Y + reg_param I` Gram matrix of the factors held
+    fixed in a sweep, shared by all the rows.
+
+    """
+    return other.T.dot(other) + reg_param * np.eye(other.shape[1])
+
+
+def cg_sweep(confidences: sparse.csr_matrix, factors: np.ndarray,
+             other: np.ndarray, reg_param: float,
+             steps: int = config.IMPLICIT_CG_STEPS,
+             block_size: int = config.IMPLICIT_BLOCK_SIZE,
+             gram_matrix: np.ndarray = None) -> np.ndarray:
+    """ Updates the factors of all the rows of the confidence matrix, with a
+    few steps of conjugate gradient from their current values.
+
+    Solves `(Y^T C_u Y + reg_param I) x_u = Y^T C_u p_u` for every row u, with
+    Y the `other` factors, C_u the confidences of the row (1 for unobserved
+    pairs) and p_u its preferences (1 for observed pairs, 0 otherwise).
+
+    Args:
+        confidences: a csr matrix of the confidences of the observed pairs.
+
+        factors: the current factors, one row per row of the matrix.
+
+        other: the factors of the columns of the matrix, held fixed.
+
+        steps: the number of conjugate gradient steps.
+
+        block_size: the number of rows solved together. The factors of the
+        observed columns of a block are gathered once, and reused by all the
+        steps.
+
+        gram_matrix: the `gram` of the other factors, when the rows are
+        swept in several parts. Computed if None.
+
+    Returns:
+        the new factors.
+
+    """
+    if gram_matrix is None:
+        gram_matrix = gram(other, reg_param)
+
+    x = np.empty_like(factors, dtype=np.float64)
+
+    for start in range(0, confidences.shape[0], block_size):
+        end = start + block_size
+
+        x[start:end] = _cg_block(confidences[start:end], factors[start:end],
+                                 other, gram_matrix, steps)
+
+    return x
+
+
+def _cg_block(confidences: sparse.csr_matrix, factors: np.ndarray,
+              other: np.ndarray, gram: np.ndarray, steps: int) -> np.ndarray:
+    """ the conjugate gradient steps of a block of rows, see `cg_sweep`. """
+    rows = np.repeat(np.arange(confidences.shape[0]),
+                     np.diff(confidences.indptr))
+    observed = other[confidences.indices]
+    extra = confidences.data - 1.0
+
+    def product(vectors: np.ndarray) -> np.ndarray:
+        """ (Y^T C_u Y + reg_param I) v_u, for all the rows at once. """
+        weights = extra * np.einsum('ij,ij->i', observed, vectors[rows])
+
+        weighted = sparse.csr_matrix(
+            (weights, confidences.indices, confidences.indptr),
+            shape=confidences.shape)
+
+        return vectors.dot(gram) + weighted.dot(other)
+
+    x = np.array(factors, dtype=np.float64)
+    residual = confidences.dot(other) - product(x)
+    direction = residual.copy()
+    residual_norm = np.einsum('ij,ij->i', residual, residual)
+
+    for _ in range(steps):
+        step = product(direction)
+
+        curvature = np.einsum('ij,ij->i', direction, step)
+        alpha = np.divide(residual_norm, curvature,
+                          out=np.zeros_like(residual_norm),
+                          where=curvature > 0)
+
+        x += alpha[:, None] * direction
+        residual -= alpha[:, None] * step
+
+        new_norm = np.einsum('ij,ij->i', residual, residual)
+        beta = np.divide(new_norm, residual_norm,
+                         out=np.zeros_like(new_norm),
+                         where=residual_norm > 0)
+
+        direction = residual + beta[:, None] * direction
+        residual_norm = new_norm
+
+    return x
+
+
+def exact_sweep(confidences: sparse.csr_matrix, factors: np.ndarray,
+                other: np.ndarray, reg_param: float) -> np.ndarray:
+    """ Solves the same problem as `cg_sweep` exactly, one row at a time. The
+    current factors are not used, and only there to match `cg_sweep`.
+
+    """
+    gram_matrix = gram(other, reg_param)
+
+    x = np.empty((confidences.shape[0], other.shape[1]))
+
+    for row in range(confidences.shape[0]):
+        start, end = confidences.indptr[row], confidences.indptr[row + 1]
+
+        observed = other[confidences.indices[start:end]]
+        weights = confidences.data[start:end]
+
+        x[row] = np.linalg.solve(
+            gram_matrix + (observed.T * (weights - 1.0)).dot(observed),
+            observed.T.dot(weights))
+
+    return x
+
+
+def fit(confidences: sparse.csr_matrix, rank: int, reg_param: float,
+        max_iter: int, solver: str = 'cg',
+        cg_steps: int = config.IMPLICIT_CG_STEPS,
+        user_factors: np.ndarray = None, item_factors: np.ndarray = None,
+        seed: int = 0, callback: Callable = None) -> tuple:
+    """ Factorizes a user x item confidence matrix.
+
+    Args:
+        confidences: a csr matrix of the confidences of the observed pairs,
+        see `confidence`.
+
+        rank: the number of factors.
+
+        reg_param: the regularization of the factors.
+
+        max_iter: the number of sweeps over the users and the items.
+
+        solver: one of `SOLVERS`.
+
+        cg_steps: the conjugate gradient steps per sweep, for the 'cg' solver.
+
+        user_factors, item_factors: the factors to start from, eg. of a
+        previous model. Small random values if None.
+
+        seed: the seed of the random starting factors.
+
+        callback: called after every sweep with the number of sweeps done,
+        the user factors and the item factors. The sweeps stop early when it
+        returns True.
+
+    Returns:
+        a tuple of the user factors and the item factors.
+
+    """
+    if solver not in SOLVERS:
+        raise ValueError('unknown solver: {}. Should be one of {}'.format(
+            solver, SOLVERS))
+
+    random = np.random.RandomState(seed)
+
+    if user_factors is None:
+        user_factors = random.normal(scale=0.01,
+                                     size=(confidences.shape[0], rank))
+
+    if item_factors is None:
+        item_factors = random.normal(scale=0.01,
+                                     size=(confidences.shape[1], rank))
+
+    user_factors = np.asarray(user_factors, dtype=np.float64)
+    item_factors = np.asarray(item_factors, dtype=np.float64)
+
+    transposed = confidences.T.tocsr()
+
+    for iteration in range(max_iter):
+        if solver == 'cg':
+            user_factors = cg_sweep(confidences, user_factors, item_factors,
+                                    reg_param, cg_steps)
+            item_factors = cg_sweep(transposed, item_factors, user_factors,
+                                    reg_param, cg_steps)
+        else:
+            user_factors = exact_sweep(confidences, user_factors,
+                                       item_factors, reg_param)
+            item_factors = exact_sweep(transposed, item_factors,
+                                       user_factors, reg_param)
+
+        logger.debug('finished sweep {} of {}'.format(iteration + 1,
+                                                      max_iter))
+
+        if callback is not None and \
+                callback(iteration + 1, user_factors, item_factors):
+            break
+
+    return user_factors, item_factors
+
+
+class EarlyStopping(object):
+    """ A `fit` callback which stops the sweeps once they stop paying off:
+    when the training loss improves by less than `tolerance` times its
+    previous value, or the validation metric gets no better. Keeps the
+    factors of the best sweep.
+
+    Attributes:
+        loss: computes the training loss of the user and item factors.
+
+        tolerance: the relative improvement of the loss worth another sweep.
+
+        validate: computes the validation metrics of the user and item
+        factors, as a dict. Only the loss is watched if None.
+
+        metric: the validation metric watched, see `core.evaluation`.
+
+        sweeps: the number of sweeps of the best factors.
+
+        user_factors, item_factors: the best factors.
+
+        metrics: the validation metrics of the best factors.
+
+        losses: the training loss after every sweep.
+
+    """
+
+    def __init__(self, loss: Callable,
+                 tolerance: float = config.ALS_TOLERANCE,
+                 validate: Callable = None, metric: str = None):
+        self.loss = loss
+        self.tolerance = tolerance
+        self.validate = validate
+        self.metric = metric
+
+        self.sweeps = 0
+        self.user_factors = self.item_factors = None
+        self.metrics = None
+        self.losses = []
+
+    def __call__(self, sweeps: int, user_factors: np.ndarray,
+                 item_factors: np.ndarray) -> bool:
+        loss = self.loss(user_factors, item_factors)
+
+        converged = bool(self.losses) and \
+            self.losses[-1] - loss < self.tolerance * abs(self.losses[-1])
+
+        self.losses.append(loss)
+
+        metrics = None
+
+        if self.validate is not None:
+            metrics = self.validate(user_factors, item_factors)
+
+            if self.metrics is not None and not evaluation.is_better(
+                    self.metric, metrics[self.metric],
+                    self.metrics[self.metric]):
+                logger.debug('{} stopped improving after {} sweeps'.format(
+                    self.metric, self.sweeps))
+                return True
+
+        self.sweeps = sweeps
+        self.user_factors, self.item_factors = user_factors, item_factors
+        self.metrics = metrics
+
+        if converged:
+            logger.debug('loss converged after {} sweeps'.format(sweeps))
+
+        return converged
+
+
+def loss(confidences: sparse.csr_matrix, user_factors: np.ndarray,
+         item_factors: np.ndarray, reg_param: float) -> float:
+    """ The implicit ALS objective, over all the user x item pairs. The
+    prediction matrix is never built, so it costs about as much as a sweep.
+
+    """
+    # every pair contributes (0 - prediction)^2, whose sum over the whole
+    # X Y^T is the sum of (X^T X) * (Y^T Y).
+    total = np.sum(user_factors.T.dot(user_factors) *
+                   item_factors.T.dot(item_factors))
+
+    total += observed_loss(confidences, user_factors, item_factors)
+
+    return float(total + reg_param * (np.sum(user_factors ** 2) +
+                                      np.sum(item_factors ** 2)))
+
+
+def observed_loss(confidences: sparse.csr_matrix, user_factors: np.ndarray,
+                  item_factors: np.ndarray) -> float:
+    """ the correction of the observed pairs to the `loss`, from
+    prediction^2 to c * (1 - prediction)^2.
+
+    Args:
+        user_factors: the factors of the rows of the confidence matrix.
+
+    """
+    observed = confidences.tocoo()
+
+    predictions = np.einsum('ij,ij->i', user_factors[observed.row],
+                            item_factors[observed.col])
+
+    return float(np.sum(observed.data * (1.0 - predictions) ** 2 -
+                        predictions ** 2))
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import numpy as np
+from scipy import sparse
+
+from core import config
+from core.scoring import FactorModel, indicator, positions, top_k
+
+logger = logging.getLogger(__name__)
+
+""" Item-based k-nearest-neighbors, over sparse matrices.
+
+The similarity of two items is computed from the users who rated both of
+them, with the cosine of their rating columns, or the Pearson correlation
+(the cosine of the columns centered on the mean rating of each item) shrunk
+towards 0 when few users rated both. Each item only keeps its `neighbors` most
+similar items, so the item x item similarities stay sparse.
+
+The items x items product behind the similarities is never held whole: it is
+computed a block of items at a time, and each block is cut down to the top
+neighbors of its items before the next one. A user is then scored, for every
+item, with the sum of the similarities of the item to the items the user
+rated: a sparse product of the user x item ratings indicator with the
+similarities. No factors are fitted, so building a model is a couple of
+sparse products, and the latest ratings of a user count at once.
+"""
+
+""" The supported similarities of two items. """
+SIMILARITIES = ('cosine', 'pearson')
+
+
+def similarities(ratings: sparse.csr_matrix,
+                 neighbors: int = config.ITEM_KNN_NEIGHBORS,
+                 similarity: str = config.ITEM_KNN_SIMILARITY,
+                 shrinkage: float = config.ITEM_KNN_SHRINKAGE,
+                 block_size: int = config.ITEM_KNN_BLOCK_SIZE
+                 ) -> sparse.csr_matrix:
+    """ Computes the top neighbors of every item.
+
+    Args:
+        ratings: a user x item matrix of the ratings, eg. from
+        `core.implicit_als.ratings_matrix`.
+
+        neighbors: the number of most similar items kept per item.
+
+        similarity: one of `SIMILARITIES`. The pearson similarities are
+        multiplied by `n / (n + shrinkage)`, n the users who rated both items.
+
+        block_size: the number of items whose similarities are computed with
+        one sparse product.
+
+    Returns:
+        a csr item x item matrix, whose column j holds the similarities of the
+        neighbors of item j. Only the positive similarities are kept, and an
+        item is never its own neighbor.
+
+    """
+    if similarity not in SIMILARITIES:
+        raise ValueError('unknown similarity: {}. Should be one of {}'
+                         .format(similarity, SIMILARITIES))
+
+    ratings = sparse.csc_matrix(ratings, dtype=np.float64)
+    ratings.sum_duplicates()
+
+    raters = None
+
+    if similarity == 'pearson':
+        counts = np.diff(ratings.indptr)
+        means = np.asarray(ratings.sum(axis=0)).ravel() / \
+            np.maximum(counts, 1)
+
+        ratings = ratings.copy()
+        ratings.data -= np.repeat(means, counts)
+
+        raters = ratings.copy()
+        raters.data[:] = 1
+
+    norms = np.sqrt(np.asarray(ratings.multiply(ratings).sum(axis=0)).ravel())
+    inverse_norms = np.divide(1.0, norms, out=np.zeros_like(norms),
+                              where=norms > 0)
+
+    normalized = ratings.dot(sparse.diags(inverse_norms)).tocsc()
+    transposed = normalized.T.tocsr()
+
+    items = ratings.shape[1]
+    rows, cols, values = [], [], []
+
+    for start in range(0, items, block_size):
+        end = min(start + block_size, items)
+
+        block = transposed.dot(normalized[:, start:end])
+
+        if raters is not None:
+            common = raters.T.dot(raters[:, start:end])
+            common.data = common.data / (common.data + shrinkage)
+            block = block.multiply(common)
+
+        block_rows, block_cols, block_values = _top(
+            sparse.csc_matrix(block), neighbors, offset=start)
+
+        rows.append(block_rows)
+        cols.append(block_cols)
+        values.append(block_values)
+
+        logger.debug('computed the neighbors of items {} to {}'
+                     .format(start, end))
+
+    return sparse.csr_matrix(
+        (np.concatenate(values or [[]]).astype(np.float32),
+         (np.concatenate(rows or [[]]).astype(np.int64),
+          np.concatenate(cols or [[]]).astype(np.int64))),
+        shape=(items, items))
+
+
+def truncate(similarities: sparse.csr_matrix,
+             neighbors: int) -> sparse.csr_matrix:
+    """ Keeps the top `neighbors` of every item of computed similarities,
+    eg. to try out fewer neighbors without computing them again.
+
+    """
+    rows, cols, values = _top(sparse.csc_matrix(similarities), neighbors)
+
+    return sparse.csr_matrix((values, (rows, cols)),
+                             shape=similarities.shape)
+
+
+def _top(block: sparse.csc_matrix, neighbors: int, offset: int = 0) -> tuple:
+    """ the positive entries of the top `neighbors` rows of each column of a
+    block, leaving out the diagonal.
+
+    Args:
+        offset: the item of the first column of the block.
+
+    Returns:
+        a tuple of the rows, the columns (with the offset) and the values of
+        the entries.
+
+    """
+    rows, cols, values = [], [], []
+
+    for col in range(block.shape[1]):
+        start, end = block.indptr[col], block.indptr[col + 1]
+
+        col_rows = block.indices[start:end]
+        col_values = block.data[start:end]
+
+        keep = (col_values > 0) & (col_rows != col + offset)
+        col_rows = col_rows[keep]
+        col_values = col_values[keep]
+
+        if len(col_values) > neighbors:
+            top = np.argpartition(-col_values, neighbors - 1)[:neighbors]
+            col_rows = col_rows[top]
+            col_values = col_values[top]
+
+        rows.append(col_rows)
+        cols.append(np.full(len(col_rows), col + offset, dtype=np.int64))
+        values.append(col_values)
+
+    if not rows:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                np.empty(0))
+
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+
+
+class SimilarityModel(FactorModel):
+    """ A read-only, in-memory snapshot of an item-kNN model.
+
+    The score of a user for an item is the sum of the similarities of the
+    item to the items the user rated. Items similar to none of them are not
+    recommended (their score is -inf). The model plays the part of a
+    `FactorModel`, with the ratings indicator as user "factors" and the
+    similarities as item "factors".
+
+    Attributes:
+        user_ids: a 1-d array of the user ids known to the model.
+
+        profiles: a csr 0/1 matrix of the items each user rated, one row per
+        user id and one column per neighbor id.
+
+        neighbor_ids: a 1-d array of the ids of the items the users rated,
+        which the candidate items are scored by.
+
+        item_ids: a 1-d array of the candidate item (product) ids.
+
+        similarities: a csr matrix of the similarities of the neighbors (one
+        row per neighbor id) to the candidates (one column per item id).
+
+    """
+
+    def __init__(self, user_ids, profiles, neighbor_ids, item_ids,
+                 similarities):
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.profiles = sparse.csr_matrix(profiles, dtype=np.float32)
+        self.neighbor_ids = np.asarray(neighbor_ids, dtype=np.int64)
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)
+        self.similarities = sparse.csr_matrix(similarities, dtype=np.float32)
+
+        self._user_index = {int(user_id): row for row, user_id in
+                            enumerate(self.user_ids)}
+
+    @classmethod
+    def from_ratings(cls, user_ids, item_ids, ratings: sparse.csr_matrix,
+                     similarities: sparse.csr_matrix) -> 'SimilarityModel':
+        """ Builds a model from the ratings matrix its similarities were
+        computed from, see `similarities`.
+
+        """
+        rows, cols = ratings.nonzero()
+
+        return cls(user_ids=user_ids,
+                   profiles=indicator(rows, cols, ratings.shape),
+                   neighbor_ids=item_ids, item_ids=item_ids,
+                   similarities=similarities)
+
+    def save(self, file: str) -> None:
+        """ Saves the model to a `.npz` file. """
+        np.savez(file, user_ids=self.user_ids,
+                 neighbor_ids=self.neighbor_ids, item_ids=self.item_ids,
+                 profile_indptr=self.profiles.indptr,
+                 profile_indices=self.profiles.indices,
+                 similarity_indptr=self.similarities.indptr,
+                 similarity_indices=self.similarities.indices,
+                 similarity_data=self.similarities.data)
+
+    @classmethod
+    def load(cls, file: str) -> 'SimilarityModel':
+        """ Loads a model saved by `save`. """
+        with np.load(file) as arrays:
+            user_ids = arrays['user_ids']
+            neighbor_ids = arrays['neighbor_ids']
+            item_ids = arrays['item_ids']
+
+            profile_indices = arrays['profile_indices']
+
+            profiles = sparse.csr_matrix(
+                (np.ones(len(profile_indices), dtype=np.float32),
+                 profile_indices, arrays['profile_indptr']),
+                shape=(len(user_ids), len(neighbor_ids)))
+
+            similarities = sparse.csr_matrix(
+                (arrays['similarity_data'], arrays['similarity_indices'],
+                 arrays['similarity_indptr']),
+                shape=(len(neighbor_ids), len(item_ids)))
+
+        return cls(user_ids=user_ids, profiles=profiles,
+                   neighbor_ids=neighbor_ids, item_ids=item_ids,
+                   similarities=similarities)
+
+    def restrict_items(self, item_ids) -> 'SimilarityModel':
+        """ Narrows down the candidate items to the given ids. The users are
+        still scored by all the items they rated.
+
+        Returns:
+            a new `SimilarityModel` sharing the profiles of this one.
+
+        """
+        keep = np.flatnonzero(np.isin(
+            self.item_ids, np.fromiter(item_ids, dtype=np.int64)))
+
+        return SimilarityModel(user_ids=self.user_ids, profiles=self.profiles,
+                               neighbor_ids=self.neighbor_ids,
+                               item_ids=self.item_ids[keep],
+                               similarities=self.similarities[:, keep])
+
+    def scores(self, user_rows: np.ndarray) -> np.ndarray:
+        """ the scores of all the items, for the users at the given rows, as
+        a users x items array.
+
+        """
+        return self._score(self.profiles[user_rows])
+
+    def predict(self, user_rows: np.ndarray,
+                item_rows: np.ndarray) -> np.ndarray:
+        """ the scores of pairs of a user row and an item row, 0 when the item
+        is similar to none of the user's items.
+
+        """
+        return np.asarray(self.profiles[user_rows].multiply(
+            self.similarities.T.tocsr()[item_rows]).sum(axis=1)).ravel()
+
+    def recommend(self, user_ids: list, count: int,
+                  batch_size: int = config.GENERATION_BATCH_SIZE,
+                  seen: list = ()) -> list:
+        """ Same as `FactorModel.recommend`, except that the users are scored
+        by the items they rated at training and the `seen` ones. So the
+        ratings since the training count, and the users unknown to the model
+        get recommendations too if they have seen items.
+
+        """
+        profiles = self._profiles(user_ids, seen)
+
+        recommendations = [[] for _ in user_ids]
+
+        scored = np.flatnonzero(np.diff(profiles.indptr))
+
+        seen = self._seen_matrix(user_ids, seen)
+
+        for start in range(0, len(scored), batch_size):
+            batch = scored[start:start + batch_size]
+
+            scores = self._score(profiles[batch])
+
+            top = top_k(scores, count, exclude=seen[batch])
+
+            for row, (position, item_rows) in enumerate(zip(batch, top)):
+                item_rows = item_rows[np.isfinite(scores[row, item_rows])]
+
+                recommendations[position] = \
+                    self.item_ids[item_rows].tolist()
+
+        return recommendations
+
+    def _score(self, profiles: sparse.csr_matrix) -> np.ndarray:
+        """ the scores of users with the given profiles, -inf for the items
+        similar to none of their items.
+
+        """
+        scores = profiles.dot(self.similarities).toarray()
+        scores[scores <= 0] = -np.inf
+
+        return scores
+
+    def _profiles(self, user_ids: list, seen: list) -> sparse.csr_matrix:
+        """ the profiles of the given users, with a row per user id (in the
+        given order), adding up their training profile and their seen items.
+
+        """
+        rows = self.user_rows(user_ids)
+        known = np.flatnonzero(rows >= 0)
+
+        stored = self.profiles[rows[known]].tocoo()
+
+        pairs = np.array(seen, dtype=np.int64).reshape(-1, 2)
+
+        user_positions = {int(user_id): position for position, user_id in
+                          enumerate(user_ids)}
+
+        users = np.array([user_positions.get(user_id, -1) for user_id in
+                          pairs[:, 0].tolist()], dtype=np.int64)
+        items = positions(self.neighbor_ids, pairs[:, 1])
+
+        pairs_known = (users >= 0) & (items >= 0)
+
+        return indicator(
+            np.concatenate([known[stored.row], users[pairs_known]]),
+            np.concatenate([stored.col, items[pairs_known]]),
+            (len(user_ids), len(self.neighbor_ids)))
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import datetime
+import fcntl
+import logging
+import os
+import uuid
+
+from core import config, utils
+
+logger = logging.getLogger(__name__)
+
+""" Versioned storage of the exported engines.
+
+Every export goes to a directory of its own, and only becomes the current
+engine once it is completely written, when a symlink is switched over to it.
+Readers resolve the symlink once and read from the version it points to, so
+they never see a partially written engine, and never wait on a writer.
+
+Several writers can export at once, eg. a retrain and a scheduled job. A
+version only replaces a newer one on a rollback, so the export which started
+last wins, whichever finishes last. The writers take turns on a lock file to
+promote and prune.
+
+The online updates of an engine are exported as checkpoints, every few
+minutes, see `core.online_learning`. Those are promoted like any version, but
+never rolled back to, nor kept once replaced, so they do not push the batch
+versions out.
+"""
+
+""" The format of the creation time at the start of the version names. """
+_VERSION_TIME = '%Y%m%dT%H%M%S%f'
+
+
+class ModelStore(object):
+    """ The exported versions of an engine, under a root directory.
+
+    The layout of the root directory is
+
+        versions/<version>/    one directory per export, named so that the
+                               names sort in the order of the exports.
+                               Holds a `promoted` file once promoted,
+                               and a `checkpoint` file if a checkpoint.
+        current                a symlink to the promoted version.
+        lock                   the lock of the writers.
+
+    A root without the `current` symlink, but with an engine exported straight
+    into it, is read as is.
+
+    Attributes:
+        root: the root directory of the engine.
+
+        keep: the number of promoted versions to keep, including the current
+        one. The older ones are removed by `prune`. The checkpoints other
+        than the current version are not counted, and removed.
+
+        stale_age: the seconds after which a version never promoted is taken
+        for a failed export, and removed by `prune`.
+
+    """
+
+    def __init__(self, root: str, keep: int = config.MODEL_VERSIONS_KEPT,
+                 stale_age: float = config.MODEL_STALE_VERSION_AGE):
+        self.root = root
+
+        self.keep = keep
+
+        self.stale_age = stale_age
+
+        self.versions_dir = '{}/versions'.format(root)
+
+        self.current_link = '{}/current'.format(root)
+
+    def new_version(self) -> str:
+        """ Creates an empty directory for a new version.
+
+        Returns:
+            the name of the version. Its directory is `path(version)`.
+
+        """
+        version = '{}-{}'.format(
+            datetime.datetime.utcnow().strftime(_VERSION_TIME),
+            uuid.uuid4().hex[:8])
+
+        utils.create_directory(self.path(version))
+
+        return version
+
+    def path(self, version: str) -> str:
+        return '{}/{}'.format(self.versions_dir, version)
+
+    def versions(self) -> list:
+        """ the names of all the versions, oldest first. """
+        if not os.path.exists(self.versions_dir):
+            return []
+
+        return sorted(os.listdir(self.versions_dir))
+
+    def current_version(self) -> str:
+        """ the name of the current version, None if none was promoted. """
+        if not os.path.islink(self.current_link):
+            return None
+
+        return os.path.basename(os.readlink(self.current_link))
+
+    def current(self) -> str:
+        """ Resolves the directory of the current version. A reader should
+        call it once, and read all the files of the engine from the returned
+        directory.
+
+        Returns:
+            the directory of the current version, or the root if no version
+            was promoted yet.
+
+        """
+        version = self.current_version()
+
+        return self.root if version is None else self.path(version)
+
+    def promote(self, version: str, checkpoint: bool = False) -> bool:
+        """ Makes a version the current one, atomically, unless the current
+        one is newer.
+
+        Args:
+            checkpoint: whether the version is a checkpoint.
+
+        Returns:
+            whether the version was promoted.
+
+        """
+        if checkpoint:
+            with open('{}/checkpoint'.format(self.path(version)), 'w'):
+                pass
+
+        with self._locked():
+            current = self.current_version()
+
+            if current is not None and version < current:
+                logger.warning('version {} in {} is older than the current '
+                               'one {}, not promoting it'.format(
+                                   version, self.root, current))
+                return False
+
+            self._switch(version)
+
+        return True
+
+    def _switch(self, version: str) -> None:
+        """ points the current link to a version. Called with the lock held.
+        """
+        # along with the versions promoted before the promotions were
+        # recorded, see `promoted_versions`.
+        for promoted in self.promoted_versions() + [version]:
+            self._record(promoted)
+
+        temporary_link = '{}.{}'.format(self.current_link, uuid.uuid4().hex)
+
+        os.symlink(os.path.relpath(self.path(version), self.root),
+                   temporary_link)
+
+        os.replace(temporary_link, self.current_link)
+
+        logger.info('promoted version {} in {}'.format(version, self.root))
+
+    def _recorded(self, version: str) -> bool:
+        return os.path.exists('{}/promoted'.format(self.path(version)))
+
+    def _record(self, version: str) -> None:
+        with open('{}/promoted'.format(self.path(version)), 'w'):
+            pass
+
+    def is_checkpoint(self, version: str) -> bool:
+        return os.path.exists('{}/checkpoint'.format(self.path(version)))
+
+    def promoted_versions(self) -> list:
+        """ the names of the versions which were promoted, oldest first. If
+        none was recorded, the ones up to the current version.
+
+        """
+        current = self.current_version()
+        recorded = [version for version in self.versions() if
+                    self._recorded(version)]
+
+        if not recorded:
+            return [version for version in self.versions() if
+                    current is not None and version <= current]
+
+        return sorted(set(recorded) | {current} - {None})
+
+    def rollback(self) -> str:
+        """ Promotes the version promoted before the current one, other
+        than a checkpoint.
+
+        Returns:
+            the name of the version promoted.
+
+        Raises:
+            ValueError: if there is no older version to roll back to.
+
+        """
+        with self._locked():
+            older = [version for version in self.promoted_versions() if
+                     version < (self.current_version() or '') and
+                     not self.is_checkpoint(version)]
+
+            if not older:
+                raise ValueError('no version to roll back to in {}'.format(
+                    self.root))
+
+            self._switch(older[-1])
+
+        return older[-1]
+
+    def prune(self) -> list:
+        """ Removes the versions older than the last `keep` promoted ones,
+        the checkpoints older than the current version, and the versions
+        never promoted for `stale_age` seconds.
+
+        The other versions newer than the current one are never removed, as
+        they may be exports in progress.
+
+        Returns:
+            the names of the versions removed.
+
+        """
+        with self._locked():
+            current = self.current_version()
+
+            if current is None:
+                return []
+
+            stale_before = (datetime.datetime.utcnow() - datetime.timedelta(
+                seconds=self.stale_age)).strftime(_VERSION_TIME)
+
+            promoted = self.promoted_versions()
+
+            older = [version for version in promoted if version < current]
+
+            checkpoints = [version for version in older if
+                           self.is_checkpoint(version)]
+
+            older = [version for version in older if
+                     version not in checkpoints]
+
+            removed = checkpoints + \
+                older[:max(len(older) - (self.keep - 1), 0)]
+
+            removed += [version for version in self.versions() if
+                        version < stale_before and version not in promoted]
+
+            for version in removed:
+                utils.delete_directory(self.path(version))
+
+        if removed:
+            logger.info('removed {} old versions from {}'.format(
+                len(removed), self.root))
+
+        return sorted(removed)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """ holds the lock of the writers. """
+        os.makedirs(self.root, exist_ok=True)
+
+        with open('{}/lock'.format(self.root), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 import json
+import time
 from collections import Generator
 
-from server import config
+from redis.exceptions import ResponseError
+
+from core import config, utils
+from core.serialization import RecommendationsCodec, ProductCodec
 from server.extensions import redis_conn
 
 
@@ -15,38 +19,135 @@ The implementation details are hackish, and best left alone.
 class Users(object):
     """ A model that represents the user.
 
+    The registry of users is kept in a redis set per data partition, so
+    membership checks are O(1) and the users can be streamed with `SSCAN`
+    instead of being loaded all at once. A second set tracks the users with
+    new activity (ratings) since the last sync with the warehouse.
+
     Supports the following queries:
     * get a user from id
-    * get all users in the system
-    * get the ratings given by a user
+    * register new users
+    * get all users in the system, or those active since the last sync
+    * get the ratings given by a user (or by many users at once)
     * persist the given ratings for a user
     * get all the products used by a user
-    * get the recommendations for a user
+    * get and set the recommendations for a user (or for many users at once)
+    * set the rendered recommendations of many users, see
+      `set_recommendations_many`
 
     """
     redis = redis_conn
 
+    recommendations_codec = RecommendationsCodec(
+        config.RECOMMENDATIONS_ENCODING)
+
     def __init__(self, id: int, data_partition: str):
         self.id = id
         self.data_partition = data_partition
 
+    @staticmethod
+    def registry_key(data_partition: str) -> str:
+        return '{}_users'.format(data_partition)
+
+    @staticmethod
+    def active_key(data_partition: str) -> str:
+        return '{}_active_users'.format(data_partition)
+
+    @staticmethod
+    def syncing_key(data_partition: str) -> str:
+        return '{}_syncing_users'.format(data_partition)
+
+    @staticmethod
+    def ratings_key(id: int, data_partition: str) -> str:
+        return '{}_ratings_{}'.format(data_partition, id)
+
+    @staticmethod
+    def recommendations_key(id: int, data_partition: str) -> str:
+        return '{}_recommendations_{}'.format(data_partition, id)
+
+    @staticmethod
+    def recommendations_payload_key(id: int, data_partition: str) -> str:
+        return '{}_recommendations_payload_{}'.format(data_partition, id)
+
     @classmethod
     def get(cls, id: int, data_partition: str):
-        if id in config.ALLOWED_USER_IDS:
+        if cls.redis.sismember(cls.registry_key(data_partition), id):
             return cls(id=id, data_partition=data_partition)
         else:
             raise KeyError("user with id: {} does not exist.".format(id))
 
     @classmethod
-    def get_all(cls, data_partition: str) -> list:
-        return [cls.get(id=user_id, data_partition=data_partition) for user_id
-                in config.ALLOWED_USER_IDS]
+    def register(cls, ids: list, data_partition: str) -> None:
+        if ids:
+            cls.redis.sadd(cls.registry_key(data_partition), *ids)
+
+    @classmethod
+    def get_all(cls, data_partition: str,
+                batch_size: int = config.USERS_BATCH_SIZE) -> Generator:
+        """ streams all the registered users. As with any `SSCAN`, a user
+        can come up more than once.
+
+        """
+        return cls._scan(cls.registry_key(data_partition), data_partition,
+                         batch_size)
+
+    @classmethod
+    def start_sync(cls, data_partition: str) -> None:
+        """ snapshots the users active since the last sync, for
+        `get_syncing` to stream. Activity from now on goes to a fresh set.
+
+        If the previous sync did not finish, its snapshot is kept as is, so
+        no activity is lost.
+
+        """
+        active_key = cls.active_key(data_partition)
+        syncing_key = cls.syncing_key(data_partition)
+
+        if not cls.redis.exists(syncing_key) and cls.redis.exists(active_key):
+            cls.redis.rename(active_key, syncing_key)
+
+    @classmethod
+    def get_syncing(cls, data_partition: str,
+                    batch_size: int = config.USERS_BATCH_SIZE) -> Generator:
+        """ streams the users in the snapshot taken by `start_sync`. """
+        return cls._scan(cls.syncing_key(data_partition), data_partition,
+                         batch_size)
+
+    @classmethod
+    def finish_sync(cls, data_partition: str) -> None:
+        """ discards the snapshot taken by `start_sync`. """
+        cls.redis.delete(cls.syncing_key(data_partition))
+
+    @classmethod
+    def _scan(cls, key: str, data_partition: str,
+              batch_size: int) -> Generator:
+        return (cls(id=int(user_id), data_partition=data_partition) for
+                user_id in cls.redis.sscan_iter(key, count=batch_size))
 
     def get_ratings(self) -> list:
-        key = '{}_ratings_{}'.format(self.data_partition, self.id)
+        ratings_hash = self.redis.hgetall(
+            self.ratings_key(self.id, self.data_partition))
+
+        return self._deserialize_ratings(ratings_hash)
+
+    @classmethod
+    def get_ratings_many(cls, users: list) -> list:
+        """ fetches the ratings of many users in one round trip.
+
+        Returns:
+            a list with the ratings of each user, in the order of the users.
 
-        ratings_hash = self.redis.hgetall(key)
+        """
+        pipeline = cls.redis.pipeline(transaction=False)
 
+        for user in users:
+            pipeline.hgetall(cls.ratings_key(user.id, user.data_partition))
+
+        return [cls._deserialize_ratings(ratings_hash) for ratings_hash in
+                pipeline.execute()]
+
+    @staticmethod
+    def _deserialize_ratings(ratings_hash: dict) -> list:
         ratings = []
 
         for key, value in ratings_hash.items():
@@ -63,46 +164,112 @@ class Users(object):
         return [item['product_id'] for item in ratings]
 
     def get_recommendations(self) -> list:
-        key = '{}_recommendations_{}'.format(self.data_partition, self.id)
+        key = self.recommendations_key(self.id, self.data_partition)
 
         return self._get_recommendations_for_key(key)
 
     def set_recommendations(self, recommendations: list) -> None:
-        key = '{}_recommendations_{}'.format(self.data_partition, self.id)
+        key = self.recommendations_key(self.id, self.data_partition)
 
-        value = json.dumps(recommendations)
+        value = self.recommendations_codec.encode(recommendations)
 
-        self.redis.set(key, value)
+        pipeline = self.redis.pipeline()
+        pipeline.set(key, value)
+        # a rendered payload would be out of date.
+        pipeline.delete(self.recommendations_payload_key(
+            self.id, self.data_partition))
+        pipeline.execute()
+
+    @classmethod
+    def set_recommendations_many(cls, recommendations: list,
+                                 data_partition: str,
+                                 payloads: list = None) -> None:
+        """ stores the recommendations of many users in one round trip.
+
+        Args:
+            recommendations: a list of (user id, recommendations) tuples.
+
+            data_partition: the data partition of the users.
+
+            payloads: the recommendations of each user rendered as served by
+            the product server, in the order of `recommendations`, for it to
+            serve them in a single read. A payload is a dict with the
+            rendered `recommendations` and the `products_version` of the
+            catalog they were rendered with. The payloads of the users
+            without one (None, or no payloads at all) are dropped, so that
+            none is left out of date.
+
+        """
+        if payloads is None:
+            payloads = [None] * len(recommendations)
+
+        pipeline = cls.redis.pipeline(transaction=False)
+
+        for (user_id, user_recommendations), payload in zip(recommendations,
+                                                            payloads):
+            pipeline.set(cls.recommendations_key(user_id, data_partition),
+                         cls.recommendations_codec.encode(
+                             user_recommendations))
+
+            payload_key = cls.recommendations_payload_key(user_id,
+                                                          data_partition)
+
+            if payload is None:
+                pipeline.delete(payload_key)
+            else:
+                pipeline.set(payload_key, json.dumps(payload).encode())
+
+        pipeline.execute()
 
     @classmethod
     def _get_recommendations_for_key(cls, key):
         value = cls.redis.get(key)
 
-        recommendations = json.loads(value) if value else []
+        if value:
+            recommendations = cls.recommendations_codec.decode(value)
+        else:
+            recommendations = []
 
         return recommendations
 
     @classmethod
     def get_default_recommendations(cls, data_partition: str):
-        key = '{}_recommendations_-1'.format(data_partition)
+        key = cls.recommendations_key(config.DEFAULT_USERID, data_partition)
 
         return cls._get_recommendations_for_key(key)
 
     def set_ratings(self, ratings: list) -> None:
-        key = '{}_ratings_{}'.format(self.data_partition, self.id)
+        key = self.ratings_key(self.id, self.data_partition)
 
         for rating in ratings:
             self.redis.hset(key, rating['product_id'], rating['rating'])
 
+        self.redis.sadd(self.active_key(self.data_partition), self.id)
+
     def has_rated(self):
         return self.get_ratings() != []
 
 
+""" The layouts of the product catalog in redis, see `Products`. """
+KEYS_LAYOUT = 'keys'
+BUCKETS_LAYOUT = 'buckets'
+
+
 class Products(object):
     """ A model that represents the Product.
 
+    The catalog is stored in one of two layouts, picked in the settings:
+    * 'keys': a string key per product.
+    * 'buckets': the products are grouped by id into hashes of `bucket_size`
+      products each. Small hashes are kept by redis in a compact encoding
+      (listpack, or ziplist before redis 7), which saves the overhead of a
+      top-level key per product. The buckets in use are tracked in a set, so
+      that the catalog can be iterated without `KEYS`.
+
+    `migrate` moves a catalog from one layout to the other.
+
     Supports the following queries:
-    * get a product from id
+    * get a product from id, or many products at once
     * get all products in the system
     * add a new product to the system. If the product already exists, update it.
 
@@ -110,35 +277,335 @@ class Products(object):
 
     redis = redis_conn
 
+    codec = ProductCodec(config.PRODUCTS_ENCODING)
+
+    layout = config.PRODUCTS_LAYOUT
+
+    bucket_size = config.PRODUCTS_BUCKET_SIZE
+
     def __init__(self, id: int, name: str, desc: str):
         self.id = id
         self.name = name
         self.desc = desc
 
+    @staticmethod
+    def key(id: int, data_partition: str) -> str:
+        return '{}_products_{}'.format(data_partition, id)
+
+    @staticmethod
+    def bucket_key(bucket: int, data_partition: str) -> str:
+        return '{}_product_buckets_{}'.format(data_partition, bucket)
+
+    @staticmethod
+    def buckets_key(data_partition: str) -> str:
+        return '{}_product_buckets'.format(data_partition)
+
+    @classmethod
+    def bucket_of(cls, id: int) -> int:
+        return int(id) // cls.bucket_size
+
     @classmethod
     def get(cls, id: int, data_partition: str):
-        key = '{}_products_{}'.format(data_partition, id)
+        if cls.layout == BUCKETS_LAYOUT:
+            meta = cls.redis.hget(
+                cls.bucket_key(cls.bucket_of(id), data_partition), id)
+        else:
+            meta = cls.redis.get(cls.key(id, data_partition))
+
+        return cls._deserialize(id, meta)
+
+    @classmethod
+    def get_many(cls, ids: list, data_partition: str) -> list:
+        """ fetches many products in one round trip, preserving the order of
+        the ids. Missing products are None.
+
+        """
+        if not ids:
+            return []
+
+        if cls.layout == BUCKETS_LAYOUT:
+            buckets = {}
+            for id in ids:
+                buckets.setdefault(cls.bucket_of(id), []).append(id)
+
+            pipeline = cls.redis.pipeline(transaction=False)
+            for bucket, bucket_ids in buckets.items():
+                pipeline.hmget(cls.bucket_key(bucket, data_partition),
+                               bucket_ids)
+
+            metas = {}
+            for bucket_ids, values in zip(buckets.values(),
+                                          pipeline.execute()):
+                metas.update(zip(bucket_ids, values))
+
+            values = [metas[id] for id in ids]
+        else:
+            values = cls.redis.mget([cls.key(id, data_partition) for id in
+                                     ids])
 
-        meta = cls.redis.get(key)
+        return [cls._deserialize(id, meta) for id, meta in zip(ids, values)]
 
+    @classmethod
+    def _deserialize(cls, id: int, meta):
         if meta:
-            meta = json.loads(meta)
+            meta = cls.codec.decode(meta)
 
             return cls(id=id, name=meta['name'], desc=meta['desc'])
 
     @classmethod
-    def get_all(cls, data_partition: str) -> Generator:
+    def get_all(cls, data_partition: str,
+                batch_size: int = config.PRODUCTS_BATCH_SIZE) -> Generator:
         # products catalog can be large, use a generator
-        return (cls.get(id=key, data_partition=data_partition) for key in
-                cls.redis.keys('{}_products_*'.format(data_partition)))
+        if cls.layout == BUCKETS_LAYOUT:
+            rows = cls._scan_buckets(data_partition)
+        else:
+            rows = cls._scan_keys(data_partition, batch_size)
+
+        return (cls._deserialize(id, meta) for id, meta in rows if meta)
 
     @classmethod
-    def upsert(cls, id, name, desc, data_partition: str) -> None:
-        key = '{}_products_{}'.format(data_partition, id)
+    def _scan_keys(cls, data_partition: str, batch_size: int) -> Generator:
+        """ streams (id, raw metadata) pairs from the 'keys' layout. """
+        prefix = cls.key('', data_partition).encode()
 
-        value = json.dumps({
+        keys = cls.redis.scan_iter(match=prefix + b'*',
+                                   count=batch_size)
+
+        for batch in utils.batches(keys, batch_size):
+            for key, meta in zip(batch, cls.redis.mget(batch)):
+                yield int(key[len(prefix):]), meta
+
+    @classmethod
+    def _scan_buckets(cls, data_partition: str) -> Generator:
+        """ streams (id, raw metadata) pairs from the 'buckets' layout. """
+        for bucket in cls.redis.sscan_iter(cls.buckets_key(data_partition)):
+            bucket_hash = cls.redis.hgetall(
+                cls.bucket_key(int(bucket), data_partition))
+
+            for id, meta in bucket_hash.items():
+                yield int(id), meta
+
+    @classmethod
+    def upsert(cls, id, name, desc, data_partition: str) -> None:
+        value = cls.codec.encode({
             'name': name,
             'desc': desc
         })
 
-        cls.redis.set(key, value)
+        pipeline = cls.redis.pipeline(transaction=False)
+        cls._write(pipeline, id, value, data_partition, cls.layout)
+        pipeline.execute()
+
+    @classmethod
+    def _write(cls, pipeline, id: int, value: bytes, data_partition: str,
+               layout: str) -> None:
+        if layout == BUCKETS_LAYOUT:
+            bucket = cls.bucket_of(id)
+
+            pipeline.hset(cls.bucket_key(bucket, data_partition), id, value)
+            pipeline.sadd(cls.buckets_key(data_partition), bucket)
+        else:
+            pipeline.set(cls.key(id, data_partition), value)
+
+    @classmethod
+    def migrate(cls, data_partition: str, layout: str,
+                delete_source: bool = True,
+                batch_size: int = config.PRODUCTS_BATCH_SIZE) -> int:
+        """ Copies the catalog of a partition from the other layout to
+        `layout`. The stored values are copied as they are.
+
+        To migrate without downtime, copy with `delete_source` off, switch
+        the layout in the settings of both servers, and run the migration
+        again to delete the source.
+
+        Args:
+            data_partition: the partition of the catalog.
+
+            layout: the layout to migrate to, 'keys' or 'buckets'.
+
+            delete_source: whether to delete the catalog in the other layout
+            once it has been copied.
+
+            batch_size: the number of products to copy per round trip.
+
+        Returns:
+            the number of products copied.
+
+        """
+        if layout == BUCKETS_LAYOUT:
+            source_layout = KEYS_LAYOUT
+            rows = cls._scan_keys(data_partition, batch_size)
+        elif layout == KEYS_LAYOUT:
+            source_layout = BUCKETS_LAYOUT
+            rows = cls._scan_buckets(data_partition)
+        else:
+            raise ValueError('unknown products layout: {}'.format(layout))
+
+        copied = 0
+
+        for batch in utils.batches(rows, batch_size):
+            pipeline = cls.redis.pipeline(transaction=False)
+
+            for id, meta in batch:
+                if meta:
+                    cls._write(pipeline, id, meta, data_partition, layout)
+                    copied += 1
+
+            pipeline.execute()
+
+        if delete_source:
+            cls._delete_layout(data_partition, source_layout, batch_size)
+
+        return copied
+
+    @classmethod
+    def _delete_layout(cls, data_partition: str, layout: str,
+                       batch_size: int) -> None:
+        if layout == BUCKETS_LAYOUT:
+            buckets_key = cls.buckets_key(data_partition)
+
+            for batch in utils.batches(cls.redis.sscan_iter(buckets_key),
+                                       batch_size):
+                cls.redis.delete(*[cls.bucket_key(int(bucket), data_partition)
+                                   for bucket in batch])
+
+            cls.redis.delete(buckets_key)
+        else:
+            keys = cls.redis.scan_iter(
+                match='{}*'.format(cls.key('', data_partition)),
+                count=batch_size)
+
+            for batch in utils.batches(keys, batch_size):
+                cls.redis.delete(*batch)
+
+
+class DataVersions(object):
+    """ A model for the version stamps of the data sets in the serving db.
+
+    Each time a data set (eg. the recommendations, or the product catalog) is
+    rewritten, its version is bumped and the time of the update recorded. The
+    serving layer uses these to validate its caches.
+
+    Supports the following queries:
+    * get or bump the version of a data set
+
+    """
+
+    redis = redis_conn
+
+    @staticmethod
+    def key(data_partition: str) -> str:
+        return '{}_versions'.format(data_partition)
+
+    @classmethod
+    def get(cls, data_set: str, data_partition: str) -> int:
+        """ the version of a data set, 0 if it was never written. """
+        return int(cls.redis.hget(cls.key(data_partition), data_set) or 0)
+
+    @classmethod
+    def bump(cls, data_set: str, data_partition: str) -> None:
+        key = cls.key(data_partition)
+
+        pipeline = cls.redis.pipeline()
+        pipeline.hincrby(key, data_set, 1)
+        pipeline.hset(key, '{}_updated_at'.format(data_set), time.time())
+        pipeline.execute()
+
+
+class RatingEvents(object):
+    """ A model for the stream of rating events published by the product
+    server, one event per rating submitted.
+
+    The stream is read through a redis consumer group: an event delivered to
+    a consumer stays pending until the consumer acknowledges it, so the
+    events read but not processed before a crash are delivered again.
+
+    Supports the following queries:
+    * create the consumer group of the stream
+    * read a batch of new (or still pending) events
+    * acknowledge processed events
+    * get the backlog of the consumer group
+
+    """
+
+    redis = redis_conn
+
+    @staticmethod
+    def key(data_partition: str) -> str:
+        return '{}_rating_events'.format(data_partition)
+
+    @classmethod
+    def create_group(cls, group: str, data_partition: str) -> None:
+        """ creates the consumer group, from the start of the stream, unless
+        it already exists.
+
+        """
+        try:
+            cls.redis.xgroup_create(cls.key(data_partition), group, id='0',
+                                    mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    @classmethod
+    def read(cls, group: str, consumer: str, data_partition: str,
+             count: int, block: int = None, pending: bool = False) -> list:
+        """ reads a batch of events for a consumer of the group.
+
+        Args:
+            count: the maximum number of events to read.
+
+            block: the milliseconds to wait for new events, if there are none.
+            Does not wait if None.
+
+            pending: read the events already delivered to the consumer but
+            not acknowledged, instead of new ones.
+
+        Returns:
+            a list of (event id, rating) tuples, in the order of the stream.
+            A rating is a dict with the `user_id`, `product_id` and `rating`,
+            or None for a pending event since trimmed from the stream.
+
+        """
+        response = cls.redis.xreadgroup(
+            group, consumer, {cls.key(data_partition): '0' if pending else '>'},
+            count=count, block=block)
+
+        if not response:
+            return []
+
+        return [(event_id.decode(),
+                 cls._deserialize_event(fields) if fields else None) for
+                event_id, fields in response[0][1]]
+
+    @staticmethod
+    def _deserialize_event(fields: dict) -> dict:
+        return {
+            'user_id': int(fields[b'user_id']),
+            'product_id': int(fields[b'product_id']),
+            'rating': int(fields[b'rating']),
+        }
+
+    @classmethod
+    def ack(cls, group: str, event_ids: list, data_partition: str) -> None:
+        if event_ids:
+            cls.redis.xack(cls.key(data_partition), group, *event_ids)
+
+    @classmethod
+    def backlog(cls, group: str, data_partition: str) -> dict:
+        """ the backlog of a consumer group.
+
+        Returns:
+            a dict with the number of events `pending` acknowledgement, and
+            the `lag`, the number of events not delivered yet. The lag is
+            None if redis can not tell (before redis 7, or after the
+            stream was trimmed past undelivered events).
+
+        """
+        for info in cls.redis.xinfo_groups(cls.key(data_partition)):
+            name = info['name']
+
+            if (name.decode() if isinstance(name, bytes) else name) == group:
+                return {'pending': info['pending'], 'lag': info.get('lag')}
+
+        raise KeyError("consumer group {} does not exist.".format(group))
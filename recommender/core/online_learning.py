@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import time
+from typing import Iterable
+
+import numpy as np
+
+from core import config
+from core.engines import (ALSRecommendationEngine, FactorEngine,
+                          ImplicitALSEngine, import_engine)
+from core.exceptions import WarehouseException
+from core.model_store import ModelStore
+from core.scoring import FactorModel
+
+logger = logging.getLogger(__name__)
+
+""" Online updates of the factors of an engine, between retrains.
+
+A retrain only runs nightly, so the items which become popular during the day
+stay invisible until the next one. Here the ratings are taken in as they land
+in the warehouse, each with a stochastic gradient step on the factors of its
+user and item, towards a preference of 1 weighted by its confidence, and with
+steps towards 0 for a few random items, standing in for the unobserved pairs.
+The new users and items get factors of their own on their first rating.
+
+The ratings of an explicit engine (`ALSRecommendationEngine`) are the values
+its factors predict, so there each step goes towards the rating itself, with
+no unobserved pairs to stand in for.
+
+The updated factors are checkpointed every now and then as a new version of
+the engine, which the serving layer then picks up like a retrained one,
+together with their drift from the batch model they started from. When a
+retrain promotes a new batch model, the updates start over from it.
+"""
+
+
+class OnlineLearner(object):
+    """ Applies the new ratings of the warehouse to the factors of an engine.
+
+    Attributes:
+        engine: the `ImplicitALSEngine` or `ALSRecommendationEngine` whose
+        factors are updated. Its model is only replaced on a `checkpoint`.
+
+        explicit: whether the engine predicts the ratings themselves.
+
+        path: the path the engine is exported to, see `ModelStore`.
+
+        baseline: the batch `FactorModel` the updates started from.
+
+        watermark: the warehouse ratings watermark read up to.
+
+        learning_rate: the step size of the updates, per unit of confidence.
+
+        negative_samples: the random items a rating pushes away, per rating.
+
+    """
+
+    def __init__(self, engine: FactorEngine, path: str,
+                 learning_rate: float = config.ONLINE_LEARNING_RATE,
+                 negative_samples: int = config.ONLINE_NEGATIVE_SAMPLES,
+                 seed: int = 0):
+        self.path = path
+        self.learning_rate = learning_rate
+        self.negative_samples = negative_samples
+
+        self._random = np.random.RandomState(seed)
+        self._version = ModelStore(path).current_version()
+        self._baseline_file = '{}/baseline.npz'.format(path)
+
+        self._rebase(engine)
+
+    @classmethod
+    def from_path(cls, path: str, **kwargs) -> 'OnlineLearner':
+        """ Creates a learner on the current version of an exported engine.
+        """
+        return cls(_import(path), path, **kwargs)
+
+    def _rebase(self, engine: FactorEngine) -> None:
+        """ starts the updates over from the model of an engine. """
+        assert engine.ready()
+
+        # a spark model is snapshotted once, its checkpoints are factors.
+        if not isinstance(engine.model, FactorModel):
+            engine.model = FactorModel.from_als_model(engine.model)
+
+        self.engine = engine
+        self.explicit = not isinstance(engine, ImplicitALSEngine)
+
+        # a checkpoint carries the watermark its updates go up to, and a
+        # batch model the one of its training data. The models trained
+        # before those were recorded are taken as up to date.
+        self.watermark = \
+            engine.model_params.get('online', {}).get('watermark') or \
+            engine.model_params.get('ratings_watermark') or \
+            engine.warehouse.ratings_watermark()
+
+        # the batch model is kept next to the versions, as the checkpoints
+        # replace it, and the learner may be restarted from one.
+        if 'online' in engine.model_params and \
+                os.path.exists(self._baseline_file):
+            self.baseline = FactorModel.load(self._baseline_file)
+        else:
+            self.baseline = engine.model
+
+            temporary_file = '{}.tmp.npz'.format(self._baseline_file[:-4])
+            self.baseline.save(temporary_file)
+            os.replace(temporary_file, self._baseline_file)
+
+        self._user_ids = list(engine.model.user_ids.tolist())
+        self._item_ids = list(engine.model.item_ids.tolist())
+        self._user_rows = {id: row for row, id in enumerate(self._user_ids)}
+        self._item_rows = {id: row for row, id in enumerate(self._item_ids)}
+
+        self._user_factors = np.array(engine.model.user_factors)
+        self._item_factors = np.array(engine.model.item_factors)
+
+        self._updated_users = set()
+        self._updated_items = set()
+        self.ratings = engine.model_params.get('online', {}).get('ratings', 0)
+
+    def _row(self, id: int, ids: list, rows: dict, factors: np.ndarray):
+        """ the factor row of an id, added with small random factors if the
+        id is new.
+
+        Returns:
+            a tuple of the row, and the factors. Those have spare rows for
+            the new ids, and are doubled when they run out.
+
+        """
+        row = rows.get(id)
+
+        if row is None:
+            row = rows[id] = len(ids)
+            ids.append(id)
+
+            if row == len(factors):
+                factors = np.concatenate([factors, np.empty(
+                    (max(len(factors), 1), factors.shape[1]))])
+
+            factors[row] = self._random.normal(scale=0.01,
+                                               size=factors.shape[1])
+
+        return row, factors
+
+    def update(self, rows: Iterable[dict]) -> int:
+        """ Applies ratings to the factors, one stochastic gradient step each.
+
+        Args:
+            rows: warehouse ratings rows.
+
+        Returns:
+            the number of ratings applied.
+
+        """
+        reg_param = self.engine.model_params['reg_param']
+        applied = 0
+
+        for row in rows:
+            user, self._user_factors = self._row(
+                row[config.USER_COL], self._user_ids, self._user_rows,
+                self._user_factors)
+            item, self._item_factors = self._row(
+                row[config.PRODUCT_COL], self._item_ids, self._item_rows,
+                self._item_factors)
+
+            if self.explicit:
+                self._step(user, item, float(row[config.RATINGS_COL]), 1.0,
+                           reg_param)
+            else:
+                confidence = float(self.engine.confidence(
+                    np.array([row[config.RATINGS_COL]]))[0])
+
+                self._step(user, item, 1.0, confidence, reg_param)
+
+                for other in self._random.randint(
+                        len(self._item_ids), size=self.negative_samples):
+                    if other != item:
+                        self._step(user, other, 0.0, 1.0, reg_param)
+
+            self._updated_users.add(user)
+            self._updated_items.add(item)
+            applied += 1
+
+        self.ratings += applied
+
+        return applied
+
+    def _step(self, user: int, item: int, preference: float,
+              confidence: float, reg_param: float) -> None:
+        """ a gradient step on `confidence * (preference - x_u . y_i)^2` and
+        the regularization of both factors.
+
+        """
+        x = self._user_factors[user].copy()
+        y = self._item_factors[item].copy()
+
+        error = preference - float(x.dot(y))
+
+        # bounded, so a high confidence never overshoots the preference.
+        rate = min(self.learning_rate * confidence,
+                   1.0 / (float(x.dot(x) + y.dot(y)) + reg_param))
+
+        self._user_factors[user] = x + rate * (error * y - reg_param * x)
+        self._item_factors[item] = y + rate * (error * x - reg_param * y)
+
+    def poll(self) -> int:
+        """ Applies the ratings added to the warehouse since the watermark.
+
+        Returns:
+            the number of ratings applied.
+
+        """
+        warehouse = self.engine.warehouse
+        watermark = warehouse.ratings_watermark()
+
+        try:
+            files = warehouse.ratings_files(since=self.watermark,
+                                            until=watermark)
+        except WarehouseException:
+            # the ratings were reset, and are left to the next retrain.
+            logger.warning('the ratings were reset, following them from now')
+            self.watermark = watermark
+            return 0
+
+        applied = self.update(warehouse.read_rows(files))
+
+        self.watermark = watermark
+
+        return applied
+
+    def model(self) -> FactorModel:
+        """ a snapshot of the updated factors. """
+        return FactorModel(user_ids=self._user_ids,
+                           user_factors=self._user_factors[
+                               :len(self._user_ids)].copy(),
+                           item_ids=self._item_ids,
+                           item_factors=self._item_factors[
+                               :len(self._item_ids)].copy())
+
+    def drift(self, model: FactorModel = None,
+              users: int = config.ONLINE_DRIFT_USERS) -> dict:
+        """ Measures how far the updated factors are from the baseline.
+
+        Args:
+            model: a snapshot of the updated factors, taken if None.
+
+            users: the number of updated users to compare the
+            recommendations of.
+
+        Returns:
+            a dict of the `ratings` applied, the `new_users` and `new_items`,
+            the mean relative change of the factors of the updated users and
+            items known to the baseline (`user_change` and `item_change`),
+            and the mean share of the top recommendations of a sample of the
+            updated users which the baseline also recommends
+            (`recommendation_overlap`).
+
+        """
+        model = model or self.model()
+
+        # the rows of the snapshot are the ones of the learner.
+        user_rows = np.array(sorted(self._updated_users), dtype=np.int64)
+        item_rows = np.array(sorted(self._updated_items), dtype=np.int64)
+
+        baseline_users = self.baseline.user_rows(model.user_ids[user_rows])
+        baseline_items = self.baseline.item_rows(model.item_ids[item_rows])
+
+        known_users = baseline_users >= 0
+        known_items = baseline_items >= 0
+
+        sample = model.user_ids[user_rows[known_users]]
+        if len(sample) > users:
+            sample = self._random.choice(sample, users, replace=False)
+
+        count = self.engine.recommendation_count
+        overlaps = [len(set(online) & set(batch)) / count for online, batch in
+                    zip(model.recommend(sample.tolist(), count),
+                        self.baseline.recommend(sample.tolist(), count))]
+
+        return {
+            'ratings': self.ratings,
+            'new_users': len(model.user_ids) - len(self.baseline.user_ids),
+            'new_items': len(model.item_ids) - len(self.baseline.item_ids),
+            'user_change': _change(
+                model.user_factors[user_rows[known_users]],
+                self.baseline.user_factors[baseline_users[known_users]]),
+            'item_change': _change(
+                model.item_factors[item_rows[known_items]],
+                self.baseline.item_factors[baseline_items[known_items]]),
+            'recommendation_overlap':
+                float(np.mean(overlaps)) if overlaps else None,
+        }
+
+    def checkpoint(self) -> dict:
+        """ Exports the engine with the updated factors as a new version,
+        along with their drift and the watermark they go up to.
+
+        Returns:
+            the drift, see `drift`.
+
+        """
+        model = self.model()
+        drift = self.drift(model)
+
+        self.engine.model = model
+        self.engine.model_params['online'] = {
+            'ratings': self.ratings,
+            'watermark': self.watermark,
+            'drift': drift,
+            'checkpointed_at': time.time(),
+        }
+
+        self.engine.export(self.path, checkpoint=True)
+        self._version = ModelStore(self.path).current_version()
+
+        logger.info('checkpointed the online model, drift {}'.format(drift))
+
+        return drift
+
+    def run(self, interval: float = config.ONLINE_LEARNING_INTERVAL,
+            checkpoint_interval: float = config.ONLINE_CHECKPOINT_INTERVAL,
+            polls: int = None) -> None:
+        """ Polls the warehouse for new ratings, and checkpoints the updates
+        every `checkpoint_interval` seconds. A new batch model, promoted by a
+        retrain, is taken as the new baseline.
+
+        Args:
+            interval: the seconds between two polls.
+
+            polls: the number of polls to stop after. Runs forever if None.
+
+        """
+        checkpointed_at = time.time()
+        done = 0
+
+        while polls is None or done < polls:
+            if ModelStore(self.path).current_version() != self._version:
+                logger.info('a new batch model was promoted, rebasing')
+
+                self._version = ModelStore(self.path).current_version()
+                self._rebase(_import(self.path))
+
+            applied = self.poll()
+            done += 1
+
+            if applied:
+                logger.debug('applied {} new ratings'.format(applied))
+
+            if (self._updated_users and
+                    time.time() - checkpointed_at >= checkpoint_interval):
+                self.checkpoint()
+                checkpointed_at = time.time()
+
+            if polls is None or done < polls:
+                time.sleep(interval)
+
+
+def _import(path: str) -> FactorEngine:
+    """ imports the engine exported to a path, which should be an ALS one,
+    see `config.ENGINE`.
+
+    """
+    engine = import_engine(path)
+
+    if not isinstance(engine, (ALSRecommendationEngine, ImplicitALSEngine)):
+        raise ValueError('online learning needs an ALS engine, {} is a '
+                         '{}'.format(path, type(engine).__name__))
+
+    return engine
+
+
+def _change(factors: np.ndarray, baseline: np.ndarray) -> float:
+    """ the mean relative distance of factors from their baseline. """
+    if not len(factors):
+        return None
+
+    distances = np.linalg.norm(factors - baseline, axis=1)
+    norms = np.linalg.norm(baseline, axis=1)
+
+    return float(np.mean(distances / np.maximum(norms, 1e-12)))
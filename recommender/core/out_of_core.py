@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import resource
+from typing import Callable, Iterator
+
+import numpy as np
+from scipy import sparse
+
+from core import config, implicit_als, utils
+from core.warehouse import FileWarehouse
+
+logger = logging.getLogger(__name__)
+
+""" Out-of-core storage of the ratings matrix, and implicit ALS over it.
+
+The ratings are converted into CSR shards on disk, twice: sorted by user, for
+the user half of each ALS sweep, and sorted by item, for the item half. A
+shard holds the ratings of a range of consecutive rows, and is stored as
+three `.npy` arrays which are memory-mapped when read. A half-sweep streams
+over the shards of its side, so only the factors of both sides, and the pages
+of the shard being solved, need to be in memory.
+
+The conversion is an external sort, in two passes over the warehouse files.
+The first finds the user and item ids and their number of ratings, which
+decide the shard boundaries. The second appends every rating to a spill file
+per shard of each side. Each spill file is then turned into a CSR shard on
+its own.
+"""
+
+""" The record of a rating in a spill file: its row in the shard, its column
+and its value. """
+SPILL_RECORD = np.dtype([('row', np.int32), ('col', np.int32),
+                         ('value', np.float64)])
+
+
+class ShardedMatrix(object):
+    """ A sparse matrix stored on disk as CSR shards of consecutive rows.
+
+    Attributes:
+        directory: the directory of the shards.
+
+        shape: the (rows, columns) of the whole matrix.
+
+        bounds: the (start, end) rows of each shard.
+
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+        with open('{}/shards.json'.format(directory)) as meta_file:
+            meta = json.load(meta_file)
+
+        self.shape = tuple(meta['shape'])
+        self.bounds = [tuple(bound) for bound in meta['bounds']]
+
+    def shard(self, number: int) -> sparse.csr_matrix:
+        """ memory-maps a shard, with a row per row of its range. """
+        start, end = self.bounds[number]
+
+        arrays = [np.load(_shard_file(self.directory, number, name),
+                          mmap_mode='r') for name in ('data', 'indices',
+                                                      'indptr')]
+
+        return sparse.csr_matrix(tuple(arrays),
+                                 shape=(end - start, self.shape[1]),
+                                 copy=False)
+
+    def shards(self) -> Iterator[tuple]:
+        """ streams the shards, as (first row, shard) tuples. """
+        for number, (start, _) in enumerate(self.bounds):
+            yield start, self.shard(number)
+
+    def size(self) -> int:
+        """ the bytes of the shards on disk. """
+        return sum(os.path.getsize('{}/{}'.format(self.directory, name)) for
+                   name in os.listdir(self.directory))
+
+    @classmethod
+    def write(cls, directory: str, shape: tuple, bounds: list) -> None:
+        """ turns the spill files of the shards into CSR shards, see
+        `spill_file`, and removes them.
+
+        """
+        for number, (start, end) in enumerate(bounds):
+            spill_file = cls.spill_file(directory, number)
+
+            records = np.fromfile(spill_file, dtype=SPILL_RECORD)
+
+            shard = sparse.csr_matrix(
+                (records['value'], (records['row'], records['col'])),
+                shape=(end - start, shape[1]))
+            # repeated pairs add up, as in `implicit_als.ratings_matrix`.
+            shard.sum_duplicates()
+
+            np.save(_shard_file(directory, number, 'data'),
+                    shard.data.astype(np.float64))
+            np.save(_shard_file(directory, number, 'indices'),
+                    shard.indices.astype(np.int32))
+            np.save(_shard_file(directory, number, 'indptr'),
+                    shard.indptr.astype(np.int32))
+
+            os.remove(spill_file)
+
+        with open('{}/shards.json'.format(directory), 'w') as meta_file:
+            json.dump({'shape': list(shape),
+                       'bounds': [list(bound) for bound in bounds]},
+                      meta_file)
+
+    @staticmethod
+    def spill_file(directory: str, number: int) -> str:
+        """ the file the ratings of a shard are appended to, before `write`
+        turns them into the shard. Each rating is a `SPILL_RECORD`.
+
+        """
+        return '{}/{:05d}.spill'.format(directory, number)
+
+
+def _shard_file(directory: str, number: int, name: str) -> str:
+    return '{}/{:05d}.{}.npy'.format(directory, number, name)
+
+
+def shard_bounds(counts: np.ndarray, ratings_per_shard: int) -> list:
+    """ splits rows into ranges of consecutive rows with about
+    `ratings_per_shard` ratings each. A row is never split, so a shard can
+    have more ratings when a row alone does.
+
+    Args:
+        counts: the number of ratings of each row.
+
+    Returns:
+        a list of (start, end) rows, covering all the rows.
+
+    """
+    if not len(counts):
+        return []
+
+    cumulative = np.cumsum(counts)
+
+    ends = np.searchsorted(
+        cumulative, np.arange(ratings_per_shard, cumulative[-1],
+                              ratings_per_shard), side='left') + 1
+
+    ends = np.unique(np.append(ends[ends < len(counts)], len(counts)))
+
+    return list(zip([0] + ends[:-1].tolist(), ends.tolist()))
+
+
+def _count(ids: np.ndarray, counts: np.ndarray,
+           chunk: np.ndarray) -> tuple:
+    """ merges the ids of a chunk of ratings into the sorted ids seen so
+    far, and their number of ratings.
+
+    """
+    all_ids, inverse = np.unique(np.concatenate([ids, chunk]),
+                                 return_inverse=True)
+
+    weights = np.concatenate([counts, np.ones(len(chunk), dtype=np.int64)])
+
+    return all_ids, np.bincount(inverse, weights=weights,
+                                minlength=len(all_ids)).astype(np.int64)
+
+
+def _chunks(files: list, size: int) -> Iterator[np.ndarray]:
+    """ reads ratings files in arrays of up to `size` (user id, item id,
+    rating) rows.
+
+    """
+    chunk = np.empty((size, 3), dtype=np.float64)
+    filled = 0
+
+    # filled in place, so a chunk never exists as rows of dicts.
+    for row in FileWarehouse.read_rows(files):
+        chunk[filled] = (row[config.USER_COL], row[config.PRODUCT_COL],
+                         row[config.RATINGS_COL])
+        filled += 1
+
+        if filled == size:
+            yield chunk
+            chunk = np.empty((size, 3), dtype=np.float64)
+            filled = 0
+
+    if filled:
+        yield chunk[:filled]
+
+
+def build(files: list, directory: str,
+          ratings_per_shard: int = config.OUT_OF_CORE_SHARD_RATINGS,
+          chunk_size: int = config.OUT_OF_CORE_CHUNK_SIZE) -> tuple:
+    """ Converts warehouse ratings files into user-sorted and item-sorted
+    CSR shards on disk, see the module docs. The directory is cleared first.
+
+    Args:
+        files: the ratings files.
+
+        directory: where to write the shards, under `users` and `items`.
+
+        ratings_per_shard: the approximate number of ratings per shard.
+
+        chunk_size: the number of ratings read into memory at a time.
+
+    Returns:
+        a tuple of the sorted user ids, the sorted item ids, the user x item
+        `ShardedMatrix` and the item x user one.
+
+    """
+    utils.delete_directory(directory)
+
+    user_ids = item_ids = np.empty(0, dtype=np.int64)
+    user_counts = item_counts = np.empty(0, dtype=np.int64)
+
+    for chunk in _chunks(files, chunk_size):
+        user_ids, user_counts = _count(user_ids, user_counts,
+                                       chunk[:, 0].astype(np.int64))
+        item_ids, item_counts = _count(item_ids, item_counts,
+                                       chunk[:, 1].astype(np.int64))
+
+    sides = (
+        ('users', user_ids, item_ids, shard_bounds(user_counts,
+                                                   ratings_per_shard)),
+        ('items', item_ids, user_ids, shard_bounds(item_counts,
+                                                   ratings_per_shard)),
+    )
+
+    for name, _, _, _ in sides:
+        utils.create_directory('{}/{}'.format(directory, name))
+
+    for chunk in _chunks(files, chunk_size):
+        users = np.searchsorted(user_ids, chunk[:, 0].astype(np.int64))
+        items = np.searchsorted(item_ids, chunk[:, 1].astype(np.int64))
+
+        for (name, _, _, bounds), rows, cols in zip(sides, (users, items),
+                                                    (items, users)):
+            _spill('{}/{}'.format(directory, name), bounds, rows, cols,
+                   chunk[:, 2])
+
+    matrices = []
+
+    for name, row_ids, col_ids, bounds in sides:
+        side_directory = '{}/{}'.format(directory, name)
+
+        ShardedMatrix.write(side_directory, (len(row_ids), len(col_ids)),
+                            bounds)
+
+        matrices.append(ShardedMatrix(side_directory))
+
+    logger.info('built {} user shards and {} item shards of {} ratings in {}'
+                .format(len(sides[0][3]), len(sides[1][3]),
+                        int(user_counts.sum()), directory))
+
+    return user_ids, item_ids, matrices[0], matrices[1]
+
+
+def _spill(directory: str, bounds: list, rows: np.ndarray, cols: np.ndarray,
+           values: np.ndarray) -> None:
+    """ appends a chunk of ratings to the spill files of their shards. """
+    starts = np.array([start for start, _ in bounds])
+
+    shards = np.searchsorted(starts, rows, side='right') - 1
+
+    order = np.argsort(shards, kind='mergesort')
+    shards = shards[order]
+
+    for number in np.unique(shards):
+        selected = order[np.searchsorted(shards, number, side='left'):
+                         np.searchsorted(shards, number, side='right')]
+
+        records = np.empty(len(selected), dtype=SPILL_RECORD)
+        records['row'] = rows[selected] - starts[number]
+        records['col'] = cols[selected]
+        records['value'] = values[selected]
+
+        with open(ShardedMatrix.spill_file(directory, number), 'ab') as file:
+            records.tofile(file)
+
+
+def sweep(matrix: ShardedMatrix, factors: np.ndarray, other: np.ndarray,
+          reg_param: float, transform: Callable, cg_steps: int) -> np.ndarray:
+    """ a half-sweep of conjugate gradient ALS over the shards of one side,
+    see `implicit_als.cg_sweep`.
+
+    Args:
+        transform: turns the ratings of a shard into confidences.
+
+    """
+    gram_matrix = implicit_als.gram(other, reg_param)
+
+    x = np.empty_like(factors, dtype=np.float64)
+
+    for start, shard in matrix.shards():
+        end = start + shard.shape[0]
+
+        # the confidences are computed per shard, the ratings stay mapped.
+        shard.data = transform(shard.data)
+
+        x[start:end] = implicit_als.cg_sweep(shard, factors[start:end], other,
+                                             reg_param, cg_steps,
+                                             gram_matrix=gram_matrix)
+
+    return x
+
+
+def fit(by_user: ShardedMatrix, by_item: ShardedMatrix, rank: int,
+        reg_param: float, max_iter: int, transform: Callable,
+        cg_steps: int = config.IMPLICIT_CG_STEPS,
+        user_factors: np.ndarray = None, item_factors: np.ndarray = None,
+        seed: int = 0, callback: Callable = None) -> tuple:
+    """ `implicit_als.fit` with the conjugate gradient solver, over sharded
+    ratings.
+
+    Args:
+        by_user, by_item: the ratings, sorted by user and by item, see
+        `build`.
+
+        transform: turns ratings into confidences, eg. a partial of
+        `implicit_als.confidence`.
+
+        rank, reg_param, max_iter, cg_steps, user_factors, item_factors,
+        seed, callback: as for `implicit_als.fit`.
+
+    Returns:
+        a tuple of the user factors and the item factors.
+
+    """
+    random = np.random.RandomState(seed)
+
+    if user_factors is None:
+        user_factors = random.normal(scale=0.01, size=(by_user.shape[0], rank))
+
+    if item_factors is None:
+        item_factors = random.normal(scale=0.01, size=(by_item.shape[0], rank))
+
+    user_factors = np.asarray(user_factors, dtype=np.float64)
+    item_factors = np.asarray(item_factors, dtype=np.float64)
+
+    for iteration in range(max_iter):
+        user_factors = sweep(by_user, user_factors, item_factors, reg_param,
+                             transform, cg_steps)
+        item_factors = sweep(by_item, item_factors, user_factors, reg_param,
+                             transform, cg_steps)
+
+        logger.debug('finished sweep {} of {}, peak rss {} bytes'.format(
+            iteration + 1, max_iter, peak_rss()))
+
+        if callback is not None and \
+                callback(iteration + 1, user_factors, item_factors):
+            break
+
+    return user_factors, item_factors
+
+
+def loss(by_user: ShardedMatrix, user_factors: np.ndarray,
+         item_factors: np.ndarray, reg_param: float,
+         transform: Callable) -> float:
+    """ `implicit_als.loss` over sharded ratings, see `fit`. """
+    # all the pairs as unobserved, and the regularization.
+    total = implicit_als.loss(sparse.csr_matrix((0, item_factors.shape[0])),
+                              user_factors, item_factors, reg_param)
+
+    for start, shard in by_user.shards():
+        shard.data = transform(shard.data)
+
+        total += implicit_als.observed_loss(
+            shard, user_factors[start:start + shard.shape[0]], item_factors)
+
+    return total
+
+
+def peak_rss() -> int:
+    """ the peak resident set size of this process so far, in bytes. """
+    # linux reports kilobytes.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
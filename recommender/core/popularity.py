@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import heapq
+import json
+import logging
+import os
+
+from core import config
+from core.exceptions import WarehouseException
+from core.warehouse import FileWarehouse
+
+logger = logging.getLogger(__name__)
+
+""" The popularity of the products, maintained incrementally.
+
+The popularity of a product is the sum of all the ratings it was given. The
+totals are kept in the warehouse with the watermark of the ratings they cover,
+so each update only reads the ratings segments added since the last one.
+"""
+
+
+class Popularity(object):
+    """ The running popularity of the products in a warehouse.
+
+    Attributes:
+        warehouse: the warehouse holding the ratings, and the totals.
+
+        totals: a dict of product id to the sum of its ratings.
+
+        watermark: the ratings watermark the totals are up to date with, None
+        if they cover no ratings yet.
+
+    """
+
+    def __init__(self, warehouse: FileWarehouse, totals: dict = None,
+                 watermark: list = None):
+        self.warehouse = warehouse
+        self.totals = {} if totals is None else totals
+        self.watermark = watermark
+
+    @classmethod
+    def load(cls, warehouse: FileWarehouse) -> 'Popularity':
+        """ Loads the totals stored in the warehouse, if any. """
+        if not os.path.exists(warehouse.popularity_file):
+            return cls(warehouse)
+
+        with open(warehouse.popularity_file) as popularity_file:
+            state = json.load(popularity_file)
+
+        return cls(warehouse,
+                   totals={int(product_id): total for product_id, total in
+                           state['totals'].items()},
+                   watermark=state['watermark'])
+
+    def save(self) -> None:
+        temporary_file = '{}.tmp'.format(self.warehouse.popularity_file)
+
+        with open(temporary_file, 'w') as popularity_file:
+            json.dump({'totals': self.totals, 'watermark': self.watermark},
+                      popularity_file)
+
+        os.replace(temporary_file, self.warehouse.popularity_file)
+
+    def update(self) -> int:
+        """ Adds the ratings stored since the last update to the totals. If
+        the ratings were reloaded in the meantime, starts over from all of
+        them.
+
+        Returns:
+            the number of ratings read.
+
+        """
+        until = self.warehouse.ratings_watermark()
+
+        try:
+            files = self.warehouse.ratings_files(since=self.watermark,
+                                                 until=until)
+        except WarehouseException:
+            logger.info('the ratings were reloaded, recomputing popularity.')
+            self.totals = {}
+            files = self.warehouse.ratings_files(until=until)
+
+        count = 0
+
+        for row in self.warehouse.read_rows(files):
+            product_id = row[config.PRODUCT_COL]
+            self.totals[product_id] = \
+                self.totals.get(product_id, 0) + row[config.RATINGS_COL]
+            count += 1
+
+        self.watermark = until
+
+        logger.debug('popularity updated with {} ratings from {} files'
+                     .format(count, len(files)))
+
+        return count
+
+    def top(self, count: int) -> list:
+        """ the ids of the `count` most popular products, best first. """
+        return [product_id for product_id, _ in
+                heapq.nlargest(count, self.totals.items(),
+                               key=lambda item: item[1])]
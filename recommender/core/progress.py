@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from typing import Callable
+
+from core import config
+
+logger = logging.getLogger(__name__)
+
+""" Progress reports of long-running jobs, like the training of an engine.
+
+A job goes through stages one after the other (loading the data, fitting the
+candidate models, ...). A stage may know how many steps it has, and counts
+them as they are done, along with any amounts worth a rate (eg. the users
+scored). The job's progress is published every now and then, as a plain dict,
+eg. to the state of the celery task running it.
+"""
+
+
+class Progress(object):
+    """ Tracks the progress of a job, stage by stage, and publishes it.
+
+    Attributes:
+        publish: called with a `snapshot` whenever the progress is reported.
+        Errors are logged, and never fail the job. Nothing is published if
+        None.
+
+        interval: the minimum seconds between two reports within a stage. The
+        start and the end of every stage are always reported.
+
+        stages: the descriptions of the finished stages, see `snapshot`.
+
+    """
+
+    def __init__(self, publish: Callable = None,
+                 interval: float = config.PROGRESS_INTERVAL):
+        self.publish = publish
+        self.interval = interval
+
+        self.stages = []
+
+        self._stage = None
+        self._started_at = time.monotonic()
+        self._reported_at = None
+
+    def start(self, name: str, total: int = None) -> None:
+        """ Starts a new stage, finishing the current one.
+
+        Args:
+            total: the number of steps of the stage, if known.
+
+        """
+        self._finish_stage()
+
+        self._stage = {'name': name, 'total': total, 'done': 0, 'counts': {},
+                       'current': None, 'started_at': time.monotonic()}
+
+        self._report(force=True)
+
+    def advance(self, steps: int = 1, current: dict = None,
+                **counts: int) -> None:
+        """ Counts steps of the current stage as done.
+
+        Args:
+            steps: the steps done. 0 to only update `current` or the counts.
+
+            current: a description of what the stage works on now, eg. the
+            params of the candidate being fitted.
+
+            counts: amounts done, eg. `users=1000`, reported with their rate.
+
+        """
+        stage = self._stage
+
+        stage['done'] += steps
+
+        if current is not None:
+            stage['current'] = current
+
+        for name, count in counts.items():
+            stage['counts'][name] = stage['counts'].get(name, 0) + count
+
+        self._report(force=stage['total'] is not None and
+                     stage['done'] >= stage['total'])
+
+    def finish(self) -> None:
+        """ Finishes the current stage, and the job. """
+        self._finish_stage()
+
+        self._report(force=True)
+
+    def snapshot(self) -> dict:
+        """ Describes the progress of the job.
+
+        Returns:
+            a dict with the `elapsed` seconds of the job, its finished
+            `stages` and its current `stage`, None once finished. A stage is
+            described by its `name`, the steps `done` of its `total`, the
+            `current` step, its `counts` and their `rates` per second, the
+            `seconds` it took so far, and the `eta_seconds` to its end,
+            estimated from the pace of the steps done so far.
+
+        """
+        now = time.monotonic()
+
+        return {
+            'elapsed': now - self._started_at,
+            'stages': list(self.stages),
+            'stage': None if self._stage is None else _describe(self._stage,
+                                                                now),
+        }
+
+    def _finish_stage(self) -> None:
+        if self._stage is not None:
+            self.stages.append(_describe(self._stage, time.monotonic()))
+
+            logger.debug('finished stage {name} in {seconds:.1f} seconds'
+                         .format(**self.stages[-1]))
+
+            self._stage = None
+
+    def _report(self, force: bool = False) -> None:
+        if self.publish is None:
+            return
+
+        now = time.monotonic()
+
+        if not force and self._reported_at is not None and \
+                now - self._reported_at < self.interval:
+            return
+
+        self._reported_at = now
+
+        try:
+            self.publish(self.snapshot())
+        except Exception as e:
+            logger.warning('could not publish the progress: {}'.format(e))
+
+
+def _describe(stage: dict, now: float) -> dict:
+    """ the public description of a stage, see `Progress.snapshot`. """
+    seconds = now - stage['started_at']
+
+    eta_seconds = None
+    if stage['total'] is not None and stage['done']:
+        eta_seconds = max(stage['total'] - stage['done'], 0) * \
+            seconds / stage['done']
+
+    return {
+        'name': stage['name'],
+        'done': stage['done'],
+        'total': stage['total'],
+        'current': stage['current'],
+        'counts': dict(stage['counts']),
+        'rates': {'{}_per_sec'.format(name): count / seconds if seconds else
+                  None for name, count in stage['counts'].items()},
+        'seconds': seconds,
+        'eta_seconds': eta_seconds,
+    }
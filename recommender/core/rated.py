@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import array
+import logging
+
+import numpy as np
+
+from core import config
+from core.exceptions import WarehouseException
+from core.warehouse import FileWarehouse
+
+logger = logging.getLogger(__name__)
+
+""" The products each user rated, maintained incrementally.
+
+The recommendations leave out the products a user already rated. Serving them
+one user at a time needs those products at hand, without reading the ratings
+again on each request. The pairs are kept in a compact csr layout (sorted user
+ids, row pointers, and product ids), about 8 bytes a rating. The ratings
+added since are kept aside in a small dict, and merged in once they grow past
+a share of the rest, so an update only costs the ratings it reads.
+"""
+
+""" The share of the merged ratings the ones kept aside can grow to. """
+_RECENT_SHARE = 0.125
+
+
+class RatedProducts(object):
+    """ The products each user of a warehouse rated.
+
+    Attributes:
+        warehouse: the warehouse holding the ratings.
+
+        shard: only the ratings of this shard are read, see
+        `FileWarehouse.ratings_files`. All the shards if None.
+
+        watermark: the ratings watermark the products are up to date with,
+        None if they cover no ratings yet.
+
+    """
+
+    def __init__(self, warehouse: FileWarehouse, shard: int = None):
+        self.warehouse = warehouse
+        self.shard = shard
+
+        self._clear()
+
+    def update(self) -> int:
+        """ Reads the ratings stored since the last update. If the ratings
+        were reloaded in the meantime, starts over from all of them.
+
+        Returns:
+            the number of ratings read.
+
+        """
+        until = self.warehouse.ratings_watermark()
+
+        if until == self.watermark:
+            return 0
+
+        try:
+            files = self.warehouse.ratings_files(
+                since=self.watermark, until=until, shard=self.shard)
+        except WarehouseException:
+            logger.info('the ratings were reloaded, reading the rated '
+                        'products again.')
+            self._clear()
+            files = self.warehouse.ratings_files(until=until,
+                                                 shard=self.shard)
+
+        user_ids = array.array('q')
+        product_ids = array.array('q')
+
+        for row in self.warehouse.read_rows(files):
+            user_ids.append(row[config.USER_COL])
+            product_ids.append(row[config.PRODUCT_COL])
+
+        count = len(user_ids)
+
+        if self._recent_count + count > \
+                _RECENT_SHARE * len(self._product_ids):
+            self._merge(np.frombuffer(user_ids, dtype=np.int64),
+                        np.frombuffer(product_ids, dtype=np.int64))
+        else:
+            for user_id, product_id in zip(user_ids, product_ids):
+                self._recent.setdefault(user_id, set()).add(product_id)
+
+            self._recent_count += count
+
+        self.watermark = until
+
+        logger.debug('rated products updated with {} ratings from {} files'
+                     .format(count, len(files)))
+
+        return count
+
+    def stale(self) -> bool:
+        """ whether the ratings were reloaded since the last update, which
+        then reads them all again.
+
+        """
+        return self.watermark is not None and \
+            self.watermark[0] != self.warehouse.ratings_watermark()[0]
+
+    def products(self, user_id: int) -> list:
+        """ the ids of the products a user rated. """
+        position = np.searchsorted(self._user_ids, user_id)
+
+        if position < len(self._user_ids) and \
+                self._user_ids[position] == user_id:
+            product_ids = self._product_ids[
+                self._indptr[position]:self._indptr[position + 1]].tolist()
+        else:
+            product_ids = []
+
+        recent = self._recent.get(user_id)
+
+        if recent:
+            product_ids.extend(recent.difference(product_ids))
+
+        return product_ids
+
+    def seen(self, user_ids: list) -> list:
+        """ the (user id, product id) pairs of the products the users rated,
+        as `FactorModel.recommend` takes them.
+
+        """
+        return [(user_id, product_id) for user_id in user_ids for
+                product_id in self.products(user_id)]
+
+    def _clear(self) -> None:
+        """ forgets all the ratings read. """
+        self.watermark = None
+
+        self._user_ids = np.empty(0, dtype=np.int64)
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._product_ids = np.empty(0, dtype=np.int64)
+
+        self._recent = {}
+        self._recent_count = 0
+
+    def _merge(self, user_ids: np.ndarray, product_ids: np.ndarray) -> None:
+        """ rebuilds the csr layout with the ratings kept aside and the given
+        ones.
+
+        """
+        recent = [(user_id, product_id) for user_id, products in
+                  self._recent.items() for product_id in products]
+        recent = np.array(recent, dtype=np.int64).reshape(-1, 2)
+
+        pairs = np.unique(np.concatenate([
+            np.column_stack([
+                np.repeat(self._user_ids, np.diff(self._indptr)),
+                self._product_ids]),
+            recent,
+            np.column_stack([user_ids, product_ids])]), axis=0)
+
+        self._user_ids, starts = np.unique(pairs[:, 0], return_index=True)
+        self._indptr = np.append(starts, len(pairs)).astype(np.int64)
+        self._product_ids = pairs[:, 1].copy()
+
+        self._recent = {}
+        self._recent_count = 0
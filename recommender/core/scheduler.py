@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+import collections
+import logging
+import os
+import threading
+from concurrent.futures import Future
+
+from core import config
+from core.engines import ENGINES, import_engine
+from core.model_store import ModelStore
+from core.progress import Progress
+from core.warehouse import FileWarehouse
+
+logger = logging.getLogger(__name__)
+
+""" Training and generation for many warehouse partitions in one process.
+
+Each catalog lives in a warehouse partition of its own, with its engine
+exported under `engine_path`. Running a process per training means a spark
+session (and a JVM) per catalog. Here the jobs of all the partitions are
+queued to one `PartitionScheduler`, which runs them on a few threads of the
+same process, so they share its spark session. Each partition runs its jobs
+in its own spark fair scheduler pool.
+
+The partitions take turns: the next job to run is the oldest one of the
+partition which was served the longest ago, so a partition with a long queue
+never holds the others back. Each partition also has caps on the jobs it runs
+at once, and on the worker processes of its generation jobs.
+"""
+
+TRAIN = 'train'
+RETRAIN = 'retrain'
+GENERATE = 'generate'
+
+""" The jobs a scheduler can run for a partition. """
+JOBS = (TRAIN, RETRAIN, GENERATE)
+
+
+def engine_path(partition: str) -> str:
+    """ the path the engine of a warehouse partition is exported to. """
+    return '{}/core_app_{}'.format(config.MODELS_DIR, partition)
+
+
+class PartitionScheduler(object):
+    """ Runs the jobs of many partitions concurrently, taking turns.
+
+    The worker threads are started on the first job. Each job imports the
+    engine of its partition from `engine_path`, runs, and exports it back. A
+    partition with no engine exported yet can only be trained, with a new
+    engine on its warehouse partition.
+
+    Attributes:
+        engine_class: the class of the engines, eg. `ImplicitALSEngine`. If
+        None, the new engines are of the `ENGINE` setting, and the exported
+        ones are imported whatever their class, see `import_engine`.
+
+        workers: the most jobs running at once, over all the partitions.
+
+        partition_jobs: the most jobs of a partition running at once.
+
+        partition_workers: the worker processes of a generation job, see
+        `FactorEngine.generate_recommendations`.
+
+    """
+
+    def __init__(self, engine_class=None,
+                 workers: int = config.SCHEDULER_WORKERS,
+                 partition_jobs: int = config.SCHEDULER_PARTITION_JOBS,
+                 partition_workers: int = config.SCHEDULER_PARTITION_WORKERS):
+        self.engine_class = engine_class
+        self.workers = workers
+        self.partition_jobs = partition_jobs
+        self.partition_workers = partition_workers
+
+        self._condition = threading.Condition()
+        self._threads = []
+        self._closed = False
+
+        # the pending jobs of each partition, in order, and when each
+        # partition was last served (in jobs started).
+        self._pending = collections.defaultdict(collections.deque)
+        self._served = {}
+        self._started = 0
+
+        self._running = collections.Counter()
+        self._done = collections.Counter()
+        self._failed = collections.Counter()
+        self._progress = {}
+
+    def submit(self, partition: str, job: str, **kwargs) -> Future:
+        """ Queues a job for a partition.
+
+        Args:
+            job: one of `JOBS`.
+
+            kwargs: passed on to the engine, eg. the `metric` and the options
+            of a training.
+
+        Returns:
+            a future of the job's result: the model params of a training, and
+            None for the others. If the job raises, so does the future.
+
+        """
+        if job not in JOBS:
+            raise ValueError('unknown job: {}. Should be one of {}'
+                             .format(job, JOBS))
+
+        future = Future()
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('the scheduler is shut down.')
+
+            self._pending[partition].append((job, kwargs, future))
+
+            self._start()
+
+            self._condition.notify()
+
+        return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        """ Stops taking jobs. The queued ones still run.
+
+        Args:
+            wait: whether to wait for all of them to be done.
+
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self) -> 'PartitionScheduler':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+
+    def status(self) -> dict:
+        """ Describes the jobs of every partition.
+
+        Returns:
+            a dict of partition to the number of its jobs `pending`,
+            `running`, `done` and `failed`, along with the `progress` of its
+            running jobs, see `core.progress.Progress.snapshot`.
+
+        """
+        with self._condition:
+            partitions = set(self._pending) | set(self._running) | \
+                set(self._done) | set(self._failed)
+
+            return {partition: {
+                'pending': len(self._pending.get(partition, ())),
+                'running': self._running[partition],
+                'done': self._done[partition],
+                'failed': self._failed[partition],
+                'progress': [progress.snapshot() for key, progress in
+                             self._progress.items() if key[0] == partition],
+            } for partition in partitions}
+
+    def _start(self) -> None:
+        """ starts the missing worker threads. Called with the lock held. """
+        self._threads = [thread for thread in self._threads if
+                         thread.is_alive()]
+
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work,
+                                      name='partition-scheduler',
+                                      daemon=True)
+            thread.start()
+
+            self._threads.append(thread)
+
+    def _next_job(self):
+        """ the next job to run, None if none can run now. Called with the
+        lock held.
+
+        """
+        partitions = [partition for partition in self._pending if
+                      self._running[partition] < self.partition_jobs]
+
+        if not partitions:
+            return None
+
+        # the partitions never served come first, in the order they came in.
+        partition = min(partitions,
+                        key=lambda partition: self._served.get(partition, -1))
+
+        job = self._pending[partition].popleft()
+
+        if not self._pending[partition]:
+            del self._pending[partition]
+
+        self._served[partition] = self._started
+        self._started += 1
+
+        return (partition,) + job
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                job = self._next_job()
+
+                while job is None:
+                    if self._closed and not self._pending:
+                        return
+
+                    self._condition.wait()
+                    job = self._next_job()
+
+                partition = job[0]
+                self._running[partition] += 1
+
+            self._execute(*job)
+
+            with self._condition:
+                self._running[partition] -= 1
+
+                if not self._running[partition]:
+                    del self._running[partition]
+
+                self._condition.notify_all()
+
+    def _execute(self, partition: str, job: str, kwargs: dict,
+                 future: Future) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+
+        key = (partition, threading.get_ident())
+
+        logger.info('running the {} job of partition {}'.format(job,
+                                                                 partition))
+
+        try:
+            engine = self._engine(partition, job)
+
+            with self._condition:
+                self._progress[key] = engine.progress
+
+            self._pool(engine, partition)
+
+            if job == TRAIN:
+                result = engine.train_new_model(**kwargs)
+            elif job == RETRAIN:
+                result = engine.retrain_with_updated_data(**kwargs)
+            else:
+                kwargs = dict({'workers': self.partition_workers}, **kwargs)
+                result = engine.generate_recommendations(**kwargs)
+
+            engine.export(engine_path(partition))
+        except Exception as e:
+            logger.exception('the {} job of partition {} failed'.format(
+                job, partition))
+
+            with self._condition:
+                self._failed[partition] += 1
+
+            future.set_exception(e)
+        else:
+            with self._condition:
+                self._done[partition] += 1
+
+            future.set_result(result)
+        finally:
+            with self._condition:
+                self._progress.pop(key, None)
+
+    def _engine(self, partition: str, job: str):
+        """ the exported engine of a partition, or a new one to train. """
+        path = engine_path(partition)
+
+        if ModelStore(path).current_version() is None and \
+                not os.path.exists('{}/{}'.format(path, 'params.json')):
+            if job != TRAIN:
+                raise ValueError('partition {} has no engine yet, it should '
+                                 'be trained first.'.format(partition))
+
+            engine_class = self.engine_class or ENGINES[config.ENGINE]
+            engine = engine_class(warehouse=FileWarehouse(partition))
+        elif self.engine_class is None:
+            engine = import_engine(path)
+        else:
+            engine = self.engine_class.import_from_path(path)
+
+        engine.progress = Progress()
+
+        return engine
+
+    @staticmethod
+    def _pool(engine, partition: str) -> None:
+        """ runs the spark jobs of this thread in the fair scheduler pool of
+        the partition, if the engine uses spark.
+
+        """
+        spark = getattr(engine, 'spark', None)
+
+        if spark is not None:
+            spark.sparkContext.setLocalProperty('spark.scheduler.pool',
+                                                partition)
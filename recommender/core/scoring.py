@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+import functools
+import logging
+import multiprocessing
+from typing import Callable, Iterable
+
+import numpy as np
+from scipy import sparse
+
+from core import config
+from core.warehouse import FileWarehouse
+
+logger = logging.getLogger(__name__)
+
+""" Batched scoring of users against an in-memory factorization model.
+
+Scoring users one at a time (a Spark job each) does not scale past a handful
+of users. Here a trained model is snapshotted into numpy factor matrices, and
+users are scored a batch at a time with a single matrix product followed by an
+`argpartition` based top-K selection. The items a user has already rated are
+masked out of the scores, through a sparse user x item matrix, before the
+selection.
+
+The batch job splits the work by warehouse shard, and fans the shards out to a
+pool of worker processes which all share the same read-only model.
+"""
+
+
+class FactorModel(object):
+    """ A read-only, in-memory snapshot of a matrix factorization model.
+
+    The predicted rating of a user for an item is the dot product of their
+    factor vectors.
+
+    Attributes:
+        user_ids: a 1-d array of the user ids known to the model.
+
+        user_factors: a 2-d array, one row of factors per user id.
+
+        item_ids: a 1-d array of the item (product) ids known to the model.
+
+        item_factors: a 2-d array, one row of factors per item id.
+
+    """
+
+    def __init__(self, user_ids, user_factors, item_ids, item_factors):
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.user_factors = np.asarray(user_factors, dtype=np.float32)
+        self.item_ids = np.asarray(item_ids, dtype=np.int64)
+        self.item_factors = np.asarray(item_factors, dtype=np.float32)
+
+        self._user_index = {int(user_id): row for row, user_id in
+                            enumerate(self.user_ids)}
+
+    @classmethod
+    def from_als_model(cls, model) -> 'FactorModel':
+        """ Snapshots the factors of a trained spark `ALSModel`.
+
+        Args:
+            model: a fitted `pyspark.ml.recommendation.ALSModel`.
+
+        Returns:
+            a new `FactorModel` instance.
+
+        """
+        users = model.userFactors.orderBy('id').collect()
+        items = model.itemFactors.orderBy('id').collect()
+
+        return cls(user_ids=[row.id for row in users],
+                   user_factors=[row.features for row in users],
+                   item_ids=[row.id for row in items],
+                   item_factors=[row.features for row in items])
+
+    def save(self, file: str) -> None:
+        """ Saves the model to a `.npz` file. """
+        np.savez(file, user_ids=self.user_ids, user_factors=self.user_factors,
+                 item_ids=self.item_ids, item_factors=self.item_factors)
+
+    @classmethod
+    def load(cls, file: str) -> 'FactorModel':
+        """ Loads a model saved by `save`. """
+        with np.load(file) as arrays:
+            return cls(user_ids=arrays['user_ids'],
+                       user_factors=arrays['user_factors'],
+                       item_ids=arrays['item_ids'],
+                       item_factors=arrays['item_factors'])
+
+    def restrict_items(self, item_ids) -> 'FactorModel':
+        """ Narrows down the candidate items to the given ids.
+
+        Args:
+            item_ids: an iterable of item ids, typically the product catalog.
+
+        Returns:
+            a new `FactorModel` sharing the user factors of this one.
+
+        """
+        keep = np.isin(self.item_ids, np.fromiter(item_ids, dtype=np.int64))
+
+        return FactorModel(user_ids=self.user_ids,
+                           user_factors=self.user_factors,
+                           item_ids=self.item_ids[keep],
+                           item_factors=self.item_factors[keep])
+
+    def user_rows(self, user_ids: list) -> np.ndarray:
+        """ Looks up the factor rows for the given user ids.
+
+        Returns:
+            an array of row numbers, with -1 for users unknown to the model.
+
+        """
+        return np.array([self._user_index.get(int(user_id), -1) for user_id
+                         in user_ids], dtype=np.int64)
+
+    def item_rows(self, item_ids) -> np.ndarray:
+        """ Looks up the factor rows for the given item ids.
+
+        Returns:
+            an array of row numbers, with -1 for items unknown to the model.
+
+        """
+        return positions(self.item_ids, item_ids)
+
+    def scores(self, user_rows: np.ndarray) -> np.ndarray:
+        """ the predicted ratings of all the items, for the users at the given
+        rows, as a users x items array.
+
+        """
+        return self.user_factors[user_rows].dot(self.item_factors.T)
+
+    def predict(self, user_rows: np.ndarray,
+                item_rows: np.ndarray) -> np.ndarray:
+        """ the predicted ratings of pairs of a user row and an item row. """
+        return np.einsum('ij,ij->i', self.user_factors[user_rows],
+                         self.item_factors[item_rows])
+
+    def recommend(self, user_ids: list, count: int,
+                  batch_size: int = config.GENERATION_BATCH_SIZE,
+                  seen: list = ()) -> list:
+        """ Generates the top `count` items for each of the given users.
+
+        Args:
+            user_ids: a list of distinct user ids.
+
+            count: the number of items to recommend per user.
+
+            batch_size: the number of users to score with one matrix product.
+
+            seen: a list of (user id, item id) pairs which should not be
+            recommended, typically the ratings of the users. Pairs of other
+            users, or of unknown items, are ignored.
+
+        Returns:
+            a list with one entry per user id, each a list of item ids sorted
+            from best to worst. Users unknown to the model get an empty list,
+            in line with what the spark model does for them. Users who have
+            seen all but a few items get fewer than `count`.
+
+        """
+        rows = self.user_rows(user_ids)
+
+        recommendations = [[] for _ in user_ids]
+
+        known = np.flatnonzero(rows >= 0)
+
+        seen = self._seen_matrix(user_ids, seen)
+
+        for start in range(0, len(known), batch_size):
+            batch = known[start:start + batch_size]
+
+            scores = self.scores(rows[batch])
+
+            top = top_k(scores, count, exclude=seen[batch])
+
+            for row, (position, item_rows) in enumerate(zip(batch, top)):
+                item_rows = item_rows[np.isfinite(scores[row, item_rows])]
+
+                recommendations[position] = \
+                    self.item_ids[item_rows].tolist()
+
+        return recommendations
+
+    def _seen_matrix(self, user_ids: list, seen: list) -> sparse.csr_matrix:
+        """ builds the user x item indicator of the seen pairs, with a row
+        per user id (in the given order) and a column per item of the model.
+
+        """
+        positions = {int(user_id): position for position, user_id in
+                     enumerate(user_ids)}
+
+        pairs = np.array(seen, dtype=np.int64).reshape(-1, 2)
+
+        users = np.array([positions.get(user_id, -1) for user_id in
+                          pairs[:, 0].tolist()], dtype=np.int64)
+        items = self.item_rows(pairs[:, 1])
+
+        known = (users >= 0) & (items >= 0)
+
+        return indicator(users[known], items[known],
+                         (len(user_ids), len(self.item_ids)))
+
+
+def positions(known_ids: np.ndarray, ids) -> np.ndarray:
+    """ the positions of ids in an array of distinct ids, -1 for the ids not
+    in it.
+
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+
+    if not len(known_ids):
+        return np.full(len(ids), -1, dtype=np.int64)
+
+    order = np.argsort(known_ids)
+    sorted_ids = known_ids[order]
+
+    found = np.searchsorted(sorted_ids, ids)
+    found = np.minimum(found, len(sorted_ids) - 1)
+
+    return np.where(sorted_ids[found] == ids, order[found], -1)
+
+
+def indicator(rows: np.ndarray, cols: np.ndarray,
+              shape: tuple) -> sparse.csr_matrix:
+    """ builds a 0/1 sparse matrix with ones at the given positions. Repeated
+    positions are counted once.
+
+    """
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=shape)
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+
+    return matrix
+
+
+def top_k(scores: np.ndarray, k: int,
+          exclude: sparse.csr_matrix = None) -> np.ndarray:
+    """ Finds the column indices of the `k` highest scores in each row.
+
+    Uses `argpartition` to avoid sorting the full rows, and only sorts the
+    `k` winners.
+
+    Args:
+        scores: a 2-d array, one row per user and one column per item.
+
+        k: the number of columns to pick per row.
+
+        exclude: a sparse matrix of the shape of `scores`. The scores at its
+        non-zero positions are set to -inf, in place, so they rank last.
+        Rows with fewer than `k` other columns still pick `k`, and the
+        callers can tell the excluded ones by their score.
+
+    Returns:
+        a 2-d array of column indices, sorted by decreasing score.
+
+    """
+    if exclude is not None:
+        excluded_rows, excluded_cols = exclude.nonzero()
+        scores[excluded_rows, excluded_cols] = -np.inf
+
+    k = min(k, scores.shape[1])
+
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+
+    winners = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+    rows = np.arange(scores.shape[0])[:, None]
+
+    order = np.argsort(-scores[rows, winners], axis=1)
+
+    return winners[rows, order]
+
+
+# the model and the content index for the worker processes of the pool. Set
+# once per process by `_init_worker`, and only ever read afterwards.
+_worker_model = None
+_worker_content_index = None
+
+
+def _init_worker(model: FactorModel, content_index=None) -> None:
+    global _worker_model, _worker_content_index
+    _worker_model = model
+    _worker_content_index = content_index
+
+
+def _generate_shard(args: tuple) -> int:
+    """ `_generate_shard_with` the model and the content index of the worker
+    process.
+
+    """
+    return _generate_shard_with(_worker_model, _worker_content_index, args)
+
+
+def _generate_shard_with(model: FactorModel, content_index,
+                         args: tuple) -> int:
+    """ Generates the recommendations for all users of one shard.
+
+    The shard's recommendations file is rewritten from scratch.
+
+    Args:
+        model: the model to score the users against.
+
+        content_index: a `core.content_index.ContentIndex`, or None.
+
+        args: a tuple of the shard's users file, the shard's ratings files,
+        the shard's recommendations file, the number of recommendations per
+        user, and the default recommendations. The products a user rated are
+        not recommended. The users with few ratings get products similar to
+        them too, the ones with none the default recommendations, and the
+        others a few new products, see
+        `core.content_index.ContentIndex.complement`.
+
+    Returns:
+        the number of users processed.
+
+    """
+    users_file, ratings_files, recommendations_file, count, defaults = args
+
+    user_ids = [row[config.USER_COL] for row in
+                FileWarehouse.read_rows([users_file])]
+
+    seen = [(row[config.USER_COL], row[config.PRODUCT_COL]) for row in
+            FileWarehouse.read_rows(ratings_files)]
+
+    recommendations = model.recommend(user_ids, count, seen=seen)
+
+    if content_index is not None:
+        recommendations = content_index.complement(
+            user_ids, recommendations, seen, count, known_ids=model.item_ids,
+            defaults=defaults)
+
+    with open(recommendations_file, 'w') as handle:
+        for user_id, user_recommendations in zip(user_ids, recommendations):
+            FileWarehouse.write_row(handle, {
+                config.USER_COL: user_id,
+                'recommendations': user_recommendations
+            })
+
+    logger.debug('generated recommendations for {} users into {}'
+                 .format(len(user_ids), recommendations_file))
+
+    return len(user_ids)
+
+
+def generate_for_shards(warehouse: FileWarehouse, model: FactorModel,
+                        count: int,
+                        workers: int = config.GENERATION_WORKERS,
+                        progress: Callable = None,
+                        content_index=None, defaults: list = ()) -> int:
+    """ Generates recommendations for all the users in the warehouse, one task
+    per shard.
+
+    Shards are processed concurrently by a pool of `workers` processes. The
+    model is handed to each worker once, when the worker starts, so it is
+    never serialized per task. The ratings are sharded like the users, so
+    each task only reads the ratings of its own users to leave out what they
+    already rated.
+
+    Args:
+        warehouse: the warehouse holding the users, and receiving the
+        recommendations.
+
+        model: the model to score the users against.
+
+        count: the number of recommendations per user.
+
+        workers: the maximum number of worker processes.
+
+        progress: called with the number of users of every shard done.
+
+        content_index: a `core.content_index.ContentIndex` to blend the
+        recommendations of the users with few ratings with. None not to.
+
+        defaults: the default recommendations, for the users with no ratings
+        when there is a content index.
+
+    Returns:
+        the total number of users processed.
+
+    """
+    tasks = [(users_file, warehouse.ratings_files(shard=shard),
+              recommendations_file, count, list(defaults)) for
+             shard, (users_file, recommendations_file) in
+             enumerate(zip(warehouse.shard_files(warehouse.users_file),
+                           warehouse.shard_files(
+                               warehouse.recommendations_file)))]
+
+    workers = min(workers or 1, len(tasks))
+
+    # daemonic processes (like celery's prefork workers) cannot have children.
+    # In process, the model is passed along rather than set as the one of the
+    # worker, as the generations of several partitions may run at once on
+    # the threads of a `core.scheduler.PartitionScheduler`.
+    if workers <= 1 or multiprocessing.current_process().daemon:
+        return _count_users(map(functools.partial(
+            _generate_shard_with, model, content_index), tasks), progress)
+
+    logger.info('generating recommendations for {} shards with {} workers'
+                .format(len(tasks), workers))
+
+    with multiprocessing.Pool(processes=workers, initializer=_init_worker,
+                              initargs=(model, content_index)) as pool:
+        return _count_users(pool.imap_unordered(_generate_shard, tasks),
+                            progress)
+
+
+def _count_users(shard_users: Iterable[int], progress: Callable) -> int:
+    """ adds up the users of the shards as they are done, reporting each. """
+    total = 0
+
+    for users in shard_users:
+        total += users
+
+        if progress is not None:
+            progress(users)
+
+    return total
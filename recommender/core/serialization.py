@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import json
+import struct
+
+""" Encodings of the values the models store in redis.
+
+Each codec encodes with one version of its format, picked in the settings,
+and decodes all the versions it knows of, so values written before a format
+change still read. Binary values start with a one-byte version tag. Values
+without one are the legacy JSON text, which always starts with '[' or '{'.
+
+The serving layer (the product server) reads these values too, and has its
+own copy of the codecs, which has to be kept in line with this one.
+"""
+
+""" The legacy version: JSON text, without a version tag. """
+JSON = 0
+
+# the first byte of a legacy JSON value.
+_JSON_MARKERS = (ord('['), ord('{'))
+
+
+class Codec(object):
+    """ The base class of the codecs.
+
+    Subclasses fill in `encoders` and `decoders`, with a function per binary
+    version of their format.
+
+    Attributes:
+        version: the version to encode with. `JSON` writes the legacy format.
+
+    """
+
+    encoders = {}
+    decoders = {}
+
+    def __init__(self, version: int):
+        if version != JSON and version not in self.encoders:
+            raise ValueError('unknown {} version: {}'.format(
+                type(self).__name__, version))
+
+        self.version = version
+
+    def encode(self, value) -> bytes:
+        if self.version == JSON:
+            return json.dumps(value).encode()
+
+        return bytes((self.version,)) + self.encoders[self.version](value)
+
+    def decode(self, raw):
+        """ decodes a value written with any version of the format. """
+        if isinstance(raw, str):
+            raw = raw.encode()
+
+        version = raw[0]
+
+        if version in _JSON_MARKERS:
+            return json.loads(raw.decode())
+
+        try:
+            decoder = self.decoders[version]
+        except KeyError:
+            raise ValueError('unknown {} version: {}'.format(
+                type(self).__name__, version))
+
+        return decoder(raw[1:])
+
+
+def _pack_ids(ids: list) -> bytes:
+    return struct.pack('<{}i'.format(len(ids)), *ids)
+
+
+def _unpack_ids(payload: bytes) -> list:
+    return list(struct.unpack('<{}i'.format(len(payload) // 4), payload))
+
+
+class RecommendationsCodec(Codec):
+    """ Encodes a list of product ids.
+
+    Versions:
+        1: the ids packed as little-endian int32s, 4 bytes per id.
+
+    """
+
+    encoders = {1: _pack_ids}
+    decoders = {1: _unpack_ids}
+
+
+def _pack_meta(meta: dict) -> bytes:
+    name = meta['name'].encode()
+
+    return struct.pack('<I', len(name)) + name + meta['desc'].encode()
+
+
+def _unpack_meta(payload: bytes) -> dict:
+    name_length, = struct.unpack_from('<I', payload)
+
+    name_end = 4 + name_length
+
+    return {
+        'name': payload[4:name_end].decode(),
+        'desc': payload[name_end:].decode()
+    }
+
+
+class ProductCodec(Codec):
+    """ Encodes the metadata of a product, a dict with a `name` and a `desc`.
+
+    Versions:
+        1: the length of the UTF-8 name as a little-endian uint32, followed by
+        the UTF-8 name and the UTF-8 description.
+
+    """
+
+    encoders = {1: _pack_meta}
+    decoders = {1: _unpack_meta}
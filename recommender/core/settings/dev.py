@@ -20,15 +20,140 @@ USER_COL = 'user_id'
 PRODUCT_COL = 'product_id'
 RATINGS_COL = 'ratings'
 DEFAULT_USERID = -1
+WAREHOUSE_SHARDS = 1
+
+# loader. More than one worker parses the source files in parallel, in
+# chunks of about LOADER_CHUNK_BYTES.
+LOADER_WORKERS = 1
+LOADER_CHUNK_BYTES = 64 * 1024 * 1024
 
 # models
-ALLOWED_USER_IDS = [-1, 10001, 10002]
+USERS_BATCH_SIZE = 1000
+# the encoding versions of the values in redis, see `core.serialization`.
+RECOMMENDATIONS_ENCODING = 1
+PRODUCTS_ENCODING = 1
+# the layout of the product catalog in redis, 'keys' or 'buckets' (see
+# `core.models.Products`). Has to match the product server's. Buckets are only
+# compact while redis' hash-max-listpack-entries and -value settings (-ziplist-
+# before redis 7) fit the bucket size and the encoded products. Changing the
+# bucket size needs a migration to 'keys' and back.
+PRODUCTS_LAYOUT = 'keys'
+PRODUCTS_BUCKET_SIZE = 100
+PRODUCTS_BATCH_SIZE = 1000
+# the demo users, registered on a fresh setup.
+SEED_USER_IDS = [-1, 10001, 10002]
 
-# engine
+# engine. The class of the engines trained for a new partition, one of
+# `core.engines.ENGINES`. The exported engines are read back whatever their
+# class. The online learner needs one of the ALS engines.
+ENGINE = 'ALSRecommendationEngine'
 als_opts = {
     'rank_opts': [6, 8, 10, 12],
-    'reg_param_opts': [0.1, 1.0, 5.0, 10.0],
-    'max_iter_opts': [3, 10, 20]
+    'reg_param_opts': [0.1, 1.0, 5.0, 10.0]
 }
+# early stopping. The number of sweeps is not searched over: the trainings
+# run ALS_MAX_ITER sweeps at most, unless given max_iter_opts. The sweeps of
+# the implicit engines stop once the training loss improves by less than
+# ALS_TOLERANCE (relative) from one sweep to the next, or the validation metric
+# stops improving. The spark engine, whose sweeps run in one go, skips the
+# larger of the max_iter_opts given once the validation metric improves by less
+# than ALS_TOLERANCE.
+ALS_TOLERANCE = 1e-3
+ALS_MAX_ITER = 30
+EVALUATION_K = 10
+RELEVANCE_THRESHOLD = 4.0
+GENERATION_WORKERS = os.cpu_count()
+GENERATION_BATCH_SIZE = 1024
+# the scheduler of the jobs of many partitions, see `core.scheduler`. It runs
+# SCHEDULER_WORKERS jobs at once, at most SCHEDULER_PARTITION_JOBS of them of
+# the same partition, and the generation jobs with SCHEDULER_PARTITION_WORKERS
+# worker processes each.
+SCHEDULER_WORKERS = 4
+SCHEDULER_PARTITION_JOBS = 1
+SCHEDULER_PARTITION_WORKERS = 2
+# the exported versions of an engine to keep, see `core.model_store`. The
+# versions never promoted are removed after MODEL_STALE_VERSION_AGE seconds.
+MODEL_VERSIONS_KEPT = 3
+MODEL_STALE_VERSION_AGE = 3600.0
+# implicit engine. The confidence of a rating r is 1 + IMPLICIT_ALPHA * r
+# ('linear') or 1 + IMPLICIT_ALPHA * log(1 + r / IMPLICIT_EPSILON) ('log').
+IMPLICIT_CONFIDENCE = 'linear'
+IMPLICIT_ALPHA = 40.0
+IMPLICIT_EPSILON = 1.0
+IMPLICIT_CG_STEPS = 3
+IMPLICIT_BLOCK_SIZE = 256
+# out-of-core engine. The ratings are converted into shards of about
+# OUT_OF_CORE_SHARD_RATINGS ratings under OUT_OF_CORE_DIR, reading
+# OUT_OF_CORE_CHUNK_SIZE of them at a time. The candidate models are
+# evaluated on a sample of OUT_OF_CORE_EVALUATION_USERS users.
+OUT_OF_CORE_DIR = '{}/shards'.format(WAREHOUSE_ROOT)
+OUT_OF_CORE_SHARD_RATINGS = 1000000
+OUT_OF_CORE_CHUNK_SIZE = 1000000
+OUT_OF_CORE_EVALUATION_USERS = 10000
+# content index. The products are described by their genres and their name
+# tokens, hashed into CONTENT_HASH_BUCKETS features of CONTENT_TITLE_WEIGHT
+# each, and keep their CONTENT_NEIGHBORS most similar products. The
+# recommendations of the users with fewer than CONTENT_COLD_START_RATINGS
+# ratings are blended with the products similar to the ones they rated, and
+# the users with none get the default recommendations. CONTENT_NEW_SHARE of
+# the recommendations of the other users, and of the default ones, are new
+# products (unknown to the engine) similar to the ones they rated, or to the
+# popular ones.
+CONTENT_HASH_BUCKETS = 1024
+CONTENT_TITLE_WEIGHT = 0.5
+CONTENT_NEIGHBORS = 50
+CONTENT_COLD_START_RATINGS = 5
+CONTENT_NEW_SHARE = 0.2
+# item-kNN engine. Each item keeps its ITEM_KNN_NEIGHBORS most similar items,
+# by ITEM_KNN_SIMILARITY ('cosine' or 'pearson'). The pearson similarities are
+# shrunk towards 0 by n / (n + ITEM_KNN_SHRINKAGE), n the users rating both
+# items. The similarities are computed ITEM_KNN_BLOCK_SIZE items at a time.
+ITEM_KNN_NEIGHBORS = 50
+ITEM_KNN_SIMILARITY = 'cosine'
+ITEM_KNN_SHRINKAGE = 100.0
+ITEM_KNN_BLOCK_SIZE = 512
+
+# transporter
+TRANSPORTER_WORKERS = 8
+# the rating events published by the product server are consumed by the
+# RATING_EVENTS_CONSUMER of the RATING_EVENTS_GROUP, RATING_EVENTS_BATCH_SIZE
+# at a time, waiting up to RATING_EVENTS_BLOCK milliseconds for new ones.
+RATING_EVENTS_GROUP = 'warehouse'
+RATING_EVENTS_CONSUMER = 'transporter'
+RATING_EVENTS_BATCH_SIZE = 1000
+RATING_EVENTS_BLOCK = 1000
+# also store the recommendations rendered with the product details, as the
+# product server serves them, so it can serve them in a single read.
+RECOMMENDATION_PAYLOADS = False
+
+# online scoring. Single-user requests arriving within ONLINE_BATCH_WINDOW
+# seconds of each other are scored together, up to ONLINE_BATCH_SIZE at a time.
+ONLINE_BATCH_WINDOW = 0.005
+ONLINE_BATCH_SIZE = 256
+
+# online learning, see `core.online_learning`. The new ratings are read from
+# the warehouse every ONLINE_LEARNING_INTERVAL seconds, each applied with a
+# gradient step of ONLINE_LEARNING_RATE per unit of confidence, and, for the
+# implicit engines, steps away from ONLINE_NEGATIVE_SAMPLES random items. The
+# factors are checkpointed every ONLINE_CHECKPOINT_INTERVAL seconds, with their
+# drift from the batch model measured on the recommendations of
+# ONLINE_DRIFT_USERS users.
+ONLINE_LEARNING_INTERVAL = 5.0
+ONLINE_LEARNING_RATE = 0.01
+ONLINE_NEGATIVE_SAMPLES = 2
+ONLINE_CHECKPOINT_INTERVAL = 300.0
+ONLINE_DRIFT_USERS = 1000
+
+# progress of the tasks, see `core.progress`. Published at most every
+# PROGRESS_INTERVAL seconds within a stage.
+PROGRESS_INTERVAL = 1.0
+
+# profiling, see `core.profiling`. PROFILE_TASKS is the mode ('deterministic'
+# or 'sampling') every task is profiled with, None to only profile the tasks
+# asked to.
+PROFILES_DIR = '{}/profiles'.format(WAREHOUSE_ROOT)
+PROFILE_TASKS = None
+PROFILING_INTERVAL = 0.005
+PROFILES_KEPT = 100
 
 log_config_file = '{}/{}/settings/log.yaml'.format(PROJECT_ROOT, 'core')
\ No newline at end of file
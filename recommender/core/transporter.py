@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 import json
 import logging
+from collections import Generator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
 
-from core.models import Users
+from core.models import Users, Products, DataVersions, RatingEvents
 from core.warehouse import FileWarehouse
-from core import config
+from core import config, utils
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +20,9 @@ class Transporter(object):
 
     Typical roles include:
     * pick fresh ratings from the serving db and dump to warehouse
-    * pick fresh recommendations from the warehouse and dump to serving db
+    * stream the rating events of the serving layer to the warehouse
+    * pick fresh recommendations from the warehouse and dump to serving db,
+      optionally rendered as served
     * keep the global list of active users in sync
     * keep the global list of products in sync
 
@@ -30,73 +35,298 @@ class Transporter(object):
         (not implemented) product_model: a product model (to populate the
         serving db)
     """
+
+    # class-level instances, as in `DataLoader`, to facilitate unit testing.
+    versions_model = DataVersions
+    events_model = RatingEvents
+    products_model = Products
+
     def __init__(self, warehouse: FileWarehouse, user_model: Users):
         self.warehouse = warehouse
         self.user_model = user_model
 
-    def send_new_ratings_to_warehouse(self) -> None:
+    def send_new_ratings_to_warehouse(
+            self, batch_size: int = config.USERS_BATCH_SIZE) -> None:
         """ picks newly added ratings from the serving db and adds to the
         warehouse.
 
+        Only the users with activity since the last sync are visited. They are
+        streamed from the serving db, and their ratings fetched and written a
+        batch of users at a time, so memory stays bounded by the batch size.
+
+        Sends all the ratings of the active users, including those already
+        streamed by `consume_rating_events`, so it is meant for backfills
+        rather than to run alongside the consumer. The serving layer streams
+        its ratings instead of marking its users active, so the activity
+        left to send is from before the streaming, and is drained once.
+
+        Args:
+            batch_size: the number of users to process at a time.
+
+        """
+        partition = self.warehouse.partition
+
+        self.user_model.start_sync(data_partition=partition)
+
+        # all the new ratings go to the warehouse together, as one update.
+        self.warehouse.update_ratings(self._new_ratings(batch_size))
+
+        # only forget the activity once all of it is in the warehouse.
+        self.user_model.finish_sync(data_partition=partition)
+
+    def _new_ratings(self, batch_size: int) -> Generator:
+        """ streams the ratings of the users active since the last sync, in
+        the warehouse format.
+
         """
-        users = self.user_model.get_all(data_partition=self.warehouse.partition)
+        # a user repeated by the scan would have their ratings stored twice.
+        users = _distinct(self.user_model.get_syncing(
+            data_partition=self.warehouse.partition, batch_size=batch_size))
 
-        for user in users:
+        for batch in utils.batches(users, batch_size):
 
-            if user.has_rated():
-                ratings = user.get_ratings()
+            transformed_ratings = []
+
+            for user, ratings in zip(batch,
+                                     self.user_model.get_ratings_many(batch)):
                 logger.debug('User {} has ratings {}'.format(user.id, ratings))
-            else:
-                logger.debug('User {} has not rated anything.'.format(user.id))
+
+                transformed_ratings.extend(
+                    self._transform_rating(user, item) for item in ratings)
+
+            logger.info('sending {} ratings of {} users to warehouse'
+                        .format(len(transformed_ratings), len(batch)))
+
+            yield from transformed_ratings
+
+    def consume_rating_events(
+            self, consumer: str = config.RATING_EVENTS_CONSUMER,
+            batch_size: int = config.RATING_EVENTS_BATCH_SIZE,
+            block: int = config.RATING_EVENTS_BLOCK,
+            batches: int = None) -> int:
+        """ consumes the rating events published by the serving layer, and
+        adds them to the warehouse as they come.
+
+        Each batch of events is stored as one ratings segment, together with
+        the id of its last event, and only then acknowledged. On a restart,
+        the events left pending are delivered again, and those the warehouse
+        already holds are skipped, so every rating is stored exactly once.
+        As the warehouse has a single writer, so should the consumer group.
+
+        Args:
+            consumer: the name of the consumer in the group.
+
+            batch_size: the maximum number of events per segment.
+
+            block: the milliseconds to wait for new events.
+
+            batches: the number of reads of new events to stop after. Runs
+            forever if None.
+
+        Returns:
+            the number of ratings added to the warehouse.
+
+        """
+        partition = self.warehouse.partition
+        group = config.RATING_EVENTS_GROUP
+
+        self.events_model.create_group(group, partition)
+
+        # the events delivered before a restart come first.
+        pending = True
+        reads = 0
+        added = 0
+
+        while batches is None or reads < batches:
+            events = self.events_model.read(
+                group, consumer, partition, count=batch_size,
+                block=None if pending else block, pending=pending)
+
+            if pending and not events:
+                pending = False
                 continue
 
-            transformed_ratings = [self._transform_rating(user, item) for item
-                                   in ratings]
+            if not pending:
+                reads += 1
+
+            if events:
+                added += self._store_events(events, group)
+
+        return added
+
+    def _store_events(self, events: list, group: str) -> int:
+        """ stores a batch of events not yet in the warehouse, and
+        acknowledges all of them.
 
-            logger.info('sending ratings: {} to warehouse'
-                         .format(transformed_ratings))
+        Returns:
+            the number of ratings stored.
 
-            self.warehouse.update_ratings(transformed_ratings)
+        """
+        partition = self.warehouse.partition
+        source = self.events_model.key(partition)
+
+        offset = self.warehouse.ratings_offsets().get(source)
+
+        # the events trimmed from the stream before they were stored are
+        # lost, and only acknowledged.
+        new_events = [rating for event_id, rating in events if
+                      rating is not None and (offset is None or
+                      _stream_position(event_id) > _stream_position(offset))]
+
+        self.warehouse.update_ratings(
+            (self._transform_event(rating) for rating in new_events),
+            offsets={source: events[-1][0]})
+
+        self.events_model.ack(group, [event_id for event_id, _ in events],
+                              partition)
 
-    def send_recommendations_to_db(self) -> None:
+        backlog = self.events_model.backlog(group, partition)
+
+        logger.info('stored {} of {} rating events, {} pending and {} '
+                    'undelivered'.format(
+                        len(new_events), len(events), backlog['pending'],
+                        backlog['lag']))
+
+        return len(new_events)
+
+    def send_recommendations_to_db(
+            self, workers: int = config.TRANSPORTER_WORKERS,
+            payloads: bool = config.RECOMMENDATION_PAYLOADS) -> None:
         """ picks recommendations from the warehouse and adds it to the
         serving db.
 
+        Each shard of the recommendations is loaded by its own thread, with up
+        to `workers` shards in flight at a time.
+
+        Args:
+            workers: the maximum number of shards to load concurrently.
+
+            payloads: also store the recommendations rendered with the
+            details of the products, exactly as the product server serves
+            them, so it serves them with a single read instead of joining
+            them with the catalog. The payloads record the version of the
+            catalog they were rendered with, and are ignored by the product
+            server once it changes, until the recommendations are sent again.
+
         """
-        with open(self.warehouse.recommendations_file) as recommendations:
+        files = self.warehouse.shard_files(self.warehouse.recommendations_file)
+
+        products_version = None
+
+        if payloads:
+            products_version = self.versions_model.get(
+                'products', data_partition=self.warehouse.partition)
 
-            for recommendation in recommendations:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # consume the results, so that errors in any shard are raised.
+            for _ in executor.map(self._send_recommendations_file, files,
+                                  [products_version] * len(files)):
+                pass
 
-                user_id, transformed_recommendation = \
-                    self._transform_recommendation(recommendation)
-                user = self.user_model.get(id=user_id,
+        # let the serving layer know that its cached recommendations are stale.
+        self.versions_model.bump('recommendations',
                                  data_partition=self.warehouse.partition)
-                user.set_recommendations(transformed_recommendation)
-                logger.debug('recommendations set for user {}: {}'
-                             .format(user.id, transformed_recommendation))
 
-    def send_users_to_warehouse(self) -> None:
+    def _send_recommendations_file(
+            self, file: str, products_version: int = None,
+            batch_size: int = config.USERS_BATCH_SIZE) -> None:
+        """ loads the recommendations in one warehouse file to the serving
+        db, a batch of users at a time. They are also rendered, with the
+        given version of the catalog, unless it is None.
+
+        """
+        with open(file) as recommendations:
+
+            for batch in utils.batches(recommendations, batch_size):
+
+                transformed_recommendations = [
+                    self._transform_recommendation(recommendation) for
+                    recommendation in batch]
+
+                if products_version is None:
+                    self.user_model.set_recommendations_many(
+                        transformed_recommendations,
+                        data_partition=self.warehouse.partition)
+                else:
+                    self.user_model.set_recommendations_many(
+                        transformed_recommendations,
+                        data_partition=self.warehouse.partition,
+                        payloads=self._render_payloads(
+                            transformed_recommendations, products_version))
+
+                logger.debug('recommendations set for {} users from {}'
+                             .format(len(batch), file))
+
+    def _render_payloads(self, recommendations: list,
+                         products_version: int) -> list:
+        """ renders the recommendations of a batch of users, fetching the
+        details of all their products in one round trip.
+
+        Returns:
+            a list with the payload of each user, see
+            `Users.set_recommendations_many`. None for the users without
+            recommendations, who are served the default ones.
+
+        """
+        product_ids = list({product_id for _, user_recommendations in
+                            recommendations for product_id in
+                            user_recommendations})
+
+        products = dict(zip(product_ids, self.products_model.get_many(
+            product_ids, data_partition=self.warehouse.partition)))
+
+        payloads = []
+
+        for _, user_recommendations in recommendations:
+            if not user_recommendations:
+                payloads.append(None)
+                continue
+
+            payloads.append({
+                'products_version': products_version,
+                # products gone from the catalog are left out.
+                'recommendations': [
+                    self._render_product(products[product_id]) for
+                    product_id in user_recommendations if
+                    products[product_id] is not None],
+            })
+
+        return payloads
+
+    def send_users_to_warehouse(
+            self, batch_size: int = config.USERS_BATCH_SIZE) -> None:
         """ creates a global list of users (for whom recommendations need to be
         generated) from the serving db and adds it to the warehouse.
 
+        The users are streamed from the registry in the serving db, and
+        checked a batch at a time, so memory stays bounded by the batch size.
+
+        Args:
+            batch_size: the number of users to check at a time.
+
         """
-        users = self.user_model.get_all(data_partition=self.warehouse.partition)
+        self.warehouse.update_users(self._users_with_ratings(batch_size))
 
-        transformed_users = []
+    def _users_with_ratings(self, batch_size: int) -> Generator:
+        """ streams the registered users who have rated something, in the
+        warehouse format.
 
-        for user in users:
-            # TODO actually this should be user.has_used_anything()
-            if user.has_rated():
-                transformed_users.append(self._transform_user(user))
-                logger.debug('sending user {} to warehouse.'.format(user.id))
-            else:
-                logger.debug('user {} has not used any product.'
-                             'Not sending to warehouse.'.format(user.id))
+        """
+        # the users rows are expected to be distinct.
+        users = _distinct(self.user_model.get_all(
+            data_partition=self.warehouse.partition, batch_size=batch_size))
 
-        logger.info(
-            'total users sent to warehouse: {}'.format(len(transformed_users)))
+        sent = 0
+
+        for batch in utils.batches(users, batch_size):
+            # TODO actually this should be user.has_used_anything()
+            for user, ratings in zip(batch,
+                                     self.user_model.get_ratings_many(batch)):
+                if ratings:
+                    sent += 1
+                    yield self._transform_user(user)
 
-        self.warehouse.update_users(transformed_users)
+        logger.info('total users sent to warehouse: {}'.format(sent))
 
     def send_products_to_warehouse(self) -> None:
         """ creates a global list of products (which are candidates for
@@ -115,6 +345,14 @@ class Transporter(object):
             config.RATINGS_COL: rating['rating']
         }
 
+    @staticmethod
+    def _transform_event(rating: dict) -> dict:
+        return {
+            config.USER_COL: rating['user_id'],
+            config.PRODUCT_COL: rating['product_id'],
+            config.RATINGS_COL: rating['rating']
+        }
+
     @staticmethod
     def _transform_recommendation(recommendation_str: str) -> tuple:
         recommendation = json.loads(recommendation_str.strip())
@@ -128,3 +366,37 @@ class Transporter(object):
     @staticmethod
     def _transform_user(user: Users) -> dict:
         return {config.USER_COL: user.id}
+
+    @staticmethod
+    def _render_product(product: Products) -> dict:
+        """ renders a product as the product server does in its
+        recommendations, which has to be kept in line with this.
+
+        """
+        return {
+            'product_id': product.id,
+            'meta': {
+                'name': product.name,
+                'desc': product.desc
+            }
+        }
+
+
+def _distinct(users: Iterable) -> Generator:
+    """ drops the users already streamed, which a `SSCAN` can repeat. Only
+    their ids are kept, for the duration of the sync.
+
+    """
+    seen = set()
+
+    for user in users:
+        if user.id not in seen:
+            seen.add(user.id)
+            yield user
+
+
+def _stream_position(event_id: str) -> tuple:
+    """ the order of a redis stream id, '<milliseconds>-<sequence>'. """
+    milliseconds, sequence = event_id.split('-')
+
+    return int(milliseconds), int(sequence)
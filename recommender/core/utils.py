@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import itertools
 import os
 import shutil
+from typing import Iterable, Iterator
 
 
 def create_directory(directory: str) -> None:
@@ -16,3 +18,16 @@ def delete_directory(directory: str) -> None:
 
 def touch_file(file: str) -> None:
     open(file, 'w').close()
+
+
+def batches(iterable: Iterable, size: int) -> Iterator[list]:
+    """ splits an iterable into lists of at most `size` items, lazily. """
+    iterator = iter(iterable)
+
+    while True:
+        batch = list(itertools.islice(iterator, size))
+
+        if not batch:
+            return
+
+        yield batch
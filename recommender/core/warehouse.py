@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 import json
 import logging
+import os
+import time
+import uuid
+import zlib
 from abc import ABC, abstractmethod
 from io import TextIOWrapper
+from typing import Iterable, Iterator
 
 from core import config, utils
 from core.exceptions import WarehouseException
@@ -80,7 +85,15 @@ class FileWarehouse(Warehouse):
         type of data.
 
         ratings_file: a warehouse file containing the ratings data in a
-        standard format.
+        standard format. It holds the bulk loaded ratings, and the ratings
+        added later are stored in segments next to it. See
+        `ratings_files`.
+
+        ratings_manifest_file: a warehouse file listing the ratings
+        segments.
+
+        popularity_file: a warehouse file with the running popularity of the
+        products, see `core.popularity`.
 
         training_file: a warehouse file containing the training data in a
         standard format. A subset of the ratings data.
@@ -94,15 +107,29 @@ class FileWarehouse(Warehouse):
         products_file: a warehouse file containing the product details in a
         standard format.
 
+        content_index_file: a warehouse file with the most similar products
+        of each product by their metadata, see `core.content_index`.
+
         recommendations_file: a warehouse file that contains the recommendations
         generated by the engine.
 
         users_file: a warehouse file containing the details of all the active
         users of the system.
 
+        shards: the number of user-hash shards that the ratings, users and
+        recommendations data sets are split into. With a single shard, each
+        data set is one flat file. With more, each data set is stored as
+        `shards` files, and a user's rows always go to the same shard. See
+        `shard_files` and `shard_of`.
+
     """
-    def __init__(self, partition: str):
+    def __init__(self, partition: str, shards: int = config.WAREHOUSE_SHARDS):
+        if shards < 1:
+            raise WarehouseException(
+                "shards should be a positive integer, got {}".format(shards))
+
         self.partition = partition
+        self.shards = shards
         self.root_path = '{}/{}'.format(config.WAREHOUSE_DATA_DIR,
                                         self.partition)
         self.ratings_file = '{}/ratings'.format(self.root_path)
@@ -112,6 +139,11 @@ class FileWarehouse(Warehouse):
         self.products_file = '{}/products'.format(self.root_path, )
         self.recommendations_file = '{}/recommendations'.format(self.root_path)
         self.users_file = '{}/users'.format(self.root_path)
+        self.ratings_manifest_file = '{}/ratings_manifest.json'.format(
+            self.root_path)
+        self.popularity_file = '{}/popularity.json'.format(self.root_path)
+        self.content_index_file = '{}/content_index.npz'.format(
+            self.root_path)
 
     def cleanup(self) -> None:
         """ Sanitizes and bootstraps a warehouse partition.
@@ -126,51 +158,244 @@ class FileWarehouse(Warehouse):
         utils.create_directory(self.root_path)
 
         for file in (
-                self.ratings_file,
                 self.training_file,
                 self.test_file,
                 self.validation_file,
-                self.products_file,
+                self.products_file):
+            utils.touch_file(file)
+
+        for file in (
+                self.ratings_file,
                 self.recommendations_file,
                 self.users_file):
-            utils.touch_file(file)
+            for shard_file in self.shard_files(file):
+                utils.touch_file(shard_file)
+
+        self.reset_ratings()
 
     def delete(self) -> None:
         """ Removes all data from the warehouse partition """
         utils.delete_directory(self.root_path)
 
-    def update_ratings(self, new_ratings: list) -> None:
+    def update_ratings(self, new_ratings: Iterable[dict],
+                       offsets: dict = None) -> None:
         """ Implements `Warehouse.update_ratings`. Assumes new ratings as
-        incremental updates, and adds them to the ratings file.
+        incremental updates, and stores them as a new ratings segment.
+
+        The segment only becomes visible once all of it is written, when it is
+        added to the manifest. There should be a single writer at a time.
 
         Args:
-            new_ratings: a list of ratings, where each rating is a dict with the
-            keys `user_id`, `product_id` and `rating`.
+            new_ratings: an iterable of ratings, where each rating is a dict
+            with the keys `user_id`, `product_id` and `rating`. It is consumed
+            once, so it can be a generator.
+
+            offsets: a dict of source (eg. a stream) to the position in it
+            that the new ratings go up to. Recorded in the manifest together
+            with the segment, so a source can be replayed without adding its
+            ratings twice. See `ratings_offsets`.
 
         """
         # TODO check for duplicate entries in ratings file and deduplicate.
+        manifest = self.ratings_manifest()
+
+        sequence = manifest['segments'][-1]['sequence'] + 1
+
+        files = self.ratings_segment_files(sequence)
+
+        rows = 0
+
         try:
-            with open(self.ratings_file, 'a') as ratings_file:
+            ratings_files = [open(file, 'w') for file in files]
+            try:
                 for rating in new_ratings:
-                    self.write_row(ratings_file, rating)
+                    shard = self.shard_of(rating[config.USER_COL])
+                    self.write_row(ratings_files[shard], rating)
+                    rows += 1
+            finally:
+                for ratings_file in ratings_files:
+                    ratings_file.close()
+
+            if offsets:
+                manifest.setdefault('offsets', {}).update(offsets)
+
+            if not rows:
+                for file in files:
+                    os.remove(file)
+
+                if offsets:
+                    self._write_ratings_manifest(manifest)
+                return
+
+            manifest['segments'].append({
+                'sequence': sequence,
+                'rows': rows,
+                'created_at': time.time(),
+            })
+            self._write_ratings_manifest(manifest)
         except IOError as e:
             message = "Unable to update ratings. Error reported:{}".format(e)
             logger.error(message)
             raise WarehouseException(message) from e
 
+        logger.info('added ratings segment {} with {} ratings'.format(
+            sequence, rows))
+
+    def reset_ratings(self) -> None:
+        """ Drops the ratings segments, and starts a new generation of the
+        ratings data set with just the bulk loaded ratings. To be called
+        whenever those are (re)loaded.
+
+        Watermarks taken before the reset are no longer valid, see
+        `ratings_files`. The offsets of the sources are kept, so their
+        ratings are not added again.
+
+        """
+        manifest = self.ratings_manifest()
+
+        if os.path.exists(self.ratings_manifest_file):
+            for segment in manifest['segments']:
+                if segment['sequence']:
+                    for file in self.ratings_segment_files(
+                            segment['sequence']):
+                        if os.path.exists(file):
+                            os.remove(file)
+
+        self._write_ratings_manifest({
+            'generation': uuid.uuid4().hex,
+            'segments': [{'sequence': 0, 'created_at': time.time()}],
+            'offsets': manifest.get('offsets', {}),
+        })
+
+    def ratings_manifest(self) -> dict:
+        """ Loads the manifest of the ratings segments.
+
+        Returns:
+            a dict with the `generation` of the ratings data set, its
+            `segments` in the order they were added, and the `offsets` of
+            its sources. Each segment is a dict with its `sequence` number
+            and the time it was `created_at`. Segment 0 holds the bulk loaded
+            ratings.
+
+        """
+        if not os.path.exists(self.ratings_manifest_file):
+            # a warehouse from before the segments: all in segment 0.
+            return {'generation': None, 'segments': [{'sequence': 0}]}
+
+        with open(self.ratings_manifest_file) as manifest_file:
+            return json.load(manifest_file)
+
+    def ratings_offsets(self) -> dict:
+        """ the positions in their sources that the stored ratings go up to,
+        see `update_ratings`.
+
+        """
+        return self.ratings_manifest().get('offsets', {})
+
+    def _write_ratings_manifest(self, manifest: dict) -> None:
+        """ replaces the manifest atomically, so readers never see a partial
+        one.
+
+        """
+        temporary_file = '{}.tmp'.format(self.ratings_manifest_file)
+
+        with open(temporary_file, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+
+        os.replace(temporary_file, self.ratings_manifest_file)
+
+    def ratings_segment_files(self, sequence: int) -> list:
+        """ Lists the physical files of a ratings segment.
+
+        Returns:
+            a list of file paths, indexed by shard number, like
+            `shard_files`. Segment 0 is `shard_files(ratings_file)`.
+
+        """
+        files = self.shard_files(self.ratings_file)
+
+        if not sequence:
+            return files
+
+        return ['{}.{:08d}'.format(file, sequence) for file in files]
+
+    def ratings_watermark(self) -> list:
+        """ Marks the current end of the ratings data set.
+
+        Returns:
+            a [generation, sequence] pair, to pass to `ratings_files`.
+
+        """
+        manifest = self.ratings_manifest()
+
+        return [manifest['generation'], manifest['segments'][-1]['sequence']]
+
+    def ratings_files(self, since: list = None, until: list = None,
+                      shard: int = None) -> list:
+        """ Lists the files of the ratings data set, or of just a part of it.
+
+        An incremental reader keeps the watermark it read up to, and passes it
+        as `since` next time, to only read the ratings added in between.
+
+        Args:
+            since: a watermark from `ratings_watermark`. Only the segments
+            added after it are listed. All of them if None.
+
+            until: a watermark from `ratings_watermark`. Only the segments
+            up to it are listed. All of them if None.
+
+            shard: only list the files of this shard, ie. the ratings of its
+            users. All the shards if None.
+
+        Returns:
+            a list of file paths, segment by segment in the order they were
+            added.
+
+        Raises:
+            WarehouseException: if a watermark is from another generation
+            of the data set, ie. from before a `reset_ratings`. The reader
+            then has to start over, with all the ratings.
+
+        """
+        manifest = self.ratings_manifest()
+
+        for watermark in (since, until):
+            if watermark is not None and \
+                    watermark[0] != manifest['generation']:
+                raise WarehouseException(
+                    "stale ratings watermark {}, the generation is now {}"
+                    .format(watermark, manifest['generation']))
+
+        low = -1 if since is None else since[1]
+
+        high = float('inf') if until is None else until[1]
+
+        shards = range(self.shards) if shard is None else [shard]
+
+        return [self.ratings_segment_files(segment['sequence'])[number] for
+                segment in manifest['segments'] if
+                low < segment['sequence'] <= high for number in shards]
+
     def update_users(self, users: list) -> None:
         """ Implements `Warehouse.update_users`. Assumes a global list of users
         to be provided each time, and swaps its current data for the new data.
 
         Args:
-            users: a list of users, where each user is a dict with a single
-            key `user_id`.
+            users: an iterable of users, where each user is a dict with a
+            single key `user_id`. It is consumed once, so it can be a
+            generator.
 
         """
         try:
-            with open(self.users_file, 'w') as users_file:
+            users_files = [open(file, 'w') for file in
+                           self.shard_files(self.users_file)]
+            try:
                 for user in users:
-                    self.write_row(users_file, user)
+                    shard = self.shard_of(user[config.USER_COL])
+                    self.write_row(users_files[shard], user)
+            finally:
+                for users_file in users_files:
+                    users_file.close()
         except IOError as e:
             message = "Unable to update users. Error reported:{}".format(e)
             logger.error(message)
@@ -194,15 +419,65 @@ class FileWarehouse(Warehouse):
             'recommendations': recommendations
         }
 
+        shard_file = \
+            self.shard_files(self.recommendations_file)[self.shard_of(user_id)]
+
         # TODO Should ideally upsert (update if exists, add otherwise)
         try:
-            with open(self.recommendations_file, 'a') as recommendations_file:
+            with open(shard_file, 'a') as recommendations_file:
                 self.write_row(recommendations_file, recommendation_dict)
         except IOError as e:
             message = "Unable to update recommendations. Error reported:{}".format(e)
             logger.error(message)
             raise WarehouseException(message)
 
+    def shard_files(self, file: str) -> list:
+        """ Lists the physical files backing a sharded data set.
+
+        Args:
+            file: one of `ratings_file`, `users_file` or
+            `recommendations_file`.
+
+        Returns:
+            a list of file paths, indexed by shard number. For an unsharded
+            warehouse this is just `[file]`.
+
+        """
+        if self.shards == 1:
+            return [file]
+
+        return ['{}-{:05d}'.format(file, shard) for shard in
+                range(self.shards)]
+
+    def shard_of(self, user_id: int) -> int:
+        """ Maps a user id to its shard number.
+
+        Uses crc32 rather than the builtin `hash`, so that the mapping is
+        stable across processes and interpreter runs.
+
+        """
+        if self.shards == 1:
+            return 0
+
+        return zlib.crc32(str(user_id).encode()) % self.shards
+
+    @staticmethod
+    def read_rows(files: list) -> Iterator[dict]:
+        """ Streams the records stored in one or more warehouse files.
+
+        Args:
+            files: a list of file paths, typically from `shard_files`.
+
+        Returns:
+            a generator of dicts, one for each non-empty line.
+
+        """
+        for file in files:
+            with open(file) as handle:
+                for line in handle:
+                    if line.strip():
+                        yield json.loads(line)
+
     @staticmethod
     def write_row(handle: TextIOWrapper, data: dict) -> None:
         """ A generic method that can be used by any file-aware caller.
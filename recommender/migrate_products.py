@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+
+from core.models import Products, KEYS_LAYOUT, BUCKETS_LAYOUT
+
+logger = logging.getLogger(__name__)
+
+""" Moves the product catalog of a partition between the redis layouts.
+
+eg. to switch the movielens catalog to bucketed hashes:
+
+    python migrate_products.py movielens buckets
+
+then set `PRODUCTS_LAYOUT = 'buckets'` in the settings of both servers. See
+`Products.migrate` for migrating without downtime.
+"""
+
+parser = argparse.ArgumentParser(
+    description='Moves a product catalog between the redis layouts.')
+parser.add_argument('partition')
+parser.add_argument('layout', choices=[KEYS_LAYOUT, BUCKETS_LAYOUT])
+parser.add_argument('--keep-source', action='store_true',
+                    help='keep the catalog in the old layout')
+args = parser.parse_args()
+
+copied = Products.migrate(args.partition, args.layout,
+                          delete_source=not args.keep_source)
+
+logger.info('copied {} products to the {} layout'.format(copied, args.layout))
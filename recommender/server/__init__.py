@@ -17,7 +17,9 @@ api = Api(app)
 
 log.configure_logging()
 
-from server import views
+from server import profiling, views
+
+profiling.install(app)
 
 # Set up a global spark session.
 ALSRecommendationEngine._load_spark_session()
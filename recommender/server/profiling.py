@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import logging
+import uuid
+
+from flask import Flask, g, request
+
+from core import config as core_config
+from core.profiling import MODES, Profile
+from server import config
+
+logger = logging.getLogger(__name__)
+
+""" Opt-in profiling of the requests to the recommender server, see
+`core.profiling`. """
+
+""" The request header to profile a single request with, set to a mode. """
+PROFILE_HEADER = 'X-Profile'
+
+""" The response header with the name of the saved profile. """
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+
+def enabled() -> bool:
+    """ whether the requests or the tasks can be profiled at all, and so
+    whether the saved profiles are served.
+
+    """
+    return bool(config.PROFILE_REQUESTS or config.PROFILING_HEADER_ENABLED or
+                core_config.PROFILE_TASKS)
+
+
+def install(app: Flask) -> None:
+    """ Profiles the requests to a flask app.
+
+    Every request is profiled with the `PROFILE_REQUESTS` mode, if set, and
+    single requests with the mode in their `X-Profile` header, if
+    `PROFILING_HEADER_ENABLED`. The name of the saved profile is sent back in
+    the `X-Profile-Id` header.
+
+    """
+    @app.before_request
+    def start_profile():
+        mode = config.PROFILE_REQUESTS
+
+        if config.PROFILING_HEADER_ENABLED:
+            mode = request.headers.get(PROFILE_HEADER, mode)
+
+        if not mode:
+            return
+
+        if mode not in MODES:
+            logger.warning('ignoring unknown profiling mode: {}'.format(mode))
+            return
+
+        name = 'request-{}'.format(
+            request.headers.get('X-Request-Id', uuid.uuid4().hex))
+
+        g.profile = Profile(name, mode, directory=core_config.PROFILES_DIR)
+        g.profile.start()
+
+    @app.after_request
+    def stop_profile(response):
+        profile = g.pop('profile', None)
+
+        if profile is not None:
+            response.headers[PROFILE_ID_HEADER] = profile.stop()
+
+        return response
+
+    @app.teardown_request
+    def stop_failed_profile(exception):
+        profile = g.pop('profile', None)
+
+        if profile is not None:
+            profile.stop()
@@ -1,23 +1,202 @@
 # -*- coding: utf-8 -*-
 import logging
+import os
+import re
+import threading
 from http import HTTPStatus
 
-from flask import request, Request
+from flask import request, Request, send_from_directory
 from flask_restful import Resource
-from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import BadRequest, NotFound
 
-from core.engines import ALSRecommendationEngine
+from core import config as core_config, profiling
+from core.batching import MicroBatcher
+from core.content_index import ContentIndex
+from core.engines import engine_class, import_engine
+from core.evaluation import METRICS
 from core.extensions import warehouse
+from core.model_store import ModelStore
+from core.rated import RatedProducts
+from core.scheduler import JOBS, TRAIN, engine_path
+from core.scoring import FactorModel
+from core.warehouse import FileWarehouse
 from server import config
 from server import tasks, api
+from server import profiling as server_profiling
 from server.exceptions import HTTPBadRequest, HTTPInternalServerError
 
 logger = logging.getLogger(__name__)
 
-""" Set up a path for the engine to be serialized and deserialized from. """
-ENGINE_PATH = '{}/{}/core_app_{}'.format(config.PROJECT_ROOT,
-                                         'warehouse_dir/models',
-                                         warehouse.partition)
+""" Set up a path for the engine to be serialized and deserialized from. The
+other partitions are addressed by their name, see `_engine_path`. """
+ENGINE_PATH = engine_path(warehouse.partition)
+
+
+def _engine_path(partition: str = None) -> str:
+    """ the engine path of a warehouse partition, the default one if None.
+    Only the existing partitions can be addressed.
+
+    """
+    if partition is None:
+        return ENGINE_PATH
+
+    if not re.fullmatch(r'\w+', partition) or \
+            not os.path.isdir(FileWarehouse(partition).root_path):
+        message = 'unknown partition: {}'.format(partition)
+        logger.error(message)
+        raise HTTPBadRequest(message, payload={'message': message})
+
+    return engine_path(partition)
+
+
+class ResidentModel(object):
+    """ The scoring model of the current engine, kept in memory for online
+    requests.
+
+    The model is snapshotted from the engine on first use, and again whenever
+    a new version of the engine is promoted, so a retrained engine gets picked
+    up without a restart.
+
+    The recommendations are the same as the generated ones: the products the
+    users rated are left out, the users with few ratings get products similar
+    to them too, and the ones with none the default recommendations. So the
+    products rated by each user are kept as well (see `core.rated`), read
+    along with the snapshot, and brought up to date with the ratings added to
+    the warehouse since, on every request.
+
+    Attributes:
+        path: the path of the engine.
+
+        recommendation_count: the number of recommendations per user of the
+        engine, as of the last snapshot.
+
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.recommendation_count = None
+
+        # the requests only wait on `_lock`. A snapshot is loaded under
+        # `_loading`, and swapped in under `_lock` once ready.
+        self._lock = threading.Lock()
+        self._loading = threading.Lock()
+        self._version = None
+        self._model = None
+        self._content_index = None
+        self._defaults = []
+        self._rated = None
+
+    def get(self) -> FactorModel:
+        """ the current model, snapshotted again if the engine changed. """
+        # engines exported before the versioned layout have no version.
+        version = ModelStore(self.path).current_version() or \
+            os.path.getmtime('{}/{}'.format(self.path, 'params.json'))
+
+        if self._outdated(version):
+            with self._loading:
+                if self._outdated(version):
+                    self._snapshot(version)
+
+        return self._model
+
+    def recommend(self, user_ids: list, count: int) -> list:
+        """ the top recommendations of distinct users, as generated by
+        `core.scoring.generate_for_shards`.
+
+        """
+        model = self.get()
+
+        with self._lock:
+            # only reads the ratings added since the last request.
+            self._rated.update()
+
+            content_index = self._content_index
+            defaults = self._defaults
+
+            seen = self._rated.seen(user_ids)
+
+        recommendations = model.recommend(user_ids, count, seen=seen)
+
+        if content_index is not None:
+            recommendations = content_index.complement(
+                user_ids, recommendations, seen, count,
+                known_ids=model.item_ids, defaults=defaults[:count])
+
+        return recommendations
+
+    def _outdated(self, version) -> bool:
+        """ whether the engine changed, or the ratings were reloaded, since
+        the last snapshot.
+
+        """
+        return version != self._version or self._rated.stale()
+
+    def _snapshot(self, version) -> None:
+        """ loads the engine, and the products rated by its users if they
+        have to be read again. The requests go on with the previous
+        snapshot meanwhile.
+
+        """
+        engine = import_engine(self.path)
+
+        model = engine.factor_model()
+        content_index = ContentIndex.load(engine.warehouse)
+        defaults = engine.default_recommendations(model, content_index)
+
+        rated = self._rated
+
+        if rated is None or rated.stale() or \
+                rated.warehouse.partition != engine.warehouse.partition:
+            rated = RatedProducts(engine.warehouse)
+            rated.update()
+
+        with self._lock:
+            self._model = model
+            self._content_index = content_index
+            self._defaults = defaults
+            self._rated = rated
+            self.recommendation_count = engine.recommendation_count
+            self._version = version
+
+        logger.info('loaded the resident model of {} users and {} '
+                    'items'.format(len(model.user_ids), len(model.item_ids)))
+
+
+def _recommend_batch(model: ResidentModel, requests: list) -> list:
+    """ scores a batch of (user id, count) requests with one matrix product.
+    The lists are sorted best first, so the shorter ones are prefixes of the
+    longest.
+
+    """
+    count = max(count for _, count in requests)
+
+    # a user can be requested more than once in a batch.
+    user_ids = list(dict.fromkeys(user_id for user_id, _ in requests))
+
+    recommendations = dict(zip(user_ids, model.recommend(user_ids, count)))
+
+    return [recommendations[user_id][:user_count] for user_id, user_count in
+            requests]
+
+
+""" The models for the online recommendations, and the batchers coalescing
+their concurrent single-user requests, by engine path. """
+_residents = {}
+_residents_lock = threading.Lock()
+
+
+def _resident(path: str) -> tuple:
+    """ the resident model of an engine path, and its batcher. Created on
+    first use.
+
+    """
+    with _residents_lock:
+        if path not in _residents:
+            model = ResidentModel(path)
+            _residents[path] = (model, MicroBatcher(
+                lambda requests: _recommend_batch(model, requests)))
+
+        return _residents[path]
 
 
 class EngineResource(Resource):
@@ -33,7 +212,7 @@ class EngineResource(Resource):
     This class handles the individual resource.
 
     """
-    def get(self, engine_id: str):
+    def get(self, engine_id: str, partition: str = None):
         """ fetch the details of an engine.
 
         As per design, the only supported engine resource is the current one.
@@ -41,6 +220,9 @@ class EngineResource(Resource):
         Args:
             engine_id: identifier for the engine resource. Currently supports
             only 1 value - "current".
+
+            partition: the warehouse partition of the engine, the default one
+            if None.
         """
 
         # validate the engine id
@@ -53,8 +235,7 @@ class EngineResource(Resource):
 
         # Load the current engine.
         try:
-            current_engine = ALSRecommendationEngine.import_from_path(
-                ENGINE_PATH)
+            current_engine = import_engine(_engine_path(partition))
         except Exception as e:
             message = "Error loading the recommendation engine."
             logger.error(message, *e.args)
@@ -81,23 +262,61 @@ class EnginesResource(Resource):
     This class handles the group (list?) resource.
 
     """
-    def post(self):
+    def post(self, partition: str = None):
         """ Train a new engine resource. When fully trained, this engine will
         be mapped to the "current" engine resource.
 
+        The payload has the `als_opts`, the options of the engine to choose
+        from, which depend on its class, see
+        `RecommendationEngine.model_opts`, and an optional `metric`.
+
+        Args:
+            partition: the warehouse partition to train on, the default one
+            if None.
+
         """
-        # validate the als options provided in request body
+        path = _engine_path(partition)
+
+        engine = engine_class(path)
+
+        # validate the options provided in request body
         try:
-            assert self._has_valid_als_opts(request)
+            assert self._has_valid_als_opts(request, engine)
         except AssertionError:
-            message = 'ALS opts seem invalid.Please check the payload.'
+            required, optional = engine.model_opts()
+            message = 'ALS opts seem invalid.Please check the payload. The ' \
+                      'options of a {} are {}, and optionally {}.'.format(
+                          engine.__name__, list(required), list(optional))
             logger.error(message)
             raise HTTPBadRequest(message, payload={'message': message})
 
         als_opts = request.get_json()['als_opts']
 
+        # the metric to choose the best model by is optional.
+        metric = request.get_json().get('metric', engine.default_metric)
+
+        if metric not in METRICS:
+            message = 'metric should be one of {}.'.format(sorted(METRICS))
+            logger.error(message)
+            raise HTTPBadRequest(message, payload={'message': message})
+
+        # the training can be profiled, see `core.profiling`, if the clients
+        # are allowed to.
+        profile = request.get_json().get('profile')
+
+        if profile is not None and not config.PROFILING_HEADER_ENABLED:
+            message = 'profiling is disabled.'
+            logger.error(message)
+            raise HTTPBadRequest(message, payload={'message': message})
+
+        if profile is not None and profile not in profiling.MODES:
+            message = 'profile should be one of {}.'.format(profiling.MODES)
+            logger.error(message)
+            raise HTTPBadRequest(message, payload={'message': message})
+
         # start training a new model asynchronously
-        task = tasks.train_new_model.delay(ENGINE_PATH, **als_opts)
+        task = tasks.train_new_model.delay(path, metric=metric,
+                                           profile=profile, **als_opts)
 
         message = 'new job created with id {}'.format(task.id)
 
@@ -116,17 +335,93 @@ class EnginesResource(Resource):
         return response_body, response_status, response_headers
 
     @staticmethod
-    def _has_valid_als_opts(request_obj: Request) -> bool:
+    def _has_valid_als_opts(request_obj: Request, engine: type) -> bool:
         try:
             als_opts = request_obj.get_json()['als_opts']
         except (BadRequest, KeyError):
             return False
 
-        required_keys = ('rank_opts', 'reg_param_opts', 'max_iter_opts')
+        return _valid_als_opts(als_opts, engine)
+
+
+def _valid_als_opts(als_opts: dict, engine: type) -> bool:
+    """ checks the options of a training against the ones of the class of
+    its engine, see `RecommendationEngine.model_opts`. Each is a list of
+    values to choose from.
+
+    """
+    required_keys, optional_keys = engine.model_opts()
 
-        for key in required_keys:
-            assert key in als_opts.keys()
-            assert isinstance(als_opts[key], list)
+    assert isinstance(als_opts, dict)
+
+    for key in required_keys:
+        assert key in als_opts.keys()
+
+    for key, values in als_opts.items():
+        assert key in required_keys + optional_keys
+        assert isinstance(values, list) and values
+
+    return True
+
+
+class SchedulesResource(Resource):
+    """ Exposes the scheduling of the jobs of many partitions at once as a
+    resource for REST. The jobs run in one worker process, sharing its spark
+    session, see `core.scheduler`.
+
+    """
+    def post(self):
+        """ Schedules jobs for partitions.
+
+        The payload has a list of `jobs`, each with a `partition` and a `job`
+        (one of `core.scheduler.JOBS`). A training also has its `als_opts`,
+        and an optional `metric` as for `EnginesResource.post`. Those depend
+        on the class of the engine of its partition.
+
+        """
+        try:
+            jobs = [self._parse_job(job) for job in request.get_json()['jobs']]
+            assert jobs
+        except (BadRequest, KeyError, TypeError, AssertionError):
+            message = 'invalid payload. Expected a list of jobs, each with ' \
+                      'a partition, a job among {} and the als_opts of ' \
+                      'the trainings.'.format(JOBS)
+            logger.error(message)
+            raise HTTPBadRequest(message, payload={'message': message})
+
+        task = tasks.run_partitions.delay(jobs)
+
+        message = 'new job created with id {}'.format(task.id)
+
+        logger.info(message)
+
+        return {'message': message}, HTTPStatus.ACCEPTED, {
+            'Location': api.url_for(TaskResource, task_id=task.id)
+        }
+
+    @staticmethod
+    def _parse_job(job: dict) -> dict:
+        """ validates a job of the payload, into the form of
+        `tasks.run_partitions`.
+
+        """
+        path = _engine_path(job['partition'])
+
+        assert job['job'] in JOBS
+
+        kwargs = {}
+
+        if job['job'] == TRAIN:
+            engine = engine_class(path)
+            metric = job.get('metric', engine.default_metric)
+
+            assert _valid_als_opts(job['als_opts'], engine)
+            assert metric in METRICS
+
+            kwargs = dict(job['als_opts'], metric=metric)
+
+        return {'partition': job['partition'], 'job': job['job'],
+                'kwargs': kwargs}
 
 
 class TaskResource(Resource):
@@ -136,6 +431,10 @@ class TaskResource(Resource):
     def get(self, task_id: str):
         """ get the progress of a celery task.
 
+        A running task is in the `PROGRESS` state, along with the `progress`
+        of its stages, their timings and the ETA of the current one. See
+        `core.progress.Progress.snapshot`.
+
         Args:
             task_id: celery task id returned by a previous API.
         """
@@ -143,6 +442,9 @@ class TaskResource(Resource):
 
         response_body = {'state': task.state}
 
+        if task.state == 'PROGRESS':
+            response_body['progress'] = task.info
+
         if task.state == 'SUCCESS':
             response_status = HTTPStatus.SEE_OTHER
             response_headers = {
@@ -151,3 +453,124 @@ class TaskResource(Resource):
             return response_body, response_status, response_headers
         else:
             return response_body
+
+
+class RecommendationsResource(Resource):
+    """ Exposes on-demand recommendations, scored against the current engine,
+    as a resource for REST.
+
+    """
+    def post(self, partition: str = None):
+        """ scores users against the resident model, and returns their top
+        recommendations, the same as the generated ones. See
+        `ResidentModel.recommend`.
+
+        The payload has a list of `user_ids`, and an optional `count` of
+        recommendations per user (the engine's count by default). Requests for
+        a single user are batched with the concurrent ones, see
+        `MicroBatcher`. Users unknown to the model get an empty list.
+
+        Args:
+            partition: the warehouse partition of the engine, the default one
+            if None.
+
+        """
+        resident_model, batcher = _resident(_engine_path(partition))
+
+        try:
+            user_ids, count = self._parse_payload(request)
+        except (BadRequest, KeyError, TypeError, ValueError, AssertionError):
+            message = 'invalid payload. Expected a list of user_ids, and an ' \
+                      'optional positive count.'
+            logger.error(message)
+            raise HTTPBadRequest(message, payload={'message': message})
+
+        try:
+            resident_model.get()
+        except Exception as e:
+            message = "Error loading the recommendation engine."
+            logger.error(message, *e.args)
+            raise HTTPInternalServerError(message, payload={'message': message})
+
+        count = count or resident_model.recommendation_count
+
+        if len(user_ids) == 1:
+            recommendations = [batcher((user_ids[0], count))]
+        else:
+            # the users are scored once, however many times they are listed.
+            distinct_ids = list(dict.fromkeys(user_ids))
+            recommendations = dict(zip(distinct_ids, resident_model.recommend(
+                distinct_ids, count)))
+            recommendations = [recommendations[user_id] for user_id in
+                               user_ids]
+
+        return {
+            'recommendations': [
+                {'user_id': user_id, 'recommendations': user_recommendations}
+                for user_id, user_recommendations in
+                zip(user_ids, recommendations)]
+        }
+
+    @staticmethod
+    def _parse_payload(request_obj: Request) -> tuple:
+        payload = request_obj.get_json()
+
+        assert isinstance(payload['user_ids'], list)
+        user_ids = [int(user_id) for user_id in payload['user_ids']]
+        assert user_ids
+
+        count = payload.get('count')
+        if count is not None:
+            count = int(count)
+            assert count > 0
+
+        return user_ids, count
+
+
+def _ensure_profiling_enabled() -> None:
+    """ the saved profiles are not found while profiling is off, see
+    `server.profiling.enabled`.
+
+    """
+    if not server_profiling.enabled():
+        raise NotFound()
+
+
+class ProfilesResource(Resource):
+    """ Exposes the saved profiles, of requests and tasks, as a resource for
+    REST, while profiling is on. See `core.profiling`.
+
+    """
+    def get(self):
+        """ lists the most recent profile files, newest first.
+
+        Request args:
+            count: the number of files to list, 50 by default.
+
+        """
+        _ensure_profiling_enabled()
+
+        try:
+            count = int(request.args.get('count', 50))
+        except ValueError:
+            message = 'invalid count:{}'.format(request.args.get('count'))
+            logger.error(message)
+            raise HTTPBadRequest(message, payload={'message': message})
+
+        return {
+            'profiles': profiling.recent_profiles(core_config.PROFILES_DIR,
+                                                  count=count)
+        }
+
+
+class ProfileResource(Resource):
+    """ Exposes a saved profile file as a resource for REST. """
+    def get(self, name: str):
+        """ downloads a profile file, by the name listed by
+        `ProfilesResource`.
+
+        """
+        _ensure_profiling_enabled()
+
+        return send_from_directory(core_config.PROFILES_DIR, name,
+                                   as_attachment=True)
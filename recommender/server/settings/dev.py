@@ -9,7 +9,12 @@ REDIS_PORT = 6379
 CELERY_BROKER_URL = 'redis://localhost:6379/0',
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 
-# models
-ALLOWED_USER_IDS = [-1, 10001, 10002]
+# profiling of requests, see `server.profiling`. PROFILE_REQUESTS is the mode
+# every request is profiled with, None to only profile the requests with an
+# X-Profile header (or the trainings with a profile), if
+# PROFILING_HEADER_ENABLED. That lets any client profile, so it is off by
+# default. The saved profiles are only served while some profiling is on.
+PROFILE_REQUESTS = None
+PROFILING_HEADER_ENABLED = False
 
 log_config_file = '{}/{}/settings/log.yaml'.format(PROJECT_ROOT, 'server')
\ No newline at end of file
@@ -1,56 +1,129 @@
 # -*- coding: utf-8 -*-
 
 import logging
+from concurrent.futures import wait
 
-from core.engines import ALSRecommendationEngine
+from core import config, profiling
+from core.engines import import_engine
+from core.progress import Progress
+from core.scheduler import PartitionScheduler
 from server.extensions import celery
 
 logger = logging.getLogger(__name__)
 
 
+def _profiled(task, profile: str = None):
+    """ profiles the body of a task with the given mode, or the
+    `PROFILE_TASKS` one. The profile is named after the task and its id.
+
+    """
+    return profiling.profiled(
+        'task-{}-{}'.format(task.name.rsplit('.', 1)[-1], task.request.id),
+        profile or config.PROFILE_TASKS)
+
+
+def _progress(task) -> Progress:
+    """ publishes the progress of an engine as the `PROGRESS` state of a
+    task, see `core.progress`.
+
+    """
+    return Progress(publish=lambda progress: task.update_state(
+        state='PROGRESS', meta=progress))
+
+
 @celery.task(bind=True)
-def train_new_model(self, engine_path: str, **als_opts: dict):
+def train_new_model(self, engine_path: str, metric: str = None,
+                    profile: str = None, **als_opts: dict):
     """ Trains a new engine instance. Stateless in nature.
 
     Args:
         engine_path: path from which engine can be loaded
-        als_opts : parameter options for the ALS model.
+        metric: the evaluation metric to choose the best model by, the
+        default one of the engine if None.
+        profile: the mode to profile the task with, see `core.profiling`.
+        als_opts : parameter options for the model of the engine, see
+        `RecommendationEngine.model_opts`.
 
     """
-    engine = ALSRecommendationEngine.import_from_path(engine_path)
+    with _profiled(self, profile):
+        engine = import_engine(engine_path)
+        engine.progress = _progress(self)
 
-    data = engine.train_new_model(**als_opts)
+        data = engine.train_new_model(metric=metric or engine.default_metric,
+                                      **als_opts)
 
-    engine.export(path=engine_path)
+        engine.export(path=engine_path)
 
     return data
 
 
 @celery.task(bind=True)
-def retrain_engine(self, engine_path: str):
+def retrain_engine(self, engine_path: str, profile: str = None):
     """ Retrains an existing engine. Stateless in nature.
 
     Args:
         engine_path: path from which engine can be loaded
+        profile: the mode to profile the task with, see `core.profiling`.
 
     """
-    engine = ALSRecommendationEngine.import_from_path(engine_path)
+    with _profiled(self, profile):
+        engine = import_engine(engine_path)
+        engine.progress = _progress(self)
 
-    engine.retrain_with_updated_data()
+        engine.retrain_with_updated_data()
 
-    engine.export(path=engine_path)
+        engine.export(path=engine_path)
 
 
 @celery.task(bind=True)
-def generate_recommendations(self, engine_path: str):
+def generate_recommendations(self, engine_path: str, profile: str = None):
     """ Generates recommendations. Stateless in nature.
 
     Args:
         engine_path: path from which engine can be loaded
+        profile: the mode to profile the task with, see `core.profiling`.
 
     """
-    engine = ALSRecommendationEngine.import_from_path(engine_path)
+    with _profiled(self, profile):
+        engine = import_engine(engine_path)
+        engine.progress = _progress(self)
+
+        engine.generate_recommendations()
+
+        engine.export(path=engine_path)
+
+
+@celery.task(bind=True)
+def run_partitions(self, jobs: list, profile: str = None):
+    """ Runs the jobs of many partitions in this worker process, sharing its
+    spark session. See `core.scheduler.PartitionScheduler`. The `PROGRESS`
+    state of the task is the status of the scheduler.
+
+    Args:
+        jobs: a list of dicts with the `partition`, the `job` (one of
+        `core.scheduler.JOBS`) and its keyword args as `kwargs`.
+        profile: the mode to profile the task with, see `core.profiling`.
+
+    Returns:
+        a dict of partition to the results of its jobs, in order. A failed job
+        has its error as result.
+
+    """
+    with _profiled(self, profile), PartitionScheduler() as scheduler:
+        futures = [(job['partition'], scheduler.submit(
+            job['partition'], job['job'], **job.get('kwargs', {}))) for
+            job in jobs]
+
+        while wait([future for _, future in futures],
+                   timeout=config.PROGRESS_INTERVAL).not_done:
+            self.update_state(state='PROGRESS', meta=scheduler.status())
+
+    results = {}
+
+    for partition, future in futures:
+        error = future.exception()
 
-    engine.generate_recommendations()
+        results.setdefault(partition, []).append(
+            {'error': str(error)} if error else future.result())
 
-    engine.export(path=engine_path)
+    return results
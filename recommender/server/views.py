@@ -1,9 +1,23 @@
 # -*- coding: utf-8 -*-
 from server import api
-from server.resources import EngineResource, EnginesResource, TaskResource
+from server.resources import EngineResource, EnginesResource, TaskResource, \
+    RecommendationsResource, ProfilesResource, ProfileResource, \
+    SchedulesResource
 
-api.add_resource(EngineResource, '/engines/<engine_id>')
+# the engine of every other warehouse partition is under its name.
+api.add_resource(EngineResource, '/engines/<engine_id>',
+                 '/partitions/<partition>/engines/<engine_id>')
 
-api.add_resource(EnginesResource, '/engines/')
+api.add_resource(EnginesResource, '/engines/',
+                 '/partitions/<partition>/engines/')
+
+api.add_resource(SchedulesResource, '/schedules/')
 
 api.add_resource(TaskResource, '/tasks/<task_id>')
+
+api.add_resource(RecommendationsResource, '/recommendations',
+                 '/partitions/<partition>/recommendations')
+
+api.add_resource(ProfilesResource, '/profiles/')
+
+api.add_resource(ProfileResource, '/profiles/<name>')
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+from core.extensions import warehouse
+from core.models import Users
+from core.transporter import Transporter
+
+# streams the ratings submitted to the product server into the warehouse.
+Transporter(warehouse=warehouse, user_model=Users).consume_rating_events()
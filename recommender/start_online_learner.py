@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+
+from core.extensions import warehouse
+from core.online_learning import OnlineLearner
+from core.scheduler import engine_path
+
+# keeps the factors of the engine up to date with the new ratings,
+# between its retrains.
+OnlineLearner.from_path(engine_path(warehouse.partition)).run()
@@ -2,4 +2,5 @@
 
 from server import app
 
-app.run(debug=True)
+# threaded, so concurrent requests can be batched together.
+app.run(debug=True, threaded=True)
@@ -36,6 +36,8 @@ engine.train_new_model(**config.als_opts)
 
 #engine = ALSRecommendationEngine.import_from_path(config.MODELS_DIR + "/core_app_movielens")
 
+Users.register(config.SEED_USER_IDS, data_partition=warehouse.partition)
+
 transporter.send_users_to_warehouse()
 
 transporter.send_new_ratings_to_warehouse()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import pickle
+
+import numpy as np
+import pytest
+
+from core.datasources.delimited_source import DelimitedSource
+from core.exceptions import ParserError
+
+
+class TestDelimitedSource(object):
+
+    @pytest.fixture
+    def source(self):
+        return DelimitedSource(
+            'test', ratings_file='ratings.csv', products_file='products.csv',
+            encoding='utf-8', delimiter=',',
+            ratings_columns=[('day', int), ('user_id', int),
+                             ('product_id', int), ('ratings', float)],
+            products_columns=[('product_id', int), ('name', str),
+                              ('desc', str)],
+            split_column='day', split_weights=(1, 1, 1))
+
+    def test_ratings_parser_parses_fields(self, source):
+        assert source.ratings_parser('5,1,2804,4.5\n') == {
+            'metadata': {'type': 'test'},
+            'payload': {'user_id': 1, 'product_id': 2804, 'ratings': 4.5}
+        }
+
+    @pytest.mark.parametrize('line', [None, '', '1,2,3', '1,2,x,4'])
+    def test_ratings_parser_throws_error_invalid_input(self, source, line):
+        with pytest.raises(ParserError):
+            source.ratings_parser(line)
+
+    def test_product_parser_keeps_strings(self, source):
+        assert source.product_parser('7,Seven (1995),Crime\n') == {
+            'product_id': 7, 'name': 'Seven (1995)', 'desc': 'Crime'}
+
+    def test_unknown_split_column(self):
+        with pytest.raises(ValueError):
+            DelimitedSource('test', 'r', 'p', 'utf-8', ',',
+                            ratings_columns=[('user_id', int)],
+                            products_columns=[], split_column='day')
+
+    def test_ratings_batch_parser(self, source):
+        parsed = source.ratings_batch_parser(['0,1,10,4.0\n', '1,2,20,3.5\n',
+                                              '2,3,30,1.0'])
+
+        assert parsed['metadata']['type'].tolist() == \
+            ['training', 'validation', 'test']
+        assert parsed['payload']['user_id'].dtype == np.int64
+        assert parsed['payload']['product_id'].tolist() == [10, 20, 30]
+        assert parsed['payload']['ratings'].tolist() == [4.0, 3.5, 1.0]
+
+    @pytest.mark.parametrize('lines', [['0,1,10,4.0', '1,2,20'],
+                                       ['0,1,10,4.0', '1,2,x,3.5']])
+    def test_ratings_batch_parser_throws_error(self, source, lines):
+        with pytest.raises(ParserError):
+            source.ratings_batch_parser(lines)
+
+    def test_product_batch_parser(self, source):
+        parsed = source.product_batch_parser(['7,Seven (1995),Crime'])
+
+        assert parsed['product_id'].tolist() == [7]
+        assert parsed['name'].tolist() == ['Seven (1995)']
+
+    def test_pickles(self, source):
+        copy = pickle.loads(pickle.dumps(source))
+
+        assert copy.ratings_parser('5,1,2804,4.5') == \
+            source.ratings_parser('5,1,2804,4.5')
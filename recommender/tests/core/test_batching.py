@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from core.batching import MicroBatcher
+
+
+class TestMicroBatcher(object):
+
+    def test_concurrent_calls_are_batched(self):
+        batches = []
+
+        def double(items):
+            batches.append(items)
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(double, window=1.0, max_size=4)
+
+        futures = [batcher.submit(item) for item in range(4)]
+
+        assert [future.result(timeout=5) for future in futures] == \
+            [0, 2, 4, 6]
+        assert batches == [[0, 1, 2, 3]]
+
+    def test_batches_close_after_the_window(self):
+        batches = []
+
+        def identity(items):
+            batches.append(items)
+            return items
+
+        batcher = MicroBatcher(identity, window=0.001, max_size=100)
+
+        assert batcher(1, timeout=5) == 1
+        assert batcher(2, timeout=5) == 2
+        assert batches == [[1], [2]]
+
+    def test_calls_from_threads(self):
+        batcher = MicroBatcher(lambda items: [-item for item in items],
+                               window=0.05, max_size=8)
+        results = {}
+
+        def call(item):
+            results[item] = batcher(item, timeout=5)
+
+        threads = [threading.Thread(target=call, args=(item,)) for item in
+                   range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == {item: -item for item in range(20)}
+
+    def test_errors_reach_every_call(self):
+        def fail(items):
+            raise ValueError('bad batch')
+
+        batcher = MicroBatcher(fail, window=1.0, max_size=2)
+
+        futures = [batcher.submit(item) for item in range(2)]
+
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result(timeout=5)
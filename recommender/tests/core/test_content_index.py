@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from core import config
+from core.content_index import (ContentIndex, blend, content_share,
+                                features)
+from core.data_loader import DataLoader
+from core.warehouse import FileWarehouse
+
+
+def _products():
+    return [
+        {config.PRODUCT_COL: 1, 'name': 'Toy Story (1995)',
+         'desc': "Animation|Children's|Comedy"},
+        {config.PRODUCT_COL: 2, 'name': 'Toy Story 2 (1999)',
+         'desc': "Animation|Children's|Comedy"},
+        {config.PRODUCT_COL: 3, 'name': 'Heat (1995)',
+         'desc': 'Action|Crime|Thriller'},
+        {config.PRODUCT_COL: 4, 'name': 'Ronin (1998)',
+         'desc': 'Action|Crime|Thriller'},
+        {config.PRODUCT_COL: 5, 'name': 'Babe (1995)',
+         'desc': "Children's|Comedy"},
+    ]
+
+
+class TestContentIndex(object):
+
+    @pytest.fixture
+    def warehouse(self):
+        warehouse = FileWarehouse(partition='content_test')
+        warehouse.cleanup()
+
+        yield warehouse
+
+        warehouse.delete()
+
+    def test_features_one_hot_genres_and_hash_names(self):
+        product_ids, genres, matrix = features(_products(), buckets=64)
+
+        assert product_ids.tolist() == [1, 2, 3, 4, 5]
+        assert genres == ['Action', 'Animation', "Children's", 'Comedy',
+                          'Crime', 'Thriller']
+        assert matrix.shape == (5, 6 + 64)
+        assert matrix[0, :6].toarray().tolist() == [[0, 1, 1, 1, 0, 0]]
+        # "toy" and "story" hash to the same features for both movies.
+        assert matrix[0, 6:].multiply(matrix[1, 6:]).sum() > 0
+
+    def test_similar_products(self):
+        index = ContentIndex.build(_products())
+
+        assert index.similar([1], 2) == [2, 5]
+        assert index.similar([3], 1) == [4]
+        assert index.similar([1, 3], 4, exclude=[2]) == [4, 5]
+        assert index.similar([99], 2) == []
+
+    def test_save_and_load(self, warehouse):
+        assert ContentIndex.load(warehouse) is None
+
+        index = ContentIndex.build(_products())
+        index.save(warehouse)
+
+        loaded = ContentIndex.load(warehouse)
+
+        assert np.array_equal(loaded.product_ids, index.product_ids)
+        assert (loaded.neighbors != index.neighbors).nnz == 0
+
+    def test_blend_interleaves_the_shares(self):
+        assert blend([1, 2, 3], [7, 8, 9], 4, share=0.5) == [7, 1, 8, 2]
+        assert blend([1, 2, 3], [7, 8, 9], 4, share=0.2) == [1, 2, 7, 3]
+        assert blend([1, 2, 3], [7, 8, 9], 3, share=0.0) == [1, 2, 3]
+        assert blend([], [7, 8], 3, share=0.2) == [7, 8]
+        assert blend([1, 7], [7, 8], 3, share=0.5) == [7, 1, 8]
+
+    def test_content_share_fades_with_the_ratings(self):
+        assert content_share(0, cold_start_ratings=4) == 1.0
+        assert content_share(2, cold_start_ratings=4) == 0.5
+        assert content_share(4, cold_start_ratings=4) == 0.0
+
+    def test_complement_only_the_cold_users(self):
+        index = ContentIndex.build(_products())
+
+        seen = [(10, 3)] + [(11, product_id) for product_id in range(1, 6)]
+
+        assert index.complement([10, 11, 12], [[1], [], [5]], seen,
+                                count=2) == [[4, 5], [], [5]]
+
+    def test_complement_gives_the_defaults_to_users_without_ratings(self):
+        index = ContentIndex.build(_products())
+
+        assert index.complement([12], [[]], [], count=2,
+                                defaults=[3, 4]) == [[3, 4]]
+
+    def test_complement_adds_the_new_products_for_everyone(self):
+        index = ContentIndex.build(_products())
+
+        # the engine knows all the products but 2.
+        seen = [(11, product_id) for product_id in range(1, 6) if
+                product_id != 2]
+
+        assert index.complement([11], [[7, 8]], seen, count=2,
+                                known_ids=[1, 3, 4, 5],
+                                new_share=0.5) == [[2, 7]]
+
+        # and so do the default recommendations.
+        assert index.add_new_products([1], known_ids=[1, 3, 4, 5], count=2,
+                                      share=0.5) == [2, 1]
+
+    def test_loader_indexes_the_catalog(self, warehouse, source):
+        loader = DataLoader(source=source, warehouse=warehouse)
+
+        loader.create_product_catalog_in_warehouse(workers=1)
+
+        index = ContentIndex.load(warehouse)
+
+        assert sorted(index.product_ids.tolist()) == [1, 2, 3, 4, 5]
+        # the comedies, not the adventure.
+        assert 2 not in index.similar([3], 2)
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import os
+
 import pytest
 
-from core.data_loader import DataLoader
+from core.data_loader import DataLoader, split_ranges
+from core.datasources.movielens_source import MovieLensSource
+from core.exceptions import ParserError
+from core.warehouse import FileWarehouse
 
 
 class TestDataLoader(object):
@@ -34,7 +39,89 @@ class TestDataLoader(object):
 
     def test_product_loader_writes_to_db(self, mocker, data_loader):
         mock_product = mocker.patch.object(data_loader, 'products_model')
+        mocker.patch.object(data_loader, 'versions_model')
 
         data_loader.create_product_catalog_in_serving_layer()
 
         mock_product.upsert.assert_called()
+
+    def test_product_loader_bumps_catalog_version(self, mocker, data_loader):
+        mocker.patch.object(data_loader, 'products_model')
+        mock_versions = mocker.patch.object(data_loader, 'versions_model')
+
+        data_loader.create_product_catalog_in_serving_layer()
+
+        mock_versions.bump.assert_called_once_with(
+            'products', data_partition=data_loader.source.name)
+
+
+class TestParallelDataLoader(object):
+
+    @pytest.fixture
+    def source(self, tmpdir):
+        ratings_file = tmpdir.join('ratings.dat')
+        ratings_file.write('\n'.join(
+            ['{}::{}::{}::{}'.format(user, product, user % 5 + 1,
+                                     978300760 + product)
+             for user in range(1, 20) for product in range(1, 15)] +
+            ['not a rating line'] +
+            ['{}::7::3::978300761'.format(user) for user in range(20, 30)]))
+
+        return MovieLensSource(name='movielens_parallel_test',
+                               ratings_file=str(ratings_file),
+                               products_file='external_data/test/products.dat')
+
+    @pytest.fixture
+    def warehouses(self, source):
+        warehouses = [FileWarehouse(partition='{}_{}'.format(source.name, i),
+                                    shards=2) for i in range(2)]
+
+        for warehouse in warehouses:
+            warehouse.cleanup()
+
+        yield warehouses
+
+        for warehouse in warehouses:
+            warehouse.delete()
+
+    @staticmethod
+    def _files(warehouse):
+        return warehouse.shard_files(warehouse.ratings_file) + [
+            warehouse.training_file, warehouse.test_file,
+            warehouse.validation_file, warehouse.products_file]
+
+    def test_split_ranges_are_line_aligned(self, source):
+        with open(source.ratings_file, 'rb') as handle:
+            data = handle.read()
+
+        ranges = split_ranges(source.ratings_file, 7)
+
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            assert end == start and data[start - 1:start] == b'\n'
+
+    def test_parallel_load_matches_serial(self, source, warehouses):
+        serial, parallel = [DataLoader(source=source, warehouse=warehouse)
+                            for warehouse in warehouses]
+
+        serial.create_ratings_data_in_warehouse(continue_on_error=True,
+                                                workers=1)
+        serial.create_product_catalog_in_warehouse(workers=1)
+
+        parallel.create_ratings_data_in_warehouse(continue_on_error=True,
+                                                  workers=3)
+        parallel.create_product_catalog_in_warehouse(workers=3)
+
+        for serial_file, parallel_file in zip(self._files(serial.warehouse),
+                                              self._files(parallel.warehouse)):
+            with open(serial_file) as expected, open(parallel_file) as actual:
+                assert actual.read() == expected.read()
+
+    def test_parallel_load_raises_parser_errors(self, source, warehouses):
+        loader = DataLoader(source=source, warehouse=warehouses[0])
+
+        with pytest.raises(ParserError):
+            loader.create_ratings_data_in_warehouse(workers=3)
+
+        assert not [file for file in os.listdir(warehouses[0].root_path) if
+                    '.part-' in file]
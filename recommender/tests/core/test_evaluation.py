@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import math
+
+import pytest
+
+from core.evaluation import Evaluator, is_better
+from core.scoring import FactorModel
+
+
+class TestEvaluator(object):
+
+    @pytest.fixture
+    def model(self):
+        # user 1 ranks the items 30 > 20 > 10, user 2 the other way around.
+        return FactorModel(user_ids=[1, 2],
+                           user_factors=[[1.0, 0.0], [0.0, 1.0]],
+                           item_ids=[10, 20, 30],
+                           item_factors=[[1.0, 5.0], [3.0, 3.0], [5.0, 1.0]])
+
+    def test_rmse(self, model):
+        evaluator = Evaluator(holdout=[(1, 30, 4.0), (2, 10, 5.0)], k=1)
+
+        actual = evaluator.evaluate(model)['rmse']
+
+        assert actual == pytest.approx(math.sqrt(0.5))
+
+    def test_rmse_ignores_unknown_users_and_items(self, model):
+        evaluator = Evaluator(holdout=[(1, 30, 5.0), (3, 10, 1.0),
+                                       (1, 40, 1.0)], k=1)
+
+        actual = evaluator.evaluate(model)['rmse']
+
+        assert actual == pytest.approx(0.0)
+
+    def test_ranking_metrics(self, model):
+        # user 1 gets 30 recommended, a hit. user 2 gets 10, a miss.
+        evaluator = Evaluator(holdout=[(1, 30, 5.0), (2, 20, 5.0)], k=1)
+
+        actual = evaluator.evaluate(model)
+
+        assert actual['precision_at_k'] == pytest.approx(0.5)
+        assert actual['recall_at_k'] == pytest.approx(0.5)
+        assert actual['ndcg_at_k'] == pytest.approx(0.5)
+        assert actual['coverage'] == pytest.approx(2 / 3)
+
+    def test_seen_items_are_not_ranked(self, model):
+        # with 10 seen, user 2 gets 20 recommended, a hit.
+        evaluator = Evaluator(holdout=[(2, 20, 5.0)], seen=[(2, 10)], k=1)
+
+        actual = evaluator.evaluate(model)
+
+        assert actual['precision_at_k'] == pytest.approx(1.0)
+        assert actual['ndcg_at_k'] == pytest.approx(1.0)
+
+    def test_irrelevant_items_are_not_hits(self, model):
+        evaluator = Evaluator(holdout=[(1, 30, 1.0)], k=1)
+
+        actual = evaluator.evaluate(model)
+
+        assert math.isnan(actual['precision_at_k'])
+
+    def test_is_better(self):
+        assert is_better('rmse', 0.8, 0.9)
+        assert is_better('ndcg_at_k', 0.3, 0.2)
+        assert not is_better('rmse', math.nan, 0.9)
+
+    def test_is_better_by_a_tolerance(self):
+        assert not is_better('rmse', 0.899, 0.9, tolerance=0.01)
+        assert is_better('rmse', 0.85, 0.9, tolerance=0.01)
+        assert not is_better('ndcg_at_k', 0.201, 0.2, tolerance=0.01)
+        assert is_better('ndcg_at_k', 0.2, float('-inf'), tolerance=0.01)
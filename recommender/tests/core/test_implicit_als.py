@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from core import config, implicit_als
+from core.engines import ImplicitALSEngine
+from core.progress import Progress
+from core.warehouse import FileWarehouse
+
+
+def _confidences(users=30, items=20, density=0.2, seed=1):
+    random = np.random.RandomState(seed)
+
+    ratings = sparse.random(users, items, density=density, format='csr',
+                            random_state=random, data_rvs=lambda size:
+                            random.randint(1, 5, size=size))
+
+    ratings.data = implicit_als.confidence(ratings.data, alpha=2.0)
+
+    return ratings
+
+
+class TestImplicitALS(object):
+
+    def test_confidence_transforms(self):
+        ratings = np.array([0.0, 1.0, 3.0])
+
+        assert implicit_als.confidence(ratings, 'linear', alpha=2.0) \
+            .tolist() == [1.0, 3.0, 7.0]
+        assert np.allclose(
+            implicit_als.confidence(ratings, 'log', alpha=2.0, epsilon=1.0),
+            1.0 + 2.0 * np.log1p(ratings))
+
+        with pytest.raises(ValueError):
+            implicit_als.confidence(ratings, 'square')
+
+    def test_ratings_matrix_sums_repeated_pairs(self):
+        rows = [{config.USER_COL: user, config.PRODUCT_COL: item,
+                 config.RATINGS_COL: rating} for user, item, rating in
+                [(7, 30, 1), (5, 10, 2), (7, 30, 2)]]
+
+        user_ids, item_ids, matrix = implicit_als.ratings_matrix(rows)
+
+        assert user_ids.tolist() == [5, 7]
+        assert item_ids.tolist() == [10, 30]
+        assert matrix.toarray().tolist() == [[2, 0], [0, 3]]
+
+    def test_cg_converges_to_the_exact_solve(self):
+        confidences = _confidences()
+        random = np.random.RandomState(2)
+        users = random.normal(size=(30, 4))
+        items = random.normal(size=(20, 4))
+
+        exact = implicit_als.exact_sweep(confidences, users, items, 0.1)
+        # conjugate gradient solves a rank 4 system in 4 steps, up to
+        # rounding.
+        cg = implicit_als.cg_sweep(confidences, users, items, 0.1, steps=4)
+
+        assert np.allclose(cg, exact, atol=1e-6)
+
+    def test_fit_lowers_the_loss(self):
+        confidences = _confidences()
+
+        start = implicit_als.fit(confidences, rank=4, reg_param=0.1,
+                                 max_iter=0)
+        fitted = implicit_als.fit(confidences, rank=4, reg_param=0.1,
+                                  max_iter=5)
+
+        assert implicit_als.loss(confidences, *fitted, reg_param=0.1) < \
+            implicit_als.loss(confidences, *start, reg_param=0.1)
+
+    def test_loss_matches_the_dense_objective(self):
+        confidences = _confidences()
+        users, items = implicit_als.fit(confidences, rank=4, reg_param=0.1,
+                                        max_iter=2)
+
+        preferences = (confidences.toarray() > 0).astype(float)
+        weights = np.where(preferences > 0, confidences.toarray(), 1.0)
+        expected = np.sum(weights * (preferences - users.dot(items.T)) ** 2) \
+            + 0.1 * (np.sum(users ** 2) + np.sum(items ** 2))
+
+        assert np.isclose(implicit_als.loss(confidences, users, items, 0.1),
+                          expected)
+
+    def test_early_stopping_once_the_loss_converges(self):
+        confidences = _confidences()
+
+        stopping = implicit_als.EarlyStopping(
+            loss=lambda users, items: implicit_als.loss(confidences, users,
+                                                        items, 0.1),
+            tolerance=1e-3)
+
+        users, items = implicit_als.fit(confidences, rank=4, reg_param=0.1,
+                                        max_iter=100, callback=stopping)
+
+        assert 1 < stopping.sweeps == len(stopping.losses) < 100
+        assert np.array_equal(users, stopping.user_factors)
+        assert stopping.losses[-2] - stopping.losses[-1] < \
+            1e-3 * stopping.losses[-2]
+
+    def test_early_stopping_keeps_the_best_validation_sweep(self):
+        scores = iter([0.1, 0.3, 0.2, 0.4])
+
+        stopping = implicit_als.EarlyStopping(
+            loss=lambda users, items: 1.0, tolerance=0.0,
+            validate=lambda users, items: {'ndcg_at_k': next(scores)},
+            metric='ndcg_at_k')
+
+        implicit_als.fit(_confidences(), rank=2, reg_param=0.1, max_iter=4,
+                         callback=stopping)
+
+        assert stopping.sweeps == 2
+        assert stopping.metrics == {'ndcg_at_k': 0.3}
+        assert len(stopping.losses) == 3
+
+    def test_few_cg_steps_are_close_to_exact(self):
+        confidences = _confidences()
+
+        cg = implicit_als.fit(confidences, rank=4, reg_param=0.1,
+                              max_iter=10, cg_steps=3)
+        exact = implicit_als.fit(confidences, rank=4, reg_param=0.1,
+                                 max_iter=10, solver='exact')
+
+        cg_loss = implicit_als.loss(confidences, *cg, reg_param=0.1)
+        exact_loss = implicit_als.loss(confidences, *exact, reg_param=0.1)
+
+        assert cg_loss <= exact_loss * 1.05
+
+
+class TestImplicitALSEngine(object):
+
+    @staticmethod
+    def _held_out(user):
+        """ the item of the user's group which is not in the training data.
+        """
+        return [item for item in range(1, 11) if item % 2 == user % 2][
+            user % 5]
+
+    @pytest.fixture
+    def warehouse(self):
+        warehouse = FileWarehouse(partition='implicit_test', shards=2)
+        warehouse.cleanup()
+
+        # 2 groups of users, each viewing the items of its own group.
+        training = [{config.USER_COL: user, config.PRODUCT_COL: item,
+                     config.RATINGS_COL: 3} for user in range(1, 21) for
+                    item in range(1, 11) if item % 2 == user % 2 and
+                    item != self._held_out(user)]
+        held_out = [{config.USER_COL: user,
+                     config.PRODUCT_COL: self._held_out(user),
+                     config.RATINGS_COL: 5} for user in range(1, 21)]
+
+        for file, rows in ((warehouse.training_file, training),
+                           (warehouse.validation_file, held_out),
+                           (warehouse.test_file, held_out)):
+            with open(file, 'w') as handle:
+                for row in rows:
+                    warehouse.write_row(handle, row)
+
+        with open(warehouse.products_file, 'w') as handle:
+            for item in range(1, 11):
+                warehouse.write_row(handle, {config.PRODUCT_COL: item,
+                                             'name': str(item), 'desc': ''})
+
+        warehouse.update_ratings(training)
+
+        yield warehouse
+
+        warehouse.delete()
+
+    @pytest.fixture
+    def engine(self, warehouse):
+        engine = ImplicitALSEngine(warehouse=warehouse, recommendation_count=2)
+
+        engine.train_new_model(rank_opts=[2], reg_param_opts=[0.1],
+                               max_iter_opts=[5])
+
+        return engine
+
+    def test_recommends_unseen_items_of_the_same_group(self, engine):
+        recommendations = engine.generate_recommendations_for_user(1)
+
+        assert recommendations[0] == self._held_out(1)
+        assert engine.model_params['metrics']['precision_at_k'] > 0
+
+    def test_export_and_import(self, engine, tmpdir):
+        engine.export(str(tmpdir))
+
+        imported = ImplicitALSEngine.import_from_path(str(tmpdir))
+
+        assert imported.model_params == engine.model_params
+        assert np.array_equal(imported.model.item_factors,
+                              engine.model.item_factors)
+
+    def test_records_the_sweeps_taken(self, warehouse):
+        engine = ImplicitALSEngine(warehouse=warehouse, recommendation_count=2)
+
+        params = engine.train_new_model(rank_opts=[2], reg_param_opts=[0.1])
+
+        assert 1 <= params['max_iter'] < config.ALS_MAX_ITER
+
+    def test_reports_the_progress(self, warehouse):
+        engine = ImplicitALSEngine(warehouse=warehouse, recommendation_count=2)
+
+        reports = []
+        engine.progress = Progress(publish=reports.append, interval=60)
+
+        engine.train_new_model(rank_opts=[2, 3], reg_param_opts=[0.1],
+                               max_iter_opts=[5])
+
+        stages = reports[-1]['stages']
+
+        assert [stage['name'] for stage in stages] == \
+            ['loading', 'candidates', 'testing']
+        assert stages[1]['done'] == stages[1]['total'] == 2
+        assert stages[1]['current'] == {'rank': 3, 'reg_param': 0.1}
+        assert reports[-1]['stage'] is None
+
+    def test_retrain_keeps_the_params(self, engine):
+        params = dict(engine.model_params)
+
+        engine.retrain_with_updated_data()
+
+        # along with the ratings the model is now up to date with.
+        assert engine.model_params == dict(
+            params, ratings_watermark=engine.warehouse.ratings_watermark())
+        assert engine.ready()
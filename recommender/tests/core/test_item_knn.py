@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from core import config, item_knn
+from core.engines import ItemKNNEngine, import_engine
+from core.warehouse import FileWarehouse
+from tests.core import test_implicit_als
+
+
+def _ratings(users=30, items=20, density=0.3, seed=1):
+    random = np.random.RandomState(seed)
+
+    return sparse.random(users, items, density=density, format='csr',
+                         random_state=random, data_rvs=lambda size:
+                         random.randint(1, 6, size=size).astype(float))
+
+
+def _dense_similarities(ratings, similarity, shrinkage):
+    """ all the similarities, computed the slow way. """
+    dense = ratings.toarray()
+    rated = dense > 0
+
+    if similarity == 'pearson':
+        means = dense.sum(axis=0) / np.maximum(rated.sum(axis=0), 1)
+        dense = np.where(rated, dense - means, 0.0)
+
+    norms = np.linalg.norm(dense, axis=0)
+    norms[norms == 0] = 1
+
+    result = dense.T.dot(dense) / np.outer(norms, norms)
+
+    if similarity == 'pearson':
+        common = rated.T.astype(float).dot(rated.astype(float))
+        result *= common / (common + shrinkage)
+
+    np.fill_diagonal(result, 0)
+
+    return np.where(result > 0, result, 0)
+
+
+class TestItemKNN(object):
+
+    @pytest.mark.parametrize('similarity', item_knn.SIMILARITIES)
+    def test_blocks_keep_the_top_neighbors(self, similarity):
+        ratings = _ratings()
+
+        expected = _dense_similarities(ratings, similarity, shrinkage=10.0)
+
+        computed = item_knn.similarities(ratings, neighbors=4,
+                                         similarity=similarity,
+                                         shrinkage=10.0, block_size=3)
+        computed = computed.toarray()
+
+        for item in range(ratings.shape[1]):
+            kept = np.flatnonzero(computed[:, item])
+
+            assert len(kept) == min(4, np.count_nonzero(expected[:, item]))
+            assert np.allclose(computed[kept, item], expected[kept, item],
+                               atol=1e-6)
+            # no neighbor left out is more similar than a kept one.
+            if len(kept):
+                others = np.delete(expected[:, item], kept)
+                assert others.max(initial=0) <= \
+                    computed[kept, item].min() + 1e-6
+
+    def test_truncate_matches_fewer_neighbors(self):
+        ratings = _ratings()
+
+        computed = item_knn.similarities(ratings, neighbors=8)
+        fewer = item_knn.similarities(ratings, neighbors=3)
+
+        truncated = item_knn.truncate(computed, 3)
+
+        assert np.allclose(truncated.toarray(), fewer.toarray())
+
+    def test_unknown_similarity(self):
+        with pytest.raises(ValueError):
+            item_knn.similarities(_ratings(), similarity='jaccard')
+
+    def test_model_save_load_and_restrict(self, tmpdir):
+        ratings = _ratings()
+        user_ids = np.arange(100, 130)
+        item_ids = np.arange(1, 21)
+
+        model = item_knn.SimilarityModel.from_ratings(
+            user_ids, item_ids, ratings,
+            item_knn.similarities(ratings, neighbors=5))
+
+        file = str(tmpdir.join('model.npz'))
+        model.save(file)
+        loaded = item_knn.SimilarityModel.load(file)
+
+        assert loaded.recommend([100, 101], 3) == model.recommend([100, 101],
+                                                                  3)
+        assert np.allclose(loaded.scores(np.array([0, 1])),
+                           model.scores(np.array([0, 1])))
+
+        restricted = model.restrict_items([2, 4, 6])
+
+        assert set(sum(restricted.recommend(user_ids.tolist(), 3), [])) <= \
+            {2, 4, 6}
+
+    def test_recommends_from_the_seen_items(self):
+        # items 1 and 2 are viewed together, as are 3 and 4.
+        ratings = sparse.csr_matrix(np.array([[1, 1, 0, 0],
+                                              [1, 1, 0, 0],
+                                              [0, 0, 1, 1]], dtype=float))
+
+        model = item_knn.SimilarityModel.from_ratings(
+            [10, 11, 12], [1, 2, 3, 4], ratings,
+            item_knn.similarities(ratings, neighbors=2))
+
+        # a user unknown to the model, and a known one with a new rating.
+        # Only the seen items are left out.
+        seen = [(99, 1), (12, 2), (12, 3), (12, 4)]
+
+        assert model.recommend([99, 12], 2, seen=seen) == [[2], [1]]
+        assert model.recommend([99], 2) == [[]]
+
+
+class TestItemKNNEngine(object):
+
+    # the grouped users and items of the implicit engine tests.
+    _held_out = staticmethod(
+        test_implicit_als.TestImplicitALSEngine._held_out)
+    warehouse = test_implicit_als.TestImplicitALSEngine.warehouse
+
+    @pytest.fixture
+    def engine(self, warehouse):
+        engine = ItemKNNEngine(warehouse=warehouse, recommendation_count=2)
+
+        engine.train_new_model(neighbors_opts=[2, 5],
+                               similarity_opts=['cosine', 'pearson'])
+
+        return engine
+
+    def test_recommends_unseen_items_of_the_same_group(self, engine):
+        recommendations = engine.generate_recommendations_for_user(1)
+
+        assert recommendations[0] == self._held_out(1)
+        assert engine.model_params['metrics']['precision_at_k'] > 0
+        assert engine.model_params['neighbors'] in (2, 5)
+
+    def test_generates_for_all_users(self, engine, warehouse):
+        warehouse.update_users([{config.USER_COL: user} for user in
+                                range(1, 21)])
+
+        engine.generate_recommendations(workers=1)
+
+        recommendations = {row[config.USER_COL]: row['recommendations'] for
+                           row in FileWarehouse.read_rows(
+                               warehouse.shard_files(
+                                   warehouse.recommendations_file))}
+
+        assert recommendations[2][0] == self._held_out(2)
+
+    def test_export_and_import(self, engine, tmpdir):
+        engine.export(str(tmpdir))
+
+        imported = ItemKNNEngine.import_from_path(str(tmpdir))
+
+        assert imported.model_params == engine.model_params
+        assert (imported.model.similarities !=
+                engine.model.similarities).nnz == 0
+
+        # the class is recorded in the export.
+        assert isinstance(import_engine(str(tmpdir)), ItemKNNEngine)
+
+    def test_retrain_keeps_the_params(self, engine):
+        params = dict(engine.model_params)
+
+        engine.retrain_with_updated_data()
+
+        assert engine.model_params == params
+        assert engine.ready()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from core.model_store import ModelStore
+
+
+class TestModelStore(object):
+
+    @pytest.fixture
+    def store(self, tmpdir):
+        return ModelStore(str(tmpdir), keep=2)
+
+    def _export(self, store, content, checkpoint=False):
+        version = store.new_version()
+
+        with open('{}/params.json'.format(store.path(version)), 'w') as file:
+            file.write(content)
+
+        store.promote(version, checkpoint=checkpoint)
+
+        return version
+
+    def _read(self, store):
+        with open('{}/params.json'.format(store.current())) as file:
+            return file.read()
+
+    def test_no_version_reads_the_root(self, store):
+        assert store.current_version() is None
+        assert store.current() == store.root
+
+    def test_promote(self, store):
+        self._export(store, 'first')
+        version = self._export(store, 'second')
+
+        assert store.current_version() == version
+        assert self._read(store) == 'second'
+
+    def test_unpromoted_version_is_not_read(self, store):
+        self._export(store, 'first')
+
+        version = store.new_version()
+
+        assert store.current_version() != version
+        assert self._read(store) == 'first'
+
+    def test_rollback(self, store):
+        first = self._export(store, 'first')
+        self._export(store, 'second')
+
+        assert store.rollback() == first
+        assert self._read(store) == 'first'
+
+        with pytest.raises(ValueError):
+            store.rollback()
+
+    def test_prune_keeps_recent_and_pending_versions(self, store):
+        versions = [self._export(store, str(number)) for number in range(4)]
+        pending = store.new_version()
+
+        removed = store.prune()
+
+        assert removed == versions[:2]
+        assert store.versions() == versions[2:] + [pending]
+        assert all(os.path.exists(store.path(version)) for version in
+                   store.versions())
+
+    def test_an_older_version_does_not_replace_a_newer_one(self, store):
+        # the exports overlap, and the first one started finishes last.
+        older = store.new_version()
+        newer = self._export(store, 'newer')
+
+        assert not store.promote(older)
+        assert store.current_version() == newer
+
+    def test_prune_removes_the_stale_unpromoted_versions(self, store):
+        failed = store.new_version()
+        versions = [self._export(store, str(number)) for number in range(2)]
+
+        # the failed export does not take the place of a promoted version.
+        assert store.prune() == []
+        assert store.rollback() == versions[0]
+
+        store.stale_age = 0
+
+        assert store.prune() == [failed]
+        assert store.versions() == versions
+
+    def test_checkpoints_do_not_push_the_batch_versions_out(self, store):
+        batch = [self._export(store, 'batch'), self._export(store, 'batch')]
+        checkpoints = [self._export(store, 'checkpoint', checkpoint=True) for
+                       _ in range(3)]
+
+        # the replaced checkpoints go, and are not counted as kept.
+        assert store.prune() == batch[:1] + checkpoints[:2]
+        assert store.versions() == batch[1:] + checkpoints[2:]
+        assert store.is_checkpoint(store.current_version())
+
+        # a rollback goes back to a batch version.
+        assert store.rollback() == batch[1]
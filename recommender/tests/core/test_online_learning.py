@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from core import config, implicit_als
+from core.engines import ALSRecommendationEngine, ImplicitALSEngine
+from core.model_store import ModelStore
+from core.online_learning import OnlineLearner
+from core.scoring import FactorModel
+from core.warehouse import FileWarehouse
+
+
+def _ratings(users, items, rating=3):
+    return [{config.USER_COL: user, config.PRODUCT_COL: item,
+             config.RATINGS_COL: rating} for user in users for item in items]
+
+
+class TestOnlineLearner(object):
+
+    @pytest.fixture
+    def warehouse(self):
+        warehouse = FileWarehouse(partition='online_test', shards=2)
+        warehouse.cleanup()
+
+        # 2 groups of users, each viewing the items of its own group.
+        warehouse.update_ratings(_ratings(range(1, 21, 2), range(1, 11, 2)) +
+                                 _ratings(range(2, 21, 2), range(2, 11, 2)))
+
+        yield warehouse
+
+        warehouse.delete()
+
+    @pytest.fixture
+    def learner(self, warehouse, tmpdir):
+        engine = ImplicitALSEngine(warehouse=warehouse, recommendation_count=3,
+                                   model_params={'rank': 2, 'reg_param': 0.1,
+                                                 'max_iter': 5})
+
+        user_ids, item_ids, confidences = engine._training_data(
+            warehouse.ratings_files())
+        user_factors, item_factors = implicit_als.fit(
+            confidences, rank=2, reg_param=0.1, max_iter=5)
+
+        engine.model = FactorModel(user_ids, user_factors, item_ids,
+                                   item_factors)
+        engine.export(str(tmpdir))
+
+        return OnlineLearner.from_path(str(tmpdir), learning_rate=0.05)
+
+    def test_new_item_gets_recommended_to_its_group(self, learner, warehouse):
+        # a new item of the odd group, rated by most of it.
+        warehouse.update_ratings(_ratings(range(1, 17, 2), [11], rating=5) *
+                                 20)
+
+        assert learner.poll() == 160
+
+        odd = learner.model().recommend([19], 3)[0]
+
+        assert 11 in odd
+        assert 11 not in learner.baseline.item_ids
+
+    def test_poll_follows_the_tail(self, learner, warehouse):
+        assert learner.poll() == 0
+
+        warehouse.update_ratings(_ratings([1], [3, 5]))
+        warehouse.update_ratings(_ratings([21], [2]))
+
+        assert learner.poll() == 3
+        assert learner.poll() == 0
+        assert 21 in learner.model().user_ids
+
+    def test_checkpoint_exports_the_factors_and_drift(self, learner,
+                                                      warehouse, tmpdir):
+        baseline = learner.baseline
+
+        warehouse.update_ratings(_ratings([1, 2], [4, 11]))
+        learner.poll()
+
+        drift = learner.checkpoint()
+
+        assert drift['ratings'] == 4
+        assert drift['new_items'] == 1
+        assert drift['user_change'] > 0
+        assert 0 <= drift['recommendation_overlap'] <= 1
+
+        engine = ImplicitALSEngine.import_from_path(str(tmpdir))
+
+        assert engine.model_params['online']['drift'] == drift
+        assert 11 in engine.model.item_ids
+
+        # a restarted learner goes on from the checkpoint.
+        restarted = OnlineLearner.from_path(str(tmpdir))
+
+        assert restarted.ratings == 4
+        assert restarted.watermark == learner.watermark
+        assert np.array_equal(restarted.baseline.item_ids, baseline.item_ids)
+
+    def test_rebases_on_a_new_batch_model(self, learner, warehouse, tmpdir):
+        warehouse.update_ratings(_ratings([1], [11]))
+        learner.run(polls=1, checkpoint_interval=0)
+
+        engine = ImplicitALSEngine.import_from_path(str(tmpdir))
+        engine.retrain_with_updated_data()
+        engine.export(str(tmpdir))
+
+        assert 'online' not in engine.model_params
+
+        learner.run(polls=1, checkpoint_interval=0)
+
+        assert learner.ratings == 0
+        assert 11 in learner.baseline.item_ids
+        assert ModelStore(str(tmpdir)).current_version()
+
+    def test_rebase_takes_the_watermark_of_the_batch_model(self, learner,
+                                                           warehouse, tmpdir):
+        engine = ImplicitALSEngine.import_from_path(str(tmpdir))
+        engine.retrain_with_updated_data()
+
+        # ratings added while the retrain ran, and not in its model.
+        warehouse.update_ratings(_ratings([1], [3]))
+        learner.run(polls=1, checkpoint_interval=0)
+
+        engine.export(str(tmpdir))
+        learner.run(polls=1, checkpoint_interval=0)
+
+        assert learner.ratings == 1
+        assert learner.watermark == warehouse.ratings_watermark()
+
+    def test_checkpoints_keep_the_batch_versions(self, learner, warehouse,
+                                                 tmpdir):
+        store = ModelStore(str(tmpdir))
+        engine = ImplicitALSEngine.import_from_path(str(tmpdir))
+
+        for _ in range(store.keep - 2):
+            engine.export(str(tmpdir))
+
+        batch = store.versions()
+
+        learner.run(polls=1)
+
+        for user in range(1, store.keep + 1):
+            warehouse.update_ratings(_ratings([user], [11]))
+            learner.poll()
+            learner.checkpoint()
+
+        assert store.versions() == batch + [store.current_version()]
+
+    def test_explicit_engine_learns_the_ratings(self, warehouse, tmpdir,
+                                                monkeypatch):
+        monkeypatch.setattr(ALSRecommendationEngine, '_load_spark_session',
+                            classmethod(lambda cls: None))
+
+        random = np.random.RandomState(0)
+        engine = ALSRecommendationEngine(
+            warehouse=warehouse, recommendation_count=3,
+            model_params={'rank': 2, 'reg_param': 0.01, 'max_iter': 5},
+            model=FactorModel(np.arange(1, 21), random.normal(size=(20, 2)),
+                              np.arange(1, 11), random.normal(size=(10, 2))))
+        engine.export(str(tmpdir))
+
+        learner = OnlineLearner.from_path(str(tmpdir), learning_rate=0.05)
+        assert learner.explicit
+
+        warehouse.update_ratings(_ratings([1], [2], rating=4) * 50)
+        learner.poll()
+
+        model = learner.model()
+        user = model.user_rows([1])[0]
+        item = model.item_rows([2])[0]
+        assert model.user_factors[user].dot(model.item_factors[item]) == \
+            pytest.approx(4, abs=0.1)
+
+        # no steps away from the other items.
+        others = model.item_rows([1, 3, 4])
+        assert np.array_equal(model.item_factors[others],
+                              learner.baseline.item_factors[others])
+
+        learner.checkpoint()
+
+        engine = ALSRecommendationEngine.import_from_path(str(tmpdir))
+        assert np.array_equal(engine.factor_model().user_factors,
+                              model.user_factors)
+
+    def test_new_ids_on_no_factors(self, learner):
+        user_ids = []
+
+        row, factors = learner._row(7, user_ids, {}, np.empty((0, 2)))
+
+        assert row == 0
+        assert factors.shape == (1, 2)
+        assert user_ids == [7]
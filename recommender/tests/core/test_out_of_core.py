@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import functools
+import os
+
+import numpy as np
+import pytest
+
+from core import config, implicit_als, out_of_core
+from core.engines import OutOfCoreALSEngine
+from core.warehouse import FileWarehouse
+from tests.core import test_implicit_als
+
+
+@pytest.fixture
+def warehouse():
+    warehouse = FileWarehouse(partition='out_of_core_test', shards=2)
+    warehouse.cleanup()
+
+    random = np.random.RandomState(3)
+
+    rows = [{config.USER_COL: int(user), config.PRODUCT_COL: int(item),
+             config.RATINGS_COL: int(rating)} for user, item, rating in
+            zip(random.randint(1, 40, size=300),
+                random.randint(100, 130, size=300),
+                random.randint(1, 5, size=300))]
+
+    warehouse.update_ratings(rows)
+
+    yield warehouse
+
+    warehouse.delete()
+
+
+class TestOutOfCore(object):
+
+    def test_shard_bounds_cover_the_rows(self):
+        bounds = out_of_core.shard_bounds(np.array([3, 1, 1, 5, 1, 1]), 4)
+
+        assert bounds == [(0, 2), (2, 4), (4, 6)]
+        assert out_of_core.shard_bounds(np.array([], dtype=np.int64), 4) == []
+
+    def test_shards_match_the_ratings_matrix(self, warehouse, tmpdir):
+        files = warehouse.ratings_files()
+
+        user_ids, item_ids, matrix = implicit_als.ratings_matrix(
+            warehouse.read_rows(files))
+
+        built = out_of_core.build(files, str(tmpdir), ratings_per_shard=50,
+                                  chunk_size=70)
+        by_user, by_item = built[2], built[3]
+
+        assert np.array_equal(built[0], user_ids)
+        assert np.array_equal(built[1], item_ids)
+        assert len(by_user.bounds) > 1
+
+        for sharded, expected in ((by_user, matrix), (by_item, matrix.T)):
+            expected = expected.tocsr()
+
+            for start, shard in sharded.shards():
+                end = start + shard.shape[0]
+
+                assert (shard != expected[start:end]).nnz == 0
+
+    def test_fit_matches_the_in_memory_fit(self, warehouse, tmpdir):
+        files = warehouse.ratings_files()
+
+        _, _, confidences = implicit_als.ratings_matrix(
+            warehouse.read_rows(files))
+        confidences.data = implicit_als.confidence(confidences.data,
+                                                   alpha=2.0)
+
+        _, _, by_user, by_item = out_of_core.build(
+            files, str(tmpdir), ratings_per_shard=50)
+
+        expected = implicit_als.fit(confidences, rank=3, reg_param=0.1,
+                                    max_iter=3)
+        factors = out_of_core.fit(
+            by_user, by_item, rank=3, reg_param=0.1, max_iter=3,
+            transform=functools.partial(implicit_als.confidence, alpha=2.0))
+
+        for actual, wanted in zip(factors, expected):
+            assert np.allclose(actual, wanted)
+
+        assert np.isclose(
+            out_of_core.loss(by_user, *factors, reg_param=0.1,
+                             transform=functools.partial(
+                                 implicit_als.confidence, alpha=2.0)),
+            implicit_als.loss(confidences, *expected, reg_param=0.1))
+
+
+class TestOutOfCoreALSEngine(test_implicit_als.TestImplicitALSEngine):
+
+    @pytest.fixture
+    def engine(self, warehouse):
+        engine = OutOfCoreALSEngine(warehouse=warehouse,
+                                    recommendation_count=2)
+
+        engine.train_new_model(rank_opts=[2], reg_param_opts=[0.1],
+                               max_iter_opts=[5])
+
+        return engine
+
+    def test_removes_the_shards(self, engine):
+        assert not os.path.exists(engine._shards_directory())
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from core import config
+from core.popularity import Popularity
+from core.warehouse import FileWarehouse
+
+
+def _ratings(*pairs):
+    return [{config.USER_COL: 1, config.PRODUCT_COL: product_id,
+             config.RATINGS_COL: rating} for product_id, rating in pairs]
+
+
+class TestPopularity(object):
+
+    @pytest.fixture
+    def warehouse(self):
+        warehouse = FileWarehouse(partition='popularity_test', shards=2)
+        warehouse.cleanup()
+
+        yield warehouse
+
+        warehouse.delete()
+
+    def test_update_reads_only_new_segments(self, warehouse):
+        warehouse.update_ratings(_ratings((1, 5), (2, 3)))
+
+        popularity = Popularity.load(warehouse)
+        assert popularity.update() == 2
+        popularity.save()
+
+        warehouse.update_ratings(_ratings((2, 4)))
+
+        popularity = Popularity.load(warehouse)
+        assert popularity.update() == 1
+        assert popularity.totals == {1: 5, 2: 7}
+        assert popularity.top(1) == [2]
+
+    def test_reset_recomputes(self, warehouse):
+        warehouse.update_ratings(_ratings((1, 5)))
+
+        popularity = Popularity(warehouse)
+        popularity.update()
+
+        warehouse.reset_ratings()
+        warehouse.update_ratings(_ratings((2, 1)))
+
+        assert popularity.update() == 1
+        assert popularity.totals == {2: 1}
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import cProfile
+import os
+import pstats
+import time
+
+import pytest
+
+from core import profiling
+
+
+def _inner():
+    return sum(i * i for i in range(100000))
+
+
+def _outer():
+    return _inner() + _inner()
+
+
+class TestProfiling(object):
+
+    def test_deterministic(self, tmpdir):
+        directory = str(tmpdir)
+
+        with profiling.profiled('task-train-1', profiling.DETERMINISTIC) \
+                as profile:
+            profile.directory = directory
+            _outer()
+
+        names = sorted(os.listdir(directory))
+        assert [os.path.splitext(name)[1] for name in names] == \
+            ['.collapsed', '.pstats']
+        assert names[0].endswith('task-train-1.collapsed')
+
+    def test_sampling(self, tmpdir):
+        profile = profiling.Profile('sampled', mode=profiling.SAMPLING,
+                                    directory=str(tmpdir), interval=0.001)
+        profile.start()
+        deadline = time.time() + 0.1
+        while time.time() < deadline:
+            _outer()
+        base_name = profile.stop()
+
+        with open('{}/{}.collapsed'.format(str(tmpdir), base_name)) as file:
+            stacks = file.read()
+
+        assert '_outer' in stacks and '_inner' in stacks
+
+    def test_profiled_without_mode(self):
+        with profiling.profiled('name', None) as profile:
+            _outer()
+
+        assert profile is None
+
+    def test_collapse_stats(self):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        _outer()
+        profiler.disable()
+
+        stacks = profiling.collapse_stats(pstats.Stats(profiler))
+
+        # the time of _inner is attributed to the path through _outer.
+        inner = [stack for stack in stacks
+                 if stack.split(';')[-1].startswith('_inner')]
+        assert inner
+        assert all('_outer' in stack for stack in inner)
+        assert all(value > 0 for value in stacks.values())
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            profiling.Profile('name', mode='tracing')
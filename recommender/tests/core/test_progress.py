@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+from core.progress import Progress
+
+
+class TestProgress(object):
+
+    def test_stages(self):
+        reports = []
+        progress = Progress(publish=reports.append, interval=60)
+
+        progress.start('loading')
+        progress.start('candidates', total=4)
+        progress.advance(current={'rank': 8}, users=100)
+
+        snapshot = progress.snapshot()
+
+        assert [stage['name'] for stage in snapshot['stages']] == ['loading']
+        assert snapshot['stage']['done'] == 1
+        assert snapshot['stage']['current'] == {'rank': 8}
+        assert snapshot['stage']['counts'] == {'users': 100}
+        assert snapshot['stage']['rates']['users_per_sec'] > 0
+        assert snapshot['stage']['eta_seconds'] == \
+            3 * snapshot['stage']['seconds']
+
+        progress.advance(3)
+        progress.finish()
+
+        # the steps within a stage are throttled, but for the last one.
+        assert [report['stage'] and report['stage']['done'] for report in
+                reports] == [0, 0, 4, None]
+        assert reports[-1]['stages'][-1]['eta_seconds'] == 0
+
+    def test_publish_errors_are_not_raised(self):
+        def publish(snapshot):
+            raise ConnectionError('the backend is down')
+
+        progress = Progress(publish=publish)
+        progress.start('scoring')
+        progress.finish()
+
+        assert progress.stages[0]['name'] == 'scoring'
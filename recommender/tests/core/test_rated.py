@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from core import config
+from core.rated import RatedProducts
+from core.warehouse import FileWarehouse
+
+
+def _ratings(*pairs):
+    return [{config.USER_COL: user_id, config.PRODUCT_COL: product_id,
+             config.RATINGS_COL: 3} for user_id, product_id in pairs]
+
+
+class TestRatedProducts(object):
+
+    @pytest.fixture
+    def warehouse(self):
+        warehouse = FileWarehouse(partition='rated_test', shards=2)
+        warehouse.cleanup()
+
+        yield warehouse
+
+        warehouse.delete()
+
+    def test_update_reads_only_new_segments(self, warehouse):
+        warehouse.update_ratings(_ratings((1, 10), (1, 11), *(
+            (2, product_id) for product_id in range(100, 116))))
+
+        rated = RatedProducts(warehouse)
+        assert rated.update() == 18
+        assert rated.update() == 0
+
+        # few enough to be kept aside, then merged in with the next ones.
+        warehouse.update_ratings(_ratings((1, 12), (1, 10)))
+        assert rated.update() == 2
+        assert sorted(rated.products(1)) == [10, 11, 12]
+
+        warehouse.update_ratings(_ratings((3, 10)))
+        assert rated.update() == 1
+
+        assert sorted(rated.products(1)) == [10, 11, 12]
+        assert rated.products(2) == list(range(100, 116))
+        assert rated.products(3) == [10]
+        assert rated.products(4) == []
+        assert rated.seen([3, 4]) == [(3, 10)]
+
+    def test_reset_reads_all_again(self, warehouse):
+        warehouse.update_ratings(_ratings((1, 10)))
+
+        rated = RatedProducts(warehouse)
+        rated.update()
+
+        warehouse.reset_ratings()
+        warehouse.update_ratings(_ratings((1, 11)))
+
+        assert rated.stale()
+        assert rated.update() == 1
+        assert not rated.stale()
+        assert rated.products(1) == [11]
+
+    def test_shard(self, warehouse):
+        warehouse.update_ratings(_ratings((1, 10), (2, 10)))
+
+        shard = warehouse.shard_of(1)
+        rated = RatedProducts(warehouse, shard=shard)
+        rated.update()
+
+        assert rated.products(1) == [10]
+        assert rated.products(2) == ([10] if warehouse.shard_of(2) == shard
+                                     else [])
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from core import config, scheduler, utils
+from core.engines import ALSRecommendationEngine, ImplicitALSEngine, \
+    ItemKNNEngine, OutOfCoreALSEngine, engine_class, import_engine
+from core.progress import Progress
+from core.scheduler import PartitionScheduler
+from core.warehouse import FileWarehouse
+
+
+class _Engine(object):
+    """ an engine recording the jobs it runs, the first one waiting for the
+    test to let it go.
+
+    """
+    runs = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def __init__(self, warehouse):
+        self.warehouse = warehouse
+        self.progress = Progress()
+
+    @classmethod
+    def import_from_path(cls, path):
+        return cls(FileWarehouse(path.rsplit('core_app_', 1)[1]))
+
+    def _run(self, job):
+        _Engine.started.set()
+        _Engine.release.wait(5)
+
+        _Engine.runs.append((self.warehouse.partition, job))
+
+        if self.warehouse.partition == 'failing':
+            raise ValueError('failed')
+
+    def train_new_model(self, **opts):
+        self._run(scheduler.TRAIN)
+        return opts
+
+    def retrain_with_updated_data(self):
+        self._run(scheduler.RETRAIN)
+
+    def generate_recommendations(self, workers):
+        self._run(scheduler.GENERATE)
+
+    def export(self, path):
+        pass
+
+
+class TestPartitionScheduler(object):
+
+    @pytest.fixture(autouse=True)
+    def engine(self, monkeypatch, tmpdir):
+        _Engine.runs = []
+        _Engine.started.clear()
+        _Engine.release.clear()
+
+        # the partitions have an engine exported.
+        monkeypatch.setattr(config, 'MODELS_DIR', str(tmpdir))
+
+        for partition in ('a', 'b', 'c', 'failing'):
+            tmpdir.mkdir('core_app_{}'.format(partition)).join(
+                'params.json').write('{}')
+
+    def test_partitions_take_turns(self):
+        with PartitionScheduler(_Engine, workers=1) as jobs:
+            jobs.submit('a', scheduler.TRAIN, rank=1)
+
+            # the first job runs while the others queue up.
+            _Engine.started.wait(5)
+
+            for _ in range(2):
+                jobs.submit('a', scheduler.GENERATE)
+            jobs.submit('b', scheduler.TRAIN)
+            jobs.submit('c', scheduler.TRAIN)
+
+            _Engine.release.set()
+
+        assert _Engine.runs == [('a', 'train'), ('b', 'train'),
+                                ('c', 'train'), ('a', 'generate'),
+                                ('a', 'generate')]
+
+    def test_caps_the_jobs_of_a_partition(self):
+        with PartitionScheduler(_Engine, workers=3,
+                                partition_jobs=1) as jobs:
+            futures = [jobs.submit('a', scheduler.RETRAIN) for _ in range(3)]
+            _Engine.started.wait(5)
+
+            status = jobs.status()['a']
+
+            assert status['running'] == 1
+            assert status['pending'] == 2
+
+            _Engine.release.set()
+
+        assert [future.result() for future in futures] == [None] * 3
+        assert jobs.status()['a']['done'] == 3
+
+    def test_failed_jobs_raise_from_their_future(self):
+        _Engine.release.set()
+
+        with PartitionScheduler(_Engine, workers=2) as jobs:
+            failed = jobs.submit('failing', scheduler.GENERATE)
+            trained = jobs.submit('a', scheduler.TRAIN, rank=3)
+
+        with pytest.raises(ValueError):
+            failed.result()
+
+        assert trained.result() == {'rank': 3}
+        assert jobs.status()['failing']['failed'] == 1
+
+    def test_unknown_job(self):
+        with PartitionScheduler(_Engine) as jobs:
+            with pytest.raises(ValueError):
+                jobs.submit('a', 'evaluate')
+
+
+class TestPartitionSchedulerEngines(object):
+
+    @pytest.fixture
+    def partitions(self):
+        warehouses = []
+
+        for partition in ('scheduler_test_a', 'scheduler_test_b'):
+            warehouse = FileWarehouse(partition=partition)
+            warehouse.cleanup()
+
+            # every user has an item held out for the evaluation.
+            rows = [{config.USER_COL: user, config.PRODUCT_COL: item,
+                     config.RATINGS_COL: 3 if item != user % 8 + 1 else 5}
+                    for user in range(1, 11) for item in range(1, 9) if
+                    (user + item) % 3]
+            held_out = [row for row in rows if row[config.RATINGS_COL] == 5]
+
+            for file, file_rows in (
+                    (warehouse.training_file, [row for row in rows if
+                                               row not in held_out]),
+                    (warehouse.validation_file, held_out),
+                    (warehouse.test_file, held_out)):
+                with open(file, 'w') as handle:
+                    for row in file_rows:
+                        warehouse.write_row(handle, row)
+
+            warehouse.update_ratings(rows)
+            warehouse.update_users([{config.USER_COL: user} for user in
+                                    range(1, 11)])
+
+            warehouses.append(warehouse)
+
+        yield [warehouse.partition for warehouse in warehouses]
+
+        for warehouse in warehouses:
+            warehouse.delete()
+            utils.delete_directory(
+                scheduler.engine_path(warehouse.partition))
+
+    def test_trains_and_generates_every_partition(self, partitions):
+        with PartitionScheduler(ImplicitALSEngine, workers=2) as jobs:
+            trainings = [jobs.submit(
+                partition, scheduler.TRAIN, rank_opts=[2],
+                reg_param_opts=[0.1], max_iter_opts=[3]) for partition in
+                partitions]
+
+            # the generation of a partition waits for its training.
+            generations = [jobs.submit(partition, scheduler.GENERATE) for
+                           partition in partitions]
+
+        for training, generation in zip(trainings, generations):
+            assert training.result()['rank'] == 2
+            generation.result()
+
+        for partition in partitions:
+            engine = ImplicitALSEngine.import_from_path(
+                scheduler.engine_path(partition))
+
+            assert engine.warehouse.partition == partition
+            assert engine.ready()
+
+    def test_trains_the_engine_of_the_setting(self, partitions, monkeypatch):
+        monkeypatch.setattr(config, 'ENGINE', 'ImplicitALSEngine')
+
+        with PartitionScheduler() as jobs:
+            jobs.submit(partitions[0], scheduler.TRAIN, rank_opts=[2],
+                        reg_param_opts=[0.1], max_iter_opts=[3])
+            retraining = jobs.submit(partitions[0], scheduler.RETRAIN)
+
+        retraining.result()
+
+        engine = import_engine(scheduler.engine_path(partitions[0]))
+
+        assert type(engine) is ImplicitALSEngine
+        assert engine.model_params['ratings_watermark'] == \
+            engine.warehouse.ratings_watermark()
+
+    def test_trains_an_item_knn_engine(self, partitions, monkeypatch):
+        monkeypatch.setattr(config, 'ENGINE', 'ItemKNNEngine')
+
+        path = scheduler.engine_path(partitions[0])
+
+        # the options a client may send, as checked by the REST API.
+        engine = engine_class(path)
+        required, optional = engine.model_opts()
+
+        assert engine is ItemKNNEngine
+        assert 'rank_opts' not in required + optional
+
+        with PartitionScheduler() as jobs:
+            training = jobs.submit(partitions[0], scheduler.TRAIN,
+                                   metric=engine.default_metric,
+                                   neighbors_opts=[2, 4],
+                                   similarity_opts=['cosine'])
+            generation = jobs.submit(partitions[0], scheduler.GENERATE)
+
+        assert training.result()['neighbors'] in (2, 4)
+        generation.result()
+
+        assert engine_class(path) is ItemKNNEngine
+        assert import_engine(path).ready()
+
+    def test_the_sweeps_are_not_searched_over(self):
+        # the trainings run `ALS_MAX_ITER` sweeps at most by default.
+        for engine in (ALSRecommendationEngine, ImplicitALSEngine,
+                       OutOfCoreALSEngine):
+            required, optional = engine.model_opts()
+
+            assert 'max_iter_opts' in optional
+            assert set(required) <= set(config.als_opts)
+
+        assert 'max_iter_opts' not in config.als_opts
+
+    def test_an_untrained_partition_cannot_generate(self, partitions):
+        with PartitionScheduler(ImplicitALSEngine) as jobs:
+            generation = jobs.submit(partitions[0], scheduler.GENERATE)
+
+        with pytest.raises(ValueError):
+            generation.result()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from scipy import sparse
+
+from core import config
+from core.scoring import FactorModel, top_k, generate_for_shards
+from core.warehouse import FileWarehouse
+
+
+class TestScoring(object):
+
+    @pytest.fixture
+    def model(self):
+        # 2 users, 3 items. user 1 likes item 30 the most, user 2 item 10.
+        return FactorModel(user_ids=[1, 2],
+                           user_factors=[[1.0, 0.0], [0.0, 1.0]],
+                           item_ids=[10, 20, 30],
+                           item_factors=[[0.1, 0.9], [0.5, 0.5], [0.9, 0.1]])
+
+    def test_top_k_sorts_by_score(self):
+        scores = np.array([[0.1, 0.7, 0.3, 0.9]])
+
+        actual = top_k(scores, 3)
+
+        assert actual.tolist() == [[3, 1, 2]]
+
+    def test_top_k_caps_at_number_of_columns(self):
+        scores = np.array([[0.1, 0.7]])
+
+        actual = top_k(scores, 5)
+
+        assert actual.tolist() == [[1, 0]]
+
+    def test_top_k_excludes(self):
+        scores = np.array([[0.1, 0.7, 0.3, 0.9]])
+
+        actual = top_k(scores, 2, exclude=sparse.csr_matrix([[0, 1, 0, 1]]))
+
+        assert actual.tolist() == [[2, 0]]
+
+    def test_recommend(self, model):
+        actual = model.recommend([1, 2], count=2)
+
+        assert actual == [[30, 20], [10, 20]]
+
+    def test_recommend_unknown_user(self, model):
+        actual = model.recommend([3, 1], count=1)
+
+        assert actual == [[], [30]]
+
+    def test_recommend_excludes_seen(self, model):
+        actual = model.recommend([1, 2], count=2,
+                                 seen=[(1, 30), (2, 10), (2, 20), (3, 20)])
+
+        assert actual == [[20, 10], [30]]
+
+    def test_restrict_items(self, model):
+        actual = model.restrict_items([10, 20]).recommend([1], count=3)
+
+        assert actual == [[20, 10]]
+
+    def test_generate_for_shards(self, model):
+        warehouse = FileWarehouse(partition='scoring_test', shards=2)
+        warehouse.cleanup()
+        warehouse.update_users([{config.USER_COL: 1}, {config.USER_COL: 2}])
+        warehouse.update_ratings([{config.USER_COL: 2, config.PRODUCT_COL: 10,
+                                   config.RATINGS_COL: 5}])
+
+        shard_users = []
+
+        users_count = generate_for_shards(warehouse, model, count=1, workers=1,
+                                          progress=shard_users.append)
+
+        actual = {row[config.USER_COL]: row['recommendations'] for row in
+                  warehouse.read_rows(warehouse.shard_files(
+                      warehouse.recommendations_file))}
+
+        warehouse.delete()
+
+        assert users_count == 2
+        assert shard_users == [0, 2]
+        assert actual == {1: [30], 2: [20]}
+
+    def test_generate_for_shards_of_partitions_at_once(self, model):
+        # the same items, in reverse: user 1 likes item 10 the most.
+        other = FactorModel(user_ids=[1, 2], user_factors=model.user_factors,
+                            item_ids=[30, 20, 10],
+                            item_factors=model.item_factors)
+
+        # the shards of the two partitions are scored in turns.
+        barrier = threading.Barrier(2)
+
+        warehouses = []
+
+        for number in range(2):
+            warehouse = FileWarehouse(
+                partition='scoring_test_{}'.format(number), shards=2)
+            warehouse.cleanup()
+            warehouse.update_users([{config.USER_COL: 1},
+                                    {config.USER_COL: 2}])
+            warehouses.append(warehouse)
+
+        with ThreadPoolExecutor(2) as threads:
+            for future in [threads.submit(
+                    generate_for_shards, warehouse,
+                    _Waiting(partition_model, barrier), count=1, workers=1)
+                    for warehouse, partition_model in
+                    zip(warehouses, [model, other])]:
+                future.result()
+
+        actual = [{row[config.USER_COL]: row['recommendations'] for row in
+                   warehouse.read_rows(warehouse.shard_files(
+                       warehouse.recommendations_file))} for warehouse in
+                  warehouses]
+
+        for warehouse in warehouses:
+            warehouse.delete()
+
+        assert actual == [{1: [30], 2: [10]}, {1: [10], 2: [30]}]
+
+
+class _Waiting(object):
+    """ a model waiting on a barrier before each scoring. """
+
+    def __init__(self, model, barrier):
+        self.model = model
+        self.barrier = barrier
+
+    def recommend(self, *args, **kwargs):
+        self.barrier.wait(5)
+
+        return self.model.recommend(*args, **kwargs)
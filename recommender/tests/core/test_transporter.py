@@ -2,25 +2,198 @@
 import pytest
 from mock import MagicMock
 
+from core import config
 from core.transporter import Transporter
+from core.warehouse import FileWarehouse
 
 
 class TestTransporter(object):
 
     @pytest.fixture
-    def transporter(self):
+    def user(self):
+        def make_user(id):
+            user = MagicMock()
+            user.id = id
+            return user
+
+        return make_user
+
+    @pytest.fixture
+    def transporter(self, mocker):
         warehouse = MagicMock()
+        warehouse.partition = 'transporter_test'
+
+        user_model = MagicMock()
+
+        transporter = Transporter(warehouse=warehouse, user_model=user_model)
+
+        mocker.patch.object(transporter, 'versions_model')
+
+        return transporter
+
+    def test_send_new_ratings_to_warehouse(self, transporter, user):
+        users = [user(1), user(2)]
+        transporter.user_model.get_syncing.return_value = iter(users)
+        transporter.user_model.get_ratings_many.return_value = [
+            [{'product_id': 10, 'rating': 4}], []]
+        sent = []
+        transporter.warehouse.update_ratings.side_effect = sent.extend
+
+        transporter.send_new_ratings_to_warehouse(batch_size=10)
+
+        transporter.warehouse.update_ratings.assert_called_once()
+        assert sent == [{
+            config.USER_COL: 1,
+            config.PRODUCT_COL: 10,
+            config.RATINGS_COL: 4
+        }]
+        transporter.user_model.start_sync.assert_called_once()
+        transporter.user_model.finish_sync.assert_called_once()
+
+    def test_send_new_ratings_keeps_activity_on_error(self, transporter,
+                                                      user):
+        transporter.user_model.get_syncing.return_value = iter([user(1)])
+        transporter.user_model.get_ratings_many.return_value = [
+            [{'product_id': 10, 'rating': 4}]]
+        transporter.warehouse.update_ratings.side_effect = IOError
+
+        with pytest.raises(IOError):
+            transporter.send_new_ratings_to_warehouse()
+
+        transporter.user_model.finish_sync.assert_not_called()
+
+    @pytest.fixture
+    def streaming_transporter(self, mocker):
+        warehouse = FileWarehouse(partition='transporter_test', shards=2)
+        warehouse.cleanup()
+
+        transporter = Transporter(warehouse=warehouse, user_model=MagicMock())
+
+        events_model = mocker.patch.object(transporter, 'events_model')
+        events_model.key.return_value = 'transporter_test_rating_events'
+        events_model.backlog.return_value = {'pending': 0, 'lag': 0}
+
+        yield transporter
+
+        warehouse.delete()
+
+    @staticmethod
+    def _event(event_id, user_id):
+        return event_id, {'user_id': user_id, 'product_id': 10, 'rating': 4}
+
+    def _stored(self, transporter):
+        warehouse = transporter.warehouse
+
+        return sorted(row[config.USER_COL] for row in
+                      warehouse.read_rows(warehouse.ratings_files()))
+
+    def test_consume_rating_events(self, streaming_transporter):
+        events_model = streaming_transporter.events_model
+        events_model.read.side_effect = [
+            [],
+            [self._event('1-0', 1), self._event('1-1', 2)],
+            [self._event('2-0', 3)],
+        ]
+
+        added = streaming_transporter.consume_rating_events(batches=2)
+
+        assert added == 3
+        assert self._stored(streaming_transporter) == [1, 2, 3]
+        # one segment per batch.
+        assert len(streaming_transporter.warehouse.ratings_manifest()[
+            'segments']) == 3
+        assert [call[0][1] for call in events_model.ack.call_args_list] == \
+            [['1-0', '1-1'], ['2-0']]
+
+    def test_consume_rating_events_skips_stored_events(
+            self, streaming_transporter):
+        events_model = streaming_transporter.events_model
+
+        # stored, but not acknowledged before a crash.
+        events_model.read.side_effect = [[], [self._event('1-0', 1)]]
+        events_model.ack.side_effect = IOError
+
+        with pytest.raises(IOError):
+            streaming_transporter.consume_rating_events(batches=1)
+
+        # delivered again on restart, with a newer event.
+        events_model.read.side_effect = [
+            [self._event('1-0', 1)], [], [self._event('1-1', 2)]]
+        events_model.ack.side_effect = None
+
+        added = streaming_transporter.consume_rating_events(batches=1)
+
+        assert added == 1
+        assert self._stored(streaming_transporter) == [1, 2]
+        assert [call[1]['pending'] for call in
+                events_model.read.call_args_list[-3:]] == [True, True, False]
+
+    def test_send_recommendations_to_db(self, transporter, tmpdir):
+        recommendations_file = tmpdir.join('recommendations')
+        recommendations_file.write('{"user_id": 1, "recommendations": [3]}\n'
+                                   '{"user_id": 2, "recommendations": [4]}\n')
+        transporter.warehouse.shard_files.return_value = [
+            str(recommendations_file)]
+
+        transporter.send_recommendations_to_db(workers=1)
+
+        transporter.user_model.set_recommendations_many.assert_called_once_with(
+            [(1, [3]), (2, [4])], data_partition='transporter_test')
+        transporter.versions_model.bump.assert_called_once_with(
+            'recommendations', data_partition='transporter_test')
+
+    def test_send_recommendations_with_payloads(self, transporter, tmpdir,
+                                                mocker):
+        recommendations_file = tmpdir.join('recommendations')
+        recommendations_file.write(
+            '{"user_id": 1, "recommendations": [3, 4]}\n'
+            '{"user_id": 2, "recommendations": []}\n')
+        transporter.warehouse.shard_files.return_value = [
+            str(recommendations_file)]
+        transporter.versions_model.get.return_value = 7
+
+        product = MagicMock()
+        product.id, product.name, product.desc = 3, 'three', 'third'
+        products_model = mocker.patch.object(transporter, 'products_model')
+        products_model.get_many.side_effect = \
+            lambda ids, data_partition: [product if id == 3 else None
+                                         for id in ids]
+
+        transporter.send_recommendations_to_db(workers=1, payloads=True)
+
+        _, kwargs = transporter.user_model.set_recommendations_many.call_args
+        assert kwargs['payloads'] == [
+            {'products_version': 7, 'recommendations': [
+                {'product_id': 3, 'meta': {'name': 'three', 'desc': 'third'}}
+            ]},
+            None,
+        ]
+
+    def test_send_users_to_warehouse(self, transporter, user):
+        transporter.user_model.get_all.return_value = iter([user(1), user(2)])
+        transporter.user_model.get_ratings_many.return_value = [
+            [], [{'product_id': 10, 'rating': 4}]]
+        sent = []
+        transporter.warehouse.update_users.side_effect = sent.extend
+
+        transporter.send_users_to_warehouse()
 
-        transporter = Transporter(warehouse=warehouse)
+        assert sent == [{config.USER_COL: 2}]
 
-    def test_send_new_ratings_to_warehouse(self):
-        # TODO implement
-        pass
+    def test_scanned_users_are_sent_once(self, transporter, user):
+        # a SSCAN can return a user more than once.
+        transporter.user_model.get_syncing.return_value = iter(
+            [user(1), user(2), user(1)])
+        transporter.user_model.get_all.return_value = iter(
+            [user(2), user(2)])
+        transporter.user_model.get_ratings_many.side_effect = lambda batch: [
+            [{'product_id': 10, 'rating': 4}] for _ in batch]
+        ratings, users = [], []
+        transporter.warehouse.update_ratings.side_effect = ratings.extend
+        transporter.warehouse.update_users.side_effect = users.extend
 
-    def test_send_recommendations_to_db(self):
-        # TODO implement
-        pass
+        transporter.send_new_ratings_to_warehouse(batch_size=2)
+        transporter.send_users_to_warehouse(batch_size=1)
 
-    def test_send_users_to_warehouse(self):
-        # TODO implement
-        pass
\ No newline at end of file
+        assert [rating[config.USER_COL] for rating in ratings] == [1, 2]
+        assert users == [{config.USER_COL: 2}]
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from core import config
+from core.exceptions import WarehouseException
+from core.warehouse import FileWarehouse
+
+
+class TestFileWarehouse(object):
+
+    @pytest.fixture
+    def warehouse(self):
+        warehouse = FileWarehouse(partition='warehouse_test', shards=4)
+        warehouse.cleanup()
+
+        yield warehouse
+
+        warehouse.delete()
+
+    def test_invalid_shards(self):
+        with pytest.raises(WarehouseException):
+            FileWarehouse(partition='warehouse_test', shards=0)
+
+    def test_unsharded_files(self):
+        warehouse = FileWarehouse(partition='warehouse_test', shards=1)
+
+        assert warehouse.shard_files(warehouse.ratings_file) == \
+            [warehouse.ratings_file]
+
+    def test_shard_of_is_stable(self, warehouse):
+        shards = [warehouse.shard_of(user_id) for user_id in range(100)]
+
+        assert shards == [warehouse.shard_of(user_id) for user_id in
+                          range(100)]
+        assert set(shards) == set(range(warehouse.shards))
+
+    def test_update_ratings_routes_by_user(self, warehouse):
+        ratings = [{config.USER_COL: user_id, config.PRODUCT_COL: 1,
+                    config.RATINGS_COL: 5} for user_id in range(20)]
+
+        warehouse.update_ratings(ratings)
+
+        files = warehouse.ratings_segment_files(1)
+
+        for shard, file in enumerate(files):
+            for row in warehouse.read_rows([file]):
+                assert warehouse.shard_of(row[config.USER_COL]) == shard
+
+        assert len(list(warehouse.read_rows(files))) == len(ratings)
+        assert len(list(warehouse.read_rows(warehouse.ratings_files()))) == \
+            len(ratings)
+
+    def test_ratings_files_since_watermark(self, warehouse):
+        rating = {config.USER_COL: 1, config.PRODUCT_COL: 1,
+                  config.RATINGS_COL: 5}
+
+        warehouse.update_ratings([rating])
+        watermark = warehouse.ratings_watermark()
+        warehouse.update_ratings(iter([rating, rating]))
+
+        assert warehouse.ratings_files(since=watermark) == \
+            warehouse.ratings_segment_files(2)
+        assert len(list(warehouse.read_rows(
+            warehouse.ratings_files(since=watermark)))) == 2
+        assert warehouse.ratings_files(
+            since=warehouse.ratings_watermark()) == []
+
+    def test_ratings_files_of_shard(self, warehouse):
+        warehouse.update_ratings([{config.USER_COL: 1, config.PRODUCT_COL: 1,
+                                   config.RATINGS_COL: 5}])
+
+        shard = warehouse.shard_of(1)
+
+        assert warehouse.ratings_files(shard=shard) == [
+            warehouse.ratings_segment_files(0)[shard],
+            warehouse.ratings_segment_files(1)[shard]]
+
+    def test_empty_update_adds_no_segment(self, warehouse):
+        watermark = warehouse.ratings_watermark()
+
+        warehouse.update_ratings(iter([]))
+
+        assert warehouse.ratings_watermark() == watermark
+        assert warehouse.ratings_files() == warehouse.ratings_segment_files(0)
+
+    def test_reset_invalidates_watermarks(self, warehouse):
+        warehouse.update_ratings([{config.USER_COL: 1, config.PRODUCT_COL: 1,
+                                   config.RATINGS_COL: 5}])
+        watermark = warehouse.ratings_watermark()
+
+        warehouse.reset_ratings()
+
+        with pytest.raises(WarehouseException):
+            warehouse.ratings_files(since=watermark)
+
+        assert warehouse.ratings_files() == warehouse.ratings_segment_files(0)
+
+    def test_ratings_offsets(self, warehouse):
+        rating = {config.USER_COL: 1, config.PRODUCT_COL: 1,
+                  config.RATINGS_COL: 5}
+
+        warehouse.update_ratings([rating], offsets={'events': '1-0'})
+        # recorded even without new ratings.
+        warehouse.update_ratings([], offsets={'events': '2-0'})
+
+        assert warehouse.ratings_offsets() == {'events': '2-0'}
+        assert len(warehouse.ratings_manifest()['segments']) == 2
+
+        warehouse.reset_ratings()
+
+        assert warehouse.ratings_offsets() == {'events': '2-0'}